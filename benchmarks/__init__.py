@@ -0,0 +1,4 @@
+"""
+Benchmarks des services Hey Hi (exécutables hors ligne)
+Usage: python -m benchmarks.<nom_du_benchmark>
+"""
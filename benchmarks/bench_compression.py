@@ -0,0 +1,75 @@
+"""
+Benchmark compression: octets transférés vs coût CPU
+- Page HTML générée volumineuse (réponse /build)
+- Historique de chat long (réponse /api/chat)
+- INDEX_HTML du website builder (précompressé au démarrage)
+
+Usage: python -m benchmarks.bench_compression [--iterations 50]
+"""
+import sys
+import json
+import time
+import argparse
+from shared.compression import compress, supported_encodings
+
+def generated_page(sections: int = 60) -> bytes:
+    """Page HTML typique d'une génération /build (~40 KB)"""
+    section = (
+        '<section class="features">\n'
+        '    <h2 class="title">Pourquoi choisir notre offre de coaching vidéo ?</h2>\n'
+        '    <div class="grid">\n'
+        '      <article class="card"><h3>Accompagnement</h3><p>Un suivi personnalisé, semaine après semaine.</p></article>\n'
+        '      <article class="card"><h3>Résultats</h3><p>Des progrès mesurables dès le premier mois.</p></article>\n'
+        '      <article class="card"><h3>Souplesse</h3><p>Des séances adaptées à votre agenda.</p></article>\n'
+        '    </div>\n'
+        '</section>\n'
+    )
+    return ("<!doctype html><html lang=\"fr\"><body>\n" + section * sections + "</body></html>").encode()
+
+def chat_history(turns: int = 40) -> bytes:
+    """Réponse JSON avec un long historique (~30 KB)"""
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"Question {i}: comment améliorer ma posture devant la caméra ?"})
+        messages.append({"role": "assistant", "content": "Gardez les épaules détendues, regardez l'objectif et parlez lentement. " * 4})
+    return json.dumps({"provider": "openai", "choices": [{"message": messages[-1]}], "history": messages}).encode()
+
+def index_html() -> bytes:
+    from shared.services import builder_index_html
+    return builder_index_html("om-website-builder-v1").encode()
+
+def measure(payload: bytes, encoding: str, level: int, iterations: int) -> tuple[int, float]:
+    """Retourne (taille compressée, ms CPU par compression)"""
+    start = time.process_time()
+    for _ in range(iterations):
+        out = compress(payload, encoding, level)
+    return len(out), (time.process_time() - start) * 1000 / iterations
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    payloads = {
+        "build_page": generated_page(),
+        "chat_history": chat_history(),
+        "index_html": index_html(),
+    }
+    # Niveaux utilisés: middleware (à la volée) et précompression (démarrage)
+    settings = [("gzip", 6, "middleware"), ("gzip", 9, "précompression")]
+    if "br" in supported_encodings():
+        settings += [("br", 4, "middleware"), ("br", 11, "précompression")]
+    else:
+        print("brotli non installé: seul gzip est mesuré", file=sys.stderr)
+
+    print(f"{'payload':<14} {'encodage':<10} {'usage':<15} {'brut':>9} {'compressé':>10} {'gain':>7} {'CPU ms':>8}")
+    for name, payload in payloads.items():
+        for encoding, level, usage in settings:
+            size, cpu_ms = measure(payload, encoding, level, args.iterations)
+            reduction = 100 * (1 - size / len(payload))
+            label = f"{encoding}-{level}"
+            print(f"{name:<14} {label:<10} {usage:<15} {len(payload):>9} {size:>10} {reduction:>6.1f}% {cpu_ms:>8.3f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Benchmark du nettoyage en flux du HTML généré (/build): débit et réduction de taille
+- Pages typiques d'une génération LLM: clôture markdown, indentation, commentaires,
+  quelques <script> et attributs on* à retirer
+- Document entier vs fragments (deltas streamés de ~16 caractères, blocs de 4 Ko)
+- Taille: brute, nettoyée, puis gzip des deux (ce qui transite réellement)
+
+Usage: python -m benchmarks.bench_html_sanitizer [--sizes 40,400,2000] [--rounds 5]
+"""
+import sys
+import time
+import argparse
+from shared.compression import compress
+from shared.html_sanitizer import HTMLSanitizer
+
+SECTION = """
+    <!-- Section générée -->
+    <section class="features" id="section-{i}">
+        <h2 class="title">
+            Pourquoi choisir notre offre de coaching vidéo ?
+        </h2>
+        <div class="grid">
+            <article class="card" onclick="track('card-{i}')">
+                <h3>Accompagnement</h3>
+                <p>
+                    Un suivi personnalisé, semaine après semaine,
+                    avec des    retours   précis sur votre posture.
+                </p>
+                <a href="/contact" class="button">Nous   contacter</a>
+            </article>
+            <article class="card">
+                <h3>Résultats</h3>
+                <p>Des progrès mesurables dès le premier mois &amp; un bilan détaillé.</p>
+                <img src="/img/resultats-{i}.webp" alt="Résultats" loading="lazy">
+            </article>
+        </div>
+        <script>window.dataLayer.push({{section: {i}}});</script>
+    </section>
+"""
+
+def generated_page(kilobytes: int) -> str:
+    """Page HTML d'environ `kilobytes` Ko, telle que renvoyée par le modèle"""
+    head = "```html\n<!DOCTYPE html>\n<html lang=\"fr\">\n  <head>\n    <title>Coaching vidéo</title>\n  </head>\n  <body>\n"
+    tail = "  </body>\n</html>\n```\nCette page présente l'offre de coaching."
+    sections, size, i = [], len(head) + len(tail), 0
+    while size < kilobytes * 1024:
+        section = SECTION.format(i=i)
+        sections.append(section)
+        size += len(section)
+        i += 1
+    return head + "".join(sections) + tail
+
+def run(page: str, chunk: int) -> tuple:
+    """(secondes, sortie) pour un passage complet, par fragments de `chunk` caractères (0 = entier)"""
+    started = time.perf_counter()
+    sanitizer = HTMLSanitizer()
+    if chunk:
+        out = [sanitizer.process(page[i:i + chunk]) for i in range(0, len(page), chunk)]
+    else:
+        out = [sanitizer.process(page)]
+    out.append(sanitizer.flush())
+    return time.perf_counter() - started, "".join(out)
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="40,400,2000", help="tailles de page en Ko")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    print(f"{'page':>7} {'mode':<12} {'Mo/s':>7} {'ms/page':>9} {'brut':>9} {'nettoyé':>9} {'gain':>6} "
+          f"{'gzip brut':>10} {'gzip net':>9} {'gain':>6}")
+    for kilobytes in (int(s) for s in args.sizes.split(",")):
+        page = generated_page(kilobytes)
+        raw_bytes = page.encode()
+        raw_gzip = len(compress(raw_bytes, "gzip", 6))
+        for label, chunk in (("entier", 0), ("blocs 4 Ko", 4096), ("deltas 16", 16)):
+            best, out = min((run(page, chunk) for _ in range(args.rounds)), key=lambda r: r[0])
+            out_bytes = out.encode()
+            out_gzip = len(compress(out_bytes, "gzip", 6))
+            print(f"{kilobytes:>5}Ko {label:<12} {len(raw_bytes) / best / 1e6:>7.1f} {best * 1000:>9.2f} "
+                  f"{len(raw_bytes):>9} {len(out_bytes):>9} {100 * (1 - len(out_bytes) / len(raw_bytes)):>5.1f}% "
+                  f"{raw_gzip:>10} {out_gzip:>9} {100 * (1 - out_gzip / raw_gzip):>5.1f}%")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
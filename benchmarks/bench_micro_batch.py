@@ -0,0 +1,71 @@
+"""
+Benchmark micro-batching: appels upstream économisés et débit gagné
+- N complétions courtes (tags, titres) envoyées en parallèle au stub local
+- Mode individuel (un appel par requête) vs MicroBatcher
+- Le stub borne la concurrence: le coût fixe par appel domine, comme en production
+
+Usage: python -m benchmarks.bench_micro_batch [--requests 200] [--concurrency 50]
+"""
+import sys
+import time
+import asyncio
+import argparse
+import httpx
+from shared.chat_proxy import MicroBatcher, call_openai_with_retry, open_upstream_pool, close_upstream_pool
+from benchmarks.openai_stub import OpenAIStub
+
+def prompts(count: int) -> list:
+    return [
+        [
+            {"role": "system", "content": "Propose un titre court pour cette vidéo."},
+            {"role": "user", "content": f"Vidéo {i}: conseils de posture et de voix face caméra"}
+        ]
+        for i in range(count)
+    ]
+
+async def run(mode: str, count: int, concurrency: int, window: float, max_batch: int) -> dict:
+    stub = OpenAIStub()
+    await open_upstream_pool(transport=httpx.ASGITransport(app=stub))
+    batcher = MicroBatcher(window=window, max_batch=max_batch)
+    limit = asyncio.Semaphore(concurrency)
+    call = batcher.submit if mode == "micro_batch" else call_openai_with_retry
+
+    async def one(messages):
+        async with limit:
+            return await call(
+                api_key="bench", messages=messages, model="gpt-4o-mini",
+                connect_timeout=5, read_timeout=30, max_tokens=32
+            )
+
+    try:
+        started = time.perf_counter()
+        results = await asyncio.gather(*(one(m) for m in prompts(count)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await close_upstream_pool()
+    assert all(r["choices"][0]["message"]["content"] for r in results)
+    return {"upstream_calls": stub.calls, "seconds": elapsed, "throughput": count / elapsed}
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--window", type=float, default=0.02, help="fenêtre de regroupement (s)")
+    parser.add_argument("--max-batch", type=int, default=16)
+    args = parser.parse_args(argv)
+
+    rows = {
+        mode: asyncio.run(run(mode, args.requests, args.concurrency, args.window, args.max_batch))
+        for mode in ("individuel", "micro_batch")
+    }
+    print(f"{'mode':<12} {'appels':>7} {'durée s':>8} {'req/s':>8}")
+    for mode, row in rows.items():
+        print(f"{mode:<12} {row['upstream_calls']:>7} {row['seconds']:>8.2f} {row['throughput']:>8.1f}")
+    base, batched = rows["individuel"], rows["micro_batch"]
+    saved = base["upstream_calls"] - batched["upstream_calls"]
+    print(f"appels économisés: {saved} ({100 * saved / base['upstream_calls']:.0f}%), "
+          f"débit x{batched['throughput'] / base['throughput']:.1f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Benchmark du régulateur de quota upstream: 429 évités et débit utile
+- Stub OpenAI local avec quotas (requêtes et tokens par fenêtre), headers x-ratelimit-*
+- Rafale de requêtes concurrentes, sans régulation (429 -> backoff -> retry, circuit
+  breaker) puis avec UpstreamGovernor (attente en file avant l'envoi)
+- Débit utile = requêtes réussies par seconde
+
+Usage: python -m benchmarks.bench_rate_governor [--requests 200] [--concurrency 40] [--rpm 40] [--tpm 4000]
+"""
+import sys
+import time
+import asyncio
+import argparse
+import httpx
+from fastapi import HTTPException
+from shared import chat_proxy
+from shared.chat_proxy import call_openai_with_retry, circuit_breaker, close_upstream_pool, open_upstream_pool
+from shared.upstream_governor import UpstreamGovernor
+from benchmarks.openai_stub import OpenAIStub
+
+def prompts(count: int) -> list:
+    # Tailles de prompt variées: le quota de tokens compte autant que celui de requêtes
+    return [
+        [{"role": "user", "content": f"Résume la vidéo {i}: " + "posture, voix, regard caméra. " * (1 + i % 8)}]
+        for i in range(count)
+    ]
+
+async def run(governed: bool, args) -> dict:
+    stub = OpenAIStub(
+        base_latency=0.05, concurrency=args.concurrency,
+        rpm_limit=args.rpm, tpm_limit=args.tpm, quota_window=args.window
+    )
+    governor = UpstreamGovernor(enabled=governed, max_wait=30)
+    chat_proxy.upstream_governor = governor
+    circuit_breaker.record_success()
+    await open_upstream_pool(transport=httpx.ASGITransport(app=stub))
+    limit = asyncio.Semaphore(args.concurrency)
+    errors = {}
+
+    async def one(messages) -> bool:
+        async with limit:
+            try:
+                await call_openai_with_retry(
+                    api_key="bench", messages=messages, model="gpt-4o-mini",
+                    connect_timeout=5, read_timeout=30, max_tokens=32
+                )
+                return True
+            except HTTPException as e:
+                error = e.detail.get("error", "http") if isinstance(e.detail, dict) else "http"
+                errors[error] = errors.get(error, 0) + 1
+                return False
+
+    try:
+        started = time.perf_counter()
+        results = await asyncio.gather(*(one(m) for m in prompts(args.requests)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await close_upstream_pool()
+    ok = sum(results)
+    return {
+        "ok": ok, "errors": errors, "upstream_429": stub.rejected, "seconds": elapsed,
+        "goodput": ok / elapsed, "waited": governor.get_stats()["total_wait_seconds"]
+    }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=40)
+    parser.add_argument("--rpm", type=int, default=40, help="requêtes par fenêtre")
+    parser.add_argument("--tpm", type=int, default=4000, help="tokens par fenêtre")
+    parser.add_argument("--window", type=float, default=1.0, help="fenêtre de quota (s), 60 chez OpenAI")
+    args = parser.parse_args(argv)
+    original = chat_proxy.upstream_governor
+
+    try:
+        rows = {mode: asyncio.run(run(mode == "régulé", args)) for mode in ("sans", "régulé")}
+    finally:
+        chat_proxy.upstream_governor = original
+    print(f"{args.requests} requêtes, quota {args.rpm} req / {args.tpm} tokens par {args.window:g}s")
+    print(f"{'mode':<8} {'ok':>5} {'429':>5} {'durée s':>8} {'ok/s':>7} {'attente s':>10}  échecs")
+    for mode, row in rows.items():
+        print(f"{mode:<8} {row['ok']:>5} {row['upstream_429']:>5} {row['seconds']:>8.2f} {row['goodput']:>7.1f} "
+              f"{row['waited']:>10.1f}  {row['errors'] or '-'}")
+    base, governed = rows["sans"], rows["régulé"]
+    print(f"429 évités: {base['upstream_429'] - governed['upstream_429']}, "
+          f"débit utile x{governed['goodput'] / base['goodput']:.2f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Benchmark du retrieval local (index BM25 en mmap): construction, latence, tokens de prompt
+- Corpus synthétique de fiches coach/vidéo (un sujet par fiche, vocabulaire partagé entre sujets)
+- Construction de l'index: durée et taille sur disque
+- Requêtes: latence de Retriever.augment (p50/p95) et rappel@k (la fiche visée est dans les extraits)
+- Tokens de prompt: documentation entière en system prompt, fiches du sujet seulement, extraits top-k
+
+Usage: python -m benchmarks.bench_retrieval [--documents 100,1000] [--queries 200] [--top-k 3]
+"""
+import sys
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+from shared.retrieval import RetrievalIndex, Retriever, build_index
+from shared.upstream_governor import estimate_tokens
+
+TOPICS = {
+    "voix": "voix respiration diaphragme articulation débit intonation projection souffle micro pause",
+    "lumiere": "lumière éclairage contre-jour softbox fenêtre ombre température reflet diffuseur ring",
+    "cadrage": "cadrage tiers regard horizon plan serré large caméra hauteur objectif fond",
+    "montage": "montage coupe rythme transition sous-titres timeline rush export musique jump-cut",
+    "posture": "posture épaules mains gestes sourire stress trac regard ancrage sol",
+    "audio": "audio cravate bruit écho réverbération niveau gain casque filtre mousse"
+}
+FILLER = ("pour une vidéo efficace il faut préparer chaque séance avec soin et garder une progression "
+          "régulière semaine après semaine en notant les retours du coach puis en refaisant la prise "
+          "jusqu'à obtenir un résultat naturel devant la caméra sans forcer").split()
+
+def generated_corpus(directory: Path, documents: int, words: int = 600, seed: int = 7) -> list:
+    """Écrit `documents` fiches dans `directory`; retourne les requêtes [(question, fiche visée, sujet)]"""
+    rng = random.Random(seed)
+    topics = list(TOPICS)
+    queries = []
+    for d in range(documents):
+        topic = topics[d % len(topics)]
+        vocabulary = TOPICS[topic].split()
+        # Terme propre à la fiche (exercice nommé): ce que l'utilisateur cite dans sa question
+        exercise = f"exercice{d:05d}"
+        body = []
+        while len(body) < words:
+            sentence = rng.sample(FILLER, 8) + rng.sample(vocabulary, 3)
+            if rng.random() < 0.15:
+                sentence.append(exercise)
+            rng.shuffle(sentence)
+            body.extend(sentence)
+            body[-1] += "."
+        path = directory / topic / f"fiche-{d:05d}.md"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(f"# {topic.capitalize()}: {exercise}\n\n" + " ".join(body), encoding="utf-8")
+        question = f"Comment réussir l'{exercise} ? J'ai du mal avec {' et '.join(rng.sample(vocabulary, 2))}."
+        queries.append((question, path.relative_to(directory).as_posix(), topic))
+    return queries
+
+def _percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", default="100,1000", help="tailles de corpus (nombre de fiches)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"{'fiches':>7} {'chunks':>7} {'build s':>8} {'index Ko':>9} {'p50 µs':>8} {'p95 µs':>8} "
+          f"{'rappel':>7} {'tok. doc':>9} {'tok. sujet':>10} {'tok. top-k':>10} {'gain sujet':>10}")
+    for documents in (int(s) for s in args.documents.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            docs, target = Path(tmp) / "docs", Path(tmp) / "index"
+            queries = generated_corpus(docs, documents)
+            stats = build_index(docs, target)
+            retriever = Retriever(RetrievalIndex(target), top_k=args.top_k, min_score=0, max_chars=10 ** 6)
+            texts = {p.relative_to(docs).as_posix(): p.read_text(encoding="utf-8") for p in docs.rglob("*.md")}
+            stuffed = estimate_tokens([{"content": "\n\n".join(texts.values())}])
+            by_topic = {topic: estimate_tokens([{"content": "\n\n".join(
+                text for name, text in texts.items() if name.startswith(topic + "/"))}]) for topic in TOPICS}
+
+            rng = random.Random(11)
+            latencies, found, topic_tokens, context_tokens = [], 0, [], []
+            for question, expected, topic in rng.choices(queries, k=args.queries):
+                messages = [{"role": "user", "content": question}]
+                started = time.perf_counter()
+                augmented = retriever.augment(messages)
+                latencies.append((time.perf_counter() - started) * 1e6)
+                context = augmented[0]["content"] if len(augmented) > 1 else ""
+                found += f"({expected})" in context
+                context_tokens.append(estimate_tokens([{"content": context}]))
+                topic_tokens.append(by_topic[topic])
+            retriever.close()
+
+        avg_topic = sum(topic_tokens) / len(topic_tokens)
+        avg_context = sum(context_tokens) / len(context_tokens)
+        print(f"{documents:>7} {stats['chunks']:>7} {stats['seconds']:>8.2f} {stats['bytes'] / 1024:>9.0f} "
+              f"{_percentile(latencies, 0.5):>8.0f} {_percentile(latencies, 0.95):>8.0f} "
+              f"{100 * found / len(latencies):>6.1f}% {stuffed:>9} {avg_topic:>10.0f} {avg_context:>10.0f} "
+              f"{100 * (1 - avg_context / avg_topic):>9.1f}%")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
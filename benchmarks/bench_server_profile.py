@@ -0,0 +1,113 @@
+"""
+Benchmark du profil serveur: `uvicorn app:app` par défaut vs `python -m shared.launcher`
+- Le stub OpenAI et le service coach tournent dans des process séparés (comme bench_ws_chat)
+- Charge: N clients concurrents envoient des POST /api/chat en boucle pendant D secondes
+- Mesures: débit (req/s), latence p50/p95, erreurs (503 de limit_concurrency comprises)
+- Générations de 2 s par défaut: le pool upstream par défaut (20 connexions) borne le débit
+  dès que les clients sont plus nombreux
+- Avec un stub très rapide (--stub-latency 0.2) sur une machine à 1 CPU, stub, service et clients
+  se disputent le CPU: un pool plus grand y coûte plus qu'il ne rapporte
+
+Usage: python -m benchmarks.bench_server_profile [--clients 16,64,128] [--duration 8] [--stub-latency 2]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import httpx
+from benchmarks.bench_ws_chat import ROOT, _free_port, _percentile, _spawn, _wait_ready
+
+MESSAGES = [{"role": "user", "content": "Comment améliorer ma posture face caméra ?"}]
+
+async def load(base: str, clients: int, duration: float) -> dict:
+    """Clients en boucle fermée: chacun renvoie une requête dès la réponse précédente reçue"""
+    latencies, errors = [], 0
+    stop_at = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base, timeout=30, limits=limits) as client:
+        async def worker():
+            nonlocal errors
+            while time.monotonic() < stop_at:
+                started = time.perf_counter()
+                try:
+                    response = await client.post("/api/chat", json={"messages": MESSAGES})
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        elapsed = time.monotonic() - started
+        server = (await client.get("/__version")).json()["server"]
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50_ms": _percentile(latencies, 0.5) * 1000 if latencies else 0,
+        "p95_ms": _percentile(latencies, 0.95) * 1000 if latencies else 0,
+        "errors": errors,
+        "server": server
+    }
+
+def measure(command: list, env: dict, port: int, clients: int, duration: float) -> dict:
+    server = _spawn(command, env)
+    try:
+        asyncio.run(_wait_ready(f"http://127.0.0.1:{port}/healthz"))
+        return asyncio.run(load(f"http://127.0.0.1:{port}", clients, duration))
+    finally:
+        server.terminate()
+        server.wait()
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", default="16,64,128", help="clients concurrents")
+    parser.add_argument("--duration", type=float, default=8.0)
+    parser.add_argument("--stub-latency", type=float, default=2.0)
+    args = parser.parse_args(argv)
+
+    stub_port = _free_port()
+    env = dict(os.environ)
+    stub = _spawn([
+        sys.executable, "-c",
+        "import uvicorn; from benchmarks.openai_stub import OpenAIStub; "
+        f"uvicorn.run(OpenAIStub(base_latency={args.stub_latency}, per_token_latency=0, concurrency=1000), "
+        f"port={stub_port}, log_level='warning', backlog=4096)"
+    ], env)
+    env.update({
+        "PYTHONPATH": os.pathsep.join([str(ROOT), str(ROOT / "hey-hi-coach-onlymatt")]),
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_CHAT_URL": f"http://127.0.0.1:{stub_port}/v1/chat/completions",
+        "SPECULATION_ENABLED": "0",
+        "MICRO_BATCH_ENABLED": "0"
+    })
+    env.pop("SERVER_PROFILE", None)
+    rows = []
+    try:
+        asyncio.run(_wait_ready(f"http://127.0.0.1:{stub_port}/v1/models"))
+        for clients in (int(c) for c in args.clients.split(",")):
+            for label in ("défaut", "lanceur"):
+                port = _free_port()
+                if label == "défaut":
+                    command = [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"]
+                else:
+                    command = [sys.executable, "-m", "shared.launcher", "app:app", "--host", "127.0.0.1", "--port", str(port)]
+                rows.append((clients, label, measure(command, env, port, clients, args.duration)))
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    print(f"stub: {args.stub_latency * 1000:.0f} ms par appel, {args.duration:.0f} s par mesure")
+    print(f"{'clients':>7} {'profil':<8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'erreurs':>8}  serveur")
+    for clients, label, row in rows:
+        server = row["server"]
+        summary = (f"workers={server.get('workers', 1)} loop={server.get('running_loop')} "
+                   f"pool={server.get('upstream_pool_size', 20)} limit={server.get('limit_concurrency', '-')}")
+        print(f"{clients:>7} {label:<8} {row['rps']:>8.1f} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} "
+              f"{row['errors']:>8}  {summary}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
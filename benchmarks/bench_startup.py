@@ -0,0 +1,107 @@
+"""
+Benchmark du temps d'import au démarrage (python -X importtime)
+- Mesure le temps cumulé d'import de chaque cible (meilleur de N exécutions)
+- Compare à benchmarks/startup_baseline.json avec une tolérance
+- Vérifie que les modules légers n'importent pas de dépendances lourdes
+- Code de sortie 1 en cas de régression (utilisable en CI)
+
+Usage:
+    python -m benchmarks.bench_startup              # compare à la baseline
+    python -m benchmarks.bench_startup --update     # réécrit la baseline
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+BASELINE_PATH = Path(__file__).resolve().parent / "startup_baseline.json"
+
+# Cible -> (code d'import, module dont on lit le temps cumulé, répertoire à ajouter au path)
+TARGETS = {
+    "shared": ("import shared", "shared", None),
+    "shared.utils": ("import shared.utils", "shared.utils", None),
+    "shared.chat_proxy": ("import shared.chat_proxy", "shared.chat_proxy", None),
+    "coach_app": ("import app", "app", "hey-hi-coach-onlymatt"),
+}
+# Ces cibles ne doivent jamais charger de dépendances lourdes
+LIGHTWEIGHT = {
+    "shared": ("fastapi", "pydantic", "httpx"),
+    "shared.utils": ("fastapi", "pydantic", "httpx"),
+    # httpx chargé au premier appel upstream ou au warm-up (lifespan), pas à l'import du service
+    "shared.chat_proxy": ("httpx",),
+    "coach_app": ("httpx",)
+}
+
+def import_time_us(code: str, module: str, extra_path: str = None) -> tuple[int, set]:
+    """Retourne (temps cumulé en µs, modules top-level importés)"""
+    env = dict(os.environ)
+    paths = [str(ROOT)] + ([str(ROOT / extra_path)] if extra_path else [])
+    env["PYTHONPATH"] = os.pathsep.join(paths + [env.get("PYTHONPATH", "")])
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    cumulative, imported = None, set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = [p.strip() for p in line[len("import time:"):].split("|")]
+        if not parts[1].isdigit():
+            continue  # ligne d'en-tête
+        name = parts[2]
+        imported.add(name.split(".")[0])
+        if name == module:
+            cumulative = int(parts[1])
+    if cumulative is None:
+        raise RuntimeError(f"module {module} absent de la sortie importtime")
+    return cumulative, imported
+
+def measure(runs: int) -> tuple[dict, dict]:
+    timings, violations = {}, {}
+    for target, (code, module, extra_path) in TARGETS.items():
+        best = None
+        for _ in range(runs):
+            us, imported = import_time_us(code, module, extra_path)
+            best = us if best is None else min(best, us)
+        timings[target] = best
+        forbidden = [dep for dep in LIGHTWEIGHT.get(target, ()) if dep in imported]
+        if forbidden:
+            violations[target] = forbidden
+    return timings, violations
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark du temps d'import")
+    parser.add_argument("--runs", type=int, default=5, help="exécutions par cible (on garde la meilleure)")
+    # +20% (+ slack): une régression de 25% sur l'import de chat_proxy ou du service échoue
+    parser.add_argument("--tolerance", type=float, default=0.2, help="régression relative tolérée (0.2 = +20%%)")
+    parser.add_argument("--slack-ms", type=float, default=15.0, help="marge absolue tolérée en ms")
+    parser.add_argument("--update", action="store_true", help="réécrit la baseline")
+    args = parser.parse_args(argv)
+
+    timings, violations = measure(args.runs)
+    if args.update:
+        BASELINE_PATH.write_text(json.dumps({k: v for k, v in timings.items()}, indent=2) + "\n")
+        print(f"Baseline écrite: {BASELINE_PATH}")
+    baseline = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+
+    failed = False
+    print(f"{'cible':<20} {'mesuré ms':>10} {'baseline ms':>12} {'limite ms':>10}  statut")
+    for target, us in timings.items():
+        base = baseline.get(target)
+        if base is None:
+            print(f"{target:<20} {us / 1000:>10.1f} {'-':>12} {'-':>10}  nouveau")
+            continue
+        limit = base * (1 + args.tolerance) + args.slack_ms * 1000
+        status = "ok" if us <= limit else "RÉGRESSION"
+        failed |= us > limit
+        print(f"{target:<20} {us / 1000:>10.1f} {base / 1000:>12.1f} {limit / 1000:>10.1f}  {status}")
+    for target, deps in violations.items():
+        failed = True
+        print(f"ÉCHEC: `{target}` importe {', '.join(deps)} (doit rester léger)")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
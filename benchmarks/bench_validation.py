@@ -0,0 +1,85 @@
+"""
+Benchmark de la validation ChatRequest seule (requêtes/seconde)
+- legacy: modèles Message avec field_validator Python + conversion en dicts
+- fast (dict): ChatRequest actuel depuis un dict déjà parsé
+- fast (json): ChatRequest.model_validate_json sur le body brut (chemin /api/chat)
+
+Usage: python -m benchmarks.bench_validation [--seconds 1.0]
+"""
+import sys
+import json
+import time
+import argparse
+from typing import List, Optional
+from pydantic import BaseModel, Field, field_validator
+from shared.chat_proxy import ChatRequest, MAX_MESSAGE_LENGTH, MAX_MESSAGES_COUNT
+
+class LegacyMessage(BaseModel):
+    role: str
+    content: str
+
+    @field_validator('role')
+    @classmethod
+    def validate_role(cls, v):
+        if v not in ['system', 'user', 'assistant', 'function', 'tool']:
+            raise ValueError('Invalid role')
+        return v
+
+    @field_validator('content')
+    @classmethod
+    def validate_content(cls, v):
+        if len(v) > MAX_MESSAGE_LENGTH:
+            raise ValueError(f'Message too long (max {MAX_MESSAGE_LENGTH} chars)')
+        return v
+
+class LegacyChatRequest(BaseModel):
+    messages: List[LegacyMessage] = Field(..., min_length=1, max_length=MAX_MESSAGES_COUNT)
+    model: Optional[str] = None
+    session_id: Optional[str] = None
+    project_id: Optional[str] = None
+    temperature: Optional[float] = Field(None, ge=0.0, le=2.0)
+    max_tokens: Optional[int] = Field(None, ge=1, le=16000)
+
+def legacy(body: bytes):
+    request = LegacyChatRequest.model_validate(json.loads(body))
+    return [{"role": m.role, "content": m.content} for m in request.messages]
+
+def fast_dict(body: bytes):
+    return list(ChatRequest.model_validate(json.loads(body)).messages)
+
+def fast_json(body: bytes):
+    return list(ChatRequest.model_validate_json(body).messages)
+
+def payload(count: int) -> bytes:
+    roles = ["user", "assistant"]
+    messages = [{"role": "system", "content": "Tu es un coach bienveillant."}]
+    messages += [{"role": roles[i % 2], "content": f"Message {i}: " + "contenu de conversation " * 8} for i in range(count - 1)]
+    return json.dumps({"messages": messages, "session_id": "s-1", "temperature": 0.7}).encode()
+
+def rate(fn, body: bytes, seconds: float) -> float:
+    fn(body)  # warm-up
+    calls, start = 0, time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(20):
+            fn(body)
+        calls += 20
+    return calls / (time.perf_counter() - start)
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark validation ChatRequest")
+    parser.add_argument("--seconds", type=float, default=1.0, help="durée de mesure par cas")
+    args = parser.parse_args(argv)
+
+    print(f"{'messages':>8} {'legacy req/s':>14} {'fast dict req/s':>16} {'fast json req/s':>16} {'gain':>7}")
+    for count in (1, 10, 100):
+        body = payload(count)
+        assert legacy(body) == fast_json(body)
+        legacy_rps = rate(legacy, body, args.seconds)
+        dict_rps = rate(fast_dict, body, args.seconds)
+        json_rps = rate(fast_json, body, args.seconds)
+        print(f"{count:>8} {legacy_rps:>14,.0f} {dict_rps:>16,.0f} {json_rps:>16,.0f} {json_rps / legacy_rps:>6.2f}x")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+Test de charge: chat multi-tours en POST /api/chat vs WebSocket /ws/chat
+- Le stub OpenAI et le service coach tournent dans des process uvicorn séparés
+- POST: chaque tour renvoie tout l'historique (nouvelle requête HTTP, CORS préflight en option)
+- WebSocket: une connexion par conversation, seuls les nouveaux messages sont envoyés,
+  la réponse est streamée (time-to-first-token mesuré)
+- CPU serveur: utime + stime du process du service (/proc/<pid>/stat), rapporté par tour
+
+Usage: python -m benchmarks.bench_ws_chat [--conversations 20] [--turns 10] [--preflight]
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+from pathlib import Path
+import httpx
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+ROOT = Path(__file__).resolve().parent.parent
+ORIGIN = "https://onlymatt.ca"
+SYSTEM_PROMPT = "Tu es un coach vidéo bienveillant. " * 20
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _cpu_seconds(pid: int) -> float:
+    """utime + stime du process (Linux)"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+def _percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def _spawn(args, env) -> subprocess.Popen:
+    return subprocess.Popen(args, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+async def _wait_ready(url: str, timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} ne répond pas")
+
+def _question(conversation: int, turn: int) -> dict:
+    return {"role": "user", "content": f"Conversation {conversation}, question {turn}: comment améliorer ma voix ?"}
+
+async def run_post(base: str, conversations: int, turns: int, preflight: bool) -> dict:
+    latencies = []
+    async with httpx.AsyncClient(base_url=base, timeout=60, limits=httpx.Limits(max_connections=conversations)) as client:
+        async def conversation(c: int):
+            history = [{"role": "system", "content": SYSTEM_PROMPT}]
+            for t in range(turns):
+                history.append(_question(c, t))
+                started = time.perf_counter()
+                if preflight:
+                    await client.options("/api/chat", headers={
+                        "Origin": ORIGIN, "Access-Control-Request-Method": "POST",
+                        "Access-Control-Request-Headers": "content-type"
+                    })
+                response = await client.post("/api/chat", json={"messages": history}, headers={"Origin": ORIGIN})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+                history.append(response.json()["choices"][0]["message"])
+
+        await asyncio.gather(*(conversation(c) for c in range(conversations)))
+    return {"latencies": latencies, "ttft": latencies}
+
+async def run_ws(base: str, conversations: int, turns: int) -> dict:
+    latencies, ttft = [], []
+    url = base.replace("http://", "ws://") + "/ws/chat"
+
+    async def conversation(c: int):
+        async with websockets.connect(url, origin=ORIGIN) as ws:
+            json.loads(await ws.recv())  # frame session
+            for t in range(turns):
+                new = [_question(c, t)]
+                if t == 0:
+                    new.insert(0, {"role": "system", "content": SYSTEM_PROMPT})
+                started = time.perf_counter()
+                first = None
+                await ws.send(json.dumps({"type": "chat", "id": str(t), "messages": new}))
+                while True:
+                    frame = json.loads(await ws.recv())
+                    if frame["type"] == "delta" and first is None:
+                        first = time.perf_counter() - started
+                    elif frame["type"] == "done":
+                        break
+                    elif frame["type"] == "error":
+                        raise RuntimeError(frame)
+                latencies.append(time.perf_counter() - started)
+                ttft.append(first if first is not None else latencies[-1])
+
+    await asyncio.gather(*(conversation(c) for c in range(conversations)))
+    return {"latencies": latencies, "ttft": ttft}
+
+async def measure(mode: str, pid: int, base: str, args) -> dict:
+    cpu_before = _cpu_seconds(pid)
+    started = time.perf_counter()
+    if mode == "websocket":
+        result = await run_ws(base, args.conversations, args.turns)
+    else:
+        result = await run_post(base, args.conversations, args.turns, args.preflight)
+    elapsed = time.perf_counter() - started
+    count = len(result["latencies"])
+    return {
+        "turns": count,
+        "p50_ms": _percentile(result["latencies"], 0.5) * 1000,
+        "p95_ms": _percentile(result["latencies"], 0.95) * 1000,
+        "ttft_p50_ms": _percentile(result["ttft"], 0.5) * 1000,
+        "cpu_ms_per_turn": (_cpu_seconds(pid) - cpu_before) / count * 1000,
+        "turns_per_s": count / elapsed
+    }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--conversations", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--preflight", action="store_true", help="OPTIONS avant chaque POST (navigateur cross-origin)")
+    parser.add_argument("--stub-latency", type=float, default=0.05)
+    parser.add_argument("--token-latency", type=float, default=0.002)
+    args = parser.parse_args(argv)
+    if websockets is None:
+        print("le paquet websockets est requis (pip install websockets)")
+        return 1
+
+    stub_port, app_port = _free_port(), _free_port()
+    env = dict(os.environ)
+    stub = _spawn([
+        sys.executable, "-c",
+        "import uvicorn; from benchmarks.openai_stub import OpenAIStub; "
+        f"uvicorn.run(OpenAIStub(base_latency={args.stub_latency}, per_token_latency={args.token_latency}, "
+        f"concurrency={args.conversations}, completion_tokens=40), port={stub_port}, log_level='warning')"
+    ], env)
+    env.update({
+        "PYTHONPATH": os.pathsep.join([str(ROOT), str(ROOT / "hey-hi-coach-onlymatt")]),
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_CHAT_URL": f"http://127.0.0.1:{stub_port}/v1/chat/completions",
+        "ALLOWED_ORIGINS": ORIGIN,
+        "SPECULATION_ENABLED": "0",
+    })
+    server = _spawn([sys.executable, "-m", "uvicorn", "app:app", "--port", str(app_port), "--log-level", "warning"], env)
+    base = f"http://127.0.0.1:{app_port}"
+    try:
+        asyncio.run(_wait_ready(f"{base}/healthz"))
+        rows = {mode: asyncio.run(measure(mode, server.pid, base, args)) for mode in ("post", "websocket")}
+    finally:
+        server.terminate()
+        stub.terminate()
+        server.wait()
+        stub.wait()
+
+    print(f"{args.conversations} conversations x {args.turns} tours" + (" (préflight CORS)" if args.preflight else ""))
+    print(f"{'mode':<10} {'p50 ms':>8} {'p95 ms':>8} {'ttft ms':>8} {'cpu ms/tour':>12} {'tours/s':>8}")
+    for mode, row in rows.items():
+        print(f"{mode:<10} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['ttft_p50_ms']:>8.1f} "
+              f"{row['cpu_ms_per_turn']:>12.2f} {row['turns_per_s']:>8.1f}")
+    post, ws = rows["post"], rows["websocket"]
+    print(f"websocket: cpu/tour x{ws['cpu_ms_per_turn'] / post['cpu_ms_per_turn']:.2f}, "
+          f"time-to-first-token {post['ttft_p50_ms'] - ws['ttft_p50_ms']:.0f} ms plus tôt (p50)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""
+Stub local de l'API OpenAI chat completions (benchmarks, tests de charge)
+- Latence fixe par appel + latence par token de completion
+- Concurrence bornée, comme un quota de requêtes simultanées par clé
+- response_format json_object: répond aux lots du MicroBatcher
+- stream=true: réponse SSE, un fragment par token simulé (latence par token étalée)
+- Quotas optionnels (rpm_limit / tpm_limit par quota_window secondes): headers
+  x-ratelimit-* sur chaque réponse, 429 au-delà, comme l'API OpenAI
+
+Usage:
+    uvicorn benchmarks.openai_stub:app --port 8001
+    OPENAI_CHAT_URL=http://127.0.0.1:8001/v1/chat/completions
+ou en process via httpx.ASGITransport(app=OpenAIStub())
+"""
+import json
+import time
+import asyncio
+from typing import Any, Dict, List, Optional
+
+class _Quota:
+    """Seau qui se remplit en continu (limit par window secondes)"""
+    __slots__ = ("limit", "window", "level", "updated")
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self.level = float(limit)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.limit, self.level + (now - self.updated) * self.limit / self.window)
+        self.updated = now
+
+    def reset_seconds(self) -> float:
+        return (self.limit - self.level) * self.window / self.limit
+
+def _duration(seconds: float) -> str:
+    # Format des headers OpenAI: "20ms", "1.5s"
+    return f"{seconds * 1000:.0f}ms" if seconds < 1 else f"{seconds:.3f}s"
+
+class OpenAIStub:
+    """Application ASGI minimale imitant /v1/chat/completions"""
+    def __init__(
+        self,
+        base_latency: float = 0.08,
+        per_token_latency: float = 0.002,
+        concurrency: int = 4,
+        completion_tokens: int = 12,
+        rpm_limit: Optional[int] = None,
+        tpm_limit: Optional[int] = None,
+        quota_window: float = 60.0
+    ):
+        self.base_latency = base_latency
+        self.per_token_latency = per_token_latency
+        self.concurrency = concurrency
+        self.completion_tokens = completion_tokens
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.calls = 0
+        self.rejected = 0
+        self.quotas = {
+            name: _Quota(limit, quota_window)
+            for name, limit in (("requests", rpm_limit), ("tokens", tpm_limit)) if limit
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                await send({"type": message["type"] + ".complete"})
+                if message["type"] == "lifespan.shutdown":
+                    return
+        if scope["method"] != "POST":
+            await _send_json(send, 405, {"error": {"message": "Method not allowed"}})
+            return
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body", False):
+                break
+        payload = json.loads(body)
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        prompt = sum(len(m.get("content") or "") for m in payload["messages"]) // 4 + 1
+        allowed, headers = self._admit(prompt + (payload.get("max_tokens") or self.completion_tokens))
+        if not allowed:
+            self.rejected += 1
+            await _send_json(send, 429, {"error": {"message": "Rate limit reached", "type": "requests"}}, headers)
+            return
+        if payload.get("stream"):
+            await self._stream(send, payload, prompt, headers)
+            return
+
+        async with self._semaphore:
+            self.calls += 1
+            content, completion = self._complete(payload)
+            await asyncio.sleep(self.base_latency + self.per_token_latency * completion)
+
+        await _send_json(send, 200, {
+            "id": f"chatcmpl-stub-{self.calls}",
+            "object": "chat.completion",
+            "model": payload.get("model", "stub"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion},
+        }, headers)
+
+    def _admit(self, tokens: int) -> tuple:
+        """Consomme 1 requête + tokens estimés (prompt + max_tokens) si le quota le permet"""
+        now = time.monotonic()
+        costs = {"requests": 1, "tokens": tokens}
+        for quota in self.quotas.values():
+            quota.refill(now)
+        allowed = all(quota.level >= costs[name] for name, quota in self.quotas.items())
+        if allowed:
+            for name, quota in self.quotas.items():
+                quota.level -= costs[name]
+        headers = []
+        for name, quota in self.quotas.items():
+            headers += [
+                (f"x-ratelimit-limit-{name}".encode(), str(quota.limit).encode()),
+                (f"x-ratelimit-remaining-{name}".encode(), str(int(quota.level)).encode()),
+                (f"x-ratelimit-reset-{name}".encode(), _duration(quota.reset_seconds()).encode()),
+            ]
+        return allowed, headers
+
+    async def _stream(self, send, payload: Dict[str, Any], prompt: int, headers: list = ()):
+        """Réponse SSE: premier fragment après base_latency, puis un fragment par token"""
+        async with self._semaphore:
+            self.calls += 1
+            content, completion = self._complete(payload)
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"text/event-stream"), *headers],
+            })
+            await asyncio.sleep(self.base_latency)
+            words = content.split(" ")
+            base = {"id": f"chatcmpl-stub-{self.calls}", "object": "chat.completion.chunk", "model": payload.get("model", "stub")}
+            for i, word in enumerate(words):
+                delta = {"content": word if i == 0 else " " + word}
+                chunk = {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                await send({"type": "http.response.body", "body": f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode(), "more_body": True})
+                await asyncio.sleep(self.per_token_latency * completion / len(words))
+            tail = [
+                {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]},
+                {**base, "choices": [], "usage": {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}},
+            ]
+            body = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in tail) + "data: [DONE]\n\n"
+            await send({"type": "http.response.body", "body": body.encode()})
+
+    def _answer(self, messages: List[Dict[str, Any]]) -> str:
+        last = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        return f"Réponse: {last[:40]}"
+
+    def _complete(self, payload: Dict[str, Any]) -> tuple:
+        """Retourne (contenu, tokens de completion)"""
+        if (payload.get("response_format") or {}).get("type") == "json_object":
+            items = json.loads(payload["messages"][-1]["content"])
+            answers = [{"id": item["id"], "content": self._answer(item["messages"])} for item in items]
+            return json.dumps({"answers": answers}, ensure_ascii=False), self.completion_tokens * len(items)
+        return self._answer(payload["messages"]), self.completion_tokens
+
+async def _send_json(send, status: int, data: Dict[str, Any], headers: list = ()):
+    body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+app = OpenAIStub()
@@ -52,8 +52,15 @@ function heyhi_connector_handle_chat($req) {
         return heyhi_connector_apply_cors($req, $resp);
     }
     
+    // X-Request-ID: réutilisé s'il est fourni, sinon généré (corrélation avec le proxy)
+    $request_id = $req->get_header('x_request_id');
+    if (empty($request_id) || !preg_match('/^[A-Za-z0-9._:-]{1,128}$/', $request_id)) {
+        $request_id = wp_generate_uuid4();
+    }
+    
     // Log de la requête (si debug activé)
     heyhi_connector_log('chat_request', array(
+        'request_id' => $request_id,
         'message_count' => count($body['messages']),
         'model' => $body['model'] ?? 'default',
         'session_id' => $body['session_id'] ?? null
@@ -61,10 +68,22 @@ function heyhi_connector_handle_chat($req) {
     
     // Forward vers Core AI
     $core_url = trailingslashit($opts['core_ai_base']) . 'assistant/chat';
-    $result = heyhi_connector_forward_json($core_url, $body, 10, 70);
+    // X-Request-Timeout: le proxy abandonne (et cesse de payer OpenAI) juste avant notre propre timeout
+    $timeout = 70;
+    $forward_headers = array(
+        'X-Request-ID' => $request_id,
+        'X-Request-Timeout' => (string) ($timeout - 2)
+    );
+    // Idempotency-Key du client transmise telle quelle: ses retries sur timeout sont rejoués, pas refacturés
+    $idempotency_key = $req->get_header('idempotency_key');
+    if (!empty($idempotency_key) && preg_match('/^[\x21-\x7e]{1,255}$/', $idempotency_key)) {
+        $forward_headers['Idempotency-Key'] = $idempotency_key;
+    }
+    $result = heyhi_connector_forward_json($core_url, $body, 10, $timeout, $forward_headers);
     
     if ($result['error']) {
         heyhi_connector_log('chat_upstream_error', array(
+            'request_id' => $request_id,
             'error' => $result['error'],
             'url' => $core_url
         ));
@@ -79,6 +98,7 @@ function heyhi_connector_handle_chat($req) {
     
     // Log de la réponse
     heyhi_connector_log('chat_response', array(
+        'request_id' => $request_id,
         'status' => $result['status'],
         'body_length' => strlen($result['body'])
     ));
@@ -91,6 +111,7 @@ function heyhi_connector_handle_chat($req) {
     
     $resp = new WP_REST_Response($data);
     $resp->set_status($result['status']);
+    $resp->header('X-Request-ID', $request_id);
     return heyhi_connector_apply_cors($req, $resp);
 }
 
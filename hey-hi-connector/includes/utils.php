@@ -49,7 +49,7 @@ function heyhi_connector_apply_cors($req, $resp){
   if ($origin && in_array($origin, $origins)) {
     $resp->header('Access-Control-Allow-Origin', $origin);
     $resp->header('Vary', 'Origin');
-    $resp->header('Access-Control-Allow-Headers', 'Authorization, Content-Type, X-HeyHi-Key');
+    $resp->header('Access-Control-Allow-Headers', 'Authorization, Content-Type, X-HeyHi-Key, Idempotency-Key');
     $resp->header('Access-Control-Allow-Methods', 'POST, GET, OPTIONS');
     $resp->header('Access-Control-Max-Age', '600');
   }
@@ -91,10 +91,10 @@ function heyhi_connector_json($arr){
   return heyhi_connector_apply_cors($req, $resp);
 }
 
-function heyhi_connector_forward_json($url, $payload, $t_connect=10, $t_total=60){
+function heyhi_connector_forward_json($url, $payload, $t_connect=10, $t_total=60, $extra_headers=array()){
   $args = array(
     'method' => 'POST',
-    'headers' => array('Content-Type' => 'application/json'),
+    'headers' => array_merge(array('Content-Type' => 'application/json'), $extra_headers),
     'body' => wp_json_encode($payload),
     'timeout' => $t_total
   );
@@ -0,0 +1,22 @@
+"""
+Gateway Hey Hi: coach, vidéo et website builder dans un seul process
+- Routage par chemin: /coach/api/chat, /video/api/chat, /builder/build
+- Routage par Host (GATEWAY_HOSTS): coach.onlymatt.ca/api/chat -> service coach
+- Un seul pool upstream, registre d'usage, circuit breaker et micro-batcher
+- Configuration par service: COACH_OPENAI_MODEL, VIDEO_BODY_LIMITS, BUILDER_ALLOWED_ORIGINS...
+  (variable préfixée, sinon variable globale)
+"""
+import os
+from shared.services import ServiceConfig, create_builder_app, create_chat_app, create_gateway_app, parse_gateway_hosts
+
+services = {
+    "coach": create_chat_app(ServiceConfig("hey-hi-coach-onlymatt", prefix="coach"), speculation=True),
+    "video": create_chat_app(ServiceConfig("hey-hi-video-onlymatt", prefix="video")),
+    "builder": create_builder_app(ServiceConfig("hey-hi-website-builder-onlymatt", prefix="builder")),
+}
+
+app = create_gateway_app(
+    services,
+    hosts=parse_gateway_hosts(os.getenv("GATEWAY_HOSTS", "")),
+    name=os.getenv("APP_NAME", "hey-hi-gateway-onlymatt")
+)
@@ -36,6 +36,16 @@ echo ""
 
 pytest tests/ -v --tb=short --cov=shared --cov-report=term-missing --cov-report=html
 
+# Régression du temps d'import au démarrage (échoue si > baseline + tolérance)
+echo ""
+echo "⏱️  Vérification du temps de démarrage..."
+python -m benchmarks.bench_startup
+
+# Régression de performance (µs/op vs tests/benchmark_baseline.json)
+echo ""
+echo "⏱️  Benchmarks de performance..."
+pytest tests/ -m benchmark -q --no-cov
+
 # Afficher le résumé
 echo ""
 echo "✅ Tests terminés!"
@@ -1,41 +1,104 @@
 """
 Script d'initialisation du package shared pour les imports
+Imports paresseux: `import shared` ne charge aucun sous-module. Chaque attribut
+est importé au premier accès, de sorte que `shared.utils` reste utilisable sans
+charger FastAPI, pydantic ni httpx (démarrage à froid plus rapide).
 """
-from .utils import (
-    get_allowed_origins,
-    get_timeouts,
-    get_security_headers,
-    SimpleRateLimiter,
-    validate_request_size,
-    sanitize_input
-)
+import importlib
 
-from .chat_proxy import (
-    Message,
-    ChatRequest,
-    CircuitBreaker,
-    ChatMetrics,
-    call_openai_with_retry,
-    handle_chat_request,
-    metrics,
-    circuit_breaker
-)
-
-__all__ = [
+# Attribut exporté -> sous-module qui le définit
+_LAZY_EXPORTS = {
     # utils
-    'get_allowed_origins',
-    'get_timeouts',
-    'get_security_headers',
-    'SimpleRateLimiter',
-    'validate_request_size',
-    'sanitize_input',
+    'get_allowed_origins': 'utils',
+    'get_timeouts': 'utils',
+    'get_security_headers': 'utils',
+    'SimpleRateLimiter': 'utils',
+    'validate_request_size': 'utils',
+    'sanitize_input': 'utils',
     # chat_proxy
-    'Message',
-    'ChatRequest',
-    'CircuitBreaker',
-    'ChatMetrics',
-    'call_openai_with_retry',
-    'handle_chat_request',
-    'metrics',
-    'circuit_breaker',
-]
+    'Message': 'chat_proxy',
+    'ChatRequest': 'chat_proxy',
+    'CircuitBreaker': 'chat_proxy',
+    'RetryBudget': 'chat_proxy',
+    'ChatMetrics': 'chat_proxy',
+    'MicroBatcher': 'chat_proxy',
+    'ToolRegistry': 'chat_proxy',
+    'tool_registry': 'chat_proxy',
+    'run_tool_loop': 'chat_proxy',
+    'call_openai_with_retry': 'chat_proxy',
+    'handle_chat_request': 'chat_proxy',
+    'open_upstream_pool': 'chat_proxy',
+    'close_upstream_pool': 'chat_proxy',
+    'prewarm': 'chat_proxy',
+    'metrics': 'chat_proxy',
+    'circuit_breaker': 'chat_proxy',
+    'retry_budget': 'chat_proxy',
+    # usage
+    'UsageLedger': 'usage',
+    'estimate_cost': 'usage',
+    'usage_ledger': 'usage',
+    # tracing
+    'RequestTracingMiddleware': 'tracing',
+    'current_request_id': 'tracing',
+    'span': 'tracing',
+    # access_log
+    'AccessLogMiddleware': 'access_log',
+    # body_limit
+    'BodySizeLimitMiddleware': 'body_limit',
+    # deadline
+    'DeadlineMiddleware': 'deadline',
+    'remaining_budget': 'deadline',
+    # compression
+    'CompressionMiddleware': 'compression',
+    'PrecompressedAsset': 'compression',
+    # speculation
+    'SpeculativeCache': 'speculation',
+    # model_policy
+    'ModelPolicy': 'model_policy',
+    # snapshot
+    'StateSnapshotter': 'snapshot',
+    # lifecycle
+    'ServiceLifecycle': 'lifecycle',
+    # runtime
+    'RuntimeMonitor': 'runtime',
+    'runtime_monitor': 'runtime',
+    # upstream_governor
+    'UpstreamGovernor': 'upstream_governor',
+    'upstream_governor': 'upstream_governor',
+    # ws_chat
+    'ChatSessions': 'ws_chat',
+    'serve_chat_websocket': 'ws_chat',
+    # html_sanitizer
+    'HTMLSanitizer': 'html_sanitizer',
+    'sanitize_html': 'html_sanitizer',
+    # drain
+    'ShutdownDrain': 'drain',
+    # launcher
+    'ServerProfile': 'launcher',
+    # idempotency
+    'IdempotencyStore': 'idempotency',
+    # retrieval
+    'RetrievalIndex': 'retrieval',
+    'Retriever': 'retrieval',
+    'build_index': 'retrieval',
+    # services
+    'ServiceConfig': 'services',
+    'create_chat_app': 'services',
+    'create_builder_app': 'services',
+    'VariantCache': 'services',
+    'create_gateway_app': 'services',
+}
+
+__all__ = list(_LAZY_EXPORTS)
+
+def __getattr__(name):
+    module_name = _LAZY_EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module_name}", __name__), name)
+    # Mise en cache: les accès suivants ne repassent plus par __getattr__
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,179 @@
+"""
+Logs d'accès structurés (JSON) non bloquants
+- Les handlers déposent les enregistrements dans un ring buffer borné en mémoire
+- Un thread d'écriture sérialise et écrit par lots (aucune I/O sur l'event loop)
+- Buffer plein: l'enregistrement est abandonné et compté
+"""
+import os
+import sys
+import json
+import time
+import threading
+from collections import deque
+from typing import Optional, Tuple, TextIO
+from .tracing import current_trace
+from .utils import route_path
+
+class AccessLogWriter:
+    """
+    Ring buffer borné + thread d'écriture par lots
+    enqueue() est O(1) sans verrou (append/popleft de deque sont atomiques)
+    """
+    def __init__(
+        self,
+        stream: Optional[TextIO] = None,
+        capacity: int = 10000,
+        batch_size: int = 256,
+        flush_interval: float = 0.5
+    ):
+        self.stream = stream if stream is not None else sys.stdout
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.write_errors = 0
+        self._buffer = deque()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._write_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls) -> "AccessLogWriter":
+        """Construit le writer depuis les variables ACCESS_LOG_*"""
+        path = os.getenv("ACCESS_LOG_PATH", "")
+        return cls(
+            stream=open(path, "a", encoding="utf-8", buffering=1) if path else None,
+            capacity=int(os.getenv("ACCESS_LOG_CAPACITY", "10000")),
+            batch_size=int(os.getenv("ACCESS_LOG_BATCH", "256")),
+            flush_interval=float(os.getenv("ACCESS_LOG_FLUSH_INTERVAL", "0.5"))
+        )
+
+    def enqueue(self, record: dict) -> bool:
+        """Dépose un enregistrement (False si abandonné car buffer plein)"""
+        if len(self._buffer) >= self.capacity:
+            self.dropped += 1
+            return False
+        self._buffer.append(record)
+        self.enqueued += 1
+        if self._thread is None:
+            self._start()
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def _start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="access-log-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+        self.flush()
+
+    def flush(self) -> int:
+        """Sérialise et écrit tout le contenu du buffer (appelé par le thread d'écriture)"""
+        written = 0
+        with self._write_lock:
+            while self._buffer:
+                lines = []
+                while self._buffer and len(lines) < self.batch_size:
+                    record = self._buffer.popleft()
+                    lines.append(json.dumps(record, separators=(",", ":"), default=str))
+                try:
+                    self.stream.write("\n".join(lines) + "\n")
+                    self.stream.flush()
+                    written += len(lines)
+                except Exception:
+                    self.write_errors += len(lines)
+        self.written += written
+        return written
+
+    def close(self, timeout: float = 2.0):
+        """Arrête le thread après un dernier flush"""
+        if self._thread is not None:
+            self._stopped.set()
+            self._wakeup.set()
+            self._thread.join(timeout)
+            self._thread = None
+        else:
+            self.flush()
+
+    def get_stats(self) -> dict:
+        return {
+            "buffered": len(self._buffer),
+            "capacity": self.capacity,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "write_errors": self.write_errors
+        }
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+class AccessLogMiddleware:
+    """
+    Middleware ASGI: un enregistrement JSON par requête sur les routes suivies
+    Doit être placé à l'intérieur de RequestTracingMiddleware (lit les annotations)
+    """
+    def __init__(
+        self,
+        app,
+        service_name: str,
+        writer: Optional[AccessLogWriter] = None,
+        routes: Tuple[str, ...] = ("/api/chat", "/build")
+    ):
+        self.app = app
+        self.service_name = service_name
+        self.writer = writer if writer is not None else access_log
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not route_path(scope).startswith(self.routes):
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            trace = current_trace()
+            annotations = trace.annotations if trace is not None else {}
+            attempts = annotations.get("upstream_attempts")
+            self.writer.enqueue({
+                "ts": round(time.time(), 3),
+                "service": self.service_name,
+                "request_id": trace.request_id if trace is not None else None,
+                "method": scope.get("method"),
+                "path": scope["path"],
+                "status": status["code"],
+                "latency_ms": {
+                    "total": _ms(time.perf_counter() - start),
+                    "validation": _ms(annotations.get("validation_seconds")),
+                    "upstream": _ms(annotations.get("upstream_seconds")),
+                    "backoff": _ms(annotations.get("backoff_seconds")),
+                },
+                "model": annotations.get("model"),
+                "tokens": annotations.get("tokens"),
+                "cache": annotations.get("cache", "none"),
+                "retries": attempts - 1 if attempts else 0,
+                "breaker": annotations.get("breaker"),
+                "model_downgrade": annotations.get("model_downgrade"),
+                "error": annotations.get("error"),
+            })
+
+# Instance globale du writer de logs d'accès
+access_log = AccessLogWriter.from_env()
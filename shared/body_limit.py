@@ -0,0 +1,106 @@
+"""
+Limite de taille des requêtes, appliquée avant la mise en mémoire du body
+- Content-Length annoncé trop grand: 413 immédiat, sans lire le body
+- Body sans Content-Length (chunked) ou mensonger: octets comptés pendant la
+  lecture, abandon dès que la limite est dépassée
+- Limites configurables par route (BODY_LIMITS="/api/chat=524288,/build=262144")
+"""
+import os
+import json
+from typing import Dict, Optional
+from fastapi import HTTPException
+from .tracing import annotate
+from .utils import route_path
+
+# /api/chat: 512 Ko, bien au-delà d'une conversation réelle (un message de taille maximale
+# en UTF-8 4 octets y tient); le maximum théorique de ChatRequest (100 x 50000 caractères,
+# ~20 Mo) reviendrait à tout mettre en mémoire avant le 413. BODY_LIMITS pour l'augmenter
+DEFAULT_CHAT_BODY_LIMIT = 512 * 1024
+DEFAULT_BODY_LIMITS = f"/api/chat={DEFAULT_CHAT_BODY_LIMIT},/build=262144"
+
+def parse_body_limits(raw: str) -> Dict[str, int]:
+    """Parse "route=octets,route=octets" en dict"""
+    limits = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        path, value = item.split("=", 1)
+        if path.strip() and value.strip():
+            limits[path.strip()] = int(value)
+    return limits
+
+class PayloadTooLarge(HTTPException):
+    """Body au-delà de la limite de la route (rendu en 413 par FastAPI ou par le middleware)"""
+    def __init__(self, limit: int, size: Optional[int] = None):
+        if size is None:
+            message = f"Requête trop volumineuse (max: {limit} bytes)"
+        else:
+            message = f"Requête trop volumineuse: {size} bytes (max: {limit})"
+        super().__init__(
+            status_code=413,
+            detail={"error": "PAYLOAD_TOO_LARGE", "message": message, "limit_bytes": limit}
+        )
+
+class BodySizeLimitMiddleware:
+    """
+    Middleware ASGI de limite de taille par route
+    Routes non configurées: aucun surcoût. Chemin normal: les messages ASGI sont
+    transmis tels quels (aucune copie), seul leur longueur est additionnée.
+    """
+    def __init__(self, app, limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.limits = parse_body_limits(os.getenv("BODY_LIMITS", DEFAULT_BODY_LIMITS)) if limits is None else limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(route_path(scope)) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope.get("headers", ()):
+            if name == b"content-length":
+                if value.isdigit() and int(value) > limit:
+                    await self._reject(send, PayloadTooLarge(limit, int(value)))
+                    return
+                break
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    annotate(error="PAYLOAD_TOO_LARGE")
+                    raise PayloadTooLarge(limit)
+            return message
+
+        async def track_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, track_send)
+        except PayloadTooLarge as exc:
+            # Normalement rendu par le handler d'exceptions FastAPI; ici si l'app ne l'a pas fait
+            if response_started:
+                raise
+            await self._reject(send, exc)
+
+    async def _reject(self, send, exc: PayloadTooLarge):
+        annotate(error="PAYLOAD_TOO_LARGE")
+        body = json.dumps({"detail": exc.detail}, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
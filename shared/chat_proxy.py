@@ -5,46 +5,138 @@ Logique commune pour les proxies chat OpenAI avec:
 - Validation des inputs
 - Métriques intégrées
 - Gestion d'erreurs améliorée
+- Comptabilité d'usage et budgets par projet
+- Traçage par requête (X-Request-ID propagé, spans)
+- Pool de connexions upstream partagé + préchauffage au démarrage
+- Micro-batching opt-in des complétions courtes (trafic non interactif)
+- Boucle d'outils côté serveur (appels d'un même tour exécutés en parallèle)
+- Régulation des envois d'après les headers de quota OpenAI (429 évités plutôt que retentés)
+- Budget de retries global (pas de tempête de retries pendant une panne upstream)
+- Retrieval local opt-in: extraits d'un index BM25 injectés au lieu de la documentation entière
 """
-import os, time, asyncio, httpx
-from typing import List, Dict, Any, Optional
-from fastapi import HTTPException
+import os, json, time, asyncio, inspect, contextvars
+from collections import deque
+from contextlib import nullcontext
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Literal, Annotated, Awaitable, Callable
+from typing_extensions import TypedDict
+from fastapi import HTTPException, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, ValidationError, field_validator, model_validator
+from .usage import usage_ledger
+from .tracing import REQUEST_ID_HEADER, annotate, current_request_id, current_trace, span
+from .speculation import SpeculativeCache
+from .deadline import current_deadline, remaining_budget
+from .model_policy import ModelPolicy, observe_attempt
+from .upstream_governor import estimate_tokens, upstream_governor
+from .retrieval import Retriever
+
+if TYPE_CHECKING:
+    # httpx (~200 ms d'import) chargé au premier appel upstream ou au warm-up, pas à l'import
+    import httpx
 
 # Configuration
 DEFAULT_MODEL = "gpt-4o-mini"
-OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
+OPENAI_CHAT_URL = os.getenv("OPENAI_CHAT_URL", "https://api.openai.com/v1/chat/completions")
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "20"))
 MAX_MESSAGE_LENGTH = 50000
 MAX_MESSAGES_COUNT = 100
 MAX_RETRIES = 3
 INITIAL_BACKOFF = 1.0
+# En dessous de ce budget restant, une nouvelle tentative n'a aucune chance d'aboutir
+MIN_ATTEMPT_SECONDS = 0.5
+# Boucle d'outils côté serveur: étapes max par requête, timeout par appel d'outil
+TOOL_MAX_STEPS = int(os.getenv("TOOL_MAX_STEPS", "5"))
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "10"))
+MAX_TOOL_RESULT_CHARS = 20000
+
+Role = Literal['system', 'user', 'assistant', 'function', 'tool']
+MessageContent = Annotated[str, Field(max_length=MAX_MESSAGE_LENGTH)]
+
+# Erreurs pydantic-core réécrites avec les messages historiques de l'API
+_LEGACY_ERRORS = {
+    ("role", "literal_error"): lambda: ValueError('Invalid role'),
+    ("content", "string_too_long"): lambda: ValueError(f'Message too long (max {MAX_MESSAGE_LENGTH} chars)'),
+}
+
+def _with_legacy_errors(exc: ValidationError) -> ValidationError:
+    """Reconstruit l'erreur de validation avec les messages historiques (chemin d'erreur uniquement)"""
+    line_errors = []
+    for error in exc.errors():
+        rewrite = _LEGACY_ERRORS.get((error["loc"][-1] if error["loc"] else None, error["type"]))
+        if rewrite is not None:
+            line_errors.append({"type": "value_error", "loc": error["loc"], "input": error["input"], "ctx": {"error": rewrite()}})
+        else:
+            line_errors.append({key: error[key] for key in ("type", "loc", "input", "ctx") if key in error})
+    return ValidationError.from_exception_data(exc.title, line_errors)
+
+class ChatMessage(TypedDict):
+    """
+    Message prêt pour l'upstream: validé directement par pydantic-core
+    (rôle Literal, longueur max) sans instancier de modèle par message
+    """
+    role: Role
+    content: MessageContent
 
 class Message(BaseModel):
-    role: str
-    content: str
-    
-    @field_validator('role')
-    @classmethod
-    def validate_role(cls, v):
-        if v not in ['system', 'user', 'assistant', 'function', 'tool']:
-            raise ValueError('Invalid role')
-        return v
+    role: Role
+    content: MessageContent
     
-    @field_validator('content')
+    @model_validator(mode='wrap')
     @classmethod
-    def validate_content(cls, v):
-        if len(v) > MAX_MESSAGE_LENGTH:
-            raise ValueError(f'Message too long (max {MAX_MESSAGE_LENGTH} chars)')
-        return v
+    def legacy_error_messages(cls, data, handler):
+        try:
+            return handler(data)
+        except ValidationError as e:
+            raise _with_legacy_errors(e)
 
 class ChatRequest(BaseModel):
-    messages: List[Message] = Field(..., min_length=1, max_length=MAX_MESSAGES_COUNT)
+    messages: List[ChatMessage] = Field(..., min_length=1, max_length=MAX_MESSAGES_COUNT)
     model: Optional[str] = None
     session_id: Optional[str] = None
     project_id: Optional[str] = None
     temperature: Optional[float] = Field(None, ge=0.0, le=2.0)
     max_tokens: Optional[int] = Field(None, ge=1, le=16000)
+    # Relances suggérées (boutons du widget), pré-générées si speculate=True
+    followups: Optional[List[Annotated[str, Field(max_length=500)]]] = Field(None, max_length=10)
+    speculate: bool = False
+    # Trafic non interactif (pré-génération en masse): peut être regroupé avec d'autres requêtes
+    batchable: bool = False
+    # Outils du registre exécutés par le proxy (boucle jusqu'à la réponse finale)
+    server_tools: Optional[List[Annotated[str, Field(max_length=64)]]] = Field(None, max_length=32)
+    max_tool_steps: Optional[int] = Field(None, ge=1, le=20)
+    # Extraits de l'index de retrieval du service (False: le client fournit déjà son contexte)
+    retrieval: bool = True
+    
+    @field_validator('messages', mode='before')
+    @classmethod
+    def accept_message_models(cls, v):
+        # Compatibilité: ChatRequest(messages=[Message(...)]) reste accepté
+        if isinstance(v, list) and any(isinstance(m, BaseModel) for m in v):
+            return [m.model_dump() if isinstance(m, BaseModel) else m for m in v]
+        return v
+    
+    @model_validator(mode='wrap')
+    @classmethod
+    def legacy_error_messages(cls, data, handler):
+        try:
+            return handler(data)
+        except ValidationError as e:
+            raise _with_legacy_errors(e)
+
+async def parse_chat_request(request: Request) -> ChatRequest:
+    """
+    Dépendance FastAPI: valide le JSON brut directement (model_validate_json),
+    sans passer par json.loads + dict intermédiaire
+    """
+    body = await request.body()
+    try:
+        return ChatRequest.model_validate_json(body)
+    except ValidationError as e:
+        errors = e.errors(include_url=False)
+        for error in errors:
+            error["loc"] = ("body", *error["loc"])
+        raise RequestValidationError(errors, body=body)
 
 class CircuitBreaker:
     """Circuit breaker basique pour éviter surcharge sur échecs répétés"""
@@ -74,10 +166,84 @@ class CircuitBreaker:
         self.last_failure_time = time.time()
         if self.failure_count >= self.failure_threshold:
             self.state = "open"
+    
+    def export_state(self) -> dict:
+        return {"failure_count": self.failure_count, "last_failure_time": self.last_failure_time, "state": self.state}
+    
+    def restore_state(self, state: dict):
+        self.failure_count = state["failure_count"]
+        self.last_failure_time = state["last_failure_time"]
+        self.state = state["state"]
 
 # Instance globale du circuit breaker
 circuit_breaker = CircuitBreaker()
 
+class RetryBudget:
+    """
+    Budget de retries du process: un retry n'est autorisé que si les retries de la fenêtre
+    glissante restent sous `ratio` x premières tentatives (+ `min_retries` pour le faible trafic)
+    Pendant une panne upstream, la charge sortante reste ~(1 + ratio) x au lieu de MAX_RETRIES x
+    """
+    def __init__(self, ratio: float = 0.1, window: float = 10.0, min_retries: int = 5):
+        self.ratio = ratio
+        self.window = window
+        self.min_retries = min_retries
+        # Compteurs par seconde: [seconde, premières tentatives, retries]
+        self._buckets = deque()
+        self.attempts = 0
+        self.retries = 0
+        self.exhausted = 0
+    
+    @classmethod
+    def from_env(cls) -> "RetryBudget":
+        """Construit le budget depuis RETRY_BUDGET_RATIO / RETRY_BUDGET_WINDOW / RETRY_BUDGET_MIN"""
+        return cls(
+            ratio=float(os.getenv("RETRY_BUDGET_RATIO", "0.1")),
+            window=float(os.getenv("RETRY_BUDGET_WINDOW", "10")),
+            min_retries=int(os.getenv("RETRY_BUDGET_MIN", "5"))
+        )
+    
+    def _bucket(self) -> list:
+        now = int(time.monotonic())
+        while self._buckets and self._buckets[0][0] <= now - self.window:
+            self._buckets.popleft()
+        if not self._buckets or self._buckets[-1][0] != now:
+            self._buckets.append([now, 0, 0])
+        return self._buckets[-1]
+    
+    def _window_counts(self) -> tuple:
+        self._bucket()
+        return sum(b[1] for b in self._buckets), sum(b[2] for b in self._buckets)
+    
+    def record_attempt(self):
+        """Première tentative d'une requête (base du budget)"""
+        self._bucket()[1] += 1
+        self.attempts += 1
+    
+    def try_retry(self) -> bool:
+        """Consomme un retry si le budget le permet"""
+        attempts, retries = self._window_counts()
+        if retries + 1 > self.ratio * attempts + self.min_retries:
+            self.exhausted += 1
+            return False
+        self._bucket()[2] += 1
+        self.retries += 1
+        return True
+    
+    def get_stats(self) -> dict:
+        attempts, retries = self._window_counts()
+        return {
+            "ratio": self.ratio,
+            "window_seconds": self.window,
+            "window_attempts": attempts,
+            "window_retries": retries,
+            "retries": self.retries,
+            "exhausted": self.exhausted
+        }
+
+# Instance globale: le budget protège l'upstream commun à tous les services du process
+retry_budget = RetryBudget.from_env()
+
 class ChatMetrics:
     """Métriques simples pour monitoring"""
     def __init__(self):
@@ -87,6 +253,18 @@ class ChatMetrics:
         self.total_tokens = 0
         self.total_latency = 0.0
         self.errors_by_type = {}
+        # Travail annulé (client parti, deadline): ce qui n'a pas été payé
+        self.cancelled_by_reason = {}
+        self.retries_skipped = 0
+        self.saved_tokens_estimate = 0
+        # Retries upstream: accordés et refusés par le budget de retries
+        self.retries = 0
+        self.retries_denied = 0
+        # Boucle d'outils: durée de chaque étape (appels parallèles) et stats par outil
+        self.tool_steps = 0
+        self.tool_step_seconds = 0.0
+        self.tool_step_max_seconds = 0.0
+        self.tools_by_name = {}
     
     def record_request(self, success: bool, latency: float, tokens: int = 0, error_type: str = None):
         self.total_requests += 1
@@ -99,6 +277,46 @@ class ChatMetrics:
                 self.errors_by_type[error_type] = self.errors_by_type.get(error_type, 0) + 1
         self.total_latency += latency
     
+    def record_cancellation(self, reason: str, saved_tokens: int = 0):
+        self.cancelled_by_reason[reason] = self.cancelled_by_reason.get(reason, 0) + 1
+        self.saved_tokens_estimate += saved_tokens
+    
+    def record_skipped_retries(self, count: int):
+        self.retries_skipped += count
+    
+    def record_retry(self, allowed: bool):
+        if allowed:
+            self.retries += 1
+        else:
+            self.retries_denied += 1
+    
+    def record_tool_step(self, seconds: float, calls: List[tuple]):
+        """Une étape de la boucle d'outils; calls: [(nom, statut, secondes)]"""
+        self.tool_steps += 1
+        self.tool_step_seconds += seconds
+        self.tool_step_max_seconds = max(self.tool_step_max_seconds, seconds)
+        for name, status, call_seconds in calls:
+            stats = self.tools_by_name.setdefault(name, {"calls": 0, "errors": {}, "total_seconds": 0.0, "max_seconds": 0.0})
+            stats["calls"] += 1
+            stats["total_seconds"] += call_seconds
+            stats["max_seconds"] = max(stats["max_seconds"], call_seconds)
+            if status != "ok":
+                stats["errors"][status] = stats["errors"].get(status, 0) + 1
+    
+    _STATE_FIELDS = (
+        "total_requests", "successful_requests", "failed_requests", "total_tokens", "total_latency",
+        "errors_by_type", "cancelled_by_reason", "retries_skipped", "saved_tokens_estimate",
+        "retries", "retries_denied", "tool_steps", "tool_step_seconds", "tool_step_max_seconds", "tools_by_name"
+    )
+    
+    def export_state(self) -> dict:
+        return {name: getattr(self, name) for name in self._STATE_FIELDS}
+    
+    def restore_state(self, state: dict):
+        for name in self._STATE_FIELDS:
+            if name in state:
+                setattr(self, name, state[name])
+    
     def get_stats(self):
         avg_latency = self.total_latency / self.total_requests if self.total_requests > 0 else 0
         success_rate = self.successful_requests / self.total_requests if self.total_requests > 0 else 0
@@ -110,12 +328,172 @@ class ChatMetrics:
             "total_tokens": self.total_tokens,
             "average_latency_seconds": round(avg_latency, 3),
             "errors_by_type": self.errors_by_type,
-            "circuit_breaker_state": circuit_breaker.state
+            "circuit_breaker_state": circuit_breaker.state,
+            "retries": {
+                "count": self.retries,
+                "budget_exhausted": self.retries_denied,
+                "budget": retry_budget.get_stats()
+            },
+            "cancellations": {
+                "by_reason": self.cancelled_by_reason,
+                "retries_skipped": self.retries_skipped,
+                "saved_tokens_estimate": self.saved_tokens_estimate
+            },
+            "tools": {
+                "steps": self.tool_steps,
+                "average_step_seconds": round(self.tool_step_seconds / self.tool_steps, 3) if self.tool_steps else 0,
+                "max_step_seconds": round(self.tool_step_max_seconds, 3),
+                "by_name": {
+                    name: {**stats, "total_seconds": round(stats["total_seconds"], 3), "max_seconds": round(stats["max_seconds"], 3)}
+                    for name, stats in self.tools_by_name.items()
+                }
+            }
         }
 
 # Instance globale des métriques
 metrics = ChatMetrics()
 
+# Pool de connexions upstream partagé (ouvert au démarrage par prewarm)
+_upstream_client: Optional["httpx.AsyncClient"] = None
+
+async def open_upstream_pool(
+    transport: Optional["httpx.AsyncBaseTransport"] = None,
+    max_connections: Optional[int] = None
+) -> "httpx.AsyncClient":
+    """Ouvre le pool keep-alive partagé par tous les appels upstream"""
+    import httpx
+    global _upstream_client
+    if _upstream_client is None:
+        size = max_connections or UPSTREAM_POOL_SIZE
+        _upstream_client = httpx.AsyncClient(
+            http2=False,
+            limits=httpx.Limits(max_connections=size, max_keepalive_connections=size),
+            transport=transport
+        )
+    return _upstream_client
+
+async def close_upstream_pool():
+    """Ferme le pool partagé (arrêt du service)"""
+    global _upstream_client
+    if _upstream_client is not None:
+        client, _upstream_client = _upstream_client, None
+        await client.aclose()
+
+def upstream_pool_stats() -> Dict[str, Any]:
+    """Connexions du pool partagé (ouvertes / inactives); valeurs None si le pool est fermé"""
+    pool = getattr(getattr(_upstream_client, "_transport", None), "_pool", None)
+    connections = getattr(pool, "connections", None)
+    if connections is None:
+        return {"open": None, "idle": None}
+    return {"open": len(connections), "idle": sum(1 for c in connections if c.is_idle())}
+
+def _clamp_timeout(timeout: "httpx.Timeout", remaining: Optional[float]) -> "httpx.Timeout":
+    """Réduit chaque timeout au budget restant de la requête"""
+    if remaining is None:
+        return timeout
+    import httpx
+    remaining = max(remaining, 0.001)
+    return httpx.Timeout(
+        connect=min(timeout.connect, remaining),
+        read=min(timeout.read, remaining),
+        write=min(timeout.write, remaining),
+        pool=min(timeout.pool, remaining)
+    )
+
+async def post_upstream(url: str, headers: Dict[str, str], payload: Dict[str, Any], timeout: "httpx.Timeout") -> "httpx.Response":
+    """POST via le pool partagé s'il est ouvert, sinon via un client éphémère (timeouts bornés par la deadline)"""
+    import httpx
+    timeout = _clamp_timeout(timeout, remaining_budget())
+    if _upstream_client is not None:
+        return await _upstream_client.post(url, headers=headers, json=payload, timeout=timeout)
+    async with httpx.AsyncClient(timeout=timeout, http2=False) as client:
+        return await client.post(url, headers=headers, json=payload)
+
+async def stream_upstream(
+    url: str,
+    headers: Dict[str, str],
+    payload: Dict[str, Any],
+    timeout: "httpx.Timeout",
+    on_delta: Callable[[str], Awaitable[None]]
+) -> "httpx.Response":
+    """
+    POST en streaming (SSE): chaque fragment de texte est transmis à on_delta dès réception
+    Retourne une réponse 200 équivalente au mode non streamé (contenu complet + usage),
+    ou la réponse d'erreur upstream telle quelle
+    """
+    import httpx
+    timeout = _clamp_timeout(timeout, remaining_budget())
+    client = _upstream_client or httpx.AsyncClient(timeout=timeout, http2=False)
+    try:
+        async with client.stream("POST", url, headers=headers, json=payload, timeout=timeout) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return response
+            parts, usage, model, response_id, finish_reason = [], {}, payload.get("model"), None, None
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                model = chunk.get("model") or model
+                response_id = chunk.get("id") or response_id
+                usage = chunk.get("usage") or usage
+                for choice in chunk.get("choices") or ():
+                    delta = (choice.get("delta") or {}).get("content")
+                    if delta:
+                        parts.append(delta)
+                        await on_delta(delta)
+                    finish_reason = choice.get("finish_reason") or finish_reason
+        # Headers de quota conservés pour le régulateur
+        quota_headers = {k: v for k, v in response.headers.items() if k.startswith("x-ratelimit-")}
+        return httpx.Response(200, headers=quota_headers, json={
+            "id": response_id,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(parts)},
+                "finish_reason": finish_reason
+            }],
+            "usage": usage
+        })
+    finally:
+        if client is not _upstream_client:
+            await client.aclose()
+
+async def prewarm(api_key: str = "", connect_timeout: float = 3.0) -> Dict[str, Any]:
+    """
+    Préchauffe le service avant de le déclarer prêt:
+    - validation + sérialisation complètes (schémas pydantic, chemins de code chauds)
+    - ouverture du pool upstream et connexion TLS établie (si clé API configurée)
+    """
+    import httpx
+    started = time.perf_counter()
+    report: Dict[str, Any] = {}
+    sample = ChatRequest.model_validate({
+        "messages": [{"role": "system", "content": "warmup"}, {"role": "user", "content": "warmup"}],
+        "temperature": 0.5,
+        "max_tokens": 16
+    })
+    sample.model_dump_json()
+    report["validators_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    
+    if api_key:
+        client = await open_upstream_pool()
+        connect_started = time.perf_counter()
+        try:
+            # Toute réponse (même 4xx) laisse une connexion keep-alive dans le pool
+            await client.head(OPENAI_CHAT_URL, timeout=connect_timeout)
+            report["upstream_connected"] = True
+        except httpx.HTTPError as e:
+            report["upstream_connected"] = False
+            report["upstream_error"] = str(e) or type(e).__name__
+        report["upstream_connect_ms"] = round((time.perf_counter() - connect_started) * 1000, 2)
+    
+    report["total_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return report
+
 async def call_openai_with_retry(
     api_key: str,
     messages: List[Dict[str, str]],
@@ -123,11 +501,22 @@ async def call_openai_with_retry(
     connect_timeout: float,
     read_timeout: float,
     temperature: Optional[float] = None,
-    max_tokens: Optional[int] = None
+    max_tokens: Optional[int] = None,
+    response_format: Optional[Dict[str, Any]] = None,
+    chat_metrics: Optional[ChatMetrics] = None,
+    on_delta: Optional[Callable[[str], Awaitable[None]]] = None,
+    tools: Optional[List[Dict[str, Any]]] = None,
+    tool_choice: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Appelle l'API OpenAI avec retry automatique et backoff exponentiel
+    chat_metrics: métriques du service appelant (défaut: métriques globales)
+    on_delta: réponse streamée, fragments transmis au fil de l'eau (pas de retry
+    une fois un fragment transmis: il serait dupliqué)
+    tools / tool_choice: outils exposés au modèle (boucle run_tool_loop)
     """
+    import httpx
+    chat_metrics = chat_metrics or metrics
     if not circuit_breaker.can_execute():
         raise HTTPException(
             status_code=503,
@@ -140,17 +529,34 @@ async def call_openai_with_retry(
     payload = {
         "model": model,
         "messages": messages,
-        "stream": False,
+        "stream": on_delta is not None,
     }
+    if on_delta is not None:
+        payload["stream_options"] = {"include_usage": True}
+        forward = on_delta
+        streamed = False
+
+        async def on_delta(text: str):
+            nonlocal streamed
+            streamed = True
+            await forward(text)
     if temperature is not None:
         payload["temperature"] = temperature
     if max_tokens is not None:
         payload["max_tokens"] = max_tokens
+    if response_format is not None:
+        payload["response_format"] = response_format
+    if tools:
+        payload["tools"] = tools
+        payload["tool_choice"] = tool_choice or "auto"
     
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
     }
+    request_id = current_request_id()
+    if request_id:
+        headers[REQUEST_ID_HEADER] = request_id
     
     timeout = httpx.Timeout(
         connect=connect_timeout,
@@ -161,40 +567,61 @@ async def call_openai_with_retry(
     
     last_error = None
     backoff = INITIAL_BACKOFF
+    backoff_total = 0.0
+    deadline_hit = False
+    budget_exhausted = False
+    quota_cost = estimate_tokens(messages, max_tokens)
     
     for attempt in range(MAX_RETRIES):
+        attempt_started = None
+        remaining = remaining_budget()
+        if remaining is not None and remaining < MIN_ATTEMPT_SECONDS:
+            deadline_hit = True
+            chat_metrics.record_skipped_retries(MAX_RETRIES - attempt)
+            break
+        annotate(upstream_attempts=attempt + 1)
+        if attempt == 0:
+            retry_budget.record_attempt()
         try:
-            async with httpx.AsyncClient(timeout=timeout, http2=False) as client:
-                response = await client.post(OPENAI_CHAT_URL, headers=headers, json=payload)
-            
-            if response.status_code == 200:
-                circuit_breaker.record_success()
-                return response.json()
-            
-            # Erreurs non-retriables (ne pas retry)
-            if response.status_code in [400, 401, 403, 404]:
-                circuit_breaker.record_failure()
-                error_detail = {
-                    "error": "OPENAI_CLIENT_ERROR",
+            # Quota estimé insuffisant: attente en file (span queue_wait) plutôt qu'un 429
+            quota_ticket = await upstream_governor.acquire(quota_cost, api_key)
+            # Latence pour la politique de modèle: tentative seule (file, backoff et outils exclus)
+            attempt_started = time.perf_counter()
+            with span("upstream.attempt", attempt=attempt + 1) as span_attrs:
+                if on_delta is None:
+                    response = await post_upstream(OPENAI_CHAT_URL, headers, payload, timeout)
+                else:
+                    response = await stream_upstream(OPENAI_CHAT_URL, headers, payload, timeout, on_delta)
+                if span_attrs is not None:
+                    span_attrs["http.status_code"] = response.status_code
+                upstream_governor.observe(response.headers, response.status_code, quota_ticket)
+                
+                if response.status_code == 200:
+                    circuit_breaker.record_success()
+                    result = response.json()
+                    observe_attempt(time.perf_counter() - attempt_started, (result.get("usage") or {}).get("completion_tokens"))
+                    return result
+                
+                # Erreurs non-retriables (ne pas retry)
+                if response.status_code in [400, 401, 403, 404]:
+                    circuit_breaker.record_failure()
+                    error_detail = {
+                        "error": "OPENAI_CLIENT_ERROR",
+                        "status": response.status_code,
+                        "body": response.text[:500]
+                    }
+                    raise HTTPException(
+                        status_code=response.status_code,
+                        detail=error_detail
+                    )
+                
+                # Erreurs retriables (429, 5xx)
+                last_error = {
+                    "error": "OPENAI_SERVER_ERROR",
                     "status": response.status_code,
-                    "body": response.text[:500]
+                    "body": response.text[:500],
+                    "attempt": attempt + 1
                 }
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=error_detail
-                )
-            
-            # Erreurs retriables (429, 5xx)
-            last_error = {
-                "error": "OPENAI_SERVER_ERROR",
-                "status": response.status_code,
-                "body": response.text[:500],
-                "attempt": attempt + 1
-            }
-            
-            if attempt < MAX_RETRIES - 1:
-                await asyncio.sleep(backoff)
-                backoff *= 2
             
         except httpx.TimeoutException as e:
             last_error = {
@@ -202,9 +629,6 @@ async def call_openai_with_retry(
                 "detail": str(e),
                 "attempt": attempt + 1
             }
-            if attempt < MAX_RETRIES - 1:
-                await asyncio.sleep(backoff)
-                backoff *= 2
         
         except httpx.NetworkError as e:
             last_error = {
@@ -212,9 +636,6 @@ async def call_openai_with_retry(
                 "detail": str(e),
                 "attempt": attempt + 1
             }
-            if attempt < MAX_RETRIES - 1:
-                await asyncio.sleep(backoff)
-                backoff *= 2
         
         except HTTPException:
             # Re-raise HTTPException sans retry (erreurs client 4xx)
@@ -226,34 +647,515 @@ async def call_openai_with_retry(
                 "detail": str(e),
                 "attempt": attempt + 1
             }
-            if attempt < MAX_RETRIES - 1:
+        
+        if attempt_started is not None:
+            # Un timeout ou une erreur lente est justement le signal recherché
+            observe_attempt(time.perf_counter() - attempt_started)
+        
+        if on_delta is not None and streamed:
+            # Réponse partiellement transmise: un retry la dupliquerait côté client
+            break
+        
+        if attempt < MAX_RETRIES - 1:
+            remaining = remaining_budget()
+            if remaining is not None and remaining < backoff + MIN_ATTEMPT_SECONDS:
+                # Le backoff consommerait le budget restant: inutile de réessayer
+                deadline_hit = True
+                chat_metrics.record_skipped_retries(MAX_RETRIES - 1 - attempt)
+                break
+            if not retry_budget.try_retry():
+                # Panne probable: ne pas multiplier la charge sur un upstream déjà en difficulté
+                budget_exhausted = True
+                chat_metrics.record_retry(allowed=False)
+                annotate(retry_budget="exhausted")
+                break
+            chat_metrics.record_retry(allowed=True)
+            with span("backoff", seconds=backoff):
                 await asyncio.sleep(backoff)
-                backoff *= 2
+            backoff_total += backoff
+            annotate(backoff_seconds=backoff_total)
+            backoff *= 2
+    
+    if deadline_hit:
+        if last_error is not None:
+            circuit_breaker.record_failure()
+        raise HTTPException(
+            status_code=504,
+            detail={
+                "error": "DEADLINE_EXCEEDED",
+                "message": "Deadline de la requête atteinte avant une réponse upstream",
+                "last_error": last_error
+            }
+        )
     
     # Tous les retries ont échoué
     circuit_breaker.record_failure()
-    raise HTTPException(
-        status_code=502,
-        detail={
-            **last_error,
-            "message": f"Échec après {MAX_RETRIES} tentatives"
+    detail = {**last_error, "message": f"Échec après {attempt + 1} tentatives"}
+    if budget_exhausted:
+        detail["retry_budget_exhausted"] = True
+    raise HTTPException(status_code=502, detail=detail)
+
+BATCH_SYSTEM_PROMPT = (
+    "Tu reçois plusieurs requêtes indépendantes au format JSON "
+    '[{"id": <int>, "messages": [...]}]. Traite chacune séparément, comme si elle '
+    "était seule, en respectant ses propres instructions système. Réponds uniquement "
+    'avec un objet JSON {"answers": [{"id": <int>, "content": "<réponse>"}]} '
+    "contenant exactement une réponse par id."
+)
+
+class _BatchItem:
+    __slots__ = ("messages", "future", "chat_metrics")
+
+    def __init__(self, messages: List[Dict[str, str]], future: asyncio.Future, chat_metrics: Optional[ChatMetrics] = None):
+        self.messages = messages
+        self.future = future
+        self.chat_metrics = chat_metrics
+
+class MicroBatcher:
+    """
+    Regroupe les complétions courtes compatibles (même tenant, modèle et paramètres)
+    reçues pendant une courte fenêtre en un seul appel upstream à sortie JSON,
+    puis redistribue les réponses. Réservé au trafic non interactif (tags,
+    titres, résumés d'une ligne). Réponse illisible: repli en appels individuels.
+    """
+    def __init__(
+        self,
+        window: float = 0.05,
+        max_batch: int = 16,
+        max_prompt_chars: int = 2000,
+        max_item_tokens: int = 256
+    ):
+        self.window = window
+        self.max_batch = max_batch
+        self.max_prompt_chars = max_prompt_chars
+        self.max_item_tokens = max_item_tokens
+        self._pending: Dict[tuple, List[_BatchItem]] = {}
+        self._timers: Dict[tuple, asyncio.TimerHandle] = {}
+        self._tasks: set = set()
+        self.submitted = 0
+        self.upstream_calls = 0
+        self.batches = 0
+        self.batched_items = 0
+        self.fallbacks = 0
+    
+    @classmethod
+    def from_env(cls) -> "MicroBatcher":
+        """Construit le batcher depuis les variables MICRO_BATCH_*"""
+        return cls(
+            window=float(os.getenv("MICRO_BATCH_WINDOW", "0.05")),
+            max_batch=int(os.getenv("MICRO_BATCH_MAX_SIZE", "16")),
+            max_prompt_chars=int(os.getenv("MICRO_BATCH_MAX_PROMPT_CHARS", "2000"))
+        )
+    
+    def accepts(self, messages: List[Dict[str, str]], max_tokens: Optional[int]) -> bool:
+        """Seules les requêtes courtes (prompt et réponse attendue) sont regroupées"""
+        if max_tokens is not None and max_tokens > self.max_item_tokens:
+            return False
+        return sum(len(m.get("content") or "") for m in messages) <= self.max_prompt_chars
+    
+    async def submit(
+        self,
+        api_key: str,
+        messages: List[Dict[str, str]],
+        model: str,
+        connect_timeout: float,
+        read_timeout: float,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        tenant: Optional[str] = None,
+        chat_metrics: Optional[ChatMetrics] = None
+    ) -> Dict[str, Any]:
+        """
+        Soumet une complétion; retourne un résultat au format upstream
+        tenant: seules les requêtes d'un même tenant partagent un prompt (un message
+        d'un lot est lisible par le modèle pour toutes les réponses du lot)
+        chat_metrics: métriques du service appelant pour ses appels individuels
+        (l'appel groupé, partagé entre services, reste compté dans les métriques globales)
+        """
+        self.submitted += 1
+        if not self.accepts(messages, max_tokens):
+            self.upstream_calls += 1
+            return await call_openai_with_retry(
+                api_key=api_key, messages=messages, model=model,
+                connect_timeout=connect_timeout, read_timeout=read_timeout,
+                temperature=temperature, max_tokens=max_tokens, chat_metrics=chat_metrics
+            )
+        
+        loop = asyncio.get_running_loop()
+        key = (tenant, api_key, model, temperature, max_tokens, connect_timeout, read_timeout)
+        item = _BatchItem(messages, loop.create_future(), chat_metrics)
+        batch = self._pending.setdefault(key, [])
+        batch.append(item)
+        if len(batch) >= self.max_batch:
+            self._flush_now(key)
+        elif len(batch) == 1:
+            self._timers[key] = loop.call_later(self.window, self._flush_now, key)
+        return await item.future
+    
+    def _flush_now(self, key: tuple):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, None)
+        if batch:
+            # Contexte vide: le lot n'hérite ni de la deadline ni de la trace du premier appelant
+            task = asyncio.get_running_loop().create_task(self._run(key, batch), context=contextvars.Context())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+    
+    async def _run(self, key: tuple, batch: List[_BatchItem]):
+        batch = [item for item in batch if not item.future.done()]
+        if not batch:
+            return
+        _, api_key, model, temperature, max_tokens, connect_timeout, read_timeout = key
+        if len(batch) == 1:
+            await self._run_single(key, batch[0])
+            return
+        
+        packed = [{"id": i, "messages": item.messages} for i, item in enumerate(batch)]
+        self.upstream_calls += 1
+        try:
+            result = await call_openai_with_retry(
+                api_key=api_key,
+                messages=[
+                    {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+                    {"role": "user", "content": json.dumps(packed, ensure_ascii=False)}
+                ],
+                model=model,
+                connect_timeout=connect_timeout,
+                read_timeout=read_timeout,
+                temperature=temperature,
+                max_tokens=(max_tokens or self.max_item_tokens) * len(batch) + 16 * len(batch),
+                response_format={"type": "json_object"}
+            )
+        except Exception as e:
+            # Erreur upstream (breaker, 5xx): la répéter par appelant ne ferait qu'amplifier
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+        
+        answers = _parse_batch_answers(result, len(batch))
+        if answers is None:
+            self.fallbacks += 1
+            await asyncio.gather(*(self._run_single(key, item) for item in batch))
+            return
+        
+        self.batches += 1
+        self.batched_items += len(batch)
+        for item, answer, usage in zip(batch, answers, _split_usage(result.get("usage", {}), answers)):
+            if not item.future.done():
+                item.future.set_result({
+                    "id": result.get("id"),
+                    "model": result.get("model"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": answer},
+                        "finish_reason": "stop"
+                    }],
+                    "usage": usage,
+                    "batch_size": len(batch)
+                })
+    
+    async def _run_single(self, key: tuple, item: _BatchItem):
+        _, api_key, model, temperature, max_tokens, connect_timeout, read_timeout = key
+        self.upstream_calls += 1
+        try:
+            result = await call_openai_with_retry(
+                api_key=api_key, messages=item.messages, model=model,
+                connect_timeout=connect_timeout, read_timeout=read_timeout,
+                temperature=temperature, max_tokens=max_tokens, chat_metrics=item.chat_metrics
+            )
+        except Exception as e:
+            if not item.future.done():
+                item.future.set_exception(e)
+            return
+        if not item.future.done():
+            item.future.set_result(result)
+    
+    def get_stats(self) -> dict:
+        return {
+            "submitted": self.submitted,
+            "upstream_calls": self.upstream_calls,
+            "calls_saved": max(0, self.submitted - self.upstream_calls - sum(map(len, self._pending.values()))),
+            "batches": self.batches,
+            "avg_batch_size": round(self.batched_items / self.batches, 2) if self.batches else 0,
+            "fallbacks": self.fallbacks
         }
+
+def _parse_batch_answers(result: Dict[str, Any], count: int) -> Optional[List[str]]:
+    """Extrait les réponses ordonnées par id; None si la sortie est inexploitable"""
+    try:
+        choice = result["choices"][0]
+        if choice.get("finish_reason") == "length":
+            return None
+        data = json.loads(choice["message"]["content"])
+        by_id = {a["id"]: a["content"] for a in data["answers"]}
+        answers = [by_id[i] for i in range(count)]
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+    if not all(isinstance(a, str) for a in answers):
+        return None
+    return answers
+
+def _split_usage(usage: Dict[str, Any], answers: List[str]) -> List[Dict[str, int]]:
+    """Répartit l'usage du lot: prompt à parts égales, completion au prorata des réponses"""
+    count = len(answers)
+    prompt = usage.get("prompt_tokens", 0)
+    completion = usage.get("completion_tokens", 0)
+    total_chars = sum(len(a) for a in answers) or count
+    shares = []
+    for i, answer in enumerate(answers):
+        p = prompt // count + (1 if i < prompt % count else 0)
+        c = completion * (len(answer) or 1) // total_chars
+        shares.append({"prompt_tokens": p, "completion_tokens": c, "total_tokens": p + c})
+    # Arrondis reportés sur la première réponse (la somme reste exacte)
+    missing = completion - sum(s["completion_tokens"] for s in shares)
+    shares[0]["completion_tokens"] += missing
+    shares[0]["total_tokens"] += missing
+    return shares
+
+class Tool:
+    """Outil exécutable par le proxy: handler async appelé avec les arguments JSON du modèle"""
+    __slots__ = ("name", "handler", "description", "parameters", "timeout", "signature")
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[..., Awaitable[Any]],
+        description: str = "",
+        parameters: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None
+    ):
+        self.name = name
+        self.handler = handler
+        self.description = description
+        self.parameters = parameters or {"type": "object", "properties": {}}
+        self.timeout = timeout or TOOL_TIMEOUT
+        self.signature = inspect.signature(handler)
+
+    def spec(self) -> Dict[str, Any]:
+        """Déclaration au format OpenAI (champ tools du payload)"""
+        return {
+            "type": "function",
+            "function": {"name": self.name, "description": self.description, "parameters": self.parameters}
+        }
+
+class ToolRegistry:
+    """
+    Registre des outils côté serveur
+    Les appels d'outils d'un même tour du modèle sont exécutés en parallèle,
+    chacun borné par son timeout (et par la deadline de la requête)
+    """
+    def __init__(self, parent: Optional["ToolRegistry"] = None):
+        self.tools: Dict[str, Tool] = {}
+        # Registre d'un service: ses outils, puis ceux du registre global
+        self.parent = parent
+
+    def get(self, name: str) -> Optional[Tool]:
+        tool = self.tools.get(name)
+        if tool is None and self.parent is not None:
+            return self.parent.get(name)
+        return tool
+
+    def names(self) -> List[str]:
+        return sorted(set(self.tools) | set(self.parent.names() if self.parent is not None else ()))
+
+    def register(self, name: str, handler: Callable[..., Awaitable[Any]], description: str = "",
+                 parameters: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None) -> Tool:
+        if not asyncio.iscoroutinefunction(handler):
+            raise TypeError(f"L'outil {name} doit être une fonction async")
+        tool = self.tools[name] = Tool(name, handler, description, parameters, timeout)
+        return tool
+
+    def tool(self, name: Optional[str] = None, description: str = "",
+             parameters: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None):
+        """Décorateur: @tool_registry.tool(description=..., parameters={...})"""
+        def decorator(handler):
+            self.register(name or handler.__name__, handler, description or (handler.__doc__ or "").strip(), parameters, timeout)
+            return handler
+        return decorator
+
+    def specs(self, names: List[str]) -> List[Dict[str, Any]]:
+        tools = [self.get(name) for name in names]
+        unknown = [name for name, tool in zip(names, tools) if tool is None]
+        if unknown:
+            raise HTTPException(status_code=400, detail={
+                "error": "UNKNOWN_TOOL",
+                "message": f"Outil(s) inconnu(s): {', '.join(unknown)}",
+                "available": self.names()
+            })
+        return [tool.spec() for tool in tools]
+
+    async def execute(self, call: Dict[str, Any]) -> tuple:
+        """
+        Exécute un appel d'outil du modèle -> (nom, statut, secondes, contenu)
+        Les erreurs sont renvoyées au modèle (contenu {"error": ...}) plutôt que d'échouer la requête
+        """
+        function = call.get("function") or {}
+        name = function.get("name") or "?"
+        started = time.perf_counter()
+        tool = self.get(name)
+        if tool is None:
+            status, content = "unknown_tool", {"error": "UNKNOWN_TOOL", "message": f"Outil inconnu: {name}"}
+        else:
+            try:
+                arguments = json.loads(function.get("arguments") or "{}")
+                if not isinstance(arguments, dict):
+                    raise ValueError("objet JSON attendu")
+                tool.signature.bind(**arguments)
+            except (TypeError, ValueError) as e:
+                status, content = "invalid_arguments", {"error": "INVALID_ARGUMENTS", "message": str(e)}
+            else:
+                timeout = tool.timeout
+                remaining = remaining_budget()
+                if remaining is not None:
+                    timeout = max(0.0, min(timeout, remaining))
+                try:
+                    with span("tool.call", tool=name):
+                        content = await asyncio.wait_for(tool.handler(**arguments), timeout)
+                    status = "ok"
+                except asyncio.TimeoutError:
+                    status, content = "timeout", {"error": "TOOL_TIMEOUT", "message": f"Pas de réponse en {timeout:.1f}s"}
+                except Exception as e:
+                    status, content = "error", {"error": "TOOL_ERROR", "message": str(e) or type(e).__name__}
+        if not isinstance(content, str):
+            content = json.dumps(content, ensure_ascii=False, default=str)
+        return name, status, time.perf_counter() - started, content[:MAX_TOOL_RESULT_CHARS]
+
+# Registre global (les services y enregistrent leurs outils au démarrage)
+tool_registry = ToolRegistry()
+
+async def run_tool_loop(
+    call_kwargs: Dict[str, Any],
+    tool_names: List[str],
+    max_steps: int = TOOL_MAX_STEPS,
+    chat_metrics: Optional[ChatMetrics] = None,
+    registry: Optional[ToolRegistry] = None
+) -> Dict[str, Any]:
+    """
+    Boucle modèle -> outils -> modèle jusqu'à une réponse sans appel d'outil
+    - max_steps: nombre d'étapes d'outils; budget épuisé, un dernier appel force
+      une réponse textuelle (tool_choice="none")
+    - usage: somme des appels upstream de la boucle
+    """
+    chat_metrics = chat_metrics or metrics
+    registry = registry or tool_registry
+    specs = registry.specs(tool_names)
+    messages = list(call_kwargs["messages"])
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    steps = 0
+    while True:
+        exhausted = steps >= max_steps
+        result = await call_openai_with_retry(**{
+            **call_kwargs, "messages": messages, "tools": specs,
+            "tool_choice": "none" if exhausted else "auto", "chat_metrics": chat_metrics
+        })
+        for key in usage:
+            usage[key] += (result.get("usage") or {}).get(key, 0)
+        message = (result.get("choices") or [{}])[0].get("message") or {}
+        tool_calls = message.get("tool_calls")
+        if not tool_calls or exhausted:
+            break
+        steps += 1
+        messages.append({"role": "assistant", "content": message.get("content"), "tool_calls": tool_calls})
+        started = time.perf_counter()
+        with span("tool.step", step=steps, calls=len(tool_calls)):
+            outcomes = await asyncio.gather(*(registry.execute(call) for call in tool_calls))
+        chat_metrics.record_tool_step(time.perf_counter() - started, [outcome[:3] for outcome in outcomes])
+        messages.extend(
+            {"role": "tool", "tool_call_id": call.get("id"), "content": outcome[3]}
+            for call, outcome in zip(tool_calls, outcomes)
+        )
+    annotate(tool_steps=steps, tool_steps_exhausted=exhausted)
+    return {**result, "usage": usage, "tool_steps": steps}
+
+def _record_usage(request: ChatRequest, model: str, result: Dict[str, Any]):
+    """Enregistre la consommation d'un appel upstream dans le ledger"""
+    usage = result.get("usage", {})
+    usage_ledger.record(
+        request.project_id,
+        request.session_id,
+        result.get("model") or model,
+        prompt_tokens=usage.get("prompt_tokens", 0),
+        completion_tokens=usage.get("completion_tokens", 0)
     )
+    usage_ledger.schedule_flush()
+
+def _schedule_speculation(
+    speculator: SpeculativeCache,
+    request: ChatRequest,
+    messages: List[Dict[str, str]],
+    result: Dict[str, Any],
+    params: tuple,
+    api_key: str,
+    model: str,
+    connect_timeout: float,
+    read_timeout: float
+):
+    """Pré-génère les relances suggérées (facturées au projet, plafonnées en tokens)"""
+    choices = result.get("choices") or []
+    answer = ((choices[0].get("message") or {}).get("content") if choices else None)
+    if not answer:
+        return
+    
+    async def generate(spec_messages: List[Dict[str, str]], cap: int) -> Optional[Dict[str, Any]]:
+        if not usage_ledger.check_budget(request.project_id)[0]:
+            return None
+        capped = request.max_tokens is None or request.max_tokens > cap
+        max_tokens = cap if capped else request.max_tokens
+        spec_result = await call_openai_with_retry(
+            api_key=api_key,
+            messages=spec_messages,
+            model=model,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            temperature=request.temperature,
+            max_tokens=max_tokens
+        )
+        _record_usage(request, model, spec_result)
+        spec_choices = spec_result.get("choices") or [{}]
+        # Réponse tronquée par notre plafond: ne pas la servir à la place d'une vraie
+        if capped and spec_choices[0].get("finish_reason") == "length":
+            return None
+        return spec_result
+    
+    speculator.schedule(request.session_id, messages, answer, request.followups, generate, params)
 
 async def handle_chat_request(
     request: ChatRequest,
     api_key: str,
     default_model: str,
     connect_timeout: float,
-    read_timeout: float
+    read_timeout: float,
+    speculator: Optional[SpeculativeCache] = None,
+    batcher: Optional[MicroBatcher] = None,
+    policy: Optional[ModelPolicy] = None,
+    chat_metrics: Optional[ChatMetrics] = None,
+    on_delta: Optional[Callable[[str], Awaitable[None]]] = None,
+    retriever: Optional[Retriever] = None,
+    tools: Optional[ToolRegistry] = None
 ) -> Dict[str, Any]:
     """
     Handler principal pour les requêtes chat avec métriques et gestion d'erreurs
+    speculator: cache spéculatif des relances (opt-in par service)
+    batcher: micro-batching des requêtes marquées batchable (opt-in par service)
+    policy: rétrogradation de modèle sous charge/latence/budget (règles par service)
+    chat_metrics: métriques du service (gateway: une instance par service)
+    on_delta: réponse streamée fragment par fragment (transport WebSocket)
+    retriever: extraits de documentation injectés avant l'appel upstream (opt-in par service)
+    tools: outils proposés via server_tools (registre du service, sinon registre global)
     """
+    chat_metrics = chat_metrics or metrics
     start_time = time.time()
+    trace = current_trace()
+    if trace is not None:
+        # Lecture du body + validation pydantic, faites par FastAPI avant le handler
+        trace.record_span("validation", trace.start_ns, time.time_ns())
+        trace.annotate(validation_seconds=(time.time_ns() - trace.start_ns) / 1e9)
     
     if not api_key:
-        metrics.record_request(False, time.time() - start_time, error_type="missing_api_key")
+        chat_metrics.record_request(False, time.time() - start_time, error_type="missing_api_key")
         return JSONResponse(
             status_code=500,
             content={
@@ -263,40 +1165,116 @@ async def handle_chat_request(
         )
     
     try:
-        messages = [{"role": m.role, "content": m.content} for m in request.messages]
-        model = request.model or default_model
+        # Messages déjà au format upstream (dicts validés par pydantic-core)
+        messages = list(request.messages)
+        model = requested_model = request.model or default_model
+        downgrade = None
+        speculation_params = (model, request.temperature, request.max_tokens)
         
-        result = await call_openai_with_retry(
-            api_key=api_key,
-            messages=messages,
-            model=model,
-            connect_timeout=connect_timeout,
-            read_timeout=read_timeout,
-            temperature=request.temperature,
-            max_tokens=request.max_tokens
-        )
+        # Relance déjà pré-générée: servie sans appel upstream (déjà payée)
+        result = None
+        if speculator is not None and request.session_id:
+            with span("speculation.lookup"):
+                result = await speculator.lookup(request.session_id, messages, speculation_params)
+        speculative = result is not None
+        
+        if speculative:
+            annotate(cache="speculative_hit")
+        else:
+            # Budget vérifié avant l'appel upstream (rien n'est facturé si refusé)
+            allowed, budget_info = usage_ledger.check_budget(request.project_id)
+            if not allowed:
+                raise HTTPException(status_code=429, detail=budget_info)
+            
+            if policy is not None:
+                model, downgrade = policy.choose(requested_model, request.project_id)
+                if downgrade:
+                    annotate(model_downgrade=f"{requested_model}->{model}:{downgrade}")
+            
+            # Extraits ajoutés au seul appel upstream (clés de spéculation inchangées)
+            upstream_messages = messages
+            if retriever is not None and request.retrieval:
+                upstream_messages = retriever.augment(messages)
+            
+            upstream_start = time.time()
+            with span("upstream.call", model=model), (policy.track(model) if policy is not None else nullcontext()):
+                call_kwargs = dict(
+                    api_key=api_key,
+                    messages=upstream_messages,
+                    model=model,
+                    connect_timeout=connect_timeout,
+                    read_timeout=read_timeout,
+                    temperature=request.temperature,
+                    max_tokens=request.max_tokens
+                )
+                if request.server_tools:
+                    max_steps = min(request.max_tool_steps or TOOL_MAX_STEPS, TOOL_MAX_STEPS)
+                    result = await run_tool_loop(call_kwargs, request.server_tools, max_steps, chat_metrics, tools)
+                    if on_delta is not None:
+                        # Étapes intermédiaires non streamées: la réponse finale part en un fragment
+                        await on_delta(((result.get("choices") or [{}])[0].get("message") or {}).get("content") or "")
+                elif batcher is not None and request.batchable and request.project_id and on_delta is None:
+                    # Lots par projet: sans project_id, aucune garantie que deux appelants sont le même tenant
+                    result = await batcher.submit(**call_kwargs, tenant=request.project_id, chat_metrics=chat_metrics)
+                else:
+                    result = await call_openai_with_retry(**call_kwargs, chat_metrics=chat_metrics, on_delta=on_delta)
+            if "batch_size" in result:
+                annotate(batch_size=result["batch_size"])
+            annotate(upstream_seconds=time.time() - upstream_start, breaker=circuit_breaker.state)
+            _record_usage(request, model, result)
         
         latency = time.time() - start_time
-        tokens = result.get("usage", {}).get("total_tokens", 0)
-        metrics.record_request(True, latency, tokens)
+        usage = result.get("usage", {})
+        tokens = usage.get("total_tokens", 0)
+        chat_metrics.record_request(True, latency, tokens)
+        annotate(model=result.get("model") or model, tokens=tokens)
         
-        return {
+        # Rétrogradé: pas de relances pré-générées (clé = modèle demandé, réponse d'un autre modèle;
+        # et des appels en plus pendant la pression qui a causé la rétrogradation)
+        if speculator is not None and request.session_id and request.speculate and request.followups and not downgrade:
+            _schedule_speculation(
+                speculator, request, messages, result, speculation_params,
+                api_key, model, connect_timeout, read_timeout
+            )
+        
+        # Encodage JSON mesuré là où il a lieu (span serialization de services._json_response)
+        response = {
             "provider": "openai",
             "choices": result.get("choices", []),
             "usage": result.get("usage", {}),
             "model": result.get("model"),
             "latency_seconds": round(latency, 3)
         }
+        if speculator is not None:
+            response["speculative"] = speculative
+        if "tool_steps" in result:
+            response["tool_steps"] = result["tool_steps"]
+        if downgrade:
+            # Compromis qualité/latence visible par le client
+            response["requested_model"] = requested_model
+            response["model_downgrade"] = downgrade
+        return response
+    
+    except asyncio.CancelledError:
+        # Client parti ou deadline dépassée: l'appel upstream et les backoffs sont abandonnés
+        deadline = current_deadline()
+        reason = (deadline.cancel_reason if deadline is not None else None) or "cancelled"
+        saved = sum(len(m.get("content") or "") for m in request.messages) // 4 + (request.max_tokens or 0)
+        chat_metrics.record_request(False, time.time() - start_time, error_type=reason)
+        chat_metrics.record_cancellation(reason, saved_tokens=saved)
+        raise
     
     except HTTPException as e:
         latency = time.time() - start_time
         error_type = e.detail.get("error") if isinstance(e.detail, dict) else "http_exception"
-        metrics.record_request(False, latency, error_type=error_type)
+        chat_metrics.record_request(False, latency, error_type=error_type)
+        annotate(error=error_type, breaker=circuit_breaker.state)
         raise
     
     except Exception as e:
         latency = time.time() - start_time
-        metrics.record_request(False, latency, error_type="unexpected_error")
+        chat_metrics.record_request(False, latency, error_type="unexpected_error")
+        annotate(error="unexpected_error", breaker=circuit_breaker.state)
         return JSONResponse(
             status_code=500,
             content={
@@ -0,0 +1,183 @@
+"""
+Compression HTTP et cache des ressources statiques
+- Négociation Accept-Encoding (brotli si disponible, sinon gzip) avec seuil de taille
+- Compression en flux pour les réponses streamées (pas de bufferisation complète)
+- Ressources précompressées une fois au démarrage, servies avec ETag fort + Cache-Control
+"""
+import os
+import gzip
+import zlib
+import hashlib
+from typing import Optional, Tuple
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # dépendance optionnelle
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/xml", "image/svg+xml")
+
+def supported_encodings() -> Tuple[str, ...]:
+    """Encodages disponibles, par ordre de préférence"""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Choisit l'encodage selon Accept-Encoding (q-values respectées)
+    Returns: "br", "gzip" ou None
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.lower().split(","):
+        token, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[token.strip()] = q
+    best, best_q = None, 0.0
+    for encoding in supported_encodings():
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+def compress(data: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    """Compresse un bloc complet (gzip: niveau 1-9, br: qualité 0-11)"""
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if level is None else level)
+    return gzip.compress(data, compresslevel=6 if level is None else level, mtime=0)
+
+class _StreamCompressor:
+    """Compresseur incrémental: chaque chunk est flushé pour rester streamable"""
+    def __init__(self, encoding: str, level: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=level)
+        else:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31 = en-tête gzip
+
+    def compress(self, chunk: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(chunk) + self._compressor.flush()
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+class CompressionMiddleware:
+    """
+    Middleware ASGI de compression négociée
+    - Réponses sous COMPRESSION_MIN_SIZE octets ou déjà encodées: inchangées
+    - Réponses streamées: compressées chunk par chunk
+    """
+    def __init__(self, app, minimum_size: Optional[int] = None, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = int(os.getenv("COMPRESSION_MIN_SIZE", "1024")) if minimum_size is None else minimum_size
+        self.levels = {"gzip": gzip_level, "br": brotli_quality}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        state = {"start": None, "compressor": None, "passthrough": False}
+
+        async def send_compressed(message):
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message.get("headers", []))
+                content_type = headers.get("content-type", "")
+                if "content-encoding" in headers or not content_type.startswith(COMPRESSIBLE_TYPES):
+                    state["passthrough"] = True
+                    await send(message)
+                else:
+                    # En attente du premier chunk pour décider (taille, streaming)
+                    state["start"] = message
+                return
+            if message["type"] != "http.response.body" or state["passthrough"]:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            start = state["start"]
+            if start is not None:
+                state["start"] = None
+                if not more_body and len(body) < self.minimum_size:
+                    state["passthrough"] = True
+                    await send(start)
+                    await send(message)
+                    return
+                headers = MutableHeaders(raw=list(start.get("headers", [])))
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if not more_body:
+                    body = compress(body, encoding, self.levels[encoding])
+                    headers["Content-Length"] = str(len(body))
+                    await send({**start, "headers": headers.raw})
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                del headers["Content-Length"]
+                await send({**start, "headers": headers.raw})
+                state["compressor"] = _StreamCompressor(encoding, self.levels[encoding])
+
+            compressor = state["compressor"]
+            chunk = compressor.compress(body) if body else b""
+            if not more_body:
+                chunk += compressor.finish()
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+class PrecompressedAsset:
+    """
+    Ressource statique compressée une seule fois (démarrage)
+    Servie avec ETag fort par codage (identity, gzip, br), Cache-Control et 304 sur If-None-Match
+    """
+    def __init__(self, content, media_type: str, cache_control: str = "public, max-age=300, must-revalidate"):
+        self.body = content.encode("utf-8") if isinstance(content, str) else content
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self._hash = hashlib.sha256(self.body).hexdigest()[:32]
+        self.etag = self.etag_for(None)
+        self.variants = {encoding: compress(self.body, encoding, 11 if encoding == "br" else 9) for encoding in supported_encodings()}
+
+    def etag_for(self, encoding: Optional[str]) -> str:
+        """ETag fort propre au codage: octets différents, validateur différent (RFC 9110 8.8.3)"""
+        return f'"{self._hash}-{encoding}"' if encoding else f'"{self._hash}"'
+
+    def _not_modified(self, if_none_match: Optional[str]) -> bool:
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        # Comparaison faible (If-None-Match): n'importe quelle variante désigne la même ressource
+        known = {self.etag, *(self.etag_for(encoding) for encoding in self.variants)}
+        return any(tag.strip().removeprefix("W/") in known for tag in if_none_match.split(","))
+
+    def response(self, request_headers) -> Response:
+        """Construit la réponse adaptée aux headers de la requête"""
+        encoding = negotiate_encoding(request_headers.get("accept-encoding"))
+        headers = {
+            "ETag": self.etag_for(encoding),
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding"
+        }
+        if self._not_modified(request_headers.get("if-none-match")):
+            return Response(status_code=304, headers=headers)
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+            return Response(self.variants[encoding], media_type=self.media_type, headers=headers)
+        return Response(self.body, media_type=self.media_type, headers=headers)
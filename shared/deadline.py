@@ -0,0 +1,166 @@
+"""
+Deadlines de requête et annulation sur déconnexion du client
+- X-Request-Timeout (secondes restantes) ou X-Request-Deadline (timestamp Unix)
+  fixent le budget de la requête; les timeouts upstream et les retries s'y plient
+- Déconnexion du client ou deadline dépassée: la tâche de la requête est annulée
+  (appel upstream en cours et sleeps de backoff compris)
+"""
+import json
+import math
+import time
+import asyncio
+from contextvars import ContextVar
+from typing import Optional, Sequence
+from .tracing import annotate
+from .utils import route_path
+
+REQUEST_TIMEOUT_HEADER = "X-Request-Timeout"
+REQUEST_DEADLINE_HEADER = "X-Request-Deadline"
+# Budget maximal accepté d'un client (secondes): au-delà, ramené à cette valeur
+MAX_REQUEST_BUDGET = 600.0
+
+class Deadline:
+    """Échéance d'une requête (horloge monotone) et raison d'annulation éventuelle"""
+    __slots__ = ("expires_at", "cancel_reason")
+
+    def __init__(self, expires_at: Optional[float] = None):
+        self.expires_at = expires_at
+        self.cancel_reason: Optional[str] = None
+
+    @classmethod
+    def from_headers(cls, headers, now: Optional[float] = None) -> "Deadline":
+        """
+        Construit l'échéance depuis les headers ASGI bruts (la plus proche l'emporte)
+        Valeurs non finies (nan, inf) ignorées, budget borné à MAX_REQUEST_BUDGET
+        """
+        now = time.monotonic() if now is None else now
+        budgets = []
+        for name, value in headers:
+            try:
+                if name == b"x-request-timeout":
+                    budget = float(value)
+                elif name == b"x-request-deadline":
+                    budget = float(value) - time.time()
+                else:
+                    continue
+            except ValueError:
+                continue
+            if math.isfinite(budget):
+                budgets.append(min(budget, MAX_REQUEST_BUDGET))
+        return cls(now + min(budgets) if budgets else None)
+
+    def remaining(self) -> Optional[float]:
+        """Secondes restantes (None = pas de deadline)"""
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.monotonic()
+
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar("deadline", default=None)
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+def remaining_budget() -> Optional[float]:
+    """Secondes restantes pour la requête courante (None = illimité)"""
+    deadline = _current_deadline.get()
+    return deadline.remaining() if deadline is not None else None
+
+class DeadlineMiddleware:
+    """
+    Middleware ASGI: exécute la requête dans une tâche annulable
+    - après lecture complète du body, surveille http.disconnect
+    - annule la tâche si le client part (499) ou si la deadline expire (504)
+    """
+    def __init__(self, app, routes: Sequence[str] = ("/api/chat", "/build")):
+        self.app = app
+        self.routes = set(routes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or route_path(scope) not in self.routes:
+            await self.app(scope, receive, send)
+            return
+
+        deadline = Deadline.from_headers(scope.get("headers", ()))
+        remaining = deadline.remaining()
+        if remaining is not None and remaining <= 0:
+            annotate(error="DEADLINE_EXCEEDED")
+            await _send_error(send, 504, "DEADLINE_EXCEEDED", "Deadline de la requête déjà dépassée")
+            return
+
+        loop = asyncio.get_running_loop()
+        disconnected = loop.create_future()
+        watcher: Optional[asyncio.Task] = None
+        response_started = False
+
+        async def watch_disconnect():
+            # Body déjà lu: le prochain message ne peut être que http.disconnect
+            message = await receive()
+            if not disconnected.done():
+                disconnected.set_result(message)
+
+        async def guarded_receive():
+            nonlocal watcher
+            if watcher is not None:
+                return await asyncio.shield(disconnected)
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                if not disconnected.done():
+                    disconnected.set_result(message)
+            elif not message.get("more_body", False):
+                watcher = loop.create_task(watch_disconnect())
+            return message
+
+        async def tracked_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        token = _current_deadline.set(deadline)
+        try:
+            task = loop.create_task(self.app(scope, guarded_receive, tracked_send))
+        finally:
+            _current_deadline.reset(token)
+
+        try:
+            done, _ = await asyncio.wait(
+                {task, disconnected},
+                timeout=remaining,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if task in done:
+                task.result()
+                return
+            deadline.cancel_reason = "client_disconnect" if disconnected in done else "deadline"
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            if not disconnected.done():
+                disconnected.cancel()
+
+        if deadline.cancel_reason == "client_disconnect":
+            annotate(error="client_disconnect")
+            if not response_started:
+                # Statut 499 (client parti) pour les logs d'accès; ignoré par le serveur
+                await _send_error(send, 499, "CLIENT_DISCONNECTED", "Client déconnecté")
+        else:
+            annotate(error="DEADLINE_EXCEEDED")
+            if not response_started:
+                await _send_error(send, 504, "DEADLINE_EXCEEDED", "Deadline de la requête dépassée")
+
+async def _send_error(send, status: int, error: str, message: str):
+    body = json.dumps({"detail": {"error": error, "message": message}}, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
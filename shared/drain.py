@@ -0,0 +1,163 @@
+"""
+Arrêt progressif sur SIGTERM (redéploiements sans couper les générations en cours)
+- SIGTERM intercepté avant uvicorn: /healthz répond 503 (instance retirée du load balancer),
+  les nouvelles requêtes reçoivent 503 SERVICE_DRAINING (Retry-After), les nouveaux tours
+  WebSocket sont refusés; requêtes, réponses streamées et tours déjà commencés continuent
+- Attente de leur fin jusqu'à DRAIN_TIMEOUT, puis arrêt normal d'uvicorn (lifespan:
+  snapshot des métriques, flush du registre d'usage et des logs d'accès)
+- Sans uvicorn (tests, thread secondaire): aucun handler installé, drain() reste appelable
+- Second SIGTERM pendant l'attente: arrêt immédiat
+"""
+import os
+import json
+import time
+import signal
+import asyncio
+import threading
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, Dict, Optional
+from .utils import route_path
+
+# Toujours servis pendant l'arrêt (sondes, observabilité)
+DRAIN_EXEMPT_PATHS = ("/healthz", "/metrics", "/__version", "/debug/")
+# Code de fermeture WebSocket "service restart" (RFC 6455): le client se reconnecte ailleurs
+CLOSE_SERVICE_RESTART = 1012
+
+class ShutdownDrain:
+    """Travail en cours du process et état de l'arrêt progressif"""
+    def __init__(self, timeout: float = 25.0, retry_after: int = 2):
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.draining = False
+        self.in_flight = 0
+        self.rejected = 0
+        self.completed = 0
+        self.abandoned = 0
+        self.started_at: Optional[float] = None
+        self.duration: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls, getenv=os.getenv) -> "ShutdownDrain":
+        """Depuis DRAIN_TIMEOUT (à garder sous le délai avant SIGKILL de l'hébergeur) / DRAIN_RETRY_AFTER"""
+        return cls(
+            timeout=float(getenv("DRAIN_TIMEOUT", "25")),
+            retry_after=int(getenv("DRAIN_RETRY_AFTER", "2"))
+        )
+
+    def hold(self):
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        if self.draining:
+            self.completed += 1
+
+    @contextmanager
+    def track(self):
+        """Bloc de travail attendu par drain()"""
+        self.hold()
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def drain(self) -> bool:
+        """Refuse le nouveau travail et attend la fin du travail en cours (True: rien d'abandonné)"""
+        self.draining = True
+        self.started_at = time.time()
+        started = time.monotonic()
+        while self.in_flight > 0 and time.monotonic() - started < self.timeout:
+            await asyncio.sleep(0.05)
+        self.abandoned = max(self.in_flight, 0)
+        self.duration = time.monotonic() - started
+        return self.abandoned == 0
+
+    def install_signal_handler(self, sig: int = signal.SIGTERM) -> bool:
+        """
+        Intercale le drain devant le handler en place (celui d'uvicorn), qui est appelé ensuite
+        À appeler depuis la boucle du thread principal (lifespan de démarrage)
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return False
+        previous = signal.getsignal(sig)
+        if isinstance(previous, partial) and previous.func == self._on_signal:
+            previous = previous.args[1]  # réinstallation (nouvelle boucle): handler d'origine conservé
+        signal.signal(sig, partial(self._on_signal, asyncio.get_running_loop(), previous))
+        return True
+
+    def _on_signal(self, loop, previous, sig, frame):
+        if self.draining or loop.is_closed():
+            _forward(previous, sig, frame)
+            return
+        self.draining = True
+        loop.call_soon_threadsafe(self._begin, previous, sig, frame)
+
+    def _begin(self, previous, sig, frame):
+        self._task = asyncio.ensure_future(self._drain_then_forward(previous, sig, frame))
+
+    async def _drain_then_forward(self, previous, sig, frame):
+        try:
+            await self.drain()
+        finally:
+            _forward(previous, sig, frame)
+
+    def rejection(self) -> Dict[str, Any]:
+        return {
+            "error": "SERVICE_DRAINING",
+            "message": "Service en cours de redémarrage, réessayer dans quelques secondes",
+            "retry_after": self.retry_after
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "draining": self.draining,
+            "in_flight": self.in_flight,
+            "timeout_seconds": self.timeout,
+            "rejected": self.rejected,
+            "completed_during_drain": self.completed,
+            "abandoned": self.abandoned,
+            "drain_seconds": round(self.duration, 3) if self.duration is not None else None
+        }
+
+def _forward(previous, sig, frame):
+    """Rend la main au handler d'origine (ou au comportement par défaut du signal)"""
+    if callable(previous):
+        previous(sig, frame)
+    elif previous == signal.SIG_DFL:
+        signal.signal(sig, signal.SIG_DFL)
+        signal.raise_signal(sig)
+
+drain = ShutdownDrain.from_env()
+
+class DrainMiddleware:
+    """Compte les requêtes HTTP en cours et refuse les nouvelles pendant le drain"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        # Chemin relatif au montage: exemptions valables sous la gateway (/coach/metrics)
+        if drain.draining and not route_path(scope).startswith(DRAIN_EXEMPT_PATHS):
+            drain.rejected += 1
+            if scope["type"] == "websocket":
+                await send({"type": "websocket.close", "code": CLOSE_SERVICE_RESTART})
+                return
+            body = json.dumps({"detail": drain.rejection()}).encode()
+            await send({"type": "http.response.start", "status": 503, "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(drain.retry_after).encode()),
+                (b"connection", b"close")
+            ]})
+            await send({"type": "http.response.body", "body": body})
+            return
+        if scope["type"] == "websocket":
+            # Connexions longues: seuls les tours en cours sont attendus (ws_chat)
+            await self.app(scope, receive, send)
+            return
+        with drain.track():
+            await self.app(scope, receive, send)
@@ -0,0 +1,325 @@
+"""
+Nettoyage en flux du HTML généré par /build
+- Le prompt interdit <script>, mais rien ne garantit que le modèle s'y tient:
+  balises actives (script, iframe, object...), attributs on*, URLs javascript: retirés ici
+- SVG et MathML retirés: leur contenu n'y est pas analysé comme en HTML (un <style> y contient
+  du balisage actif, <animate>/<set> réécrivent des attributs en javascript:)
+- Contenu de <style> contenant "<" retiré (sortie du texte brut)
+- Clôtures markdown retirées (```html en première ligne, ``` final et la prose qui suit)
+- Minification: espaces réduits à un seul, supprimés autour des balises de bloc,
+  commentaires retirés; contenu de <pre>/<textarea> préservé
+- Incrémental (process() par fragment, flush() à la fin): seul le fragment en cours
+  d'analyse est tamponné (jusqu'à la prochaine fin de balise, ligne de clôture potentielle)
+"""
+import re
+from html import escape
+from html.parser import HTMLParser
+from typing import AsyncIterable, AsyncIterator, Dict
+
+# Balises retirées avec tout leur contenu
+DROPPED_TAGS = frozenset({
+    "script", "iframe", "frame", "frameset", "object", "embed", "applet",
+    "noscript", "noembed", "noframes", "base",
+    # Contenu étranger (noms déjà en minuscules)
+    "svg", "math", "animate", "set", "animatemotion", "animatetransform"
+})
+VOID_TAGS = frozenset({
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta",
+    "param", "source", "track", "wbr"
+})
+# Attributs porteurs d'URL (javascript:, vbscript:, data: hors images refusés);
+# values/from/to: valeurs posées par une animation SVG sur un autre attribut
+URL_ATTRIBUTES = frozenset({
+    "href", "src", "action", "formaction", "poster", "background", "cite", "srcset", "xlink:href",
+    "values", "from", "to"
+})
+# Texte brut pour le parseur (pas de balises analysées jusqu'à la fermeture)
+RAWTEXT_TAGS = frozenset({"style"})
+DROPPED_ATTRIBUTES = frozenset({"srcdoc"})
+# Espaces autour de ces balises sans effet sur le rendu: supprimés
+BLOCK_TAGS = frozenset({
+    "html", "head", "body", "title", "meta", "link", "style", "div", "section", "article", "header",
+    "footer", "nav", "main", "aside", "h1", "h2", "h3", "h4", "h5", "h6", "p", "ul", "ol", "li",
+    "dl", "dt", "dd", "table", "thead", "tbody", "tfoot", "tr", "td", "th", "caption", "form",
+    "fieldset", "legend", "figure", "figcaption", "blockquote", "hr", "br", "address", "details",
+    "summary", "option", "optgroup", "select", "picture", "source", "video", "audio", "pre"
+})
+PRESERVED_TAGS = frozenset({"pre", "textarea"})
+# Fragments regroupés jusqu'à une fin de balise ou cette taille (les deltas d'un flux
+# font quelques caractères: les analyser un par un coûte deux fois plus cher)
+COALESCE_CHARS = 512
+
+_WHITESPACE = re.compile(r"\s+")
+_URL_NOISE = re.compile(r"[\x00-\x20]+")
+# Noms d'attributs (déjà en minuscules); les autres, tolérés par HTMLParser, sont retirés
+_ATTRIBUTE_NAME = re.compile(r"[a-z_:][-a-z0-9_:.]*")
+_FENCE = re.compile(r"[ \t]*```[\w+-]*[ \t]*\r?")
+# Début de ligne pouvant encore devenir une clôture (à tamponner jusqu'à la fin de ligne)
+_FENCE_PREFIX = re.compile(r"[ \t]*(`{0,2}|```[\w+-]*[ \t]*\r?)")
+
+class _FenceStripper:
+    """Retire la clôture ouvrante (première ligne non vide) et tout ce qui suit la clôture fermante"""
+    __slots__ = ("state", "pending", "line_start")
+
+    def __init__(self):
+        self.state = "start"  # start -> body (pas de clôture) | fenced -> closed
+        # Début de ligne tamponné tant qu'il peut encore devenir une clôture
+        self.pending = ""
+        self.line_start = True
+
+    def process(self, chunk: str) -> str:
+        if self.state == "body":
+            return chunk
+        if self.state == "closed":
+            return ""
+        data, self.pending = self.pending + chunk, ""
+        if self.state == "start":
+            data = data.lstrip()
+            if not data:
+                return ""
+            newline = data.find("\n")
+            line = data if newline < 0 else data[:newline]
+            if newline < 0 and _FENCE_PREFIX.fullmatch(line):
+                self.pending = line
+                return ""
+            if newline < 0 or not _FENCE.fullmatch(line):
+                self.state = "body"
+                return data
+            self.state = "fenced"
+            data = data[newline + 1:]
+        return self._fenced(data)
+
+    def _fenced(self, data: str) -> str:
+        out = []
+        position = 0
+        if not self.line_start:
+            newline = data.find("\n")
+            if newline < 0:
+                return data
+            out.append(data[:newline + 1])
+            position, self.line_start = newline + 1, True
+        while position < len(data):
+            newline = data.find("\n", position)
+            if newline < 0:
+                line = data[position:]
+                if _FENCE_PREFIX.fullmatch(line):
+                    self.pending = line
+                else:
+                    out.append(line)
+                    self.line_start = False
+                break
+            if _FENCE.fullmatch(data, position, newline):
+                self.state = "closed"
+                break
+            out.append(data[position:newline + 1])
+            position = newline + 1
+        return "".join(out)
+
+    def flush(self) -> str:
+        pending, self.pending = self.pending, ""
+        if self.state == "closed" or (self.state != "body" and _FENCE.fullmatch(pending)):
+            return ""
+        return pending
+
+class HTMLSanitizer(HTMLParser):
+    """
+    Nettoyeur incrémental: process(fragment) -> HTML sûr disponible, flush() -> reste
+    Une instance par document
+    """
+    def __init__(self, minify: bool = True):
+        super().__init__(convert_charrefs=False)
+        self.minify = minify
+        self._fences = _FenceStripper()
+        self._out = []
+        self._pending = []
+        self._pending_chars = 0
+        self._skip_tag = None
+        self._skip_depth = 0
+        self._preserve_depth = 0
+        self._rawtext = False
+        # Espace en attente: émis seulement si la suite n'est pas une balise de bloc
+        self._space = False
+        self._block_edge = True
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.removed_tags = 0
+        self.removed_attributes = 0
+
+    def process(self, chunk: str) -> str:
+        """Analyse un fragment et retourne le HTML nettoyé disponible"""
+        self.bytes_in += len(chunk)
+        self._pending.append(chunk)
+        self._pending_chars += len(chunk)
+        if self._pending_chars < COALESCE_CHARS and ">" not in chunk:
+            return ""
+        self.feed(self._fences.process("".join(self._pending)))
+        self._pending.clear()
+        self._pending_chars = 0
+        return self._drain()
+
+    def flush(self) -> str:
+        """Fin du document: analyse le reste tamponné"""
+        self.feed(self._fences.process("".join(self._pending)) + self._fences.flush())
+        self._pending.clear()
+        self.close()
+        return self._drain()
+
+    def _drain(self) -> str:
+        out = "".join(self._out)
+        self._out.clear()
+        self.bytes_out += len(out)
+        return out
+
+    def _text(self, text: str):
+        if self.minify and self._space and not self._block_edge:
+            self._out.append(" ")
+        self._space = False
+        self._block_edge = False
+        self._out.append(text)
+
+    def _boundary(self, tag: str):
+        if not self.minify or self._preserve_depth:
+            return
+        if tag in BLOCK_TAGS:
+            self._space = False
+            self._block_edge = True
+        else:
+            if self._space and not self._block_edge:
+                self._out.append(" ")
+            self._space = False
+            self._block_edge = False
+
+    def _clean_attrs(self, attrs) -> str:
+        parts = []
+        for name, value in attrs:
+            if (name.startswith("on") or name in DROPPED_ATTRIBUTES or not _ATTRIBUTE_NAME.fullmatch(name)
+                    or not self._safe_value(name, value)):
+                self.removed_attributes += 1
+                continue
+            parts.append(f" {name}" if value is None else f' {name}="{escape(value, quote=True)}"')
+        return "".join(parts)
+
+    @staticmethod
+    def _safe_value(name: str, value) -> bool:
+        if value is None:
+            return True
+        if name in URL_ATTRIBUTES:
+            normalized = _URL_NOISE.sub("", value).lower()
+            if normalized.startswith(("javascript:", "vbscript:")):
+                return False
+            return not normalized.startswith("data:") or normalized.startswith("data:image/")
+        if name == "style":
+            normalized = _URL_NOISE.sub("", value).lower()
+            return "expression(" not in normalized and "javascript:" not in normalized
+        return True
+
+    def _dropped(self, tag: str, attrs) -> bool:
+        if tag in DROPPED_TAGS:
+            return True
+        # <meta http-equiv="refresh">: redirection sans script
+        return tag == "meta" and any(n == "http-equiv" and (v or "").lower() == "refresh" for n, v in attrs)
+
+    def _start(self, tag: str, attrs, self_closing: bool):
+        if self._skip_tag is not None:
+            if tag == self._skip_tag and not self_closing:
+                self._skip_depth += 1
+            return
+        if self._dropped(tag, attrs):
+            self.removed_tags += 1
+            if tag not in VOID_TAGS and not self_closing:
+                self._skip_tag, self._skip_depth = tag, 1
+            return
+        self._boundary(tag)
+        self._out.append(f"<{tag}{self._clean_attrs(attrs)}{'/' if self_closing else ''}>")
+        if tag in PRESERVED_TAGS and not self_closing:
+            self._preserve_depth += 1
+        if tag in RAWTEXT_TAGS and not self_closing:
+            self._rawtext = True
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, attrs, False)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs, tag not in VOID_TAGS)
+
+    def handle_endtag(self, tag):
+        if self._skip_tag is not None:
+            if tag == self._skip_tag:
+                self._skip_depth -= 1
+                if not self._skip_depth:
+                    self._skip_tag = None
+            return
+        if tag in DROPPED_TAGS:
+            return  # balise fermante orpheline
+        if tag in PRESERVED_TAGS and self._preserve_depth:
+            self._preserve_depth -= 1
+        if tag in RAWTEXT_TAGS:
+            self._rawtext = False
+        self._boundary(tag)
+        self._out.append(f"</{tag}>")
+
+    def handle_data(self, data):
+        if self._skip_tag is not None:
+            return
+        if self._rawtext and "<" in data:
+            # Aucun CSS légitime n'en a besoin; un navigateur pourrait y voir du balisage
+            self.removed_tags += 1
+            return
+        if not self.minify or self._preserve_depth:
+            self._text(data)
+            return
+        collapsed = _WHITESPACE.sub(" ", data)
+        if collapsed.startswith(" "):
+            self._space = True
+            collapsed = collapsed[1:]
+        if not collapsed:
+            return
+        trailing = collapsed.endswith(" ")
+        self._text(collapsed[:-1] if trailing else collapsed)
+        self._space = trailing
+
+    def handle_entityref(self, name):
+        if self._skip_tag is None:
+            self._text(f"&{name};")
+
+    def handle_charref(self, name):
+        if self._skip_tag is None:
+            self._text(f"&#{name};")
+
+    def handle_decl(self, decl):
+        if self._skip_tag is None:
+            self._out.append(f"<!{decl}>")
+            self._space, self._block_edge = False, True
+
+    def handle_comment(self, data):
+        pass  # commentaires retirés (y compris les commentaires conditionnels)
+
+    def unknown_decl(self, data):
+        pass
+
+    def handle_pi(self, data):
+        pass
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "removed_tags": self.removed_tags,
+            "removed_attributes": self.removed_attributes
+        }
+
+def sanitize_html(html: str, minify: bool = True) -> str:
+    """Nettoie un document complet"""
+    sanitizer = HTMLSanitizer(minify=minify)
+    return sanitizer.process(html) + sanitizer.flush()
+
+async def sanitize_stream(chunks: AsyncIterable[str], minify: bool = True) -> AsyncIterator[str]:
+    """Nettoie un flux de fragments (réponse streamée) sans le mettre en tampon"""
+    sanitizer = HTMLSanitizer(minify=minify)
+    async for chunk in chunks:
+        out = sanitizer.process(chunk)
+        if out:
+            yield out
+    tail = sanitizer.flush()
+    if tail:
+        yield tail
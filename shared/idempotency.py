@@ -0,0 +1,149 @@
+"""
+Header Idempotency-Key sur /api/chat et /build
+- Les clients (connecteur WordPress, navigateur) réessaient sur timeout: sans clé,
+  chaque essai relance une génération upstream complète, facturée
+- Doublon pendant le calcul: rattaché à la tâche en cours (un seul appel upstream)
+- Doublon après le calcul: résultat rejoué depuis un store borné (TTL + nombre d'entrées)
+- Clés propres à l'Origin de l'appelant (header vu par le serveur, pas le project_id du payload):
+  deux sites peuvent choisir la même clé
+- Même clé, payload différent: 422 IDEMPOTENCY_KEY_REUSED
+- Seuls les succès sont conservés: après une erreur, un retry recalcule
+- Le calcul survit à la déconnexion de son client (le retry annoncé par la clé s'y rattache);
+  ses timeouts upstream restent bornés par la deadline de la première requête
+"""
+import os
+import re
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Awaitable, Callable, Optional, Tuple
+from fastapi import HTTPException
+from fastapi.responses import Response
+from .tracing import annotate
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+# Caractères imprimables ASCII (UUID, ULID, hash...), 255 au plus
+_KEY_PATTERN = re.compile(r"[\x21-\x7e]{1,255}")
+
+def fingerprint(payload: str) -> str:
+    """Empreinte du payload normalisé (JSON du modèle validé)"""
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class _Entry:
+    __slots__ = ("fingerprint", "task", "created")
+
+    def __init__(self, fingerprint: str, task: asyncio.Task):
+        self.fingerprint = fingerprint
+        self.task = task
+        self.created = time.monotonic()
+
+class IdempotencyStore:
+    """Calculs en cours et résultats récents d'un service, indexés par Idempotency-Key"""
+    def __init__(self, ttl: float = 86400, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self.executed = 0
+        self.attached = 0
+        self.replayed = 0
+        self.conflicts = 0
+        self.discarded = 0
+
+    @classmethod
+    def from_env(cls, getenv=os.getenv) -> "IdempotencyStore":
+        """Construit le store depuis IDEMPOTENCY_TTL / IDEMPOTENCY_MAX_ENTRIES"""
+        return cls(
+            ttl=float(getenv("IDEMPOTENCY_TTL", "86400")),
+            max_entries=int(getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+        )
+
+    @staticmethod
+    def validate_key(key: Optional[str]) -> Optional[str]:
+        """Clé du header (None si absente); 400 si elle est malformée"""
+        if key is None:
+            return None
+        if not _KEY_PATTERN.fullmatch(key):
+            raise HTTPException(status_code=400, detail={
+                "error": "INVALID_IDEMPOTENCY_KEY",
+                "message": "Idempotency-Key: 1 à 255 caractères ASCII imprimables"
+            })
+        return key
+
+    def _expire(self, now: float):
+        # Ordre d'insertion = ordre de création: les plus anciennes entrées sont en tête
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if now - entry.created <= self.ttl:
+                break
+            self._entries.popitem(last=False)
+
+    def _evict(self):
+        """Au-delà de max_entries: résultats les plus anciens d'abord, jamais un calcul en cours"""
+        excess = len(self._entries) - self.max_entries
+        done = (key for key, entry in self._entries.items() if entry.task.done())
+        for key in list(islice(done, excess)):
+            del self._entries[key]
+
+    def _settle(self, key: Tuple[str, str], entry: _Entry):
+        """Fin du calcul: échec, annulation ou réponse d'erreur -> entrée retirée (un retry recalcule)"""
+        task = entry.task
+        keep = not task.cancelled() and task.exception() is None and not isinstance(task.result(), Response)
+        if not keep and self._entries.get(key) is entry:
+            del self._entries[key]
+            self.discarded += 1
+
+    async def run(
+        self,
+        key: str,
+        payload_fingerprint: str,
+        compute: Callable[[], Awaitable[Any]],
+        scope: str = ""
+    ) -> Tuple[Any, str]:
+        """
+        Exécute `compute` une seule fois par clé dans `scope` (Origin de l'appelant)
+        Retourne (résultat, "executed" | "attached" | "replayed")
+        """
+        now = time.monotonic()
+        self._expire(now)
+        key = (scope, key)
+        entry = self._entries.get(key)
+        if entry is not None and entry.fingerprint != payload_fingerprint:
+            self.conflicts += 1
+            annotate(idempotency="conflict")
+            raise HTTPException(status_code=422, detail={
+                "error": "IDEMPOTENCY_KEY_REUSED",
+                "message": "Idempotency-Key déjà utilisée avec un payload différent"
+            })
+        if entry is None:
+            outcome = "executed"
+            entry = _Entry(payload_fingerprint, asyncio.get_running_loop().create_task(compute()))
+            entry.task.add_done_callback(lambda _, key=key, entry=entry: self._settle(key, entry))
+            self._entries[key] = entry
+            if len(self._entries) > self.max_entries:
+                self._evict()
+            self.executed += 1
+        elif entry.task.done():
+            outcome = "replayed"
+            self.replayed += 1
+        else:
+            outcome = "attached"
+            self.attached += 1
+        annotate(idempotency=outcome)
+        # shield: l'annulation d'un client (déconnexion, deadline) n'interrompt pas le calcul partagé
+        return await asyncio.shield(entry.task), outcome
+
+    def get_stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "in_flight": sum(1 for e in self._entries.values() if not e.task.done()),
+            "executed": self.executed,
+            "attached": self.attached,
+            "replayed": self.replayed,
+            "conflicts": self.conflicts,
+            "discarded": self.discarded,
+            "ttl_seconds": self.ttl,
+            "max_entries": self.max_entries
+        }
@@ -0,0 +1,179 @@
+"""
+Lanceur de production des services (remplace `uvicorn app:app` dans les Dockerfiles)
+    python -m shared.launcher app:app --host 0.0.0.0 --port $PORT
+    python -m shared.launcher --dry-run        # affiche le profil calculé sans démarrer
+- Boucle uvloop et parseur httptools s'ils sont installés (uvicorn[standard]), sinon asyncio / h11
+- Un seul worker sauf WEB_CONCURRENCY explicite: caches de variantes, idempotence, budget de retries
+  et quota upstream sont en mémoire, propres à chaque process. Le nombre de workers que CPU et
+  mémoire du conteneur permettraient (quotas cgroup compris) est indiqué à titre de suggestion
+- Par worker: pool upstream (part du total de connexions vers OpenAI), limite de connexions
+  simultanées (503 immédiat au-delà, plutôt qu'une file où tout le monde expire), backlog, keep-alive
+- Profil effectif transmis aux workers (SERVER_PROFILE) et exposé sur /__version
+"""
+import os
+import sys
+import json
+import math
+import asyncio
+import argparse
+import importlib.util
+from typing import Any, Dict, Optional
+
+PROFILE_ENV = "SERVER_PROFILE"
+# Mémoire laissée au process superviseur (workers > 1) et au système
+RESERVED_MEMORY_MB = 64
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def _available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+def cpu_count() -> float:
+    """CPU utilisables: affinité du process, bornée par le quota cgroup (fractionnaire sur les petits plans)"""
+    try:
+        cpus = float(len(os.sched_getaffinity(0)))
+    except AttributeError:
+        cpus = float(os.cpu_count() or 1)
+    quota = None
+    cpu_max = _read("/sys/fs/cgroup/cpu.max")  # cgroup v2: "quota période" ou "max période"
+    if cpu_max and not cpu_max.startswith("max"):
+        limit, _, period = cpu_max.partition(" ")
+        quota = int(limit) / int(period or 100000)
+    else:
+        limit, period = _read("/sys/fs/cgroup/cpu/cpu.cfs_quota_us"), _read("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+        if limit and period and int(limit) > 0:
+            quota = int(limit) / int(period)
+    return min(cpus, quota) if quota else cpus
+
+def memory_mb() -> Optional[int]:
+    """Mémoire du conteneur (limite cgroup v2/v1), sinon mémoire physique"""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        value = _read(path)
+        # v1 sans limite: valeur proche de 2^63
+        if value and value.isdigit() and int(value) < 1 << 60:
+            return int(value) // 2 ** 20
+    for line in (_read("/proc/meminfo") or "").splitlines():
+        if line.startswith("MemTotal:"):
+            return int(line.split()[1]) // 1024
+    return None
+
+def _somaxconn() -> int:
+    value = _read("/proc/sys/net/core/somaxconn")
+    return int(value) if value and value.isdigit() else 4096
+
+class ServerProfile:
+    """Réglages uvicorn et tailles de pools d'un déploiement"""
+    def __init__(self, cpus: float, memory: Optional[int], workers: int, loop: str, http: str,
+                 upstream_pool_size: int, limit_concurrency: int, backlog: int, keepalive: int,
+                 graceful_timeout: int, suggested_workers: Optional[int] = None):
+        self.cpus = cpus
+        self.memory = memory
+        self.workers = workers
+        self.suggested_workers = workers if suggested_workers is None else suggested_workers
+        self.loop = loop
+        self.http = http
+        self.upstream_pool_size = upstream_pool_size
+        self.limit_concurrency = limit_concurrency
+        self.backlog = backlog
+        self.keepalive = keepalive
+        self.graceful_timeout = graceful_timeout
+
+    @classmethod
+    def from_env(cls, getenv=os.getenv, cpus: Optional[float] = None, memory: Optional[int] = None) -> "ServerProfile":
+        """
+        Profil dérivé de la machine, chaque valeur remplaçable par l'environnement:
+        WEB_CONCURRENCY (workers, 1 par défaut), SERVER_WORKER_MEMORY_MB et SERVER_MAX_WORKERS
+        (suggestion), SERVER_UPSTREAM_CONNECTIONS (total du process), UPSTREAM_POOL_SIZE (par worker),
+        SERVER_LIMIT_CONCURRENCY, SERVER_BACKLOG, SERVER_KEEPALIVE
+        """
+        cpus = cpu_count() if cpus is None else cpus
+        memory = memory_mb() if memory is None else memory
+        # Moins d'un CPU (plans partagés): un seul worker, un second ne ferait que se disputer le quota
+        by_cpu = max(1, math.floor(cpus))
+        worker_mb = int(getenv("SERVER_WORKER_MEMORY_MB", "160"))
+        by_memory = max(1, (memory - RESERVED_MEMORY_MB) // worker_mb) if memory else by_cpu
+        suggested = min(by_cpu, by_memory, int(getenv("SERVER_MAX_WORKERS", "8")))
+        # Plusieurs workers seulement sur demande: l'état en mémoire n'est pas partagé entre process
+        # (variante servie par un autre worker: 404, retry idempotent recalculé, quota compté N fois)
+        workers = max(1, int(getenv("WEB_CONCURRENCY") or 1))
+        # Une génération en cours occupe une connexion upstream pendant toute sa durée
+        total = int(getenv("SERVER_UPSTREAM_CONNECTIONS", "64"))
+        pool = int(getenv("UPSTREAM_POOL_SIZE") or max(8, math.ceil(total / workers)))
+        # Au-delà du pool: connexions keep-alive et WebSocket inactives, endpoints légers
+        limit = int(getenv("SERVER_LIMIT_CONCURRENCY") or pool * 4)
+        backlog = int(getenv("SERVER_BACKLOG") or min(max(limit * workers, 128), _somaxconn()))
+        return cls(
+            cpus=round(cpus, 2),
+            memory=memory,
+            workers=workers,
+            loop="uvloop" if _available("uvloop") else "asyncio",
+            http="httptools" if _available("httptools") else "h11",
+            upstream_pool_size=pool,
+            limit_concurrency=limit,
+            backlog=backlog,
+            # Au-delà du timeout d'inactivité du proxy (60 s): il ne réutilise jamais une connexion fermée par l'app
+            keepalive=int(getenv("SERVER_KEEPALIVE", "65")),
+            # Après le drain (shared/drain.py): ne reste que des requêtes hors génération
+            graceful_timeout=int(getenv("SERVER_GRACEFUL_TIMEOUT", "5")),
+            suggested_workers=suggested
+        )
+
+    def uvicorn_kwargs(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "loop": self.loop,
+            "http": self.http,
+            "limit_concurrency": self.limit_concurrency,
+            "backlog": self.backlog,
+            "timeout_keep_alive": self.keepalive,
+            "timeout_graceful_shutdown": self.graceful_timeout
+        }
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "launcher": True,
+            "cpus": self.cpus,
+            "memory_mb": self.memory,
+            "suggested_workers": self.suggested_workers,
+            "upstream_pool_size": self.upstream_pool_size,
+            **self.uvicorn_kwargs()
+        }
+
+def current_profile() -> Dict[str, Any]:
+    """Profil du process (publié par le lanceur) et boucle effectivement utilisée"""
+    raw = os.getenv(PROFILE_ENV)
+    profile = json.loads(raw) if raw else {"launcher": False}
+    try:
+        profile["running_loop"] = type(asyncio.get_running_loop()).__module__.split(".")[0]
+    except RuntimeError:
+        pass
+    profile["pid"] = os.getpid()
+    return profile
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Lance un service avec le profil de production")
+    parser.add_argument("app", nargs="?", default="app:app", help="application ASGI (module:attribut)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--dry-run", action="store_true", help="affiche le profil sans démarrer")
+    args = parser.parse_args(argv)
+
+    profile = ServerProfile.from_env()
+    # Lus à l'import de shared.chat_proxy / au premier /__version, dans chaque worker
+    os.environ["UPSTREAM_POOL_SIZE"] = str(profile.upstream_pool_size)
+    os.environ[PROFILE_ENV] = json.dumps(profile.as_dict())
+    if args.dry_run:
+        print(json.dumps(profile.as_dict(), indent=2))
+        return 0
+
+    import uvicorn
+    uvicorn.run(args.app, host=args.host, port=args.port, app_dir=".", **profile.uvicorn_kwargs())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""
+Cycle de vie des services (démarrage / arrêt)
+- Préchauffage exécuté avant que /healthz ne déclare le service prêt
+- Libération des ressources (pool upstream, flush des registres) à l'arrêt
+"""
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+class ServiceLifecycle:
+    """
+    État de démarrage d'un service
+    - lifespan: à passer à FastAPI(lifespan=...), exécute le warm-up avant d'accepter du trafic
+    - ensure_ready(): utilisé par /healthz (lance le warm-up si le lifespan n'a pas tourné)
+    """
+    def __init__(
+        self,
+        warmup: Optional[Callable[[], Awaitable[Dict[str, Any]]]] = None,
+        shutdown: Optional[Callable[[], Awaitable[Any]]] = None
+    ):
+        self._warmup = warmup
+        self._shutdown = shutdown
+        self._task: Optional[asyncio.Task] = None
+        self.ready = False
+        self.warmup_report: Dict[str, Any] = {}
+        self.created_at = time.time()
+        self.ready_at: Optional[float] = None
+
+    async def _run_warmup(self):
+        try:
+            self.warmup_report = await self._warmup() if self._warmup else {}
+        except Exception as e:
+            # Un warm-up raté ne doit pas bloquer le service: il sera juste plus lent
+            self.warmup_report = {"error": str(e) or type(e).__name__}
+        self.ready = True
+        self.ready_at = time.time()
+
+    async def ensure_ready(self) -> bool:
+        """Attend la fin du warm-up (partagé entre appels concurrents)"""
+        if self.ready:
+            return True
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._run_warmup())
+        await asyncio.shield(self._task)
+        return self.ready
+
+    @asynccontextmanager
+    async def lifespan(self, app):
+        await self.ensure_ready()
+        yield
+        self.ready = False
+        if self._shutdown is not None:
+            await self._shutdown()
+
+    def get_stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "startup_seconds": round(self.ready_at - self.created_at, 3) if self.ready_at else None,
+            "warmup": self.warmup_report
+        }
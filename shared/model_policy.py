@@ -0,0 +1,201 @@
+"""
+Politique de modèle: rétrogradation adaptative sous charge ou pression de latence
+- Latence suivie par modèle (moyenne mobile exponentielle), mesurée par tentative upstream:
+  file du régulateur de quota, backoffs et exécution des outils exclus
+- Latence par token de complétion (ms), comparable entre réponses courtes et pages entières
+- Profondeur de file = appels upstream en cours sur le service
+- Consommation du budget du projet (registre d'usage)
+Règles par service, aucune par défaut (les latences normales diffèrent: chat vs /build):
+MODEL_POLICY_RULES="gpt-4o->gpt-4o-mini:token_latency=60,inflight=50,budget=0.9"
+(une règle s'applique dès qu'un de ses seuils est dépassé; règles séparées par ";")
+"""
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+from .usage import usage_ledger
+
+DEFAULT_RULES = ""
+
+class DowngradeRule:
+    """
+    source -> target si latence EWMA par tentative (s), latence par token (ms), appels en cours
+    ou part du budget dépasse le seuil
+    """
+    __slots__ = ("source", "target", "max_latency", "max_token_latency", "max_in_flight", "max_budget_ratio")
+
+    def __init__(
+        self,
+        source: str,
+        target: str,
+        max_latency: Optional[float] = None,
+        max_in_flight: Optional[int] = None,
+        max_budget_ratio: Optional[float] = None,
+        max_token_latency: Optional[float] = None
+    ):
+        self.source = source
+        self.target = target
+        self.max_latency = max_latency
+        self.max_token_latency = max_token_latency
+        self.max_in_flight = max_in_flight
+        self.max_budget_ratio = max_budget_ratio
+
+def parse_rules(raw: str) -> List[DowngradeRule]:
+    """Parse "source->target:latency=8,token_latency=60,inflight=20,budget=0.8;..." en règles"""
+    rules = []
+    for chunk in raw.split(";"):
+        if "->" not in chunk:
+            continue
+        models, _, thresholds = chunk.partition(":")
+        source, target = (m.strip() for m in models.split("->", 1))
+        rule = DowngradeRule(source, target)
+        for item in thresholds.split(","):
+            if "=" not in item:
+                continue
+            name, value = (part.strip() for part in item.split("=", 1))
+            if name == "latency":
+                rule.max_latency = float(value)
+            elif name == "token_latency":
+                rule.max_token_latency = float(value)
+            elif name == "inflight":
+                rule.max_in_flight = int(value)
+            elif name == "budget":
+                rule.max_budget_ratio = float(value)
+            else:
+                raise ValueError(f"Seuil inconnu dans MODEL_POLICY_RULES: {name}")
+        rules.append(rule)
+    return rules
+
+# Politique et modèle de l'appel en cours (posés par ModelPolicy.track)
+_tracked: ContextVar[Optional[Tuple["ModelPolicy", str]]] = ContextVar("model_policy_tracked", default=None)
+
+def observe_attempt(seconds: float, completion_tokens: Optional[int] = None):
+    """Mesure d'une tentative upstream, attribuée au modèle suivi par ModelPolicy.track (s'il y en a un)"""
+    tracked = _tracked.get()
+    if tracked is not None:
+        policy, model = tracked
+        policy.observe(model, seconds, completion_tokens)
+
+class ModelPolicy:
+    """
+    Choisit le modèle effectif d'une requête
+    Une latence observée il y a plus de `stale_after` secondes est ignorée: le modèle
+    source reçoit de nouveau du trafic, ce qui rafraîchit sa mesure (retour automatique)
+    """
+    def __init__(self, rules: List[DowngradeRule], alpha: float = 0.2, stale_after: float = 60.0):
+        self.rules = {rule.source: rule for rule in rules}
+        self.alpha = alpha
+        self.stale_after = stale_after
+        self.latency_ewma: Dict[str, float] = {}
+        self.token_latency_ewma: Dict[str, float] = {}
+        self._last_sample: Dict[str, float] = {}
+        self.in_flight = 0
+        self.chosen: Dict[str, int] = {}
+        self.downgrades: Dict[str, int] = {}
+
+    @classmethod
+    def from_env(cls, getenv=os.getenv) -> "ModelPolicy":
+        """Construit la politique depuis MODEL_POLICY_RULES / MODEL_POLICY_* (règles vides = désactivée)"""
+        return cls(
+            parse_rules(getenv("MODEL_POLICY_RULES", DEFAULT_RULES)),
+            alpha=float(getenv("MODEL_POLICY_EWMA_ALPHA", "0.2")),
+            stale_after=float(getenv("MODEL_POLICY_STALE_AFTER", "60"))
+        )
+
+    def _smooth(self, values: Dict[str, float], model: str, sample: float):
+        previous = values.get(model)
+        values[model] = sample if previous is None else previous + self.alpha * (sample - previous)
+
+    def observe(self, model: str, latency: float, completion_tokens: Optional[int] = None, now: Optional[float] = None):
+        """
+        Intègre la latence d'une tentative upstream terminée (succès ou échec)
+        completion_tokens: tokens générés (succès), pour la latence par token
+        """
+        self._smooth(self.latency_ewma, model, latency)
+        if completion_tokens:
+            self._smooth(self.token_latency_ewma, model, latency * 1000 / completion_tokens)
+        self._last_sample[model] = time.time() if now is None else now
+
+    def _latency(self, values: Dict[str, float], model: str, now: float) -> Optional[float]:
+        if now - self._last_sample.get(model, 0) > self.stale_after:
+            return None
+        return values.get(model)
+
+    def _pressure(self, rule: DowngradeRule, project_id: Optional[str], now: float) -> Optional[str]:
+        """Raison de rétrograder selon la règle, None si aucun seuil n'est dépassé"""
+        latency = self._latency(self.latency_ewma, rule.source, now)
+        if rule.max_latency is not None and latency is not None and latency > rule.max_latency:
+            return "latency"
+        token_latency = self._latency(self.token_latency_ewma, rule.source, now)
+        if rule.max_token_latency is not None and token_latency is not None and token_latency > rule.max_token_latency:
+            return "token_latency"
+        if rule.max_in_flight is not None and self.in_flight >= rule.max_in_flight:
+            return "in_flight"
+        if rule.max_budget_ratio is not None and usage_ledger.budget_ratio(project_id) >= rule.max_budget_ratio:
+            return "budget"
+        return None
+
+    def choose(self, model: str, project_id: Optional[str] = None, now: Optional[float] = None) -> Tuple[str, Optional[str]]:
+        """Retourne (modèle effectif, raison de la rétrogradation ou None)"""
+        now = time.time() if now is None else now
+        reasons = []
+        seen = {model}
+        rule = self.rules.get(model)
+        while rule is not None:
+            reason = self._pressure(rule, project_id, now)
+            if reason is None or rule.target in seen:
+                break
+            key = f"{rule.source}->{rule.target}:{reason}"
+            self.downgrades[key] = self.downgrades.get(key, 0) + 1
+            reasons.append(reason)
+            model = rule.target
+            seen.add(model)
+            rule = self.rules.get(model)
+        self.chosen[model] = self.chosen.get(model, 0) + 1
+        return model, ",".join(reasons) or None
+
+    @contextmanager
+    def track(self, model: str):
+        """
+        Compte l'appel comme en cours; chaque tentative upstream faite dans le bloc
+        est mesurée par observe_attempt (call_openai_with_retry)
+        """
+        self.in_flight += 1
+        token = _tracked.set((self, model))
+        try:
+            yield
+        finally:
+            _tracked.reset(token)
+            self.in_flight -= 1
+
+    def export_state(self) -> dict:
+        return {
+            "latency_ewma": self.latency_ewma,
+            "token_latency_ewma": self.token_latency_ewma,
+            "last_sample": self._last_sample,
+            "chosen": self.chosen,
+            "downgrades": self.downgrades
+        }
+
+    def restore_state(self, state: dict):
+        self.latency_ewma = dict(state["latency_ewma"])
+        self.token_latency_ewma = dict(state.get("token_latency_ewma", {}))
+        self._last_sample = dict(state["last_sample"])
+        self.chosen = dict(state["chosen"])
+        self.downgrades = dict(state["downgrades"])
+
+    def get_stats(self) -> dict:
+        return {
+            "rules": [
+                {"source": r.source, "target": r.target, "max_latency": r.max_latency,
+                 "max_token_latency_ms": r.max_token_latency, "max_in_flight": r.max_in_flight,
+                 "max_budget_ratio": r.max_budget_ratio}
+                for r in self.rules.values()
+            ],
+            "latency_ewma_seconds": {m: round(v, 3) for m, v in self.latency_ewma.items()},
+            "token_latency_ewma_ms": {m: round(v, 2) for m, v in self.token_latency_ewma.items()},
+            "in_flight": self.in_flight,
+            "requests_by_model": self.chosen,
+            "downgrades": self.downgrades
+        }
@@ -0,0 +1,325 @@
+"""
+Index de recherche local (BM25) pour donner aux assistants une base de connaissances
+- Construit hors ligne depuis un dossier de documents (.md, .txt, .html):
+    python -m shared.retrieval build docs/coach data/coach-index [--chunk-words 120] [--overlap 30]
+    python -m shared.retrieval query data/coach-index "comment poser ma voix ?"
+- Sur disque: postings (ids de chunks + poids BM25 précalculés) et texte des chunks,
+  ouverts en mmap; seuls le vocabulaire et les métadonnées sont chargés en mémoire
+- Par requête: les derniers messages user sélectionnent les top-k chunks, injectés dans
+  un message system; les clients n'ont plus à envoyer toute la documentation
+- CPU seulement, bibliothèque standard
+"""
+import os
+import re
+import sys
+import json
+import math
+import mmap
+import time
+import heapq
+import argparse
+import unicodedata
+from array import array
+from collections import Counter
+from html import unescape
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from .tracing import annotate, span
+
+FORMAT_VERSION = 1
+DOCUMENT_SUFFIXES = (".md", ".markdown", ".txt", ".html", ".htm")
+RETRIEVAL_PREAMBLE = "Extraits de la documentation (à utiliser s'ils sont pertinents, sans les citer mot pour mot):\n\n"
+STOPWORDS = frozenset("""
+    au aux avec ce ces cet cette dans de des du elle en et eux il ils je la le les leur leurs lui ma mais me
+    meme mes moi mon ne nos notre nous on ou par pas pour qu que qui sa se ses son sur ta te tes toi ton tu
+    un une vos votre vous est sont etre avoir ai as avons avez ont fait faire comme plus tres bien aussi
+    si tout tous toute toutes cela ca ici la quoi dont sans sous entre vers chez
+    the and for are but not you all any can her was one our out his has had how its may new now see
+    who did get let she too use with this that from they have what when your will would there their
+    which about into than then them these some could other just like also only over such more most
+""".split())
+_TOKEN = re.compile(r"\w+")
+_TAG = re.compile(r"<[^>]+>")
+# Repli des accents latins (é -> e, œ -> oe) par str.translate
+_FOLD = {
+    cp: "".join(c for c in unicodedata.normalize("NFKD", chr(cp)) if not unicodedata.combining(c))
+    for cp in range(0xC0, 0x250)
+}
+_FOLD = {cp: base for cp, base in _FOLD.items() if base and base.isascii() and base != chr(cp)}
+_FOLD.update({ord("œ"): "oe", ord("æ"): "ae", ord("ß"): "ss"})
+
+def tokenize(text: str) -> List[str]:
+    """Minuscules, accents repliés, mots vides ignorés, pluriels en -s réduits"""
+    tokens = []
+    for token in _TOKEN.findall(text.lower().translate(_FOLD)):
+        if len(token) < 2 or token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+def chunk_text(text: str, words: int = 120, overlap: int = 30) -> List[str]:
+    """Fenêtres de `words` mots se recouvrant de `overlap` mots"""
+    tokens = text.split()
+    if not tokens:
+        return []
+    step = max(1, words - overlap)
+    return [" ".join(tokens[i:i + words]) for i in range(0, max(len(tokens) - overlap, 1), step)]
+
+def _read_document(path: Path) -> str:
+    text = path.read_text(encoding="utf-8", errors="replace")
+    if path.suffix.lower() in (".html", ".htm"):
+        text = unescape(_TAG.sub(" ", text))
+    return text
+
+def _write(path: Path, data: bytes):
+    # Écriture puis renommage: un service qui a l'ancien fichier en mmap le garde intact
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+def build_index(source, target, chunk_words: int = 120, overlap: int = 30, k1: float = 1.2, b: float = 0.75) -> Dict[str, Any]:
+    """Construit l'index de `source` (dossier de documents) dans le dossier `target`"""
+    source, target = Path(source), Path(target)
+    started = time.perf_counter()
+    files = sorted(p for p in source.rglob("*") if p.is_file() and p.suffix.lower() in DOCUMENT_SUFFIXES)
+    chunks: List[str] = []
+    chunk_sources = array("I")
+    sources: List[str] = []
+    for path in files:
+        parts = chunk_text(_read_document(path), chunk_words, overlap)
+        if not parts:
+            continue
+        sources.append(path.relative_to(source).as_posix())
+        chunks.extend(parts)
+        chunk_sources.extend([len(sources) - 1] * len(parts))
+
+    postings: Dict[str, List[Tuple[int, int]]] = {}
+    lengths = []
+    for chunk_id, chunk in enumerate(chunks):
+        counts = Counter(tokenize(chunk))
+        lengths.append(sum(counts.values()))
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append((chunk_id, tf))
+    count = len(chunks)
+    avgdl = sum(lengths) / count if count else 0.0
+
+    # Poids BM25 précalculés: score(q, d) = somme idf(t) x poids(t, d)
+    ids, weights = array("I"), array("f")
+    terms = {}
+    for term in sorted(postings):
+        entries = postings[term]
+        df = len(entries)
+        terms[term] = [len(ids), df, round(math.log(1 + (count - df + 0.5) / (df + 0.5)), 6)]
+        for chunk_id, tf in entries:
+            norm = k1 * (1 - b + b * lengths[chunk_id] / avgdl) if avgdl else k1
+            ids.append(chunk_id)
+            weights.append(tf * (k1 + 1) / (tf + norm))
+
+    encoded = [chunk.encode("utf-8") for chunk in chunks]
+    offsets = array("Q", [0])
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+
+    target.mkdir(parents=True, exist_ok=True)
+    _write(target / "postings.bin", ids.tobytes() + weights.tobytes())
+    _write(target / "chunks.bin", offsets.tobytes() + chunk_sources.tobytes() + b"".join(encoded))
+    _write(target / "terms.json", json.dumps(terms, separators=(",", ":")).encode())
+    meta = {
+        "format": FORMAT_VERSION, "byteorder": sys.byteorder, "k1": k1, "b": b,
+        "chunks": count, "postings": len(ids), "terms": len(terms), "avgdl": round(avgdl, 3),
+        "chunk_words": chunk_words, "overlap": overlap, "sources": sources, "built_at": time.time()
+    }
+    # Métadonnées en dernier: elles valident les autres fichiers
+    _write(target / "meta.json", json.dumps(meta, ensure_ascii=False).encode())
+    return {
+        "documents": len(sources), "chunks": count, "terms": len(terms), "postings": len(ids),
+        "bytes": sum((target / name).stat().st_size for name in ("postings.bin", "chunks.bin", "terms.json", "meta.json")),
+        "seconds": round(time.perf_counter() - started, 3)
+    }
+
+class RetrievalIndex:
+    """Index BM25 ouvert en lecture (postings et texte des chunks en mmap)"""
+    def __init__(self, path):
+        path = Path(path)
+        self.path = path
+        self.meta = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+        if self.meta.get("format") != FORMAT_VERSION or self.meta.get("byteorder") != sys.byteorder:
+            raise ValueError(f"Index {path}: format incompatible (reconstruire avec python -m shared.retrieval build)")
+        self.terms: Dict[str, list] = json.loads((path / "terms.json").read_text(encoding="utf-8"))
+        self.sources: List[str] = self.meta["sources"]
+        self._maps: List[mmap.mmap] = []
+        self._views: List[memoryview] = []
+        total, count = self.meta["postings"], self.meta["chunks"]
+        postings = self._map(path / "postings.bin")
+        self._ids = self._view(postings, 0, 4 * total, "I")
+        self._weights = self._view(postings, 4 * total, 8 * total, "f")
+        chunks = self._map(path / "chunks.bin")
+        text_start = 8 * (count + 1) + 4 * count
+        self._offsets = self._view(chunks, 0, 8 * (count + 1), "Q")
+        self._chunk_sources = self._view(chunks, 8 * (count + 1), text_start, "I")
+        self._text = self._view(chunks, text_start, len(chunks), "B")
+
+    def _map(self, path: Path) -> memoryview:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                view = memoryview(b"")
+            else:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps.append(mapped)
+                view = memoryview(mapped)
+        self._views.append(view)
+        return view
+
+    def _view(self, base: memoryview, start: int, end: int, fmt: str) -> memoryview:
+        part = base[start:end]
+        cast = part.cast(fmt)
+        self._views += [part, cast]
+        return cast
+
+    def __len__(self) -> int:
+        return self.meta["chunks"]
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[float, int]]:
+        """Top-k (score BM25, id du chunk)"""
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            entry = self.terms.get(term)
+            if entry is None:
+                continue
+            offset, df, idf = entry
+            for chunk_id, weight in zip(self._ids[offset:offset + df].tolist(), self._weights[offset:offset + df].tolist()):
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * weight
+        return heapq.nlargest(k, ((score, chunk_id) for chunk_id, score in scores.items()))
+
+    def chunk(self, chunk_id: int) -> Tuple[str, str]:
+        """(document source, texte) d'un chunk"""
+        text = bytes(self._text[self._offsets[chunk_id]:self._offsets[chunk_id + 1]]).decode("utf-8")
+        return self.sources[self._chunk_sources[chunk_id]], text
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views.clear()
+        for mapped in self._maps:
+            mapped.close()
+        self._maps.clear()
+
+class Retriever:
+    """Étape de handle_chat_request: extraits pertinents injectés avant l'appel upstream"""
+    def __init__(self, index: RetrievalIndex, top_k: int = 3, min_score: float = 1.0,
+                 max_chars: int = 4000, query_messages: int = 2):
+        self.index = index
+        self.top_k = top_k
+        self.min_score = min_score
+        self.max_chars = max_chars
+        self.query_messages = query_messages
+        self.queries = 0
+        self.misses = 0
+        self.injected_chunks = 0
+        self.injected_chars = 0
+        self.total_seconds = 0.0
+
+    @classmethod
+    def from_env(cls, getenv=os.getenv) -> Optional["Retriever"]:
+        """Depuis RETRIEVAL_INDEX (vide: pas de retrieval) et RETRIEVAL_TOP_K / _MIN_SCORE / _MAX_CHARS"""
+        path = getenv("RETRIEVAL_INDEX", "")
+        if not path:
+            return None
+        return cls(
+            RetrievalIndex(path),
+            top_k=int(getenv("RETRIEVAL_TOP_K", "3")),
+            min_score=float(getenv("RETRIEVAL_MIN_SCORE", "1.0")),
+            max_chars=int(getenv("RETRIEVAL_MAX_CHARS", "4000"))
+        )
+
+    def search(self, query: str) -> List[Dict[str, Any]]:
+        """Extraits pour une requête libre (outil search_docs): mêmes seuils que augment()"""
+        results, used = [], 0
+        with span("retrieval"):
+            for score, chunk_id in self.index.search(query, self.top_k):
+                source, text = self.index.chunk(chunk_id)
+                if score < self.min_score or (results and used + len(text) > self.max_chars):
+                    break
+                results.append({"source": source, "text": text, "score": round(score, 3)})
+                used += len(text)
+        self.queries += 1
+        self.injected_chunks += len(results)
+        self.injected_chars += used
+        if not results:
+            self.misses += 1
+        return results
+
+    def augment(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Messages + message system d'extraits (après les messages system du client)"""
+        questions = [m.get("content") or "" for m in messages if m.get("role") == "user"][-self.query_messages:]
+        started = time.perf_counter()
+        with span("retrieval"):
+            hits = [hit for hit in self.index.search(" ".join(questions), self.top_k) if hit[0] >= self.min_score]
+            parts, used = [], 0
+            for rank, (score, chunk_id) in enumerate(hits, 1):
+                source, text = self.index.chunk(chunk_id)
+                if parts and used + len(text) > self.max_chars:
+                    break
+                parts.append(f"[{rank}] ({source}) {text}")
+                used += len(text)
+        elapsed = time.perf_counter() - started
+        self.queries += 1
+        self.total_seconds += elapsed
+        self.injected_chunks += len(parts)
+        self.injected_chars += used
+        annotate(retrieval_chunks=len(parts), retrieval_ms=round(elapsed * 1000, 3))
+        if not parts:
+            self.misses += 1
+            return messages
+        position = 0
+        while position < len(messages) and messages[position].get("role") == "system":
+            position += 1
+        context = {"role": "system", "content": RETRIEVAL_PREAMBLE + "\n\n".join(parts)}
+        return messages[:position] + [context] + messages[position:]
+
+    def close(self):
+        self.index.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "index": str(self.index.path),
+            "chunks": len(self.index),
+            "queries": self.queries,
+            "misses": self.misses,
+            "injected_chunks": self.injected_chunks,
+            "injected_chars": self.injected_chars,
+            "avg_query_ms": round(self.total_seconds / self.queries * 1000, 3) if self.queries else 0,
+            "top_k": self.top_k
+        }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Index BM25 local pour le retrieval du chat")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="construit l'index depuis un dossier de documents")
+    build.add_argument("source")
+    build.add_argument("target")
+    build.add_argument("--chunk-words", type=int, default=120)
+    build.add_argument("--overlap", type=int, default=30)
+    query = commands.add_parser("query", help="affiche les meilleurs chunks pour une question")
+    query.add_argument("index")
+    query.add_argument("question")
+    query.add_argument("-k", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        stats = build_index(args.source, args.target, args.chunk_words, args.overlap)
+        print(json.dumps(stats, ensure_ascii=False))
+        return 0 if stats["chunks"] else 1
+    index = RetrievalIndex(args.index)
+    try:
+        for score, chunk_id in index.search(args.question, args.k):
+            source, text = index.chunk(chunk_id)
+            print(f"{score:7.3f}  {source}  {text[:160]}")
+    finally:
+        index.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
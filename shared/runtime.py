@@ -0,0 +1,191 @@
+"""
+Instrumentation du process: lag de l'event loop, requêtes en cours, pool upstream, mémoire, GC
+- Échantillonnage en tâche de fond dans des ring buffers (coût négligeable)
+- Permet de distinguer un OpenAI lent d'une boucle bloquée (CPU) ou d'une pression mémoire
+- Profileur à la demande (échantillonnage des piles du thread de la boucle), format
+  "piles repliées" compatible flamegraph.pl / speedscope
+"""
+import os
+import gc
+import sys
+import time
+import asyncio
+import threading
+from collections import Counter, deque
+from typing import Any, Dict, Optional
+from .chat_proxy import upstream_pool_stats
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def current_rss_bytes() -> Optional[int]:
+    """RSS courant (Linux: /proc/self/statm, sinon pic via getrusage)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    return None
+
+def _percentile(values, q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class RuntimeMonitor:
+    """
+    Échantillonne toutes les `interval` secondes (ring buffers de `capacity` points)
+    - lag: retard du réveil de la boucle par rapport à l'intervalle prévu
+    - in_flight: requêtes HTTP en cours (RuntimeMiddleware)
+    - upstream: connexions ouvertes / inactives du pool partagé
+    - rss_bytes, pauses GC (par génération)
+    """
+    def __init__(self, interval: float = 0.5, capacity: int = 240):
+        self.interval = interval
+        self.samples: deque = deque(maxlen=capacity)
+        self.gc_pauses: deque = deque(maxlen=capacity)
+        self.in_flight = 0
+        self.loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._gc_started: Optional[float] = None
+        self._profiling = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "RuntimeMonitor":
+        """Construit le moniteur depuis RUNTIME_SAMPLE_INTERVAL / RUNTIME_SAMPLE_CAPACITY"""
+        return cls(
+            interval=float(os.getenv("RUNTIME_SAMPLE_INTERVAL", "0.5")),
+            capacity=int(os.getenv("RUNTIME_SAMPLE_CAPACITY", "240"))
+        )
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def _on_gc(self, phase: str, info: dict):
+        if phase == "start":
+            self._gc_started = time.perf_counter()
+        elif self._gc_started is not None:
+            self.gc_pauses.append((time.time(), info.get("generation"), (time.perf_counter() - self._gc_started) * 1000))
+            self._gc_started = None
+
+    def sample(self, lag_ms: float = 0.0) -> dict:
+        pool = upstream_pool_stats()
+        point = {
+            "ts": round(time.time(), 3),
+            "lag_ms": round(lag_ms, 3),
+            "in_flight": self.in_flight,
+            "upstream_open": pool["open"],
+            "upstream_idle": pool["idle"],
+            "rss_bytes": current_rss_bytes()
+        }
+        self.samples.append(point)
+        return point
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.sample(max(0.0, (loop.time() - expected) * 1000))
+
+    def start(self):
+        if self.running:
+            return
+        self.loop_thread_id = threading.get_ident()
+        if self._on_gc not in gc.callbacks:
+            gc.callbacks.append(self._on_gc)
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self._on_gc in gc.callbacks:
+            gc.callbacks.remove(self._on_gc)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def profile(self, seconds: float = 5.0, interval_ms: float = 5.0, thread_id: Optional[int] = None) -> Optional[str]:
+        """
+        Échantillonne la pile du thread de la boucle (à appeler depuis un autre thread)
+        Retourne les piles repliées "module:fonction;...;module:fonction N", None si un profil est déjà en cours
+        """
+        if not self._profiling.acquire(blocking=False):
+            return None
+        try:
+            target = thread_id or self.loop_thread_id or threading.main_thread().ident
+            stacks: Counter = Counter()
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                frame = sys._current_frames().get(target)
+                if frame is not None:
+                    names = []
+                    while frame is not None:
+                        code = frame.f_code
+                        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                        frame = frame.f_back
+                    stacks[";".join(reversed(names))] += 1
+                time.sleep(interval_ms / 1000)
+            return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+        finally:
+            self._profiling.release()
+
+    def get_stats(self, last: int = 60) -> Dict[str, Any]:
+        """Résumé sur tout le buffer + les `last` derniers échantillons"""
+        samples = list(self.samples)
+        lags = [s["lag_ms"] for s in samples]
+        pauses = [p[2] for p in self.gc_pauses]
+        rss = [s["rss_bytes"] for s in samples if s["rss_bytes"] is not None]
+        return {
+            "running": self.running,
+            "interval_seconds": self.interval,
+            "in_flight": self.in_flight,
+            "upstream": upstream_pool_stats(),
+            "rss_bytes": current_rss_bytes(),
+            "loop_lag_ms": {
+                "p50": _percentile(lags, 0.5),
+                "p99": _percentile(lags, 0.99),
+                "max": max(lags) if lags else None
+            },
+            "rss_peak_bytes": max(rss) if rss else None,
+            "gc": {
+                "counts": gc.get_count(),
+                "pauses": len(pauses),
+                "pause_ms_p99": round(_percentile(pauses, 0.99), 3) if pauses else None,
+                "pause_ms_max": round(max(pauses), 3) if pauses else None,
+                "recent": [
+                    {"ts": round(ts, 3), "generation": gen, "ms": round(ms, 3)}
+                    for ts, gen, ms in list(self.gc_pauses)[-10:]
+                ]
+            },
+            "samples": samples[-last:] if last > 0 else []
+        }
+
+class RuntimeMiddleware:
+    """Middleware ASGI: compte les requêtes HTTP en cours"""
+    def __init__(self, app, monitor: Optional[RuntimeMonitor] = None):
+        self.app = app
+        self.monitor = monitor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        monitor = self.monitor or runtime_monitor
+        monitor.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            monitor.in_flight -= 1
+
+# Instance globale (une boucle par process)
+runtime_monitor = RuntimeMonitor.from_env()
@@ -0,0 +1,691 @@
+"""
+Fabriques des services Hey Hi (coach, vidéo, website builder)
+- Chaque service est une app FastAPI construite depuis sa ServiceConfig
+- Les ressources coûteuses sont partagées par tous les services du process:
+  pool upstream, registre d'usage, logs d'accès, circuit breaker, micro-batcher
+- Mode autonome: hey-hi-*/app.py construit un seul service (déploiements existants)
+- Mode gateway: create_gateway_app monte les trois services dans un seul process
+  (routage par préfixe de chemin et/ou par Host)
+"""
+import os
+import hmac
+import time
+import uuid
+import asyncio
+import threading
+from collections import Counter, OrderedDict
+from functools import partial
+from contextlib import AsyncExitStack, asynccontextmanager
+from pathlib import Path
+from datetime import datetime
+from typing import Dict, Optional
+from zoneinfo import ZoneInfo
+from fastapi import FastAPI, Query, Depends, HTTPException, Body, Header, Request, Response, WebSocket
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
+from pydantic import BaseModel, Field
+from .utils import get_allowed_origins
+from .chat_proxy import (
+    ChatMetrics, ChatRequest, MicroBatcher, OPENAI_CHAT_URL, ToolRegistry, circuit_breaker, close_upstream_pool,
+    handle_chat_request, parse_chat_request, post_upstream, prewarm, tool_registry
+)
+from .lifecycle import ServiceLifecycle
+from .model_policy import ModelPolicy
+from .snapshot import StateSnapshotter
+from .usage import usage_ledger
+from .tracing import REQUEST_ID_HEADER, RequestTracingMiddleware, annotate, current_request_id, span
+from .access_log import AccessLogMiddleware, access_log
+from .body_limit import DEFAULT_BODY_LIMITS, BodySizeLimitMiddleware, parse_body_limits
+from .deadline import DeadlineMiddleware
+from .compression import CompressionMiddleware, PrecompressedAsset
+from .speculation import SpeculativeCache
+from .runtime import RuntimeMiddleware, runtime_monitor
+from .upstream_governor import estimate_tokens, upstream_governor
+from .ws_chat import ChatSessions, serve_chat_websocket
+from .html_sanitizer import HTMLSanitizer
+from .idempotency import IDEMPOTENCY_HEADER, REPLAYED_HEADER, IdempotencyStore, fingerprint
+from .retrieval import Retriever
+from .drain import DrainMiddleware, drain
+from .launcher import current_profile
+
+STATIC_DIR = Path(__file__).resolve().parent / "static"
+CORS_HEADERS = [
+    "Content-Type", "Authorization", "Accept", "Cache-Control", "X-Request-ID", "X-Request-Timeout",
+    "X-Request-Deadline", IDEMPOTENCY_HEADER
+]
+# Fichiers propres à chaque service: suffixés par le préfixe en mode gateway
+PER_SERVICE_FILES = ("STATE_SNAPSHOT_PATH",)
+MAX_BUILD_VARIANTS = int(os.getenv("BUILD_MAX_VARIANTS", "4"))
+
+class ServiceConfig:
+    """
+    Configuration d'un service lue dans l'environnement
+    Avec un préfixe (mode gateway), COACH_OPENAI_MODEL l'emporte sur OPENAI_MODEL;
+    APP_NAME n'est jamais hérité (chaque service garde son nom dans logs et métriques)
+    """
+    __slots__ = ("default_name", "prefix")
+
+    def __init__(self, default_name: str, prefix: str = ""):
+        self.default_name = default_name
+        self.prefix = prefix.upper()
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        if self.prefix:
+            value = os.getenv(f"{self.prefix}_{key}")
+            if value is not None:
+                return value
+            if key == "APP_NAME":
+                return default
+            value = os.getenv(key)
+            if value and key in PER_SERVICE_FILES:
+                return f"{value}.{self.prefix.lower()}"
+            return default if value is None else value
+        return os.getenv(key, default)
+
+    @property
+    def app_name(self) -> str:
+        return self.get("APP_NAME", self.default_name)
+
+    @property
+    def api_key(self) -> str:
+        return self.get("OPENAI_API_KEY", "")
+
+    @property
+    def model(self) -> str:
+        return self.get("OPENAI_MODEL", "gpt-4o-mini")
+
+    @property
+    def allowed_origins(self):
+        return get_allowed_origins("*", raw=self.get("ALLOWED_ORIGINS", "*"))
+
+    @property
+    def timeouts(self) -> tuple[float, float]:
+        return float(self.get("LLM_TIMEOUT_CONNECT", "10")), float(self.get("LLM_TIMEOUT_READ", "70"))
+
+    @property
+    def body_limits(self) -> Dict[str, int]:
+        return parse_body_limits(self.get("BODY_LIMITS", DEFAULT_BODY_LIMITS))
+
+class SharedResources:
+    """
+    Ressources partagées par tous les services du process
+    Le warm-up (pool upstream, validateurs) et l'arrêt (pool, flush du registre,
+    logs d'accès) ne sont exécutés qu'une fois, quel que soit le nombre de services
+    """
+    def __init__(self):
+        self.api_key = ""
+        self.connect_timeout = 3.0
+        self._batcher: Optional[MicroBatcher] = None
+        self._batcher_checked = False
+        self._snapshot_owners: Dict[str, str] = {}
+        self.lifecycle = ServiceLifecycle(warmup=self._warmup, shutdown=self._shutdown)
+
+    def register(self, config: ServiceConfig):
+        """Première clé API configurée: utilisée pour préchauffer le pool"""
+        if not self.api_key and config.api_key:
+            self.api_key = config.api_key
+            self.connect_timeout = min(config.timeouts[0], 3.0)
+
+    def snapshot_owner(self, name: str, service: str) -> bool:
+        """
+        État partagé du process (circuit breaker): snapshoté par un seul service, le premier
+        qui le réclame (en gateway, plusieurs snapshots se l'écraseraient à la restauration)
+        """
+        return self._snapshot_owners.setdefault(name, service) == service
+
+    @property
+    def batcher(self) -> Optional[MicroBatcher]:
+        # Un seul ordonnanceur: les lots regroupent les requêtes de tous les services.
+        # Opt-in: la fenêtre de regroupement ajoute de la latence
+        if not self._batcher_checked:
+            self._batcher_checked = True
+            if os.getenv("MICRO_BATCH_ENABLED", "0") == "1":
+                self._batcher = MicroBatcher.from_env()
+        return self._batcher
+
+    async def _warmup(self):
+        runtime_monitor.start()
+        # SIGTERM: drain des générations en cours avant l'arrêt d'uvicorn
+        drain.install_signal_handler()
+        return await prewarm(self.api_key, self.connect_timeout)
+
+    async def _shutdown(self):
+        await runtime_monitor.stop()
+        await close_upstream_pool()
+        await asyncio.to_thread(usage_ledger.flush)
+        access_log.close()
+
+resources = SharedResources()
+
+def _add_middlewares(app: FastAPI, config: ServiceConfig, app_name: str):
+    # Au plus près de l'app: les 413 reçoivent aussi les headers CORS
+    app.add_middleware(BodySizeLimitMiddleware, limits=config.body_limits)
+    # Idem pour les 503 de l'arrêt progressif
+    app.add_middleware(DrainMiddleware)
+    app.add_middleware(DeadlineMiddleware)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=config.allowed_origins,
+        allow_credentials=False,
+        allow_methods=["POST", "GET", "OPTIONS"],
+        allow_headers=CORS_HEADERS,
+        expose_headers=["X-Request-ID", REPLAYED_HEADER]
+    )
+    app.add_middleware(CompressionMiddleware)
+    app.add_middleware(AccessLogMiddleware, service_name=app_name)
+    app.add_middleware(RequestTracingMiddleware, service_name=app_name)
+    app.add_middleware(RuntimeMiddleware)
+
+async def _run_idempotent(store: IdempotencyStore, key: Optional[str], payload: BaseModel, http_request: Request,
+                          response: Response, compute):
+    """
+    Calcul dédoublonné par Idempotency-Key (sans clé: exécution directe)
+    Clé propre à l'Origin vue par le serveur (pas au project_id, choisi par le client);
+    même clé avec un autre payload: 422, avec ou sans projet
+    """
+    key = IdempotencyStore.validate_key(key)
+    if key is None:
+        return await compute()
+    payload_fingerprint = fingerprint(payload.model_dump_json())
+    scope = http_request.headers.get("origin", "")
+    result, outcome = await store.run(key, payload_fingerprint, compute, scope=scope)
+    if outcome != "executed":
+        response.headers[REPLAYED_HEADER] = "true"
+    return result
+
+def _json_response(result, response: Response) -> Response:
+    """
+    Réponse JSON encodée ici, dans le span serialization (le temps réel d'encodage;
+    laissé à FastAPI, il aurait lieu hors de tout span). Headers posés sur `response` conservés
+    """
+    if isinstance(result, Response):
+        return result
+    with span("serialization") as attributes:
+        encoded = JSONResponse(result)
+        if attributes is not None:
+            attributes["bytes"] = len(encoded.body)
+    encoded.headers.update(response.headers)
+    return encoded
+
+def _add_debug_routes(app: FastAPI, admin_key: str):
+    """/debug/runtime (lecture seule) et /debug/profile (protégé par ADMIN_KEY)"""
+    @app.get("/debug/runtime")
+    async def debug_runtime(samples: int = Query(60, ge=0, le=10000)):
+        """Lag de la boucle, requêtes en cours, pool upstream, RSS et pauses GC"""
+        return runtime_monitor.get_stats(last=samples)
+
+    @app.post("/debug/profile", response_class=PlainTextResponse)
+    async def debug_profile(
+        request: Request,
+        seconds: float = Query(5.0, gt=0, le=30),
+        interval_ms: float = Query(5.0, ge=1, le=100)
+    ):
+        """Profil par échantillonnage du thread de la boucle (piles repliées, flamegraph)"""
+        if not admin_key:
+            raise HTTPException(status_code=404, detail={"error": "PROFILER_DISABLED", "message": "ADMIN_KEY non configurée"})
+        if not hmac.compare_digest(request.headers.get("X-Admin-Key", ""), admin_key):
+            raise HTTPException(status_code=403, detail={"error": "FORBIDDEN", "message": "Clé admin invalide"})
+        # Échantillonné depuis un thread: la boucle continue de servir pendant le profil
+        profile = await asyncio.to_thread(runtime_monitor.profile, seconds, interval_ms, threading.get_ident())
+        if profile is None:
+            raise HTTPException(status_code=409, detail={"error": "PROFILE_IN_PROGRESS", "message": "Un profil est déjà en cours"})
+        return profile
+
+def _standalone_lifespan(lifecycle: ServiceLifecycle):
+    """Lifespan d'un service autonome: ressources partagées puis service"""
+    @asynccontextmanager
+    async def lifespan(app):
+        async with resources.lifecycle.lifespan(app), lifecycle.lifespan(app):
+            yield
+    return lifespan
+
+async def _ensure_ready(lifecycle: ServiceLifecycle) -> bool:
+    shared_ready = await resources.lifecycle.ensure_ready()
+    return await lifecycle.ensure_ready() and shared_ready
+
+def _health(payload: dict):
+    """/healthz: 503 pendant l'arrêt progressif (le load balancer retire l'instance)"""
+    if drain.draining:
+        return JSONResponse(status_code=503, content={**payload, "ready": False, "draining": True})
+    return payload
+
+def _chat_tools(retriever: Optional[Retriever]) -> ToolRegistry:
+    """
+    Outils proposés par un service de chat (server_tools), en plus du registre global
+    - current_time: date et heure courantes (le modèle ne les connaît pas)
+    - search_docs: recherche dans l'index de documentation du service (si RETRIEVAL_INDEX)
+    """
+    tools = ToolRegistry(parent=tool_registry)
+
+    @tools.tool(timeout=1, parameters={
+        "type": "object",
+        "properties": {"timezone": {"type": "string", "description": "Fuseau IANA, ex: America/Montreal"}}
+    })
+    async def current_time(timezone: str = "UTC"):
+        """Date et heure courantes dans un fuseau horaire (UTC par défaut)"""
+        now = datetime.now(ZoneInfo(timezone))
+        return {"datetime": now.isoformat(timespec="seconds"), "weekday": now.strftime("%A"), "timezone": timezone}
+
+    if retriever is not None:
+        @tools.tool(timeout=2, parameters={
+            "type": "object",
+            "properties": {"query": {"type": "string", "description": "Question ou mots-clés"}},
+            "required": ["query"]
+        })
+        async def search_docs(query: str):
+            """Recherche dans la documentation du service; retourne les extraits les plus pertinents"""
+            return {"results": retriever.search(query)}
+
+    return tools
+
+def create_chat_app(config: ServiceConfig, speculation: bool = False) -> FastAPI:
+    """
+    Service de chat (coach, vidéo)
+    speculation: préchargement des relances (coach), désactivable par SPECULATION_ENABLED=0
+    """
+    app_name = config.app_name
+    api_key, model = config.api_key, config.model
+    allowed_origins = config.allowed_origins
+    connect_timeout, read_timeout = config.timeouts
+    version = config.get("APP_VERSION", "v2-resilient")
+    resources.register(config)
+    batcher = resources.batcher
+    # Métriques et politique de modèle propres au service (labels distincts en gateway)
+    chat_metrics = ChatMetrics()
+    policy = ModelPolicy.from_env(getenv=config.get)
+    speculator = (
+        SpeculativeCache.from_env(getenv=config.get)
+        if speculation and config.get("SPECULATION_ENABLED", "1") == "1" else None
+    )
+    snapshot_sources = {"metrics": chat_metrics, "model_policy": policy}
+    if resources.snapshot_owner("circuit_breaker", app_name):
+        snapshot_sources["circuit_breaker"] = circuit_breaker
+    snapshotter = StateSnapshotter.from_env(snapshot_sources, getenv=config.get)
+
+    idempotency = IdempotencyStore.from_env(getenv=config.get)
+    # Index de documentation du service (COACH_RETRIEVAL_INDEX en gateway), absent par défaut
+    retriever = Retriever.from_env(getenv=config.get)
+    tools = _chat_tools(retriever)
+    ws_sessions = ChatSessions(
+        idle_timeout=float(config.get("WS_IDLE_TIMEOUT", "300")),
+        delta_interval=float(config.get("WS_DELTA_INTERVAL", "0.02")),
+        max_sessions=int(config.get("WS_MAX_SESSIONS", "500"))
+    )
+
+    async def warmup():
+        report = {"snapshot": snapshotter.restore()}
+        snapshotter.start()
+        return report
+
+    async def shutdown():
+        # Tours WebSocket annulés avant le snapshot final (métriques à jour)
+        await ws_sessions.close_all("shutdown")
+        await snapshotter.stop()
+        if retriever is not None:
+            retriever.close()
+
+    lifecycle = ServiceLifecycle(warmup=warmup, shutdown=shutdown)
+    app = FastAPI(title=app_name, version=version, lifespan=_standalone_lifespan(lifecycle))
+    _add_middlewares(app, config, app_name)
+    _add_debug_routes(app, config.get("ADMIN_KEY", ""))
+
+    def get_stats() -> dict:
+        stats = {**chat_metrics.get_stats(), "access_log": access_log.get_stats(), "model_policy": policy.get_stats(),
+                 "snapshot": snapshotter.get_stats(), "websocket": ws_sessions.get_stats(),
+                 "upstream_governor": upstream_governor.get_stats(), "idempotency": idempotency.get_stats(),
+                 "drain": drain.get_stats()}
+        if speculator is not None:
+            stats["speculation"] = speculator.get_stats()
+        if batcher is not None:
+            stats["micro_batch"] = batcher.get_stats()
+        if retriever is not None:
+            stats["retrieval"] = retriever.get_stats()
+        return stats
+
+    app.state.service_name = app_name
+    app.state.lifecycle = lifecycle
+    app.state.get_stats = get_stats
+
+    @app.get("/__version")
+    async def version_info():
+        # Profil serveur effectif (workers, boucle, pools, limites): vérifiable après un déploiement
+        return {"service": app_name, "version": version, "model": model, "server": current_profile()}
+
+    @app.get("/healthz")
+    async def healthz():
+        # Prêt uniquement une fois le warm-up terminé (pool ouvert, validateurs chauds)
+        ready = await _ensure_ready(lifecycle)
+        return _health({
+            "ok": True,
+            "ready": ready,
+            "service": app_name,
+            "has_openai_key": bool(api_key),
+            "model": model,
+            "allowed_origins": allowed_origins
+        })
+
+    @app.get("/metrics")
+    async def get_metrics():
+        """Endpoint pour monitoring/observabilité"""
+        return get_stats()
+
+    @app.get("/usage")
+    async def get_usage(
+        window: int = Query(86400, ge=60, le=90 * 86400),
+        project_id: Optional[str] = None,
+        session_id: Optional[str] = None,
+        model: Optional[str] = None,
+        group_by: str = "project_id,model",
+        interval: Optional[int] = Query(None, ge=60)
+    ):
+        """Usage agrégé (tokens + coût estimé) sur une fenêtre temporelle"""
+        rows = await asyncio.to_thread(
+            usage_ledger.query,
+            since=time.time() - window,
+            project_id=project_id,
+            session_id=session_id,
+            model=model,
+            group_by=tuple(f.strip() for f in group_by.split(",") if f.strip()),
+            interval=interval
+        )
+        return {"window_seconds": window, "usage": rows, **usage_ledger.get_stats()}
+
+    @app.post("/api/chat")
+    async def chat(
+        http_request: Request,
+        response: Response,
+        request: ChatRequest = Depends(parse_chat_request),
+        idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER)
+    ):
+        """Endpoint chat avec retry automatique, circuit breaker et validation"""
+        compute = partial(
+            handle_chat_request,
+            request=request,
+            api_key=api_key,
+            default_model=model,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            speculator=speculator,
+            batcher=batcher,
+            policy=policy,
+            chat_metrics=chat_metrics,
+            retriever=retriever,
+            tools=tools
+        )
+        result = await _run_idempotent(idempotency, idempotency_key, request, http_request, response, compute)
+        return _json_response(result, response)
+
+    @app.websocket("/ws/chat")
+    async def ws_chat(websocket: WebSocket):
+        """Chat en session persistante: nouveaux messages seulement, réponse streamée"""
+        await serve_chat_websocket(
+            websocket,
+            ws_sessions,
+            allowed_origins=allowed_origins,
+            api_key=api_key,
+            default_model=model,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            policy=policy,
+            chat_metrics=chat_metrics,
+            retriever=retriever,
+            tools=tools
+        )
+
+    return app
+
+class BuildBody(BaseModel):
+    title: str
+    instructions: str
+    # Alternatives générées en un seul appel upstream (paramètre n: prompt envoyé et facturé une fois)
+    variants: int = Field(1, ge=1, le=MAX_BUILD_VARIANTS)
+
+class VariantCache:
+    """
+    Variantes récentes du website builder, servies une à une par id (GET /build/variants/{id})
+    Immuables: le navigateur les garde en cache, passer de l'une à l'autre ne coûte aucun aller-retour
+    """
+    def __init__(self, ttl: float = 3600, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls, getenv=os.getenv) -> "VariantCache":
+        """Construit le cache depuis BUILD_VARIANT_TTL / BUILD_VARIANT_CACHE"""
+        return cls(
+            ttl=float(getenv("BUILD_VARIANT_TTL", "3600")),
+            max_entries=int(getenv("BUILD_VARIANT_CACHE", "256"))
+        )
+
+    def put(self, variant: dict) -> str:
+        variant_id = uuid.uuid4().hex
+        self._entries[variant_id] = {"id": variant_id, **variant, "created": time.monotonic()}
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return variant_id
+
+    def get(self, variant_id: str) -> Optional[dict]:
+        variant = self._entries.get(variant_id)
+        if variant is None or time.monotonic() - variant["created"] > self.ttl:
+            self._entries.pop(variant_id, None)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {k: v for k, v in variant.items() if k != "created"}
+
+    def get_stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "ttl_seconds": self.ttl}
+
+def build_prompt(title, instructions):
+    return [
+        {"role":"system","content":"Tu es un assistant qui génère du HTML5 propre, sans <script>, responsive et accessible (labels, alt)."},
+        {"role":"user","content": f"Génère une page intitulée '{title}'. Consignes :\n{instructions}\n\nRetourne UNIQUEMENT le HTML final."}
+    ]
+
+def builder_index_html(version: str) -> str:
+    """Page d'accueil du website builder (shared/static/builder_index.html)"""
+    return (STATIC_DIR / "builder_index.html").read_text(encoding="utf-8").replace("__VERSION__", version)
+
+def create_builder_app(config: ServiceConfig, version: str = "om-website-builder-v1") -> FastAPI:
+    """Website builder: page d'accueil précompressée + génération HTML (/build)"""
+    app_name = config.app_name
+    api_key, model = config.api_key, config.model
+    allowed_origins = config.allowed_origins
+    connect_timeout, read_timeout = config.timeouts
+    resources.register(config)
+    policy = ModelPolicy.from_env(getenv=config.get)
+    snapshotter = StateSnapshotter.from_env({"model_policy": policy}, getenv=config.get)
+    idempotency = IdempotencyStore.from_env(getenv=config.get)
+    # Sortie du modèle toujours nettoyée (balises actives, clôtures markdown); minifiée par défaut
+    minify = config.get("BUILD_MINIFY", "1") == "1"
+    sanitized: Counter = Counter()
+    variant_cache = VariantCache.from_env(getenv=config.get)
+    # Tokens du prompt comptés une fois par appel, quel que soit le nombre de variantes
+    build_stats: Counter = Counter()
+    # Page d'accueil compressée une seule fois au démarrage (ETag fort + Cache-Control)
+    index_asset = PrecompressedAsset(builder_index_html(version), "text/html; charset=utf-8")
+
+    async def warmup():
+        report = {"snapshot": snapshotter.restore()}
+        snapshotter.start()
+        BuildBody.model_validate({"title": "warmup", "instructions": "warmup"})
+        return report
+
+    lifecycle = ServiceLifecycle(warmup=warmup, shutdown=snapshotter.stop)
+    app = FastAPI(lifespan=_standalone_lifespan(lifecycle))
+    _add_middlewares(app, config, app_name)
+    _add_debug_routes(app, config.get("ADMIN_KEY", ""))
+
+    def get_stats() -> dict:
+        return {"model_policy": policy.get_stats(), "snapshot": snapshotter.get_stats(), "idempotency": idempotency.get_stats(),
+                "html_sanitizer": {"minify": minify, **sanitized}, "build": dict(build_stats),
+                "variants": variant_cache.get_stats(), "drain": drain.get_stats()}
+
+    app.state.service_name = app_name
+    app.state.lifecycle = lifecycle
+    app.state.get_stats = get_stats
+
+    @app.get("/", response_class=HTMLResponse)
+    async def home(request: Request):
+        return index_asset.response(request.headers)
+
+    @app.get("/__version")
+    async def version_info():
+        # Profil serveur effectif (workers, boucle, pools, limites): vérifiable après un déploiement
+        return {"service": app_name, "version": version, "model": model, "server": current_profile()}
+
+    @app.get("/healthz")
+    async def healthz():
+        ready = await _ensure_ready(lifecycle)
+        return _health({"ok": True, "ready": ready, "has_openai_key": bool(api_key), "model": model, "allowed": allowed_origins})
+
+    @app.get("/metrics")
+    async def get_metrics():
+        return get_stats()
+
+    @app.post("/build")
+    async def build_page(
+        http_request: Request,
+        response: Response,
+        body: BuildBody = Body(...),
+        idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER)
+    ):
+        if not api_key:
+            raise HTTPException(status_code=500, detail="Missing OPENAI_API_KEY")
+
+        async def generate():
+            import httpx  # chargé au premier /build (hors chemin d'import du service)
+            headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+            if current_request_id():
+                headers[REQUEST_ID_HEADER] = current_request_id()
+            chosen, downgrade = policy.choose(model)
+            if downgrade:
+                annotate(model_downgrade=f"{model}->{chosen}:{downgrade}")
+            payload = {"model": chosen, "messages": build_prompt(body.title, body.instructions)}
+            if body.variants > 1:
+                payload["n"] = body.variants
+            timeout = httpx.Timeout(connect=connect_timeout, read=read_timeout, write=read_timeout, pool=connect_timeout)
+            # Même quota OpenAI que les services de chat: attente en file plutôt qu'un 429
+            quota_ticket = await upstream_governor.acquire(estimate_tokens(payload["messages"]), api_key)
+            try:
+                upstream_start = time.time()
+                with span("upstream.call", model=chosen), policy.track(chosen):
+                    try:
+                        r = await post_upstream(OPENAI_CHAT_URL, headers, payload, timeout)
+                    except httpx.TimeoutException:
+                        policy.observe(chosen, time.time() - upstream_start)
+                        raise
+                upstream_seconds = time.time() - upstream_start
+                upstream_governor.observe(r.headers, r.status_code, quota_ticket)
+                annotate(upstream_seconds=upstream_seconds, upstream_attempts=1)
+                if r.status_code >= 400:
+                    policy.observe(chosen, upstream_seconds)
+                    annotate(error="UPSTREAM_ERROR")
+                    return JSONResponse(status_code=r.status_code, content={"error":"UPSTREAM_ERROR","status":r.status_code,"body":r.text})
+                d = r.json()
+                pages, removed = [], Counter()
+                for choice in sorted(d.get("choices") or [{}], key=lambda c: c.get("index", 0)):
+                    sanitizer = HTMLSanitizer(minify=minify)
+                    html = sanitizer.process(choice.get("message", {}).get("content", ""))
+                    pages.append((html + sanitizer.flush()).strip())
+                    removed.update(pages=1, **sanitizer.get_stats())
+                sanitized.update(removed)
+                usage = d.get("usage", {})
+                policy.observe(chosen, upstream_seconds, usage.get("completion_tokens"))
+                build_stats.update(
+                    requests=1, variants=len(pages), prompt_tokens=usage.get("prompt_tokens", 0),
+                    completion_tokens=usage.get("completion_tokens", 0),
+                    prompt_tokens_saved=usage.get("prompt_tokens", 0) * (len(pages) - 1)
+                )
+                annotate(model=d.get("model"), tokens=usage.get("total_tokens"), variants=len(pages),
+                         html_removed_tags=removed["removed_tags"], html_removed_attributes=removed["removed_attributes"])
+                result = {"html": pages[0], "model": d.get("model")}
+                if body.variants > 1:
+                    result["variants"] = [
+                        {"id": variant_cache.put({"html": html, "model": d.get("model"), "index": i}), "html": html}
+                        for i, html in enumerate(pages)
+                    ]
+                if downgrade:
+                    result.update(requested_model=model, model_downgrade=downgrade)
+                return result
+            except Exception as e:
+                annotate(error="OPENAI_FAIL")
+                return JSONResponse(status_code=502, content={"error":"OPENAI_FAIL","detail": str(e)})
+
+        return await _run_idempotent(idempotency, idempotency_key, body, http_request, response, generate)
+
+    @app.get("/build/variants/{variant_id}")
+    async def build_variant(variant_id: str):
+        """Une variante d'un /build récent (immuable: mise en cache par le navigateur)"""
+        variant = variant_cache.get(variant_id)
+        if variant is None:
+            raise HTTPException(status_code=404, detail={"error": "VARIANT_NOT_FOUND", "message": "Variante inconnue ou expirée"})
+        return JSONResponse(variant, headers={"Cache-Control": f"private, max-age={int(variant_cache.ttl)}, immutable"})
+
+    return app
+
+def parse_gateway_hosts(raw: str) -> Dict[str, str]:
+    """Parse "coach.onlymatt.ca=coach,video.onlymatt.ca=video" en {host: service}"""
+    hosts = {}
+    for item in raw.split(","):
+        if "=" in item:
+            host, service = (part.strip() for part in item.split("=", 1))
+            if host and service:
+                hosts[host] = service
+    return hosts
+
+def create_gateway_app(
+    services: Dict[str, FastAPI],
+    hosts: Optional[Dict[str, str]] = None,
+    name: str = "hey-hi-gateway-onlymatt"
+) -> FastAPI:
+    """
+    Monte plusieurs services dans un seul process
+    - /<service>/... : routage par préfixe de chemin (toujours actif)
+    - hosts {host: service}: une requête sur ce Host est servie à la racine par le service
+    Les lifespans des sous-apps ne sont pas exécutés par Starlette: la gateway les enchaîne
+    """
+    hosts = hosts or {}
+    unknown = set(hosts.values()) - set(services)
+    if unknown:
+        raise ValueError(f"Service(s) inconnu(s) dans GATEWAY_HOSTS: {', '.join(sorted(unknown))}")
+
+    @asynccontextmanager
+    async def lifespan(app):
+        async with AsyncExitStack() as stack:
+            await stack.enter_async_context(resources.lifecycle.lifespan(app))
+            for service in services.values():
+                await stack.enter_async_context(service.state.lifecycle.lifespan(service))
+            yield
+
+    app = FastAPI(title=name, lifespan=lifespan)
+    # Routes Host en premier: sur un domaine de service, /healthz est celui du service
+    for host, service in hosts.items():
+        app.host(host, services[service])
+
+    _add_debug_routes(app, os.getenv("ADMIN_KEY", ""))
+
+    @app.get("/healthz")
+    async def healthz():
+        ready = {key: await _ensure_ready(service.state.lifecycle) for key, service in services.items()}
+        return _health({"ok": True, "ready": all(ready.values()), "service": name, "services": ready})
+
+    @app.get("/metrics")
+    async def get_metrics():
+        """Métriques de chaque service (label = clé du service) + pool partagé"""
+        return {
+            "services": {key: service.state.get_stats() for key, service in services.items()},
+            "shared": {
+                "lifecycle": resources.lifecycle.get_stats(),
+                "drain": drain.get_stats(),
+                "access_log": access_log.get_stats(),
+                "upstream_governor": upstream_governor.get_stats()
+            }
+        }
+
+    for key, service in services.items():
+        app.mount(f"/{key}", service)
+    return app
@@ -0,0 +1,186 @@
+"""
+Snapshots de l'état appris en mémoire et redémarrage à chaud
+- Métriques, circuit breaker, EWMA de latence... exportés périodiquement
+- Fichier compact: en-tête binaire (struct) + payload msgpack (JSON si absent)
+- Écriture atomique (fichier temporaire unique + fsync + os.replace), CRC32 vérifié
+- Restauré au démarrage: format inconnu ou fichier corrompu = démarrage à froid
+"""
+import os
+import copy
+import json
+import time
+import zlib
+import struct
+import asyncio
+import tempfile
+import contextlib
+from typing import Any, Dict, Optional
+
+try:
+    import msgpack
+except ImportError:  # dépendance optionnelle
+    msgpack = None
+
+SNAPSHOT_MAGIC = b"HHSS"
+SNAPSHOT_VERSION = 1
+# magic, version, codec, horodatage, taille du payload, crc32 du payload
+_HEADER = struct.Struct("<4sHBdII")
+CODEC_JSON = 0
+CODEC_MSGPACK = 1
+
+def encode_snapshot(state: Dict[str, Any], created_at: Optional[float] = None) -> bytes:
+    """Sérialise l'état avec son en-tête"""
+    if msgpack is not None:
+        codec, payload = CODEC_MSGPACK, msgpack.packb(state, use_bin_type=True)
+    else:
+        codec, payload = CODEC_JSON, json.dumps(state, separators=(",", ":")).encode("utf-8")
+    created_at = time.time() if created_at is None else created_at
+    header = _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, codec, created_at, len(payload), zlib.crc32(payload))
+    return header + payload
+
+def decode_snapshot(data: bytes) -> tuple[float, Dict[str, Any]]:
+    """Retourne (horodatage, état); ValueError si le fichier est inexploitable"""
+    if len(data) < _HEADER.size:
+        raise ValueError("snapshot tronqué")
+    magic, version, codec, created_at, size, crc = _HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("format inconnu")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"version {version} non supportée (attendue {SNAPSHOT_VERSION})")
+    payload = data[_HEADER.size:_HEADER.size + size]
+    if len(payload) != size or zlib.crc32(payload) != crc:
+        raise ValueError("snapshot corrompu (crc)")
+    if codec == CODEC_MSGPACK:
+        if msgpack is None:
+            raise ValueError("snapshot msgpack mais msgpack non installé")
+        state = msgpack.unpackb(payload, raw=False, strict_map_key=False)
+    elif codec == CODEC_JSON:
+        state = json.loads(payload)
+    else:
+        raise ValueError(f"codec {codec} inconnu")
+    return created_at, state
+
+class StateSnapshotter:
+    """
+    Snapshot périodique d'objets exposant export_state() / restore_state(state)
+    path vide = désactivé (aucun fichier lu ni écrit)
+    """
+    def __init__(self, path: str, sources: Dict[str, Any], interval: float = 30.0):
+        self.path = path
+        self.sources = sources
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.writes = 0
+        self.last_write_at: Optional[float] = None
+        self.last_size = 0
+        self.last_error: Optional[str] = None
+        self.restore_report: Dict[str, Any] = {}
+
+    @classmethod
+    def from_env(cls, sources: Dict[str, Any], getenv=os.getenv) -> "StateSnapshotter":
+        """Construit le snapshotter depuis STATE_SNAPSHOT_PATH / STATE_SNAPSHOT_INTERVAL"""
+        return cls(
+            getenv("STATE_SNAPSHOT_PATH", ""),
+            sources,
+            interval=float(getenv("STATE_SNAPSHOT_INTERVAL", "30"))
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def collect(self) -> Dict[str, Any]:
+        """
+        Exporte l'état de chaque source, copié sur la boucle: export_state() peut renvoyer
+        des dicts vivants, que le thread d'écriture ne doit pas parcourir pendant leur mise à jour
+        """
+        return copy.deepcopy({name: source.export_state() for name, source in self.sources.items()})
+
+    def write(self, state: Optional[Dict[str, Any]] = None) -> int:
+        """Écrit le snapshot de façon atomique; retourne sa taille en octets"""
+        data = encode_snapshot(self.collect() if state is None else state)
+        # Nom temporaire unique: workers ou process partageant le chemin n'écrivent jamais le même fichier
+        directory, name = os.path.split(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+            raise
+        self.writes += 1
+        self.last_write_at = time.time()
+        self.last_size = len(data)
+        return len(data)
+
+    def restore(self) -> Dict[str, Any]:
+        """Recharge le dernier snapshot; les sources en échec restent à froid"""
+        if not self.enabled:
+            self.restore_report = {"enabled": False}
+            return self.restore_report
+        started = time.perf_counter()
+        report: Dict[str, Any] = {"enabled": True, "restored": [], "skipped": {}}
+        try:
+            with open(self.path, "rb") as f:
+                created_at, state = decode_snapshot(f.read())
+        except FileNotFoundError:
+            report["error"] = "absent"
+        except (OSError, ValueError) as e:
+            report["error"] = str(e)
+        else:
+            report["age_seconds"] = round(time.time() - created_at, 3)
+            for name, source in self.sources.items():
+                if name not in state:
+                    continue
+                try:
+                    source.restore_state(state[name])
+                    report["restored"].append(name)
+                except Exception as e:
+                    report["skipped"][name] = str(e) or type(e).__name__
+        report["restore_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        self.restore_report = report
+        return report
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.snapshot()
+
+    async def snapshot(self):
+        """Collecte sur la boucle, sérialisation + écriture disque dans un thread"""
+        try:
+            await asyncio.to_thread(self.write, self.collect())
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e) or type(e).__name__
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        """Arrête la boucle et écrit un dernier snapshot (arrêt propre)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.enabled:
+            await self.snapshot()
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "codec": "msgpack" if msgpack is not None else "json",
+            "writes": self.writes,
+            "last_write_at": self.last_write_at,
+            "last_size_bytes": self.last_size,
+            "last_error": self.last_error,
+            "restore": self.restore_report
+        }
@@ -0,0 +1,208 @@
+"""
+Préchargement spéculatif des relances suggérées (sessions coach)
+- Après une réponse, les top-K relances affichées en boutons sont générées en
+  tâche de fond, à basse priorité, et stockées dans un cache par session
+- Un clic sur une relance est servi depuis le cache (attente de la génération
+  en cours si elle n'est pas terminée)
+- Plafonné par un budget de tokens, annulé dès que l'utilisateur envoie autre chose
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import contextvars
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Génère une réponse: (messages, max_tokens) -> résultat upstream (None = inutilisable)
+Generator = Callable[[List[Dict[str, str]], int], Awaitable[Optional[Dict[str, Any]]]]
+
+def _estimate_tokens(messages: List[Dict[str, str]]) -> int:
+    """Estimation grossière (~4 caractères par token)"""
+    return sum(len(m.get("content") or "") for m in messages) // 4 + 4 * len(messages)
+
+class _Speculation:
+    __slots__ = ("task", "created")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.created = time.time()
+
+class SpeculativeCache:
+    """
+    Cache spéculatif par session (LRU sur les sessions, TTL sur les entrées)
+    Le budget de tokens est une enveloppe glissante réinitialisée chaque fenêtre
+    """
+    def __init__(
+        self,
+        top_k: int = 3,
+        max_tokens: int = 400,
+        token_budget: int = 50000,
+        budget_window: int = 3600,
+        ttl: int = 600,
+        max_sessions: int = 1000,
+        concurrency: int = 2,
+        delay: float = 0.05
+    ):
+        self.top_k = top_k
+        self.max_tokens = max_tokens
+        self.token_budget = token_budget
+        self.budget_window = budget_window
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.concurrency = concurrency
+        self.delay = delay
+        self._sessions: "OrderedDict[str, Dict[str, _Speculation]]" = OrderedDict()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._window_start = time.time()
+        self._window_tokens = 0
+        self.scheduled = 0
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.skipped_budget = 0
+        self.tokens_spent = 0
+
+    @classmethod
+    def from_env(cls, getenv=os.getenv) -> "SpeculativeCache":
+        """Construit le cache depuis les variables SPECULATION_*"""
+        return cls(
+            top_k=int(getenv("SPECULATION_TOP_K", "3")),
+            max_tokens=int(getenv("SPECULATION_MAX_TOKENS", "400")),
+            token_budget=int(getenv("SPECULATION_TOKEN_BUDGET", "50000")),
+            budget_window=int(getenv("SPECULATION_BUDGET_WINDOW", "3600")),
+            ttl=int(getenv("SPECULATION_TTL", "600"))
+        )
+
+    @staticmethod
+    def key(messages: List[Dict[str, str]], params: Tuple = ()) -> str:
+        """Empreinte d'une conversation (espaces de bord ignorés) et de ses paramètres"""
+        normalized = [(m.get("role"), (m.get("content") or "").strip()) for m in messages]
+        raw = json.dumps([list(params), normalized], ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _roll_window(self):
+        now = time.time()
+        if now - self._window_start >= self.budget_window:
+            self._window_start = now
+            self._window_tokens = 0
+
+    def _cancel(self, entries: Dict[str, _Speculation]):
+        for spec in entries.values():
+            if not spec.task.done():
+                spec.task.cancel()
+                self.cancelled += 1
+
+    def cancel_session(self, session_id: str):
+        """Annule toutes les spéculations d'une session"""
+        entries = self._sessions.pop(session_id, None)
+        if entries:
+            self._cancel(entries)
+
+    async def lookup(self, session_id: str, messages: List[Dict[str, str]], params: Tuple = ()) -> Optional[Dict[str, Any]]:
+        """
+        Retourne la réponse spéculée si la requête correspond à une relance prévue
+        Toute autre requête annule les spéculations en cours de la session
+        """
+        entries = self._sessions.pop(session_id, None)
+        if not entries:
+            return None
+        spec = entries.pop(self.key(messages, params), None)
+        # La conversation avance: les autres relances ne serviront plus
+        self._cancel(entries)
+        if spec is None or time.time() - spec.created > self.ttl:
+            if spec is not None:
+                self._cancel({"expired": spec})
+            self.misses += 1
+            return None
+        try:
+            result = await asyncio.shield(spec.task)
+        except asyncio.CancelledError:
+            if not spec.task.cancelled():
+                raise  # c'est la requête elle-même qui est annulée
+            result = None
+        except Exception:
+            result = None
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def schedule(
+        self,
+        session_id: str,
+        messages: List[Dict[str, str]],
+        answer: str,
+        followups: List[str],
+        generate: Generator,
+        params: Tuple = ()
+    ) -> int:
+        """Lance la génération des top-K relances, dans la limite du budget. Retourne le nombre lancé"""
+        self.cancel_session(session_id)
+        self._roll_window()
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or getattr(self._semaphore, "_loop", None) not in (None, loop):
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        base = list(messages) + [{"role": "assistant", "content": answer}]
+        entries: Dict[str, _Speculation] = {}
+        for followup in followups[:self.top_k]:
+            spec_messages = base + [{"role": "user", "content": followup}]
+            reserved = self.max_tokens + _estimate_tokens(spec_messages)
+            if self._window_tokens + reserved > self.token_budget:
+                self.skipped_budget += 1
+                continue
+            self._window_tokens += reserved
+            # Contexte vide: la génération de fond n'hérite pas de la trace de la requête
+            task = loop.create_task(
+                self._run(generate, spec_messages, reserved),
+                context=contextvars.Context()
+            )
+            entries[self.key(spec_messages, params)] = _Speculation(task)
+        if entries:
+            self._sessions[session_id] = entries
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                _, evicted = self._sessions.popitem(last=False)
+                self._cancel(evicted)
+            self.scheduled += len(entries)
+        return len(entries)
+
+    async def _run(self, generate: Generator, messages: List[Dict[str, str]], reserved: int) -> Optional[Dict[str, Any]]:
+        try:
+            async with self._semaphore:
+                # Basse priorité: laisse d'abord passer le trafic interactif
+                await asyncio.sleep(self.delay)
+                result = await generate(messages, self.max_tokens)
+        except asyncio.CancelledError:
+            self._release(reserved)
+            raise
+        except Exception:
+            self.failed += 1
+            self._release(reserved)
+            return None
+        used = (result or {}).get("usage", {}).get("total_tokens", 0)
+        self._release(reserved - used)
+        self.tokens_spent += used
+        return result
+
+    def _release(self, tokens: int):
+        self._window_tokens = max(0, self._window_tokens - tokens)
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "sessions": len(self._sessions),
+            "scheduled": self.scheduled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups * 100, 2) if lookups else 0,
+            "cancelled": self.cancelled,
+            "failed": self.failed,
+            "skipped_budget": self.skipped_budget,
+            "tokens_spent": self.tokens_spent,
+            "window_tokens": self._window_tokens,
+            "token_budget": self.token_budget
+        }
@@ -0,0 +1,223 @@
+"""
+Traçage par requête pour corréler connecteur WordPress -> proxy -> OpenAI
+- X-Request-ID accepté (ou généré), renvoyé au client et propagé vers l'upstream
+- Spans: validation, attente, tentatives, backoff, appel upstream, sérialisation
+- Export JSON au format OTLP (compatible OpenTelemetry) avec échantillonnage
+"""
+import os
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+REQUEST_ID_HEADER = "X-Request-ID"
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+class Span:
+    """Span terminé (temps en nanosecondes epoch)"""
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "attributes")
+
+    def __init__(self, name: str, span_id: str, parent_id: Optional[str], start_ns: int, end_ns: int, attributes: dict):
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.start_ns = start_ns
+        self.end_ns = end_ns
+        self.attributes = attributes
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+class RequestTrace:
+    """
+    Contexte d'une requête: identifiant, spans (si échantillonnée) et annotations
+    Les annotations (retries, tokens, modèle...) sont toujours collectées
+    """
+    def __init__(self, request_id: str, sampled: bool = False):
+        self.request_id = request_id
+        self.trace_id = uuid.uuid4().hex
+        self.root_span_id = _new_span_id()
+        self.sampled = sampled
+        self.start_ns = time.time_ns()
+        self.spans: List[Span] = []
+        self.annotations: Dict[str, Any] = {}
+
+    def annotate(self, **values):
+        self.annotations.update(values)
+
+    def record_span(self, name: str, start_ns: int, end_ns: int, parent_id: Optional[str] = None, **attributes):
+        """Enregistre un span a posteriori (no-op si non échantillonnée)"""
+        if not self.sampled:
+            return
+        self.spans.append(Span(
+            name, _new_span_id(), parent_id or _current_span_id.get() or self.root_span_id,
+            start_ns, end_ns, attributes
+        ))
+
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("current_trace", default=None)
+_current_span_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_span_id", default=None)
+
+def _new_span_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+def current_trace() -> Optional[RequestTrace]:
+    """Trace de la requête en cours (None hors middleware)"""
+    return _current_trace.get()
+
+def current_request_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.request_id if trace else None
+
+def annotate(**values):
+    """Ajoute des annotations à la requête en cours (no-op hors requête)"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.annotations.update(values)
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Mesure un bloc comme span enfant du span courant
+    Coût quasi nul si la requête n'est pas échantillonnée
+    """
+    trace = _current_trace.get()
+    if trace is None or not trace.sampled:
+        yield None
+        return
+    span_id = _new_span_id()
+    parent_id = _current_span_id.get() or trace.root_span_id
+    token = _current_span_id.set(span_id)
+    start_ns = time.time_ns()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes["error"] = type(e).__name__
+        raise
+    finally:
+        _current_span_id.reset(token)
+        trace.spans.append(Span(name, span_id, parent_id, start_ns, time.time_ns(), attributes))
+
+@contextmanager
+def bind_trace(trace: Optional[RequestTrace]):
+    """Active une trace hors middleware (tâches de fond, WebSocket...)"""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _otlp_attributes(attributes: dict) -> list:
+    return [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items() if v is not None]
+
+def to_otlp(trace: RequestTrace, service_name: str) -> dict:
+    """Sérialise une trace au format OTLP/JSON (resourceSpans)"""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": service_name})},
+            "scopeSpans": [{
+                "scope": {"name": "hey-hi.tracing"},
+                "spans": [
+                    {
+                        "traceId": trace.trace_id,
+                        "spanId": s.span_id,
+                        "parentSpanId": s.parent_id or "",
+                        "name": s.name,
+                        "kind": 2 if s.span_id == trace.root_span_id else 1,
+                        "startTimeUnixNano": str(s.start_ns),
+                        "endTimeUnixNano": str(s.end_ns),
+                        "attributes": _otlp_attributes({"request_id": trace.request_id, **s.attributes})
+                    }
+                    for s in trace.spans
+                ]
+            }]
+        }]
+    }
+
+class JsonSpanExporter:
+    """
+    Exporte les traces en JSON lines (une ligne OTLP par requête)
+    Le fichier peut être ingéré par un collecteur OpenTelemetry (filelog/otlpjson)
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.exported = 0
+        self._lock = threading.Lock()
+
+    def export(self, payload: dict):
+        line = json.dumps(payload, separators=(",", ":")) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+            self.exported += 1
+
+class RequestTracingMiddleware:
+    """
+    Middleware ASGI: attribue/accepte X-Request-ID et collecte les spans
+    - TRACE_SAMPLE_RATE: part des requêtes tracées (défaut 0.01)
+    - TRACE_LOG_PATH: fichier JSON lines des spans (vide = export désactivé)
+    """
+    def __init__(self, app, service_name: str, exporter: Optional[JsonSpanExporter] = None, sample_rate: Optional[float] = None):
+        self.app = app
+        self.service_name = service_name
+        if exporter is None and os.getenv("TRACE_LOG_PATH"):
+            exporter = JsonSpanExporter(os.getenv("TRACE_LOG_PATH"))
+        self.exporter = exporter
+        self.sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", "0.01")) if sample_rate is None else sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                candidate = value.decode("latin-1")
+                if _REQUEST_ID_RE.match(candidate):
+                    request_id = candidate
+                break
+        request_id = request_id or uuid.uuid4().hex
+        sampled = self.exporter is not None and random.random() < self.sample_rate
+        trace = RequestTrace(request_id, sampled)
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span_id.set(trace.root_span_id)
+        status = {"code": 500}
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (b"x-request-id", request_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            _current_span_id.reset(span_token)
+            _current_trace.reset(trace_token)
+            if sampled:
+                trace.spans.append(Span(
+                    "http.request", trace.root_span_id, None, trace.start_ns, time.time_ns(),
+                    {"http.method": scope.get("method"), "http.route": scope.get("path"), "http.status_code": status["code"]}
+                ))
+                payload = to_otlp(trace, self.service_name)
+                # Réponse déjà envoyée: écriture disque hors event loop
+                await asyncio.get_running_loop().run_in_executor(None, self.exporter.export, payload)
@@ -0,0 +1,239 @@
+"""
+Régulation des appels sortants d'après les headers de quota OpenAI
+- Chaque réponse (200 comme 429) porte x-ratelimit-{limit,remaining,reset}-{requests,tokens}
+- Par clé API, deux seaux (requêtes, tokens) recalés sur ces headers et remplis linéairement
+  jusqu'à l'instant de reset annoncé
+- Avant l'envoi: réservation de 1 requête + tokens estimés (prompt + max_tokens);
+  quota insuffisant -> attente plutôt qu'un 429 suivi d'un backoff (une grosse requête
+  en attente ne retient pas les petites que le quota laisse passer)
+- Attente plus longue que GOVERNOR_MAX_WAIT ou que la deadline: 429 immédiat côté client
+"""
+import os
+import re
+import time
+import hashlib
+import asyncio
+from typing import Any, Dict, Optional
+from fastapi import HTTPException
+from .deadline import remaining_budget
+from .tracing import annotate, span
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """Durée au format OpenAI ("20ms", "1.5s", "6m0s", "1h2m3s") -> secondes"""
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _UNITS[unit] for amount, unit in parts)
+
+def estimate_tokens(messages, max_tokens: Optional[int] = None) -> int:
+    """Coût compté par OpenAI pour le quota: prompt estimé (~4 caractères/token) + max_tokens"""
+    chars = sum(len(m.get("content") or "") for m in messages)
+    return chars // 4 + 1 + (max_tokens or 0)
+
+class _Bucket:
+    """Quota d'une dimension (requêtes ou tokens) tel que connu au dernier header"""
+    __slots__ = ("limit", "base", "observed_at", "reset_at", "used", "reserved")
+
+    def __init__(self):
+        self.limit: Optional[int] = None
+        self.base: Optional[float] = None
+        self.observed_at = 0.0
+        self.reset_at = 0.0
+        self.used = 0.0
+        # Cumul des réservations (sert à dater les headers d'une réponse)
+        self.reserved = 0.0
+
+    def reserve(self, cost: float):
+        self.used += cost
+        self.reserved += cost
+
+    def observe(self, limit: Optional[int], remaining: Optional[int], reset: Optional[float],
+                at: float, reserved_before: float):
+        """
+        Headers valables à l'envoi de la requête (`at`): les réservations faites
+        depuis (`reserved` - `reserved_before`) ne sont pas encore comptées par l'upstream
+        """
+        if remaining is None:
+            return
+        self.limit = limit if limit is not None else self.limit
+        self.base = float(remaining)
+        self.observed_at = at
+        self.reset_at = at + (reset or 0.0)
+        self.used = self.reserved - reserved_before
+
+    def level(self, now: float) -> float:
+        """Quota disponible estimé (remplissage linéaire jusqu'au reset, moins les réservations)"""
+        if self.base is None:
+            return float("inf")
+        if now >= self.reset_at:
+            full = self.limit if self.limit is not None else float("inf")
+            return full - self.used
+        if self.limit is None or self.reset_at <= self.observed_at:
+            return self.base - self.used
+        progress = (now - self.observed_at) / (self.reset_at - self.observed_at)
+        return self.base + (self.limit - self.base) * progress - self.used
+
+    def wait_for(self, cost: float, now: float) -> float:
+        """Secondes à attendre pour disposer de `cost`"""
+        level = self.level(now)
+        if level >= cost or self.base is None:
+            return 0.0
+        if self.limit is None or self.limit <= self.base or cost > self.limit:
+            # Pas de vitesse de remplissage connue (ou coût > quota entier): attendre le reset
+            return max(0.0, self.reset_at - now)
+        rate = (self.limit - self.base) / max(self.reset_at - self.observed_at, 1e-6)
+        return min(max(0.0, self.reset_at - now), (cost - level) / rate) if now < self.reset_at else 0.0
+
+class _Quota:
+    """Seaux requêtes/tokens d'une clé API"""
+    __slots__ = ("requests", "tokens", "last_ticket")
+
+    def __init__(self):
+        self.requests = _Bucket()
+        self.tokens = _Bucket()
+        self.last_ticket = 0.0
+
+    def wait(self, tokens: int, now: float) -> float:
+        return max(self.requests.wait_for(1, now), self.tokens.wait_for(tokens, now))
+
+    def reserve(self, key: str, tokens: int) -> tuple:
+        """Réservation -> ticket (clé, instant d'envoi, cumuls après réservation) pour observe()"""
+        self.requests.reserve(1)
+        self.tokens.reserve(tokens)
+        return (key, time.monotonic(), self.requests.reserved, self.tokens.reserved)
+
+def _fingerprint(api_key: str) -> str:
+    """Identifiant du quota d'une clé, sans la clé elle-même (stats /metrics)"""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:8] if api_key else "default"
+
+class UpstreamGovernor:
+    """Quotas requêtes/tokens du process, un par clé API (partagé par les services qui l'utilisent)"""
+    def __init__(self, enabled: bool = True, max_wait: float = 30.0):
+        self.enabled = enabled
+        self.max_wait = max_wait
+        self._quotas: Dict[str, _Quota] = {}
+        self.paced = 0
+        self.rejected = 0
+        self.rate_limited = 0
+        self.total_wait = 0.0
+        self.max_observed_wait = 0.0
+
+    @classmethod
+    def from_env(cls) -> "UpstreamGovernor":
+        """Construit le régulateur depuis GOVERNOR_ENABLED / GOVERNOR_MAX_WAIT"""
+        return cls(
+            enabled=os.getenv("GOVERNOR_ENABLED", "1") == "1",
+            max_wait=float(os.getenv("GOVERNOR_MAX_WAIT", "30"))
+        )
+
+    def _quota(self, key: str) -> _Quota:
+        quota = self._quotas.get(key)
+        if quota is None:
+            quota = self._quotas[key] = _Quota()
+        return quota
+
+    async def acquire(self, tokens: int, api_key: str = "") -> Optional[tuple]:
+        """
+        Réserve 1 requête + `tokens` sur le quota de `api_key`; attend si le quota estimé
+        est insuffisant. Retourne le ticket
+        """
+        if not self.enabled:
+            return None
+        key = _fingerprint(api_key)
+        quota = self._quota(key)
+        started = time.monotonic()
+        # Attente calculée puis dormie sans rien retenir; le quota est revérifié au réveil
+        # (une autre requête a pu consommer ce qui s'est libéré entre-temps)
+        while True:
+            now = time.monotonic()
+            wait = quota.wait(tokens, now)
+            if wait <= 0:
+                break
+            budget = remaining_budget()
+            limit = self.max_wait - (now - started)
+            if budget is not None:
+                limit = min(limit, budget)
+            if wait > limit:
+                self.rejected += 1
+                annotate(error="UPSTREAM_RATE_LIMITED")
+                raise HTTPException(status_code=429, detail={
+                    "error": "UPSTREAM_RATE_LIMITED",
+                    "message": "Quota OpenAI épuisé, réessayer plus tard",
+                    "retry_after_seconds": round(wait, 3)
+                })
+            with span("queue_wait", seconds=round(wait, 3)):
+                await asyncio.sleep(wait)
+        ticket = quota.reserve(key, tokens)
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            self.paced += 1
+            self.total_wait += waited
+            self.max_observed_wait = max(self.max_observed_wait, waited)
+            annotate(queue_wait_seconds=round(waited, 3))
+        return ticket
+
+    def observe(self, headers, status_code: int = 200, ticket: Optional[tuple] = None):
+        """Recale les seaux sur les headers x-ratelimit-* de la réponse à la requête `ticket`"""
+        if status_code == 429:
+            self.rate_limited += 1
+        if not self.enabled or ticket is None:
+            return
+        key, sent_at, requests_reserved, tokens_reserved = ticket
+        quota = self._quota(key)
+        if requests_reserved < quota.last_ticket:
+            return  # réponse plus ancienne que la dernière prise en compte
+        quota.last_ticket = requests_reserved
+        applied = False
+        for name, bucket, reserved in (("requests", quota.requests, requests_reserved),
+                                       ("tokens", quota.tokens, tokens_reserved)):
+            remaining = _int(headers.get(f"x-ratelimit-remaining-{name}"))
+            applied |= remaining is not None
+            bucket.observe(
+                _int(headers.get(f"x-ratelimit-limit-{name}")),
+                remaining,
+                parse_reset(headers.get(f"x-ratelimit-reset-{name}")),
+                sent_at,
+                reserved
+            )
+        if status_code == 429 and not applied:
+            # 429 sans headers de quota: Retry-After seul
+            retry_after = parse_reset(headers.get("retry-after"))
+            if retry_after:
+                quota.requests.observe(None, 0, retry_after, time.monotonic(), requests_reserved)
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "enabled": self.enabled,
+            "paced_requests": self.paced,
+            "rejected_requests": self.rejected,
+            "upstream_429": self.rate_limited,
+            "total_wait_seconds": round(self.total_wait, 3),
+            "max_wait_seconds": round(self.max_observed_wait, 3),
+            # Par empreinte de clé API
+            "estimated_remaining": {
+                key: {
+                    name: (None if bucket.base is None else round(bucket.level(now), 1))
+                    for name, bucket in (("requests", quota.requests), ("tokens", quota.tokens))
+                }
+                for key, quota in self._quotas.items()
+            }
+        }
+
+def _int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(float(value)) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+# Instance globale: un quota par clé API, partagé par les services du process
+upstream_governor = UpstreamGovernor.from_env()
@@ -0,0 +1,290 @@
+"""
+Registre d'usage (tokens + coût estimé) par project_id / session_id / modèle
+- Agrégation en mémoire par tranche de temps
+- Flush par lots vers SQLite (hors event loop)
+- Budgets configurables appliqués avant l'appel upstream
+- Requêtes d'usage sur des fenêtres temporelles
+"""
+import os
+import time
+import sqlite3
+import asyncio
+import threading
+from typing import Dict, List, Optional, Tuple, Any
+
+# Prix estimés en USD par million de tokens: (prompt, completion)
+MODEL_PRICING = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+# Modèle inconnu: on estime au tarif élevé par prudence
+DEFAULT_PRICING = (2.50, 10.00)
+BUCKET_SECONDS = 60
+GROUP_BY_FIELDS = ("project_id", "session_id", "model")
+
+def estimate_cost(model: Optional[str], prompt_tokens: int, completion_tokens: int) -> float:
+    """Estime le coût en USD d'un appel (préfixe le plus long, ex: gpt-4o-mini-2024-07-18)"""
+    pricing = DEFAULT_PRICING
+    if model:
+        matches = [name for name in MODEL_PRICING if model.startswith(name)]
+        if matches:
+            pricing = MODEL_PRICING[max(matches, key=len)]
+    return (prompt_tokens * pricing[0] + completion_tokens * pricing[1]) / 1_000_000
+
+def parse_budgets(raw: str) -> Dict[str, float]:
+    """
+    Parse les budgets depuis l'environnement
+    Format: "projet_a=5,projet_b=12.5,*=50" (USD par fenêtre, "*" = défaut)
+    """
+    budgets = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        project, amount = item.split("=", 1)
+        if project.strip():
+            budgets[project.strip()] = float(amount)
+    return budgets
+
+class UsageLedger:
+    """
+    Registre d'usage en mémoire avec persistance SQLite par lots
+    Note: les budgets sont vérifiés sur l'état en mémoire (pas d'I/O sur le hot path)
+    """
+    def __init__(
+        self,
+        db_path: str = ":memory:",
+        flush_interval: float = 10.0,
+        batch_size: int = 100,
+        budgets: Optional[Dict[str, float]] = None,
+        budget_window: int = 86400
+    ):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.budgets = budgets or {}
+        self.budget_window = budget_window
+        # (bucket, project_id, session_id, model) -> [requests, prompt, completion, cost]
+        self._pending: Dict[Tuple[int, str, str, str], List[float]] = {}
+        # project_id -> {bucket: cost} sur la fenêtre de budget
+        self._spend: Dict[str, Dict[int, float]] = {}
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._flushing = False
+        self.last_flush = time.time()
+        self.flushed_rows = 0
+        self.rejected_requests = 0
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS usage ("
+            " bucket INTEGER NOT NULL,"
+            " project_id TEXT NOT NULL,"
+            " session_id TEXT NOT NULL,"
+            " model TEXT NOT NULL,"
+            " requests INTEGER NOT NULL,"
+            " prompt_tokens INTEGER NOT NULL,"
+            " completion_tokens INTEGER NOT NULL,"
+            " cost REAL NOT NULL,"
+            " PRIMARY KEY (bucket, project_id, session_id, model))"
+        )
+        self._conn.commit()
+        self._load_spend()
+
+    @classmethod
+    def from_env(cls) -> "UsageLedger":
+        """Construit le registre depuis les variables USAGE_*"""
+        return cls(
+            db_path=os.getenv("USAGE_DB_PATH", ":memory:"),
+            flush_interval=float(os.getenv("USAGE_FLUSH_INTERVAL", "10")),
+            batch_size=int(os.getenv("USAGE_FLUSH_BATCH", "100")),
+            budgets=parse_budgets(os.getenv("USAGE_BUDGETS", "")),
+            budget_window=int(os.getenv("USAGE_BUDGET_WINDOW", "86400"))
+        )
+
+    def _load_spend(self):
+        """Recharge les dépenses de la fenêtre courante depuis SQLite (redémarrage)"""
+        window_start = int(time.time()) - self.budget_window
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT project_id, bucket, SUM(cost) FROM usage"
+                " WHERE bucket >= ? GROUP BY project_id, bucket",
+                (window_start,)
+            ).fetchall()
+        for project_id, bucket, cost in rows:
+            self._spend.setdefault(project_id, {})[bucket] = cost
+
+    def record(
+        self,
+        project_id: Optional[str],
+        session_id: Optional[str],
+        model: Optional[str],
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        now: Optional[float] = None
+    ) -> float:
+        """Enregistre l'usage d'un appel et retourne son coût estimé"""
+        now = time.time() if now is None else now
+        bucket = int(now) - int(now) % BUCKET_SECONDS
+        project = project_id or ""
+        cost = estimate_cost(model, prompt_tokens, completion_tokens)
+        key = (bucket, project, session_id or "", model or "")
+        with self._lock:
+            entry = self._pending.setdefault(key, [0, 0, 0, 0.0])
+            entry[0] += 1
+            entry[1] += prompt_tokens
+            entry[2] += completion_tokens
+            entry[3] += cost
+            spend = self._spend.setdefault(project, {})
+            spend[bucket] = spend.get(bucket, 0.0) + cost
+        return cost
+
+    def budget_for(self, project_id: Optional[str]) -> Optional[float]:
+        """Budget applicable au projet (spécifique, sinon défaut "*")"""
+        return self.budgets.get(project_id or "", self.budgets.get("*"))
+
+    def spent(self, project_id: Optional[str], now: Optional[float] = None) -> float:
+        """Dépense estimée du projet sur la fenêtre de budget"""
+        now = time.time() if now is None else now
+        window_start = now - self.budget_window
+        with self._lock:
+            spend = self._spend.get(project_id or "", {})
+            for bucket in [b for b in spend if b + BUCKET_SECONDS <= window_start]:
+                del spend[bucket]
+            return sum(spend.values())
+
+    def budget_ratio(self, project_id: Optional[str]) -> float:
+        """Part du budget consommée (0 si aucun budget configuré)"""
+        budget = self.budget_for(project_id)
+        if not budget:
+            return 0.0
+        return self.spent(project_id) / budget
+
+    def check_budget(self, project_id: Optional[str]) -> tuple[bool, dict]:
+        """
+        Vérifie si le projet peut encore consommer
+        Returns: (is_allowed, info_dict)
+        """
+        budget = self.budget_for(project_id)
+        if budget is None:
+            return True, {}
+        spent = self.spent(project_id)
+        if spent >= budget:
+            self.rejected_requests += 1
+            return False, {
+                "error": "BUDGET_EXCEEDED",
+                "message": f"Budget de {budget} USD sur {self.budget_window}s atteint",
+                "project_id": project_id,
+                "spent_usd": round(spent, 6),
+                "budget_usd": budget
+            }
+        return True, {"spent_usd": round(spent, 6), "budget_usd": budget}
+
+    def should_flush(self) -> bool:
+        """Vrai si le lot en attente est plein ou si l'intervalle est écoulé"""
+        if not self._pending or self._flushing:
+            return False
+        return (
+            len(self._pending) >= self.batch_size
+            or time.time() - self.last_flush >= self.flush_interval
+        )
+
+    def schedule_flush(self):
+        """Déclenche un flush en tâche de fond (thread) si nécessaire, sans attendre"""
+        if not self.should_flush():
+            return
+        self._flushing = True
+        asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+    def flush(self) -> int:
+        """Écrit le lot en attente dans SQLite (bloquant: à appeler hors event loop)"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        try:
+            if pending:
+                rows = [(*key, *values) for key, values in pending.items()]
+                with self._db_lock:
+                    self._conn.executemany(
+                        "INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                        " ON CONFLICT (bucket, project_id, session_id, model) DO UPDATE SET"
+                        " requests = requests + excluded.requests,"
+                        " prompt_tokens = prompt_tokens + excluded.prompt_tokens,"
+                        " completion_tokens = completion_tokens + excluded.completion_tokens,"
+                        " cost = cost + excluded.cost",
+                        rows
+                    )
+                    self._conn.commit()
+                self.flushed_rows += len(rows)
+            return len(pending)
+        finally:
+            self.last_flush = time.time()
+            self._flushing = False
+
+    def query(
+        self,
+        since: float,
+        until: Optional[float] = None,
+        project_id: Optional[str] = None,
+        session_id: Optional[str] = None,
+        model: Optional[str] = None,
+        group_by: Tuple[str, ...] = ("project_id", "model"),
+        interval: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Agrège l'usage sur [since, until[ (flush préalable du lot en attente)
+        interval: regroupe en tranches de N secondes (série temporelle)
+        """
+        self.flush()
+        until = time.time() if until is None else until
+        columns = [field for field in group_by if field in GROUP_BY_FIELDS]
+        where = ["bucket >= ?", "bucket < ?"]
+        params: List[Any] = [int(since) - int(since) % BUCKET_SECONDS, until]
+        for field, value in (("project_id", project_id), ("session_id", session_id), ("model", model)):
+            if value is not None:
+                where.append(f"{field} = ?")
+                params.append(value)
+        select = list(columns)
+        if interval:
+            step = max(BUCKET_SECONDS, int(interval))
+            select.insert(0, f"(bucket / {step}) * {step} AS window_start")
+            columns.insert(0, "window_start")
+        sql = (
+            f"SELECT {', '.join(select + ['SUM(requests)', 'SUM(prompt_tokens)', 'SUM(completion_tokens)', 'SUM(cost)'])}"
+            f" FROM usage WHERE {' AND '.join(where)}"
+        )
+        if columns:
+            sql += f" GROUP BY {', '.join(columns)} ORDER BY {', '.join(columns)}"
+        with self._db_lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        results = []
+        for row in rows:
+            if row[len(columns)] is None:
+                continue  # aucun enregistrement sans GROUP BY
+            item = dict(zip(columns, row))
+            requests, prompt, completion, cost = row[len(columns):]
+            item.update({
+                "requests": requests,
+                "prompt_tokens": prompt,
+                "completion_tokens": completion,
+                "total_tokens": prompt + completion,
+                "cost_usd": round(cost, 6)
+            })
+            results.append(item)
+        return results
+
+    def get_stats(self) -> dict:
+        return {
+            "pending_rows": len(self._pending),
+            "flushed_rows": self.flushed_rows,
+            "rejected_requests": self.rejected_requests,
+            "budgets": self.budgets,
+            "budget_window_seconds": self.budget_window
+        }
+
+    def close(self):
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+
+# Instance globale du registre d'usage
+usage_ledger = UsageLedger.from_env()
@@ -7,12 +7,13 @@ Utilitaires partagés pour les services Hey Hi
 """
 import os
 import time
-from typing import List
+from typing import List, Optional
 from collections import defaultdict
 
-def get_allowed_origins(default="*") -> List[str]:
-    """Parse les origines CORS depuis l'environnement"""
-    raw = os.getenv("ALLOWED_ORIGINS", default)
+def get_allowed_origins(default="*", raw: Optional[str] = None) -> List[str]:
+    """Parse les origines CORS depuis l'environnement (ou depuis `raw` si fourni)"""
+    if raw is None:
+        raw = os.getenv("ALLOWED_ORIGINS", default)
     origins = [o.strip() for o in raw.split(",") if o.strip()]
     return origins if origins else [default]
 
@@ -22,6 +23,13 @@ def get_timeouts() -> tuple[float, float]:
     read = float(os.getenv("LLM_TIMEOUT_READ", "70"))
     return connect, read
 
+def route_path(scope: dict) -> str:
+    """Chemin vu par l'app ASGI courante (sans le préfixe de montage root_path)"""
+    path, root_path = scope["path"], scope.get("root_path", "")
+    if root_path and path.startswith(root_path):
+        return path[len(root_path):] or "/"
+    return path
+
 def get_security_headers() -> dict:
     """
     Headers de sécurité recommandés pour les services API
@@ -0,0 +1,354 @@
+"""
+Transport WebSocket du chat (/ws/chat): une session persistante par connexion
+- L'historique reste côté serveur: le client n'envoie que les nouveaux messages
+  (borné en messages et en caractères); identifiant de session toujours généré par le serveur
+- Nombre de sessions ouvertes borné par service (au-delà: fermeture 1013)
+- La réponse est streamée fragment par fragment (frames "delta" puis "done")
+- Validation, retries, circuit breaker, budget et métriques: ceux de handle_chat_request
+- Annulation d'un tour: par le client (frame "cancel"), à la déconnexion,
+  à l'expiration du timeout du tour ou à l'arrêt du service
+- Arrêt progressif (SIGTERM): les tours en cours sont attendus, les nouveaux refusés (503)
+
+Frames client (JSON texte; une trame binaire ferme la session avec 1003):
+    {"type": "chat", "id": "t1", "messages": [...], "model"?, "temperature"?, "max_tokens"?,
+     "project_id"?, "timeout"? (secondes, fini et > 0)}
+    {"type": "cancel"}   {"type": "reset"}   {"type": "ping"}
+Frames serveur:
+    {"type": "session", "session_id": ...}
+    {"type": "delta", "id": "t1", "content": "..."}
+    {"type": "done", "id": "t1", "content": "...", "usage": {...}, "model": ..., "latency_seconds": ...}
+    {"type": "error", "id": "t1", "status": 422, "detail": {...}}
+    {"type": "cancelled", "id": "t1", "reason": "client_cancel"}
+    {"type": "pong"}
+"""
+import os
+import json
+import math
+import time
+import uuid
+import asyncio
+from collections import Counter
+from typing import Any, Dict, List, Optional
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse
+from pydantic import ValidationError
+from .chat_proxy import MAX_MESSAGES_COUNT, ChatMetrics, ChatRequest, ToolRegistry, handle_chat_request
+from .deadline import MAX_REQUEST_BUDGET, Deadline, _current_deadline
+from .drain import drain
+from .model_policy import ModelPolicy
+from .retrieval import Retriever
+
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "300"))
+# Fragments regroupés sur cet intervalle (un frame par token coûte plus cher en CPU que le POST)
+WS_DELTA_INTERVAL = float(os.getenv("WS_DELTA_INTERVAL", "0.02"))
+# Sessions ouvertes simultanément (chacune garde son historique en mémoire)
+WS_MAX_SESSIONS = int(os.getenv("WS_MAX_SESSIONS", "500"))
+# Caractères d'historique conservés par session (en plus de la limite en messages)
+WS_HISTORY_MAX_CHARS = int(os.getenv("WS_HISTORY_MAX_CHARS", "200000"))
+# Options du tour conservées d'un tour à l'autre (le client ne les renvoie pas)
+SESSION_OPTIONS = ("model", "temperature", "max_tokens", "project_id")
+# Codes de fermeture (RFC 6455)
+CLOSE_GOING_AWAY = 1001
+CLOSE_UNSUPPORTED_DATA = 1003
+CLOSE_POLICY_VIOLATION = 1008
+CLOSE_TRY_AGAIN_LATER = 1013
+
+def _chars(messages: List[dict]) -> int:
+    return sum(len(message.get("content") or "") for message in messages)
+
+def trim_history(
+    history: List[dict],
+    new_messages: List[dict],
+    limit: int = MAX_MESSAGES_COUNT,
+    max_chars: int = WS_HISTORY_MAX_CHARS
+) -> List[dict]:
+    """
+    Historique + nouveaux messages, ramené à `limit` messages et `max_chars` caractères:
+    les messages system sont conservés, les plus anciens échanges abandonnés
+    """
+    excess = len(history) + len(new_messages) - limit
+    excess_chars = _chars(history) + _chars(new_messages) - max_chars
+    if excess <= 0 and excess_chars <= 0:
+        return history + new_messages
+    kept = []
+    for message in history:
+        if (excess > 0 or excess_chars > 0) and message["role"] != "system":
+            excess -= 1
+            excess_chars -= len(message.get("content") or "")
+            continue
+        kept.append(message)
+    return kept + new_messages
+
+class ChatSession:
+    """État d'une connexion: historique, options persistées, tour en cours"""
+    __slots__ = ("session_id", "websocket", "history", "options", "turn", "turn_id", "deadline", "turns", "opened_at")
+
+    def __init__(self, websocket: WebSocket):
+        # Jamais fourni par le client: deux connexions ne partagent ni entrée dans `active`
+        # ni réponses spéculatives
+        self.session_id = uuid.uuid4().hex
+        self.websocket = websocket
+        self.history: List[dict] = []
+        self.options: Dict[str, Any] = {}
+        self.turn: Optional[asyncio.Task] = None
+        self.turn_id: Optional[str] = None
+        self.deadline: Optional[Deadline] = None
+        self.turns = 0
+        self.opened_at = time.time()
+
+    @property
+    def busy(self) -> bool:
+        return self.turn is not None and not self.turn.done()
+
+    def cancel_turn(self, reason: str) -> bool:
+        """Annule le tour en cours (appel upstream et backoffs compris)"""
+        if not self.busy:
+            return False
+        self.deadline.cancel_reason = reason
+        self.turn.cancel()
+        return True
+
+    async def send(self, frame: Dict[str, Any]):
+        await self.websocket.send_text(json.dumps(frame, ensure_ascii=False))
+
+class ChatSessions:
+    """Sessions WebSocket ouvertes d'un service (stats /metrics, fermeture à l'arrêt)"""
+    def __init__(
+        self,
+        idle_timeout: float = WS_IDLE_TIMEOUT,
+        delta_interval: float = WS_DELTA_INTERVAL,
+        max_sessions: int = WS_MAX_SESSIONS
+    ):
+        self.idle_timeout = idle_timeout
+        self.delta_interval = delta_interval
+        self.max_sessions = max_sessions
+        self.active: Dict[str, ChatSession] = {}
+        self.opened = 0
+        self.turns = 0
+        self.rejected = 0
+        self.closed: Counter = Counter()
+        self.cancelled: Counter = Counter()
+
+    def open(self, session: ChatSession):
+        self.active[session.session_id] = session
+        self.opened += 1
+
+    def close(self, session: ChatSession, reason: str):
+        if self.active.pop(session.session_id, None) is not None:
+            self.closed[reason] += 1
+
+    async def close_all(self, reason: str = "shutdown"):
+        """Annule les tours en cours et ferme toutes les connexions (arrêt du service)"""
+        sessions = list(self.active.values())
+        for session in sessions:
+            session.cancel_turn(reason)
+        for session in sessions:
+            if session.turn is not None:
+                await asyncio.gather(session.turn, return_exceptions=True)
+            try:
+                await session.websocket.close(code=CLOSE_GOING_AWAY, reason=reason)
+            except Exception:
+                pass  # connexion déjà fermée
+            self.close(session, reason)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "active_sessions": len(self.active),
+            "busy_sessions": sum(1 for s in self.active.values() if s.busy),
+            "opened_sessions": self.opened,
+            "rejected_sessions": self.rejected,
+            "max_sessions": self.max_sessions,
+            "turns": self.turns,
+            "closed": dict(self.closed),
+            "cancelled_turns": dict(self.cancelled),
+            "idle_timeout_seconds": self.idle_timeout,
+            "delta_interval_seconds": self.delta_interval
+        }
+
+def _origin_allowed(websocket: WebSocket, allowed_origins: List[str]) -> bool:
+    # Pas de CORS pour les WebSockets: l'Origin est vérifiée ici
+    origin = websocket.headers.get("origin")
+    return origin is None or "*" in allowed_origins or origin in allowed_origins
+
+async def _run_turn(
+    session: ChatSession,
+    sessions: ChatSessions,
+    turn_id: Optional[str],
+    request: ChatRequest,
+    new_messages: List[dict],
+    handler_kwargs: Dict[str, Any]
+):
+    """Un tour de conversation: deltas streamés puis frame finale (done/error/cancelled)"""
+    pending: List[str] = []
+    last_sent = 0.0
+
+    async def flush():
+        nonlocal last_sent
+        if pending:
+            content = "".join(pending)
+            pending.clear()
+            last_sent = time.monotonic()
+            await session.send({"type": "delta", "id": turn_id, "content": content})
+
+    async def on_delta(content: str):
+        # Le premier fragment part tout de suite, les suivants sont regroupés
+        pending.append(content)
+        if time.monotonic() - last_sent >= sessions.delta_interval:
+            await flush()
+
+    try:
+        result = await handle_chat_request(request, on_delta=on_delta, **handler_kwargs)
+    except asyncio.CancelledError:
+        reason = session.deadline.cancel_reason or "cancelled"
+        sessions.cancelled[reason] += 1
+        if reason in ("client_cancel", "deadline"):
+            # Connexion toujours ouverte: le client est prévenu, la session continue
+            await session.send({"type": "cancelled", "id": turn_id, "reason": reason})
+            return
+        raise
+    except HTTPException as e:
+        await session.send({"type": "error", "id": turn_id, "status": e.status_code, "detail": e.detail})
+        return
+
+    if isinstance(result, JSONResponse):
+        await session.send({"type": "error", "id": turn_id, "status": result.status_code, "detail": json.loads(result.body)})
+        return
+
+    await flush()
+    choices = result.get("choices") or [{}]
+    content = (choices[0].get("message") or {}).get("content") or ""
+    # L'historique n'avance que sur un tour réussi: un tour annulé peut être renvoyé tel quel
+    session.history = trim_history(session.history, new_messages + [{"role": "assistant", "content": content}])
+    session.turns += 1
+    sessions.turns += 1
+    frame = {"type": "done", "id": turn_id, "content": content, **{k: v for k, v in result.items() if k not in ("provider", "choices")}}
+    await session.send(frame)
+
+def _start_turn(session: ChatSession, sessions: ChatSessions, frame: dict, handler_kwargs: Dict[str, Any]):
+    turn_id = frame.get("id")
+    options = {**session.options, **{key: frame[key] for key in SESSION_OPTIONS if key in frame}}
+    try:
+        # Seuls les nouveaux messages sont validés: l'historique l'a déjà été aux tours précédents
+        request = ChatRequest.model_validate({
+            **options,
+            "session_id": session.session_id,
+            "messages": frame.get("messages")
+        })
+        timeout = float(frame["timeout"]) if frame.get("timeout") is not None else None
+        if timeout is not None and not (math.isfinite(timeout) and timeout > 0):
+            raise ValueError("timeout doit être un nombre de secondes fini et positif")
+    except ValidationError as e:
+        return {"type": "error", "id": turn_id, "status": 422, "detail": json.loads(e.json(include_url=False))}
+    except (TypeError, ValueError) as e:
+        return {"type": "error", "id": turn_id, "status": 422, "detail": {"error": "INVALID_FRAME", "message": str(e)}}
+
+    session.options = options
+    new_messages = request.messages
+    request.messages = trim_history(session.history, new_messages)
+    loop = asyncio.get_running_loop()
+    if timeout is not None:
+        timeout = min(timeout, MAX_REQUEST_BUDGET)
+    session.deadline = Deadline(time.monotonic() + timeout if timeout is not None else None)
+    session.turn_id = turn_id
+    token = _current_deadline.set(session.deadline)
+    try:
+        session.turn = loop.create_task(_run_turn(session, sessions, turn_id, request, new_messages, handler_kwargs))
+    finally:
+        _current_deadline.reset(token)
+    # Tour attendu par l'arrêt progressif jusqu'à sa frame finale
+    drain.hold()
+    session.turn.add_done_callback(lambda _: drain.release())
+    if timeout is not None:
+        timer = loop.call_later(timeout, session.cancel_turn, "deadline")
+        session.turn.add_done_callback(lambda _: timer.cancel())
+    return None
+
+async def serve_chat_websocket(
+    websocket: WebSocket,
+    sessions: ChatSessions,
+    allowed_origins: List[str],
+    api_key: str,
+    default_model: str,
+    connect_timeout: float,
+    read_timeout: float,
+    policy: Optional[ModelPolicy] = None,
+    chat_metrics: Optional[ChatMetrics] = None,
+    retriever: Optional[Retriever] = None,
+    tools: Optional[ToolRegistry] = None
+):
+    """Boucle d'une connexion /ws/chat (réception des frames, un tour à la fois)"""
+    if not _origin_allowed(websocket, allowed_origins):
+        sessions.rejected += 1
+        await websocket.close(code=CLOSE_POLICY_VIOLATION, reason="origin")
+        return
+    if len(sessions.active) >= sessions.max_sessions:
+        sessions.rejected += 1
+        await websocket.close(code=CLOSE_TRY_AGAIN_LATER, reason="capacity")
+        return
+
+    await websocket.accept()
+    session = ChatSession(websocket)
+    sessions.open(session)
+    handler_kwargs = dict(
+        api_key=api_key, default_model=default_model, connect_timeout=connect_timeout,
+        read_timeout=read_timeout, policy=policy, chat_metrics=chat_metrics, retriever=retriever,
+        tools=tools
+    )
+    reason = "client_disconnect"
+    try:
+        await session.send({"type": "session", "session_id": session.session_id})
+        while True:
+            try:
+                message = await asyncio.wait_for(websocket.receive(), sessions.idle_timeout)
+            except asyncio.TimeoutError:
+                if session.busy:
+                    continue  # le client attend sa réponse: pas inactif
+                reason = "idle_timeout"
+                await websocket.close(code=CLOSE_GOING_AWAY, reason=reason)
+                return
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            raw = message.get("text")
+            if raw is None:
+                # Trame binaire: le protocole est JSON texte uniquement
+                reason = "unsupported_data"
+                await websocket.close(code=CLOSE_UNSUPPORTED_DATA, reason=reason)
+                return
+            try:
+                frame = json.loads(raw)
+                kind = frame.get("type")
+            except (ValueError, AttributeError):
+                await session.send({"type": "error", "status": 400, "detail": {"error": "INVALID_FRAME", "message": "JSON objet attendu"}})
+                continue
+
+            if kind == "chat":
+                if session.busy:
+                    await session.send({"type": "error", "id": frame.get("id"), "status": 409, "detail": {
+                        "error": "TURN_IN_PROGRESS", "message": "Un tour est déjà en cours (envoyer cancel d'abord)"
+                    }})
+                    continue
+                if drain.draining:
+                    await session.send({"type": "error", "id": frame.get("id"), "status": 503, "detail": drain.rejection()})
+                    continue
+                error = _start_turn(session, sessions, frame, handler_kwargs)
+                if error is not None:
+                    await session.send(error)
+            elif kind == "cancel":
+                if not session.cancel_turn("client_cancel"):
+                    await session.send({"type": "cancelled", "id": frame.get("id"), "reason": "no_turn"})
+            elif kind == "reset":
+                session.cancel_turn("client_cancel")
+                session.history = []
+                session.options = {}
+            elif kind == "ping":
+                await session.send({"type": "pong"})
+            else:
+                await session.send({"type": "error", "status": 400, "detail": {"error": "UNKNOWN_FRAME", "message": f"Type inconnu: {kind}"}})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # Désinscription avant toute attente: le handler peut lui-même être annulé (arrêt du serveur)
+        session.cancel_turn(reason)
+        sessions.close(session, reason)
+        if session.turn is not None and not session.turn.done():
+            await asyncio.gather(session.turn, return_exceptions=True)
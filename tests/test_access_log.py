@@ -0,0 +1,95 @@
+"""
+Tests pour shared/access_log.py
+"""
+import io
+import json
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from shared.access_log import AccessLogWriter, AccessLogMiddleware
+from shared.tracing import RequestTracingMiddleware, annotate
+
+def test_writer_batches_records():
+    """Teste l'écriture par lots en JSON lines"""
+    stream = io.StringIO()
+    writer = AccessLogWriter(stream=stream, capacity=100, batch_size=2, flush_interval=60)
+    for i in range(5):
+        assert writer.enqueue({"i": i}) is True
+    writer.close()
+
+    lines = stream.getvalue().splitlines()
+    assert [json.loads(line)["i"] for line in lines] == [0, 1, 2, 3, 4]
+    stats = writer.get_stats()
+    assert stats["written"] == 5
+    assert stats["dropped"] == 0
+    assert stats["buffered"] == 0
+
+def test_writer_drops_when_full():
+    """Teste l'abandon compté quand le buffer est plein"""
+    stream = io.StringIO()
+    writer = AccessLogWriter(stream=stream, capacity=3, batch_size=1000, flush_interval=60)
+    # Thread non démarré: le buffer se remplit
+    writer._thread = object()
+    results = [writer.enqueue({"i": i}) for i in range(5)]
+    assert results == [True, True, True, False, False]
+    assert writer.dropped == 2
+
+    writer._thread = None
+    writer.close()
+    assert len(stream.getvalue().splitlines()) == 3
+
+def test_writer_counts_write_errors():
+    """Teste qu'une erreur d'écriture ne casse pas le writer"""
+    class BrokenStream:
+        def write(self, data):
+            raise OSError("disk full")
+        def flush(self):
+            pass
+
+    writer = AccessLogWriter(stream=BrokenStream(), flush_interval=60)
+    writer._thread = object()
+    writer.enqueue({"i": 1})
+    writer._thread = None
+    writer.close()
+    assert writer.write_errors == 1
+
+def test_middleware_logs_tracked_routes():
+    """Teste le contenu des enregistrements produits par le middleware"""
+    stream = io.StringIO()
+    writer = AccessLogWriter(stream=stream, flush_interval=60)
+    app = FastAPI()
+
+    @app.post("/api/chat")
+    async def chat():
+        annotate(model="gpt-4o-mini", tokens=42, upstream_attempts=2, upstream_seconds=0.5, breaker="closed")
+        return {"ok": True}
+
+    @app.get("/healthz")
+    async def healthz():
+        return {"ok": True}
+
+    app.add_middleware(AccessLogMiddleware, service_name="svc", writer=writer)
+    app.add_middleware(RequestTracingMiddleware, service_name="svc", sample_rate=0.0)
+    client = TestClient(app)
+
+    client.post("/api/chat", headers={"X-Request-ID": "log-1"})
+    client.get("/healthz")
+    writer.close()
+
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 1  # /healthz n'est pas suivi
+    record = json.loads(lines[0])
+    assert record["service"] == "svc"
+    assert record["request_id"] == "log-1"
+    assert record["path"] == "/api/chat"
+    assert record["status"] == 200
+    assert record["model"] == "gpt-4o-mini"
+    assert record["tokens"] == 42
+    assert record["retries"] == 1
+    assert record["breaker"] == "closed"
+    assert record["cache"] == "none"
+    assert record["latency_ms"]["upstream"] == 500.0
+    assert record["latency_ms"]["total"] >= 0
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
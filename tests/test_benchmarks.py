@@ -0,0 +1,159 @@
+"""
+Benchmarks de performance (hors ligne, exclus des tests unitaires par défaut)
+    pytest -m benchmark                       # compare aux baselines
+    BENCHMARK_UPDATE=1 pytest -m benchmark    # réécrit tests/benchmark_baseline.json
+Tolérance: BENCHMARK_TOLERANCE (régression relative, défaut 1.0 = +100%, les timings
+à la µs variant du simple au double sur une machine partagée) et BENCHMARK_SLACK_US
+(marge absolue en µs/op, défaut 5)
+Les baselines dépendent de la machine: les régénérer après un changement d'environnement
+"""
+import os
+import json
+import time
+import asyncio
+import tempfile
+from pathlib import Path
+import httpx
+import pytest
+from shared.chat_proxy import (
+    ChatMetrics, ChatRequest, call_openai_with_retry, circuit_breaker, close_upstream_pool,
+    handle_chat_request, open_upstream_pool
+)
+from shared.html_sanitizer import sanitize_html
+from shared.retrieval import RetrievalIndex, Retriever, build_index
+from shared.utils import SimpleRateLimiter, sanitize_input
+from benchmarks.bench_html_sanitizer import generated_page
+from benchmarks.bench_retrieval import generated_corpus
+from benchmarks.openai_stub import OpenAIStub
+
+pytestmark = pytest.mark.benchmark
+
+BASELINE_PATH = Path(__file__).resolve().parent / "benchmark_baseline.json"
+TOLERANCE = float(os.getenv("BENCHMARK_TOLERANCE", "1.0"))
+SLACK_US = float(os.getenv("BENCHMARK_SLACK_US", "5"))
+UPDATE = os.getenv("BENCHMARK_UPDATE") == "1"
+ROUNDS = 7
+
+MESSAGES = [
+    {"role": "system", "content": "Tu es un coach vidéo bienveillant."},
+    *[
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"Tour {i}: comment améliorer ma posture face caméra ? " * 3}
+        for i in range(20)
+    ]
+]
+
+def _best_of(fn, iterations: int) -> float:
+    """µs par opération sur le meilleur tour (le moins perturbé par le bruit), après un tour de chauffe"""
+    best = None
+    for _ in range(iterations // 10):
+        fn()
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        elapsed = (time.perf_counter() - started) / iterations * 1e6
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+async def _best_of_async(fn, iterations: int) -> float:
+    best = None
+    for _ in range(iterations // 10):
+        await fn()
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            await fn()
+        elapsed = (time.perf_counter() - started) / iterations * 1e6
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def _check(name: str, us_per_op: float):
+    """Compare à la baseline (ou l'enregistre avec BENCHMARK_UPDATE=1)"""
+    baseline = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+    print(f"{name}: {us_per_op:.2f} µs/op (baseline {baseline.get(name, '-')})")
+    if UPDATE:
+        baseline[name] = round(us_per_op, 2)
+        BASELINE_PATH.write_text(json.dumps(dict(sorted(baseline.items())), indent=2) + "\n")
+        return
+    base = baseline.get(name)
+    if base is None:
+        pytest.skip(f"pas de baseline pour {name} (BENCHMARK_UPDATE=1 pour l'enregistrer)")
+    limit = base * (1 + TOLERANCE) + SLACK_US
+    assert us_per_op <= limit, f"{name}: {us_per_op:.2f} µs/op > limite {limit:.2f} (baseline {base})"
+
+async def _with_stub(coro_factory):
+    """Pool upstream branché sur le stub local sans latence: seul le coût du client est mesuré"""
+    await open_upstream_pool(transport=httpx.ASGITransport(app=OpenAIStub(base_latency=0, per_token_latency=0)))
+    circuit_breaker.record_success()
+    try:
+        return await coro_factory()
+    finally:
+        await close_upstream_pool()
+
+def test_bench_call_openai_with_retry():
+    """Surcoût d'un appel upstream (payload, headers, pool, parsing) contre le stub local"""
+    async def one():
+        await call_openai_with_retry(
+            api_key="bench", messages=MESSAGES, model="gpt-4o-mini",
+            connect_timeout=5, read_timeout=30, chat_metrics=ChatMetrics()
+        )
+
+    _check("call_openai_with_retry", asyncio.run(_with_stub(lambda: _best_of_async(one, 200))))
+
+def test_bench_handle_chat_request():
+    """Requête chat de bout en bout: JSON brut -> validation -> handler -> réponse sérialisée"""
+    raw = json.dumps({"messages": MESSAGES, "temperature": 0.5, "max_tokens": 64}).encode()
+    chat_metrics = ChatMetrics()
+
+    async def one():
+        request = ChatRequest.model_validate_json(raw)
+        response = await handle_chat_request(request, "bench", "gpt-4o-mini", 5, 30, chat_metrics=chat_metrics)
+        json.dumps(response)
+
+    _check("handle_chat_request", asyncio.run(_with_stub(lambda: _best_of_async(one, 200))))
+    assert chat_metrics.failed_requests == 0
+
+def test_bench_rate_limiter():
+    """Débit de SimpleRateLimiter.is_allowed (100 clients, mix autorisé/refusé)"""
+    limiter = SimpleRateLimiter(max_requests=60, window_seconds=60)
+    identifiers = [f"10.0.0.{i}" for i in range(100)]
+    counter = iter(range(10 ** 9))
+    _check("rate_limiter_is_allowed", _best_of(lambda: limiter.is_allowed(identifiers[next(counter) % 100]), 20000))
+
+def test_bench_sanitize_input():
+    """Débit de sanitize_input sur un message de 4 Ko avec caractères de contrôle"""
+    text = ("Bonjour\x00 coach, voici ma question:\tcomment\x07 parler face caméra ?\n" * 64)[:4096]
+    _check("sanitize_input_4kb", _best_of(lambda: sanitize_input(text), 500))
+
+def test_bench_sanitize_html():
+    """Nettoyage + minification d'une page /build de 40 Ko (clôture, scripts, indentation)"""
+    page = generated_page(40)
+    _check("sanitize_html_40kb", _best_of(lambda: sanitize_html(page), 20))
+
+def test_bench_retrieval_query():
+    """Retriever.augment (recherche BM25 + lecture des chunks en mmap) sur un index de 300 fiches"""
+    with tempfile.TemporaryDirectory() as tmp:
+        queries = generated_corpus(Path(tmp) / "docs", 300)
+        build_index(Path(tmp) / "docs", Path(tmp) / "index")
+        retriever = Retriever(RetrievalIndex(Path(tmp) / "index"), top_k=3, min_score=0)
+        messages = [[{"role": "user", "content": question}] for question, _, _ in queries]
+        counter = iter(range(10 ** 9))
+        try:
+            _check("retrieval_query_300_docs", _best_of(lambda: retriever.augment(messages[next(counter) % 300]), 200))
+        finally:
+            retriever.close()
+
+def test_bench_json_handling():
+    """Parsing/validation d'une requête chat et aller-retour JSON d'une réponse upstream"""
+    raw = json.dumps({"messages": MESSAGES}).encode()
+    _check("chat_request_parse", _best_of(lambda: ChatRequest.model_validate_json(raw), 2000))
+
+    response = json.dumps({
+        "id": "chatcmpl-bench", "model": "gpt-4o-mini",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": MESSAGES[-1]["content"] * 8}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 600, "completion_tokens": 200, "total_tokens": 800}
+    })
+    _check("response_json_roundtrip", _best_of(lambda: json.dumps(json.loads(response)), 5000))
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "-m", "benchmark"])
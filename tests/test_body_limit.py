@@ -0,0 +1,70 @@
+"""
+Tests de la limite de taille des requêtes (shared/body_limit.py)
+"""
+import json
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from shared.body_limit import DEFAULT_BODY_LIMITS, BodySizeLimitMiddleware, parse_body_limits
+from shared.chat_proxy import MAX_MESSAGE_LENGTH, ChatRequest
+
+def _client(limits):
+    app = FastAPI()
+    app.state.calls = 0
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        app.state.calls += 1
+        body = await request.body()
+        return {"size": len(body)}
+
+    @app.post("/other")
+    async def other(request: Request):
+        return {"size": len(await request.body())}
+
+    app.add_middleware(BodySizeLimitMiddleware, limits=limits)
+    return app, TestClient(app)
+
+def test_parse_body_limits():
+    """Teste le parsing de BODY_LIMITS"""
+    assert parse_body_limits("/api/chat=100, /build=20,invalide") == {"/api/chat": 100, "/build": 20}
+
+def test_default_chat_limit_bounds_buffering():
+    """Teste la limite par défaut de /api/chat: quelques centaines de Ko, un message maximal (UTF-8 4 octets) passe"""
+    limit = parse_body_limits(DEFAULT_BODY_LIMITS)["/api/chat"]
+    assert limit <= 1024 * 1024
+    payload = {"messages": [{"role": "user", "content": "😀" * MAX_MESSAGE_LENGTH}],
+               "model": "gpt-4o-mini", "temperature": 0.7, "max_tokens": 4000}
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    assert len(ChatRequest.model_validate_json(body).messages) == 1
+    assert len(body) <= limit
+
+def test_content_length_rejected_without_reading():
+    """Teste qu'un Content-Length trop grand est refusé sans appeler l'endpoint"""
+    app, client = _client({"/api/chat": 100})
+    response = client.post("/api/chat", content=b"x" * 101)
+    assert response.status_code == 413
+    assert response.json()["detail"]["error"] == "PAYLOAD_TOO_LARGE"
+    assert response.json()["detail"]["limit_bytes"] == 100
+    assert app.state.calls == 0
+
+def test_streamed_body_aborted_while_reading():
+    """Teste qu'un body chunked (sans Content-Length) est coupé dès la limite"""
+    app, client = _client({"/api/chat": 100})
+
+    def chunks():
+        for _ in range(10):
+            yield b"x" * 30
+
+    response = client.post("/api/chat", content=chunks())
+    assert response.status_code == 413
+    assert response.json()["detail"]["message"] == "Requête trop volumineuse (max: 100 bytes)"
+
+def test_small_body_and_other_routes_untouched():
+    """Teste que les bodies sous la limite et les routes non configurées passent"""
+    _, client = _client({"/api/chat": 100})
+    assert client.post("/api/chat", content=b"x" * 100).json() == {"size": 100}
+    assert client.post("/other", content=b"x" * 1000).json() == {"size": 1000}
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
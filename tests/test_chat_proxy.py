@@ -3,11 +3,12 @@ Tests unitaires pour shared/chat_proxy.py
 """
 import pytest
 import asyncio
+import httpx
 from unittest.mock import Mock, AsyncMock, patch
 from fastapi import HTTPException
 from shared.chat_proxy import (
-    Message, ChatRequest, CircuitBreaker, ChatMetrics,
-    call_openai_with_retry, handle_chat_request, metrics
+    Message, ChatRequest, CircuitBreaker, ChatMetrics, MicroBatcher, RetryBudget, ToolRegistry,
+    call_openai_with_retry, handle_chat_request, metrics, run_tool_loop
 )
 
 # Tests des modèles Pydantic
@@ -51,6 +52,42 @@ def test_chat_request_validation():
             temperature=3.0
         )
 
+def test_chat_request_fast_path():
+    """Teste la validation directe du JSON vers des dicts prêts pour l'upstream"""
+    req = ChatRequest.model_validate_json(
+        '{"messages": [{"role": "system", "content": "Be nice"}, {"role": "user", "content": "Hi"}]}'
+    )
+    assert req.messages == [
+        {"role": "system", "content": "Be nice"},
+        {"role": "user", "content": "Hi"}
+    ]
+    # Aucun objet Message construit
+    assert all(type(m) is dict for m in req.messages)
+    
+    # Les modèles Message restent acceptés
+    req = ChatRequest(messages=[Message(role="user", content="Hello")])
+    assert req.messages == [{"role": "user", "content": "Hello"}]
+
+def test_chat_request_error_messages_unchanged():
+    """Teste que les messages d'erreur historiques sont conservés"""
+    from pydantic import ValidationError
+    with pytest.raises(ValidationError) as exc_info:
+        ChatRequest.model_validate_json('{"messages": [{"role": "root", "content": "Hi"}]}')
+    error = exc_info.value.errors()[0]
+    assert error["loc"] == ("messages", 0, "role")
+    assert error["msg"] == "Value error, Invalid role"
+    
+    with pytest.raises(ValidationError) as exc_info:
+        ChatRequest(messages=[{"role": "user", "content": "x" * 50001}], temperature=3.0)
+    errors = exc_info.value.errors()
+    assert errors[0]["msg"] == "Value error, Message too long (max 50000 chars)"
+    # Les autres erreurs sont conservées telles quelles
+    assert errors[1]["type"] == "less_than_equal"
+    
+    with pytest.raises(ValidationError) as exc_info:
+        Message(role="invalid", content="Hi")
+    assert exc_info.value.errors()[0]["msg"] == "Value error, Invalid role"
+
 # Tests du Circuit Breaker
 def test_circuit_breaker_states():
     """Teste les états du circuit breaker"""
@@ -230,6 +267,255 @@ async def test_handle_chat_request_success():
         assert "latency_seconds" in result
         assert result["usage"]["total_tokens"] == 25
 
+# Tests du micro-batching
+@pytest.mark.asyncio
+async def test_micro_batcher_packs_compatible_requests():
+    """Teste que des requêtes compatibles partent en un seul appel et sont redistribuées"""
+    import json
+    calls = []
+
+    async def fake_call(**kwargs):
+        calls.append(kwargs)
+        items = json.loads(kwargs["messages"][-1]["content"])
+        answers = [{"id": item["id"], "content": "titre " + item["messages"][-1]["content"]} for item in items]
+        return {
+            "model": "gpt-4o-mini",
+            "choices": [{"message": {"content": json.dumps({"answers": answers})}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 30, "completion_tokens": 9, "total_tokens": 39}
+        }
+
+    batcher = MicroBatcher(window=0.01)
+    with patch("shared.chat_proxy.call_openai_with_retry", side_effect=fake_call):
+        results = await asyncio.gather(*(
+            batcher.submit("test-key", [{"role": "user", "content": str(i)}], "gpt-4o-mini", 10, 70, max_tokens=20)
+            for i in range(3)
+        ))
+
+    assert len(calls) == 1
+    assert calls[0]["response_format"] == {"type": "json_object"}
+    assert [r["choices"][0]["message"]["content"] for r in results] == ["titre 0", "titre 1", "titre 2"]
+    assert sum(r["usage"]["total_tokens"] for r in results) == 39
+    assert batcher.get_stats()["calls_saved"] == 2
+
+@pytest.mark.asyncio
+async def test_micro_batcher_falls_back_on_parse_failure():
+    """Teste le repli en appels individuels si la sortie JSON est inexploitable"""
+    calls = []
+
+    async def fake_call(**kwargs):
+        calls.append(kwargs)
+        if "response_format" in kwargs:
+            return {"choices": [{"message": {"content": "pas du json"}, "finish_reason": "stop"}], "usage": {}}
+        return {"choices": [{"message": {"content": "seul"}}], "usage": {"total_tokens": 5}}
+
+    batcher = MicroBatcher(window=0.01)
+    with patch("shared.chat_proxy.call_openai_with_retry", side_effect=fake_call):
+        results = await asyncio.gather(*(
+            batcher.submit("test-key", [{"role": "user", "content": str(i)}], "gpt-4o-mini", 10, 70)
+            for i in range(2)
+        ))
+
+    assert len(calls) == 3
+    assert all(r["choices"][0]["message"]["content"] == "seul" for r in results)
+    assert batcher.get_stats()["fallbacks"] == 1
+
+@pytest.mark.asyncio
+async def test_micro_batcher_keeps_incompatible_requests_apart():
+    """Teste que modèles différents et prompts longs ne sont pas regroupés"""
+    calls = []
+
+    async def fake_call(**kwargs):
+        calls.append(kwargs)
+        return {"choices": [{"message": {"content": "ok"}}], "usage": {}}
+
+    batcher = MicroBatcher(window=0.01, max_prompt_chars=100)
+    with patch("shared.chat_proxy.call_openai_with_retry", side_effect=fake_call):
+        await asyncio.gather(
+            batcher.submit("test-key", [{"role": "user", "content": "a"}], "gpt-4o-mini", 10, 70),
+            batcher.submit("test-key", [{"role": "user", "content": "b"}], "gpt-4o", 10, 70),
+            batcher.submit("test-key", [{"role": "user", "content": "x" * 500}], "gpt-4o-mini", 10, 70),
+            # Tenants différents: jamais dans le même prompt
+            batcher.submit("test-key", [{"role": "user", "content": "c"}], "gpt-4o", 10, 70, tenant="site-a"),
+            batcher.submit("test-key", [{"role": "user", "content": "d"}], "gpt-4o", 10, 70, tenant="site-b")
+        )
+
+    assert len(calls) == 5
+    assert all("response_format" not in call for call in calls)
+
+@pytest.mark.asyncio
+async def test_micro_batcher_opt_in_and_service_metrics(monkeypatch):
+    """Teste le batcher désactivé par défaut et les appels individuels comptés dans les métriques du service"""
+    from shared.services import SharedResources
+    monkeypatch.delenv("MICRO_BATCH_ENABLED", raising=False)
+    assert SharedResources().batcher is None
+    monkeypatch.setenv("MICRO_BATCH_ENABLED", "1")
+    assert isinstance(SharedResources().batcher, MicroBatcher)
+
+    seen = []
+
+    async def fake_call(**kwargs):
+        seen.append(kwargs.get("chat_metrics"))
+        return {"choices": [{"message": {"content": "ok"}}], "usage": {}}
+
+    service_metrics = ChatMetrics()
+    batcher = MicroBatcher(window=0.01, max_prompt_chars=100)
+    with patch("shared.chat_proxy.call_openai_with_retry", side_effect=fake_call):
+        await batcher.submit("test-key", [{"role": "user", "content": "x" * 500}], "gpt-4o-mini", 10, 70,
+                             chat_metrics=service_metrics)
+        await batcher.submit("test-key", [{"role": "user", "content": "seul"}], "gpt-4o-mini", 10, 70,
+                             chat_metrics=service_metrics)
+    assert seen == [service_metrics, service_metrics]
+
+@pytest.mark.asyncio
+async def test_batchable_request_batched_per_project_only():
+    """Teste que handle_chat_request ne regroupe que les requêtes portant un project_id, par projet"""
+    batcher = MicroBatcher(window=0.01)
+    result = {"model": "gpt-4o-mini", "choices": [{"message": {"content": "ok"}}], "usage": {}}
+    with patch.object(batcher, "submit", new=AsyncMock(return_value=result)) as submit, \
+            patch("shared.chat_proxy.call_openai_with_retry", new=AsyncMock(return_value=result)) as direct:
+        messages = [Message(role="user", content="Titre ?")]
+        await handle_chat_request(ChatRequest(messages=messages, batchable=True), "test-key", "gpt-4o-mini", 10, 70,
+                                  batcher=batcher)
+        assert submit.await_count == 0 and direct.await_count == 1
+        await handle_chat_request(ChatRequest(messages=messages, batchable=True, project_id="site-a"), "test-key",
+                                  "gpt-4o-mini", 10, 70, batcher=batcher)
+        assert submit.await_args.kwargs["tenant"] == "site-a"
+
+# Tests de la boucle d'outils
+def _tool_call(call_id, name, arguments):
+    import json
+    return {"id": call_id, "type": "function", "function": {"name": name, "arguments": json.dumps(arguments)}}
+
+@pytest.mark.asyncio
+async def test_tool_loop_runs_calls_in_parallel():
+    """Teste que les appels d'un même tour sont parallèles et que les résultats sont renvoyés au modèle"""
+    registry = ToolRegistry()
+
+    @registry.tool(description="Météo d'une ville", timeout=1)
+    async def weather(city: str):
+        await asyncio.sleep(0.1)
+        return {"city": city, "temp": 21}
+
+    @registry.tool(timeout=0.05)
+    async def slow():
+        await asyncio.sleep(1)
+
+    calls = []
+
+    async def fake_call(**kwargs):
+        calls.append(kwargs)
+        if len(calls) == 1:
+            message = {"role": "assistant", "content": None, "tool_calls": [
+                _tool_call("a", "weather", {"city": "Montréal"}),
+                _tool_call("b", "weather", {"city": "Paris"}),
+                _tool_call("c", "slow", {}),
+                _tool_call("d", "weather", {"town": "Lyon"}),
+            ]}
+        else:
+            message = {"role": "assistant", "content": "Il fait 21°C partout."}
+        return {"model": "gpt-4o-mini", "choices": [{"message": message}], "usage": {"total_tokens": 10}}
+
+    chat_metrics = ChatMetrics()
+    started = asyncio.get_running_loop().time()
+    with patch("shared.chat_proxy.call_openai_with_retry", side_effect=fake_call):
+        result = await run_tool_loop(
+            {"api_key": "k", "messages": [{"role": "user", "content": "Météo ?"}], "model": "gpt-4o-mini",
+             "connect_timeout": 10, "read_timeout": 70},
+            ["weather", "slow"], chat_metrics=chat_metrics, registry=registry
+        )
+    assert asyncio.get_running_loop().time() - started < 0.25  # 3 x 0.1s en parallèle
+    assert result["tool_steps"] == 1 and result["usage"]["total_tokens"] == 20
+    assert [t["function"]["name"] for t in calls[0]["tools"]] == ["weather", "slow"]
+    tool_messages = calls[1]["messages"][2:]
+    assert [m["tool_call_id"] for m in tool_messages] == ["a", "b", "c", "d"]
+    assert '"Paris"' in tool_messages[1]["content"]
+    assert "TOOL_TIMEOUT" in tool_messages[2]["content"] and "INVALID_ARGUMENTS" in tool_messages[3]["content"]
+    stats = chat_metrics.get_stats()["tools"]
+    assert stats["steps"] == 1
+    assert stats["by_name"]["weather"]["calls"] == 3 and stats["by_name"]["weather"]["errors"] == {"invalid_arguments": 1}
+    assert stats["by_name"]["slow"]["errors"] == {"timeout": 1}
+
+@pytest.mark.asyncio
+async def test_tool_loop_max_steps_forces_final_answer():
+    """Teste qu'au budget d'étapes épuisé, un dernier appel sans outils produit la réponse"""
+    registry = ToolRegistry()
+
+    @registry.tool()
+    async def ping():
+        return "pong"
+
+    calls = []
+
+    async def fake_call(**kwargs):
+        calls.append(kwargs["tool_choice"])
+        message = {"content": "fin"} if kwargs["tool_choice"] == "none" else {"content": None, "tool_calls": [_tool_call(str(len(calls)), "ping", {})]}
+        return {"choices": [{"message": message}], "usage": {"total_tokens": 1}}
+
+    with patch("shared.chat_proxy.call_openai_with_retry", side_effect=fake_call):
+        result = await run_tool_loop(
+            {"api_key": "k", "messages": [{"role": "user", "content": "boucle"}], "model": "m",
+             "connect_timeout": 10, "read_timeout": 70},
+            ["ping"], max_steps=2, chat_metrics=ChatMetrics(), registry=registry
+        )
+    assert calls == ["auto", "auto", "none"]
+    assert result["tool_steps"] == 2 and result["choices"][0]["message"]["content"] == "fin"
+
+    with pytest.raises(HTTPException) as exc:
+        registry.specs(["ping", "absent"])
+    assert exc.value.status_code == 400 and exc.value.detail["error"] == "UNKNOWN_TOOL"
+
+async def _simulate_outage(budget: RetryBudget, healthy: int = 100, failing: int = 200) -> dict:
+    """Trafic sain puis panne upstream (503): appels sortants par requête pendant la panne"""
+    calls = {"count": 0}
+    outage = {"on": False}
+
+    async def upstream(url, headers, payload, timeout):
+        calls["count"] += 1
+        if outage["on"]:
+            return httpx.Response(503, text="Service Unavailable")
+        return httpx.Response(200, json={"choices": [{"message": {"role": "assistant", "content": "ok"}}]})
+
+    chat_metrics = ChatMetrics()
+    errors = []
+    # Circuit breaker neutralisé: on mesure le seul effet du budget
+    with patch("shared.chat_proxy.post_upstream", upstream), \
+         patch("shared.chat_proxy.circuit_breaker", CircuitBreaker(failure_threshold=10**6)), \
+         patch("shared.chat_proxy.retry_budget", budget), \
+         patch("shared.chat_proxy.INITIAL_BACKOFF", 0):
+        for _ in range(healthy):
+            await call_openai_with_retry(
+                api_key="k", messages=[{"role": "user", "content": "Hi"}], model="gpt-4o-mini",
+                connect_timeout=5, read_timeout=5, chat_metrics=chat_metrics
+            )
+        outage["on"], calls["count"] = True, 0
+        for _ in range(failing):
+            with pytest.raises(HTTPException) as exc:
+                await call_openai_with_retry(
+                    api_key="k", messages=[{"role": "user", "content": "Hi"}], model="gpt-4o-mini",
+                    connect_timeout=5, read_timeout=5, chat_metrics=chat_metrics
+                )
+            errors.append(exc.value)
+        stats = chat_metrics.get_stats()["retries"]
+    return {"amplification": calls["count"] / failing, "errors": errors, "stats": stats}
+
+@pytest.mark.asyncio
+async def test_retry_budget_caps_amplification_during_outage():
+    """Simulation de panne: le budget de retries ramène l'amplification de ~3x à ~1.1x"""
+    unbounded = await _simulate_outage(RetryBudget(ratio=100))
+    assert unbounded["amplification"] == 3.0
+    assert unbounded["stats"]["budget_exhausted"] == 0
+
+    bounded = await _simulate_outage(RetryBudget(ratio=0.1, min_retries=5))
+    # Au plus 10% des premières tentatives de la fenêtre (+5) partent en retry
+    assert bounded["amplification"] <= 1 + (0.1 * 300 + 5) / 200
+    assert all(e.status_code == 502 for e in bounded["errors"])
+    denied = [e for e in bounded["errors"] if e.detail.get("retry_budget_exhausted")]
+    assert len(denied) > 150
+    stats = bounded["stats"]
+    assert stats["budget_exhausted"] == len(denied)
+    assert stats["count"] == stats["budget"]["retries"] <= 35
+    assert stats["budget"]["exhausted"] == len(denied)
+
 # Fixture pour réinitialiser le circuit breaker entre les tests
 @pytest.fixture(autouse=True)
 def reset_circuit_breaker():
@@ -238,7 +524,9 @@ def reset_circuit_breaker():
     circuit_breaker.state = "closed"
     circuit_breaker.failure_count = 0
     circuit_breaker.last_failure_time = 0
-    yield
+    # Budget de retries neuf: les tests ne se partagent pas la fenêtre glissante
+    with patch("shared.chat_proxy.retry_budget", RetryBudget()):
+        yield
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
@@ -0,0 +1,119 @@
+"""
+Tests pour shared/compression.py
+"""
+import gzip
+import zlib
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from fastapi.testclient import TestClient
+from shared import compression
+from shared.compression import CompressionMiddleware, PrecompressedAsset, negotiate_encoding
+
+def test_negotiate_encoding():
+    """Teste la négociation Accept-Encoding"""
+    assert negotiate_encoding(None) is None
+    assert negotiate_encoding("identity") is None
+    assert negotiate_encoding("gzip, deflate") == "gzip"
+    assert negotiate_encoding("gzip;q=0") is None
+    assert negotiate_encoding("*") in ("br", "gzip")
+    if compression.brotli is not None:
+        assert negotiate_encoding("gzip, br") == "br"
+        assert negotiate_encoding("br;q=0.1, gzip;q=0.9") == "gzip"
+
+def test_negotiate_without_brotli(monkeypatch):
+    """Teste le repli gzip quand brotli n'est pas installé"""
+    monkeypatch.setattr(compression, "brotli", None)
+    assert negotiate_encoding("br") is None
+    assert negotiate_encoding("br, gzip") == "gzip"
+
+def _app():
+    app = FastAPI()
+
+    @app.get("/big")
+    async def big():
+        return {"history": [{"role": "user", "content": "bonjour " * 50}] * 20}
+
+    @app.get("/small")
+    async def small():
+        return {"ok": True}
+
+    @app.get("/stream")
+    async def stream():
+        async def chunks():
+            for i in range(5):
+                yield ("<p>chunk %d</p>" % i) * 200
+        return StreamingResponse(chunks(), media_type="text/html")
+
+    @app.get("/binary")
+    async def binary():
+        return PlainTextResponse("x" * 5000, media_type="application/octet-stream")
+
+    app.add_middleware(CompressionMiddleware, minimum_size=500)
+    return app
+
+def test_middleware_compresses_large_json():
+    """Teste la compression gzip d'une grosse réponse JSON"""
+    client = TestClient(_app())
+    raw = client.get("/big", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in raw.headers
+
+    response = client.get("/big", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert int(response.headers["content-length"]) < len(raw.content)
+    # httpx décompresse de façon transparente
+    assert response.json() == raw.json()
+
+def test_middleware_skips_small_and_binary():
+    """Teste le seuil de taille et les types non compressibles"""
+    client = TestClient(_app())
+    response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    response = client.get("/binary", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+
+def test_middleware_streams_compressed_chunks():
+    """Teste la compression chunk par chunk d'une réponse streamée"""
+    client = TestClient(_app())
+    with client.stream("GET", "/stream", headers={"Accept-Encoding": "gzip"}) as response:
+        assert response.headers["content-encoding"] == "gzip"
+        assert "content-length" not in response.headers
+        raw = b"".join(response.iter_raw())
+    expected = "".join(("<p>chunk %d</p>" % i) * 200 for i in range(5))
+    assert zlib.decompress(raw, 31).decode() == expected
+    assert len(raw) < len(expected)
+
+def test_precompressed_asset():
+    """Teste l'ETag fort propre à chaque codage, le 304 et les variantes précompressées"""
+    asset = PrecompressedAsset("<html>" + "x" * 2000 + "</html>", "text/html; charset=utf-8")
+    app = FastAPI()
+
+    @app.get("/")
+    async def home(request: Request):
+        return asset.response(request.headers)
+
+    client = TestClient(app)
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["etag"] == asset.etag_for("gzip") != asset.etag
+    assert response.headers["etag"].startswith('"')
+    assert "max-age" in response.headers["cache-control"]
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.text.startswith("<html>")
+
+    response = client.get("/", headers={"If-None-Match": asset.etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    # Validateur obtenu en gzip, revalidé sans compression: toujours la même ressource
+    response = client.get("/", headers={"If-None-Match": f'"other", {asset.etag_for("gzip")}',
+                                        "Accept-Encoding": "identity"})
+    assert response.status_code == 304 and response.headers["etag"] == asset.etag
+
+    response = client.get("/", headers={"If-None-Match": '"other"', "Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+    assert gzip.decompress(asset.variants["gzip"]) == asset.body
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
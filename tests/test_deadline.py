@@ -0,0 +1,139 @@
+"""
+Tests des deadlines et de l'annulation sur déconnexion (shared/deadline.py)
+"""
+import time
+import json
+import asyncio
+import httpx
+import pytest
+from unittest.mock import patch
+from fastapi import FastAPI, HTTPException
+from shared.chat_proxy import (
+    ChatRequest, call_openai_with_retry, handle_chat_request,
+    open_upstream_pool, close_upstream_pool, metrics
+)
+from shared.deadline import MAX_REQUEST_BUDGET, Deadline, DeadlineMiddleware, _current_deadline
+
+def _scope(headers=()):
+    return {
+        "type": "http", "method": "POST", "path": "/api/chat", "query_string": b"",
+        "headers": [(b"content-type", b"application/json"), *headers],
+    }
+
+async def _drive(app, scope, body: bytes, disconnect_after=None):
+    """Exécute l'app ASGI; le client se déconnecte après `disconnect_after` secondes"""
+    sent = []
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        if disconnect_after is None:
+            await asyncio.Event().wait()
+        await asyncio.sleep(disconnect_after)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    return sent
+
+def _chat_app():
+    app = FastAPI()
+
+    @app.post("/api/chat")
+    async def chat(request: ChatRequest):
+        return await handle_chat_request(request, "test-key", "gpt-4o-mini", 10, 70)
+
+    app.add_middleware(DeadlineMiddleware)
+    return app
+
+def test_deadline_from_headers():
+    """Teste que le budget le plus court l'emporte et que les valeurs invalides sont ignorées"""
+    deadline = Deadline.from_headers(
+        [(b"x-request-timeout", b"30"), (b"x-request-deadline", str(time.time() + 5).encode())],
+        now=100.0
+    )
+    assert 104 < deadline.expires_at <= 105
+    assert Deadline.from_headers([(b"x-request-timeout", b"abc")]).remaining() is None
+
+def test_deadline_rejects_non_finite_and_caps_budget():
+    """Teste que nan/inf sont ignorés et qu'un budget démesuré est ramené à MAX_REQUEST_BUDGET"""
+    for value in (b"nan", b"inf", b"-inf", b"NaN"):
+        assert Deadline.from_headers([(b"x-request-timeout", value)]).expires_at is None
+        assert Deadline.from_headers([(b"x-request-deadline", value)]).expires_at is None
+    deadline = Deadline.from_headers([(b"x-request-timeout", b"nan"), (b"x-request-timeout", b"1e12")], now=0.0)
+    assert deadline.expires_at == MAX_REQUEST_BUDGET
+
+@pytest.mark.asyncio
+async def test_disconnect_cancels_upstream_call():
+    """Teste qu'une déconnexion du client annule l'appel upstream et est comptée"""
+    cancelled = asyncio.Event()
+
+    async def slow_upstream(**kwargs):
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    before = metrics.cancelled_by_reason.get("client_disconnect", 0)
+    body = json.dumps({"messages": [{"role": "user", "content": "x" * 400}], "max_tokens": 100}).encode()
+    with patch("shared.chat_proxy.call_openai_with_retry", side_effect=slow_upstream):
+        sent = await asyncio.wait_for(_drive(_chat_app(), _scope(), body, disconnect_after=0.05), 5)
+
+    assert cancelled.is_set()
+    assert sent[0]["status"] == 499
+    assert metrics.cancelled_by_reason["client_disconnect"] == before + 1
+    assert metrics.get_stats()["cancellations"]["saved_tokens_estimate"] >= 200
+
+@pytest.mark.asyncio
+async def test_deadline_expiry_returns_504():
+    """Teste qu'une deadline dépassée coupe la requête avec un 504"""
+    async def slow_upstream(**kwargs):
+        await asyncio.sleep(30)
+
+    body = json.dumps({"messages": [{"role": "user", "content": "Hi"}]}).encode()
+    with patch("shared.chat_proxy.call_openai_with_retry", side_effect=slow_upstream):
+        started = time.monotonic()
+        sent = await _drive(_chat_app(), _scope([(b"x-request-timeout", b"0.1")]), body)
+
+    assert time.monotonic() - started < 2
+    assert sent[0]["status"] == 504
+    assert json.loads(sent[1]["body"])["detail"]["error"] == "DEADLINE_EXCEEDED"
+
+@pytest.mark.asyncio
+async def test_deadline_shrinks_timeouts_and_skips_retries():
+    """Teste que le budget restant borne les timeouts et évite des retries inutiles"""
+    read_timeouts = []
+
+    def handler(request):
+        read_timeouts.append(request.extensions["timeout"]["read"])
+        return httpx.Response(500, text="boom")
+
+    skipped_before = metrics.retries_skipped
+    await open_upstream_pool(transport=httpx.MockTransport(handler))
+    token = _current_deadline.set(Deadline(time.monotonic() + 1.2))
+    try:
+        with pytest.raises(HTTPException) as exc:
+            await call_openai_with_retry(
+                api_key="test-key",
+                messages=[{"role": "user", "content": "Hi"}],
+                model="gpt-4o-mini",
+                connect_timeout=10,
+                read_timeout=70
+            )
+    finally:
+        _current_deadline.reset(token)
+        await close_upstream_pool()
+
+    assert exc.value.status_code == 504
+    assert exc.value.detail["error"] == "DEADLINE_EXCEEDED"
+    assert exc.value.detail["last_error"]["status"] == 500
+    # Une seule tentative: le backoff de 1s ne laissait pas assez de budget
+    assert len(read_timeouts) == 1 and read_timeouts[0] <= 1.2
+    assert metrics.retries_skipped == skipped_before + 2
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
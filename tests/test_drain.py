@@ -0,0 +1,147 @@
+"""
+Tests de l'arrêt progressif (shared/drain.py): refus du nouveau travail, attente des générations
+en cours, et SIGTERM envoyé à un vrai process uvicorn sous charge
+"""
+import os
+import sys
+import json
+import signal
+import asyncio
+import httpx
+import pytest
+from unittest.mock import AsyncMock, patch
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+from shared.drain import ShutdownDrain
+from shared.services import ServiceConfig, SharedResources, create_chat_app, create_gateway_app
+from benchmarks.bench_ws_chat import ROOT, _free_port, _spawn, _wait_ready
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+@pytest.fixture
+def drain():
+    instance = ShutdownDrain(timeout=1.0)
+    # Warm-up partagé isolé: pas de pool upstream ouvert par /healthz
+    with patch("shared.drain.drain", instance), patch("shared.services.drain", instance), \
+            patch("shared.ws_chat.drain", instance), patch("shared.services.resources", SharedResources()), \
+            patch("shared.services.prewarm", new=AsyncMock(return_value={})):
+        yield instance
+
+@pytest.mark.asyncio
+async def test_drain_waits_for_in_flight_work():
+    """Teste l'attente du travail en cours puis l'abandon au-delà de DRAIN_TIMEOUT"""
+    drain = ShutdownDrain(timeout=2.0)
+
+    async def work(seconds):
+        with drain.track():
+            await asyncio.sleep(seconds)
+
+    task = asyncio.ensure_future(work(0.2))
+    await asyncio.sleep(0)
+    assert await drain.drain() is True and task.done()
+    assert drain.get_stats()["completed_during_drain"] == 1
+
+    drain = ShutdownDrain(timeout=0.1)
+    drain.hold()
+    assert await drain.drain() is False and drain.get_stats()["abandoned"] == 1
+
+def test_draining_service_refuses_new_work(drain, monkeypatch):
+    """Teste les 503 SERVICE_DRAINING (HTTP et WebSocket) et /healthz non prêt pendant le drain"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    client = TestClient(create_chat_app(ServiceConfig("hey-hi-test")))
+    assert client.get("/healthz").status_code == 200
+
+    with client.websocket_connect("/ws/chat") as ws:
+        ws.receive_json()
+        drain.draining = True
+        ws.send_json({"type": "chat", "id": "t1", "messages": [{"role": "user", "content": "Bonjour"}]})
+        frame = ws.receive_json()
+        assert frame["status"] == 503 and frame["detail"]["error"] == "SERVICE_DRAINING"
+
+    response = client.post("/api/chat", json={"messages": [{"role": "user", "content": "Bonjour"}]})
+    assert response.status_code == 503 and response.headers["retry-after"] == "2"
+    assert response.json()["detail"]["error"] == "SERVICE_DRAINING"
+    health = client.get("/healthz")
+    assert health.status_code == 503 and health.json()["ready"] is False and health.json()["draining"] is True
+    with pytest.raises(WebSocketDisconnect) as exc:
+        with client.websocket_connect("/ws/chat"):
+            pass
+    assert exc.value.code == 1012
+    assert client.get("/metrics").json()["drain"]["rejected"] == 2
+
+def test_draining_mounted_service_keeps_exempt_paths(drain):
+    """Teste les exemptions du drain sous un préfixe de gateway (/coach/metrics, /coach/__version)"""
+    client = TestClient(create_gateway_app({"coach": create_chat_app(ServiceConfig("hey-hi-coach-onlymatt", prefix="coach"))}))
+    drain.draining = True
+    assert client.get("/coach/metrics").status_code == 200
+    assert client.get("/coach/__version").status_code == 200
+    assert client.get("/metrics").status_code == 200
+    response = client.post("/coach/api/chat", json={"messages": [{"role": "user", "content": "Bonjour"}]})
+    assert response.status_code == 503 and response.json()["detail"]["error"] == "SERVICE_DRAINING"
+
+async def _load_then_sigterm(server, base: str) -> dict:
+    messages = [{"role": "user", "content": "Comment améliorer ma posture ?"}]
+    async with httpx.AsyncClient(base_url=base, timeout=30) as client, \
+            websockets.connect(base.replace("http", "ws") + "/ws/chat") as ws:
+        await ws.recv()
+        await ws.send(json.dumps({"type": "chat", "id": "t1", "messages": messages}))
+        posts = [asyncio.ensure_future(client.post("/api/chat", json={"messages": messages})) for _ in range(8)]
+        # Générations de 1 s en cours: SIGTERM au milieu (redéploiement)
+        await asyncio.sleep(0.4)
+        server.send_signal(signal.SIGTERM)
+        await asyncio.sleep(0.2)
+        during = {
+            "health": (await client.get("/healthz")).status_code,
+            "new_request": (await client.post("/api/chat", json={"messages": messages})).status_code,
+            "drain": (await client.get("/metrics")).json()["drain"]
+        }
+        frames = []
+        while not frames or frames[-1]["type"] not in ("done", "error", "cancelled"):
+            frames.append(json.loads(await ws.recv()))
+        responses = await asyncio.gather(*posts)
+    return {"during": during, "statuses": [r.status_code for r in responses], "ws": frames[-1]}
+
+@pytest.mark.skipif(websockets is None, reason="le paquet websockets est requis")
+def test_sigterm_under_load_drops_no_in_flight_request():
+    """Teste un SIGTERM pendant 8 POST et un tour WebSocket en cours: tous aboutissent, puis le process s'arrête"""
+    stub_port, app_port = _free_port(), _free_port()
+    env = dict(os.environ)
+    stub = _spawn([
+        sys.executable, "-c",
+        "import uvicorn; from benchmarks.openai_stub import OpenAIStub; "
+        "uvicorn.run(OpenAIStub(base_latency=1.0, per_token_latency=0, concurrency=20), "
+        f"port={stub_port}, log_level='warning')"
+    ], env)
+    env.update({
+        "PYTHONPATH": os.pathsep.join([str(ROOT), str(ROOT / "hey-hi-coach-onlymatt")]),
+        "OPENAI_API_KEY": "test-key",
+        "OPENAI_CHAT_URL": f"http://127.0.0.1:{stub_port}/v1/chat/completions",
+        "SPECULATION_ENABLED": "0",
+        "MICRO_BATCH_ENABLED": "0",
+        "DRAIN_TIMEOUT": "10"
+    })
+    server = _spawn([sys.executable, "-m", "uvicorn", "app:app", "--port", str(app_port), "--log-level", "warning"], env)
+    base = f"http://127.0.0.1:{app_port}"
+    try:
+        asyncio.run(_wait_ready(f"http://127.0.0.1:{stub_port}/v1/models"))
+        asyncio.run(_wait_ready(f"{base}/healthz"))
+        result = asyncio.run(_load_then_sigterm(server, base))
+        returncode = server.wait(timeout=15)
+    finally:
+        server.kill()
+        stub.terminate()
+        server.wait()
+        stub.wait()
+
+    assert result["during"]["health"] == 503 and result["during"]["new_request"] == 503
+    assert result["during"]["drain"]["draining"] is True and result["during"]["drain"]["in_flight"] >= 9
+    assert result["statuses"] == [200] * 8
+    assert result["ws"]["type"] == "done" and result["ws"]["content"]
+    # Arrêt normal d'uvicorn une fois le drain terminé (signal rejoué après le lifespan)
+    assert returncode in (0, -signal.SIGTERM)
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
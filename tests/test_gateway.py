@@ -0,0 +1,129 @@
+"""
+Tests de la gateway multi-services (shared/services.py)
+"""
+import re
+import httpx
+import pytest
+from urllib.parse import urljoin
+from unittest.mock import AsyncMock, patch
+from fastapi.testclient import TestClient
+from shared.snapshot import decode_snapshot
+from shared.services import (
+    ServiceConfig, SharedResources, create_builder_app, create_chat_app, create_gateway_app, parse_gateway_hosts
+)
+
+def _gateway(hosts=None):
+    services = {
+        "coach": create_chat_app(ServiceConfig("hey-hi-coach-onlymatt", prefix="coach"), speculation=True),
+        "video": create_chat_app(ServiceConfig("hey-hi-video-onlymatt", prefix="video")),
+        "builder": create_builder_app(ServiceConfig("hey-hi-website-builder-onlymatt", prefix="builder")),
+    }
+    return create_gateway_app(services, hosts=hosts), services
+
+def test_service_config_prefix(monkeypatch):
+    """Teste la priorité des variables préfixées et les fichiers propres au service"""
+    monkeypatch.setenv("OPENAI_MODEL", "gpt-4o")
+    monkeypatch.setenv("VIDEO_OPENAI_MODEL", "gpt-4o-mini")
+    monkeypatch.setenv("APP_NAME", "hey-hi-gateway-onlymatt")
+    monkeypatch.setenv("STATE_SNAPSHOT_PATH", "/var/data/state.bin")
+    coach, video = ServiceConfig("coach-svc", prefix="coach"), ServiceConfig("video-svc", prefix="video")
+    assert coach.model == "gpt-4o" and video.model == "gpt-4o-mini"
+    assert coach.app_name == "coach-svc"
+    assert coach.get("STATE_SNAPSHOT_PATH") == "/var/data/state.bin.coach"
+    assert ServiceConfig("coach-svc").get("STATE_SNAPSHOT_PATH") == "/var/data/state.bin"
+    assert parse_gateway_hosts("coach.onlymatt.ca=coach, bad,video.onlymatt.ca=video") == {
+        "coach.onlymatt.ca": "coach", "video.onlymatt.ca": "video"
+    }
+
+def test_path_and_host_routing():
+    """Teste le routage par préfixe et par Host, et le healthz agrégé"""
+    gateway, _ = _gateway(hosts={"coach.example.com": "coach"})
+    client = TestClient(gateway)
+
+    assert client.get("/video/__version").json()["service"] == "hey-hi-video-onlymatt"
+    assert "AI Website Builder" in client.get("/builder/").text
+    health = client.get("/healthz").json()
+    assert health["ready"] is True and set(health["services"]) == {"coach", "video", "builder"}
+
+    # Sur le domaine du service, /healthz et /__version sont ceux du service
+    response = client.get("/__version", headers={"Host": "coach.example.com"})
+    assert response.json()["service"] == "hey-hi-coach-onlymatt"
+    assert client.get("/healthz", headers={"Host": "coach.example.com"}).json()["service"] == "hey-hi-coach-onlymatt"
+
+    with pytest.raises(ValueError):
+        create_gateway_app({}, hosts={"x.example.com": "absent"})
+
+def test_per_service_limits_and_metrics(monkeypatch):
+    """Teste les limites et métriques par service derrière un préfixe de montage"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("VIDEO_BODY_LIMITS", "/api/chat=1024")
+    gateway, _ = _gateway()
+    client = TestClient(gateway)
+
+    async def fake_call(**kwargs):
+        return {"choices": [{"message": {"content": "ok"}}], "usage": {"total_tokens": 5}, "model": kwargs["model"]}
+
+    body = {"messages": [{"role": "user", "content": "x" * 2000}]}
+    with patch("shared.chat_proxy.call_openai_with_retry", side_effect=fake_call):
+        assert client.post("/coach/api/chat", json=body).status_code == 200
+        response = client.post("/video/api/chat", json=body)
+    assert response.status_code == 413
+    assert response.json()["detail"]["limit_bytes"] == 1024
+
+    stats = client.get("/metrics").json()["services"]
+    assert stats["coach"]["total_requests"] == 1 and stats["coach"]["total_tokens"] == 5
+    assert stats["video"]["total_requests"] == 0
+
+def test_builder_form_posts_under_mount_prefix(monkeypatch):
+    """Teste le formulaire du builder servi sous /builder/: son URL de génération reste sous le préfixe"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    gateway, _ = _gateway()
+    client = TestClient(gateway)
+    page = client.get("/builder/")
+    assert page.status_code == 200
+    # Résolution de l'URL du fetch() comme le ferait le navigateur depuis la page
+    target = urljoin(str(page.url), re.search(r'fetch\("([^"]+)"', page.text).group(1))
+    assert target == "http://testserver/builder/build"
+
+    async def upstream(url, headers, payload, timeout):
+        return httpx.Response(200, json={
+            "model": payload["model"], "choices": [{"index": 0, "message": {"content": "<p>Accueil</p>"}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5}
+        })
+
+    with patch("shared.services.post_upstream", side_effect=upstream):
+        response = client.post(target, json={"title": "Accueil", "instructions": "Une page", "variants": 1})
+    assert response.status_code == 200 and response.json()["html"] == "<p>Accueil</p>"
+
+def test_gateway_lifespan_runs_shared_warmup_once():
+    """Teste que la gateway exécute le warm-up partagé une seule fois, puis celui de chaque service"""
+    shared = SharedResources()
+    with patch("shared.services.resources", shared), \
+         patch("shared.services.prewarm", new=AsyncMock(return_value={"validators_ms": 1.0})) as fake_prewarm, \
+         patch("shared.services.close_upstream_pool", new=AsyncMock()) as fake_close:
+        gateway, services = _gateway()
+        with TestClient(gateway) as client:
+            assert shared.lifecycle.ready
+            assert all(service.state.lifecycle.ready for service in services.values())
+            assert client.get("/coach/healthz").json()["ready"] is True
+    assert fake_prewarm.await_count == 1
+    assert fake_close.await_count == 1
+    assert not any(service.state.lifecycle.ready for service in services.values())
+
+def test_gateway_snapshots_shared_breaker_once(monkeypatch, tmp_path):
+    """Teste que le circuit breaker partagé n'est snapshoté que par un seul service de la gateway"""
+    monkeypatch.setenv("STATE_SNAPSHOT_PATH", str(tmp_path / "state.bin"))
+    shared = SharedResources()
+    with patch("shared.services.resources", shared), \
+         patch("shared.services.prewarm", new=AsyncMock(return_value={})), \
+         patch("shared.services.close_upstream_pool", new=AsyncMock()):
+        gateway, _ = _gateway()
+        with TestClient(gateway):
+            pass
+    _, coach = decode_snapshot((tmp_path / "state.bin.coach").read_bytes())
+    _, video = decode_snapshot((tmp_path / "state.bin.video").read_bytes())
+    assert "circuit_breaker" in coach and "circuit_breaker" not in video
+    assert "metrics" in coach and "metrics" in video
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,108 @@
+"""
+Tests du nettoyage en flux du HTML généré (shared/html_sanitizer.py)
+"""
+import httpx
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from shared.html_sanitizer import HTMLSanitizer, sanitize_html, sanitize_stream
+from shared.services import ServiceConfig, create_builder_app
+
+PAGE = """```html
+<!DOCTYPE html>
+<html lang="fr">
+  <head>
+    <title>  Coaching vidéo  </title>
+    <meta http-equiv="refresh" content="0;url=https://ailleurs.example">
+    <script>alert("x")</script>
+  </head>
+  <body onload="evil()">
+    <!-- section principale -->
+    <h1 class="titre">Bonjour   <em>le</em>   monde</h1>
+    <p>Prix &amp; offres &#233;té
+      <a href=" jav&#x09;ascript:alert(1)" title='dit "oui"'>piège</a> <a href="/contact">contact</a></p>
+    <iframe src="https://pub.example"><p>dedans</p></iframe>
+    <pre>  indentation
+    conservée  </pre>
+    <img src="data:image/png;base64,AAAA" alt="logo"><img src="data:text/html,<script>x</script>">
+  </body>
+</html>
+```
+Cette page contient un titre et un lien."""
+
+EXPECTED = (
+    '<!DOCTYPE html><html lang="fr"><head><title>Coaching vidéo</title></head><body>'
+    '<h1 class="titre">Bonjour <em>le</em> monde</h1>'
+    '<p>Prix &amp; offres &#233;té <a title="dit &quot;oui&quot;">piège</a> <a href="/contact">contact</a></p>'
+    '<pre>  indentation\n    conservée  </pre>'
+    '<img src="data:image/png;base64,AAAA" alt="logo"><img></body></html>'
+)
+
+def test_sanitizes_and_minifies_fenced_page():
+    """Teste le retrait des clôtures, balises et attributs actifs, et la minification"""
+    sanitizer = HTMLSanitizer()
+    assert sanitizer.process(PAGE) + sanitizer.flush() == EXPECTED
+    # script, iframe, meta refresh / onload, href javascript:, src data:text/html
+    assert sanitizer.removed_tags == 3 and sanitizer.removed_attributes == 3
+    assert sanitizer.bytes_out < sanitizer.bytes_in * 0.8
+
+    # Sans minification: seul le nettoyage s'applique
+    raw = sanitize_html("<p>a  <b>b</b>\n  <script>x</script></p>", minify=False)
+    assert raw == "<p>a  <b>b</b>\n  </p>"
+    # Sans clôture: le document passe tel quel (pas de ``` retirés au milieu)
+    assert sanitize_html("<p>x</p>\n```\n<p>y</p>") == "<p>x</p>```<p>y</p>"
+
+@pytest.mark.parametrize("vector", [
+    '<svg><style><img src=x onerror=alert(1)></style></svg>',
+    '<svg><a><animate attributeName="href" values="javascript:alert(1)"/><text y="20">clic</text></a></svg>',
+    '<svg><set attributeName="href" to="javascript:alert(1)"/></svg>',
+    '<math><mtext><table><mglyph><style><img src=x onerror=alert(1)></style></mglyph></table></mtext></math>',
+    '<style>p{color:red}<img src=x onerror=alert(1)></style>',
+    '<a values="javascript:alert(1)" from="javascript:alert(2)">lien</a>',
+])
+def test_foreign_content_and_rawtext_vectors(vector):
+    """Teste les XSS par contenu SVG/MathML, animations et texte brut de <style>, entier et par caractère"""
+    sanitizer = HTMLSanitizer()
+    chunked = "".join(sanitizer.process(c) for c in vector) + sanitizer.flush()
+    for out in (sanitize_html(vector), chunked):
+        assert "<img" not in out and "javascript" not in out and "<svg" not in out and "<math" not in out
+    assert sanitize_html("<style>p{color:red}</style><p>ok</p>") == "<style>p{color:red}</style><p>ok</p>"
+
+def test_chunked_output_matches_whole_document():
+    """Teste que le découpage en fragments (deltas streamés) ne change pas la sortie"""
+    for size in (1, 2, 3, 7, 16, 64, 1000):
+        sanitizer = HTMLSanitizer()
+        chunks = [sanitizer.process(PAGE[i:i + size]) for i in range(0, len(PAGE), size)]
+        assert "".join(chunks) + sanitizer.flush() == EXPECTED, size
+
+    # Pas de mise en tampon du document: la sortie suit l'entrée
+    sanitizer = HTMLSanitizer()
+    body = "<section><p>Paragraphe de présentation.</p></section>\n" * 200
+    emitted = sanitizer.process(body[:len(body) // 2])
+    assert len(emitted) > len(body) // 3
+
+@pytest.mark.asyncio
+async def test_sanitize_stream():
+    """Teste le nettoyage d'un flux asynchrone de fragments"""
+    async def deltas():
+        for i in range(0, len(PAGE), 5):
+            yield PAGE[i:i + 5]
+
+    assert "".join([chunk async for chunk in sanitize_stream(deltas())]) == EXPECTED
+
+def test_build_returns_sanitized_html(monkeypatch):
+    """Teste /build: sortie du modèle nettoyée et compteurs dans /metrics"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    client = TestClient(create_builder_app(ServiceConfig("om-builder-test")))
+
+    async def upstream(url, headers, payload, timeout):
+        return httpx.Response(200, json={"model": payload["model"], "choices": [{"message": {"content": PAGE}}]})
+
+    with patch("shared.services.post_upstream", side_effect=upstream):
+        response = client.post("/build", json={"title": "Accueil", "instructions": "Une page"})
+    assert response.status_code == 200 and response.json()["html"] == EXPECTED
+    stats = client.get("/metrics").json()["html_sanitizer"]
+    assert stats["pages"] == 1 and stats["removed_tags"] == 3 and stats["minify"] is True
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,153 @@
+"""
+Tests de l'Idempotency-Key (shared/idempotency.py) sur /api/chat et /build
+"""
+import asyncio
+import httpx
+import pytest
+from unittest.mock import patch
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from shared.idempotency import IdempotencyStore
+from shared.services import ServiceConfig, create_builder_app, create_chat_app
+
+@pytest.mark.asyncio
+async def test_store_attaches_replays_and_rejects_conflicts():
+    """Teste le rattachement au calcul en cours, le rejeu, le conflit de payload et l'expiration"""
+    store = IdempotencyStore(ttl=60)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"answer": len(calls)}
+
+    first, second = await asyncio.gather(store.run("k1", "fp", compute), store.run("k1", "fp", compute))
+    assert first == ({"answer": 1}, "executed") and second == ({"answer": 1}, "attached")
+    assert await store.run("k1", "fp", compute) == ({"answer": 1}, "replayed")
+    assert len(calls) == 1
+
+    with pytest.raises(HTTPException) as exc:
+        await store.run("k1", "autre", compute)
+    assert exc.value.status_code == 422 and exc.value.detail["error"] == "IDEMPOTENCY_KEY_REUSED"
+
+    # Un client annulé n'interrompt pas le calcul: le retry s'y rattache
+    waiter = asyncio.ensure_future(store.run("k2", "fp", compute))
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    assert await store.run("k2", "fp", compute) == ({"answer": 2}, "attached")
+
+    store.ttl = 0
+    await asyncio.sleep(0.01)
+    assert (await store.run("k1", "fp", compute))[1] == "executed"
+    stats = store.get_stats()
+    assert stats["attached"] == 2 and stats["replayed"] == 1 and stats["conflicts"] == 1
+
+@pytest.mark.asyncio
+async def test_store_forgets_failures():
+    """Teste qu'un échec n'est pas rejoué: le retry suivant recalcule"""
+    store = IdempotencyStore()
+    outcomes = [HTTPException(status_code=502, detail={"error": "OPENAI_SERVER_ERROR"}), {"answer": "ok"}]
+
+    async def compute():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    with pytest.raises(HTTPException):
+        await store.run("k", "fp", compute)
+    assert await store.run("k", "fp", compute) == ({"answer": "ok"}, "executed")
+    assert store.get_stats()["discarded"] == 1
+
+@pytest.mark.asyncio
+async def test_store_scopes_keys_and_never_evicts_in_flight():
+    """Teste des clés propres à chaque scope et l'éviction limitée aux résultats terminés"""
+    store = IdempotencyStore(max_entries=2)
+    release = asyncio.Event()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await release.wait()
+        return {"answer": len(calls)}
+
+    slow = asyncio.ensure_future(store.run("k", "fp-a", compute, scope="site-a"))
+    await asyncio.sleep(0)
+    assert await asyncio.wait_for(store.run("k", "fp-b", lambda: asyncio.sleep(0, {"b": 1}), scope="site-b"), 1) \
+        == ({"b": 1}, "executed")
+    # Capacité dépassée: seule l'entrée terminée (site-b) peut partir
+    third = asyncio.ensure_future(store.run("k3", "fp", compute, scope="site-a"))
+    await asyncio.sleep(0)
+    retry = asyncio.ensure_future(store.run("k", "fp-a", compute, scope="site-a"))
+    release.set()
+    assert (await retry)[1] == "attached" and (await slow)[1] == "executed"
+    await third
+    assert len(calls) == 2 and store.get_stats()["entries"] == 2
+
+def _upstream(calls):
+    async def fake(url, headers, payload, timeout):
+        calls.append(payload)
+        return httpx.Response(200, json={
+            "model": payload["model"],
+            "choices": [{"message": {"role": "assistant", "content": f"<p>Réponse {len(calls)}</p>"}}],
+            "usage": {"prompt_tokens": 5, "completion_tokens": 5, "total_tokens": 10}
+        })
+    return fake
+
+def test_chat_and_build_replay_duplicates(monkeypatch):
+    """Teste le rejeu sur /api/chat et /build: un seul appel upstream par clé"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    calls = []
+    chat = TestClient(create_chat_app(ServiceConfig("hey-hi-test")))
+    body = {"messages": [{"role": "user", "content": "Bonjour"}], "project_id": "site-a"}
+    other = {"messages": [{"role": "user", "content": "Autre"}], "project_id": "site-a"}
+    with patch("shared.chat_proxy.post_upstream", side_effect=_upstream(calls)):
+        first = chat.post("/api/chat", json=body, headers={"Idempotency-Key": "abc-1"})
+        retry = chat.post("/api/chat", json=body, headers={"Idempotency-Key": "abc-1"})
+        conflict = chat.post("/api/chat", json=other, headers={"Idempotency-Key": "abc-1"})
+        # project_id choisi par le client: en changer ne contourne pas le conflit
+        other_project = chat.post("/api/chat", json={**other, "project_id": "site-b"}, headers={"Idempotency-Key": "abc-1"})
+        # Autre Origin, même clé: calcul indépendant, pas de faux conflit
+        other_tenant = chat.post("/api/chat", json=other,
+                                 headers={"Idempotency-Key": "abc-1", "Origin": "https://site-b.example"})
+        invalid = chat.post("/api/chat", json=body, headers={"Idempotency-Key": "cle invalide"})
+        without_key = chat.post("/api/chat", json=body)
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json() and retry.headers["idempotent-replayed"] == "true"
+    assert "idempotent-replayed" not in first.headers
+    assert conflict.status_code == 422 and conflict.json()["detail"]["error"] == "IDEMPOTENCY_KEY_REUSED"
+    assert other_project.status_code == 422
+    assert invalid.status_code == 400
+    assert other_tenant.status_code == 200 and "idempotent-replayed" not in other_tenant.headers
+    assert without_key.status_code == 200 and len(calls) == 3
+    assert chat.get("/metrics").json()["idempotency"]["replayed"] == 1
+
+    builder = TestClient(create_builder_app(ServiceConfig("om-builder-test")))
+    body = {"title": "Accueil", "instructions": "Une section héro"}
+    with patch("shared.services.post_upstream", side_effect=_upstream(calls)):
+        first = builder.post("/build", json=body, headers={"Idempotency-Key": "page-1"})
+        retry = builder.post("/build", json=body, headers={"Idempotency-Key": "page-1"})
+    assert first.json()["html"] == retry.json()["html"] == "<p>Réponse 4</p>"
+    assert retry.headers["idempotent-replayed"] == "true" and len(calls) == 4
+
+def test_key_reused_with_other_payload_without_project(monkeypatch):
+    """Teste le 422 sans project_id: /build (pas de projet) et /api/chat anonyme"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    calls = []
+    builder = TestClient(create_builder_app(ServiceConfig("om-builder-test")))
+    with patch("shared.services.post_upstream", side_effect=_upstream(calls)):
+        first = builder.post("/build", json={"title": "Accueil", "instructions": "Héro"}, headers={"Idempotency-Key": "k"})
+        reused = builder.post("/build", json={"title": "Contact", "instructions": "Formulaire"}, headers={"Idempotency-Key": "k"})
+    assert first.status_code == 200
+    assert reused.status_code == 422 and reused.json()["detail"]["error"] == "IDEMPOTENCY_KEY_REUSED"
+
+    chat = TestClient(create_chat_app(ServiceConfig("hey-hi-test")))
+    with patch("shared.chat_proxy.post_upstream", side_effect=_upstream(calls)):
+        first = chat.post("/api/chat", json={"messages": [{"role": "user", "content": "Un"}]}, headers={"Idempotency-Key": "k"})
+        reused = chat.post("/api/chat", json={"messages": [{"role": "user", "content": "Deux"}]}, headers={"Idempotency-Key": "k"})
+    assert first.status_code == 200
+    assert reused.status_code == 422 and reused.json()["detail"]["error"] == "IDEMPOTENCY_KEY_REUSED"
+    assert len(calls) == 2
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
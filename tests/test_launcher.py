@@ -0,0 +1,57 @@
+"""
+Tests du lanceur de production (shared/launcher.py): dimensionnement des workers et des pools,
+profil publié aux workers et exposé sur /__version
+"""
+import json
+import pytest
+from fastapi.testclient import TestClient
+from shared.launcher import PROFILE_ENV, ServerProfile, main
+from shared.services import ServiceConfig, create_chat_app
+
+def test_profile_single_worker_unless_requested():
+    """Teste un seul worker par défaut (état en mémoire par process) et la suggestion bornée par CPU puis mémoire"""
+    small = ServerProfile.from_env(getenv={}.get, cpus=0.1, memory=512)
+    assert small.workers == small.suggested_workers == 1
+    assert small.upstream_pool_size == 64 and small.limit_concurrency == 256
+
+    # 4 CPU mais 512 Mo: (512 - 64) // 160 = 2 workers suggérés, 1 lancé
+    tight = ServerProfile.from_env(getenv={}.get, cpus=4, memory=512)
+    assert tight.workers == 1 and tight.suggested_workers == 2 and tight.upstream_pool_size == 64
+
+    large = ServerProfile.from_env(getenv={}.get, cpus=16, memory=65536)
+    assert large.workers == 1 and large.suggested_workers == 8
+
+    # Demande explicite: pool upstream réparti entre les workers
+    split = ServerProfile.from_env(getenv={"WEB_CONCURRENCY": "4"}.get, cpus=16, memory=65536)
+    assert split.workers == 4 and split.upstream_pool_size == 16 and split.limit_concurrency == 64
+
+def test_profile_env_overrides():
+    """Teste WEB_CONCURRENCY, UPSTREAM_POOL_SIZE et SERVER_LIMIT_CONCURRENCY prioritaires sur le calcul"""
+    env = {"WEB_CONCURRENCY": "3", "UPSTREAM_POOL_SIZE": "12", "SERVER_LIMIT_CONCURRENCY": "40",
+           "SERVER_BACKLOG": "512"}
+    profile = ServerProfile.from_env(getenv=env.get, cpus=1, memory=256)
+    kwargs = profile.uvicorn_kwargs()
+    assert kwargs["workers"] == 3 and profile.upstream_pool_size == 12
+    assert kwargs["limit_concurrency"] == 40 and kwargs["backlog"] == 512
+    assert kwargs["loop"] in ("uvloop", "asyncio") and kwargs["http"] in ("httptools", "h11")
+
+def test_dry_run_publishes_profile_on_version(monkeypatch, capsys):
+    """Teste --dry-run (profil affiché et publié dans l'environnement) puis sa lecture sur /__version"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.delenv(PROFILE_ENV, raising=False)
+    monkeypatch.delenv("UPSTREAM_POOL_SIZE", raising=False)
+    client = TestClient(create_chat_app(ServiceConfig("hey-hi-test")))
+    server = client.get("/__version").json()["server"]
+    assert server["launcher"] is False and "pid" in server
+
+    monkeypatch.setenv("WEB_CONCURRENCY", "2")
+    assert main(["--dry-run"]) == 0
+    printed = json.loads(capsys.readouterr().out)
+    assert printed["workers"] == 2 and printed["launcher"] is True
+
+    server = client.get("/__version").json()["server"]
+    assert server["workers"] == 2 and server["upstream_pool_size"] == printed["upstream_pool_size"]
+    assert server["running_loop"]
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,95 @@
+"""
+Tests de la politique de rétrogradation de modèle (shared/model_policy.py)
+"""
+import pytest
+from unittest.mock import patch
+from shared.chat_proxy import ChatRequest, handle_chat_request
+from shared.model_policy import ModelPolicy, DowngradeRule, observe_attempt, parse_rules
+
+def test_parse_rules():
+    """Teste le parsing de MODEL_POLICY_RULES"""
+    rules = parse_rules("gpt-4o->gpt-4o-mini:latency=8,token_latency=60,inflight=20;gpt-4-turbo->gpt-4o:budget=0.5")
+    assert [(r.source, r.target) for r in rules] == [("gpt-4o", "gpt-4o-mini"), ("gpt-4-turbo", "gpt-4o")]
+    assert rules[0].max_latency == 8 and rules[0].max_token_latency == 60 and rules[0].max_in_flight == 20
+    assert rules[1].max_budget_ratio == 0.5
+    assert parse_rules("") == []
+    with pytest.raises(ValueError):
+        parse_rules("gpt-4o->gpt-4o-mini:p99=3")
+
+def test_latency_downgrade_and_recovery():
+    """Teste la rétrogradation sur latence EWMA puis le retour quand la mesure vieillit"""
+    policy = ModelPolicy([DowngradeRule("gpt-4o", "gpt-4o-mini", max_latency=5)], alpha=0.5, stale_after=60)
+    assert policy.choose("gpt-4o", now=100) == ("gpt-4o", None)
+
+    policy.observe("gpt-4o", 4, now=100)
+    policy.observe("gpt-4o", 12, now=101)  # EWMA = 8
+    assert policy.choose("gpt-4o", now=102) == ("gpt-4o-mini", "latency")
+    # Plus de mesure récente: le modèle demandé est retenté
+    assert policy.choose("gpt-4o", now=200) == ("gpt-4o", None)
+    assert policy.get_stats()["downgrades"] == {"gpt-4o->gpt-4o-mini:latency": 1}
+
+def test_token_latency_measured_per_attempt_only():
+    """Teste que seules les tentatives upstream comptent (pas l'attente dans le bloc) et la latence par token"""
+    policy = ModelPolicy([DowngradeRule("gpt-4o", "gpt-4o-mini", max_token_latency=50)], alpha=1)
+    assert ModelPolicy.from_env(getenv={}.get).rules == {}
+    with policy.track("gpt-4o"):
+        # File du régulateur, backoff, outils: non mesurés
+        observe_attempt(3.0, completion_tokens=100)
+    observe_attempt(99.0)  # hors track: ignorée
+    assert policy.latency_ewma == {"gpt-4o": 3.0}
+    assert policy.token_latency_ewma == {"gpt-4o": 30.0}
+    assert policy.choose("gpt-4o") == ("gpt-4o", None)
+
+    # Page entière lente en absolu mais rapide par token: pas de rétrogradation
+    policy.observe("gpt-4o", 45.0, completion_tokens=3000)
+    assert policy.choose("gpt-4o") == ("gpt-4o", None)
+    policy.observe("gpt-4o", 20.0, completion_tokens=200)
+    assert policy.choose("gpt-4o") == ("gpt-4o-mini", "token_latency")
+
+def test_in_flight_and_budget_pressure():
+    """Teste la rétrogradation sur profondeur de file et sur budget consommé"""
+    policy = ModelPolicy([DowngradeRule("gpt-4o", "gpt-4o-mini", max_in_flight=1, max_budget_ratio=0.8)])
+    with policy.track("gpt-4o"):
+        assert policy.choose("gpt-4o") == ("gpt-4o-mini", "in_flight")
+    assert policy.in_flight == 0
+
+    with patch("shared.model_policy.usage_ledger") as ledger:
+        ledger.budget_ratio.return_value = 0.9
+        assert policy.choose("gpt-4o", project_id="site-a") == ("gpt-4o-mini", "budget")
+        ledger.budget_ratio.assert_called_with("site-a")
+
+def test_chained_rules_stop_on_cycle():
+    """Teste l'enchaînement des règles et l'arrêt sur un cycle"""
+    policy = ModelPolicy([
+        DowngradeRule("gpt-4-turbo", "gpt-4o", max_in_flight=0),
+        DowngradeRule("gpt-4o", "gpt-4o-mini", max_in_flight=0),
+        DowngradeRule("gpt-4o-mini", "gpt-4-turbo", max_in_flight=0),
+    ])
+    assert policy.choose("gpt-4-turbo") == ("gpt-4o-mini", "in_flight,in_flight")
+
+@pytest.mark.asyncio
+async def test_handle_chat_request_reports_downgrade():
+    """Teste que le modèle effectif est envoyé upstream et visible dans la réponse"""
+    policy = ModelPolicy([DowngradeRule("gpt-4o", "gpt-4o-mini", max_latency=1)])
+    policy.observe("gpt-4o", 30)
+    seen = []
+
+    async def fake_call(**kwargs):
+        seen.append(kwargs["model"])
+        observe_attempt(0.5, completion_tokens=2)
+        return {"choices": [{"message": {"content": "ok"}}], "usage": {"total_tokens": 3}, "model": kwargs["model"]}
+
+    request = ChatRequest(messages=[{"role": "user", "content": "Hi"}], model="gpt-4o")
+    with patch("shared.chat_proxy.call_openai_with_retry", side_effect=fake_call):
+        response = await handle_chat_request(request, "test-key", "gpt-4o-mini", 10, 70, policy=policy)
+
+    assert seen == ["gpt-4o-mini"]
+    assert response["model"] == "gpt-4o-mini"
+    assert response["requested_model"] == "gpt-4o"
+    assert response["model_downgrade"] == "latency"
+    assert policy.get_stats()["requests_by_model"] == {"gpt-4o-mini": 1}
+    assert policy.get_stats()["latency_ewma_seconds"]["gpt-4o-mini"] == 0.5
+    assert policy.get_stats()["token_latency_ewma_ms"]["gpt-4o-mini"] == 250
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
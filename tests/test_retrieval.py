@@ -0,0 +1,139 @@
+"""
+Tests de l'index de retrieval local (shared/retrieval.py) et de son injection dans le chat
+"""
+import json
+import httpx
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from shared.retrieval import RetrievalIndex, Retriever, build_index, chunk_text, main, tokenize
+from shared.services import ServiceConfig, create_chat_app
+
+DOCS = {
+    "voix.md": "# Voix\nRespirez par le ventre avant de parler. La projection de la voix vient du diaphragme, "
+               "pas de la gorge. Articulez lentement les consonnes.",
+    "lumiere/eclairage.html": "<h1>Éclairage</h1><p>Placez la lumière principale à 45 degrés du visage &amp; "
+                              "ajoutez une lumière de contre pour détacher le sujet du fond.</p>",
+    "cadrage.txt": "Cadrage: gardez les yeux sur la ligne du tiers supérieur. Laissez de l'air au-dessus de la tête.",
+    "notes.pdf": "ignoré (format non indexé)"
+}
+
+@pytest.fixture
+def index_dir(tmp_path):
+    docs = tmp_path / "docs"
+    for name, text in DOCS.items():
+        path = docs / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text, encoding="utf-8")
+    stats = build_index(docs, tmp_path / "index", chunk_words=12, overlap=4)
+    assert stats["documents"] == 3 and stats["chunks"] > 3
+    return tmp_path / "index"
+
+def test_tokenize_and_chunk():
+    """Teste la normalisation (accents, mots vides, pluriels) et le découpage avec recouvrement"""
+    assert tokenize("Les Lumières de l'éclairage, ÇA marche") == ["lumiere", "eclairage", "marche"]
+    words = " ".join(f"m{i}" for i in range(25))
+    chunks = chunk_text(words, words=10, overlap=2)
+    assert chunks[0].split()[-2:] == chunks[1].split()[:2]
+    assert chunks[-1].split()[-1] == "m24" and len(chunks) == 3
+    assert chunk_text("court", words=10, overlap=2) == ["court"] and chunk_text("  ") == []
+
+def test_index_search_and_cli(index_dir, capsys):
+    """Teste le classement BM25, la lecture des chunks en mmap et la CLI"""
+    index = RetrievalIndex(index_dir)
+    try:
+        score, chunk_id = index.search("Comment placer les lumières ?", k=1)[0]
+        source, text = index.chunk(chunk_id)
+        assert source == "lumiere/eclairage.html" and "lumière" in text and "<p>" not in text and "&amp;" not in text
+        assert index.chunk(index.search("respiration ventre diaphragme")[0][1])[0] == "voix.md"
+        assert index.search("inconnu xyz") == []
+    finally:
+        index.close()
+
+    assert main(["query", str(index_dir), "cadrage tiers", "-k", "1"]) == 0
+    assert "cadrage.txt" in capsys.readouterr().out
+
+    meta = json.loads((index_dir / "meta.json").read_text())
+    meta["format"] = 99
+    (index_dir / "meta.json").write_text(json.dumps(meta))
+    with pytest.raises(ValueError):
+        RetrievalIndex(index_dir)
+
+def test_augment_inserts_context_after_system_messages(index_dir):
+    """Teste l'injection des extraits (après le prompt system) et les limites top_k / max_chars"""
+    retriever = Retriever(RetrievalIndex(index_dir), top_k=3, min_score=0.1, max_chars=10)
+    messages = [
+        {"role": "system", "content": "Tu es un coach vidéo."},
+        {"role": "user", "content": "Ma voix manque de projection"}
+    ]
+    augmented = retriever.augment(messages)
+    assert [m["role"] for m in augmented] == ["system", "system", "user"]
+    # max_chars dépassé dès le premier extrait: un seul chunk injecté
+    assert "(voix.md)" in augmented[1]["content"] and "[2]" not in augmented[1]["content"]
+    assert retriever.augment([{"role": "user", "content": "sans rapport"}]) == [{"role": "user", "content": "sans rapport"}]
+    stats = retriever.get_stats()
+    assert stats["queries"] == 2 and stats["misses"] == 1 and stats["injected_chunks"] == 1
+    retriever.close()
+
+def test_chat_service_injects_retrieved_chunks(index_dir, monkeypatch):
+    """Teste /api/chat: extraits envoyés upstream selon RETRIEVAL_INDEX, opt-out par requête"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("RETRIEVAL_INDEX", str(index_dir))
+    monkeypatch.setenv("RETRIEVAL_MIN_SCORE", "0.1")
+    sent = []
+
+    async def upstream(url, headers, payload, timeout):
+        sent.append(payload["messages"])
+        return httpx.Response(200, json={
+            "model": payload["model"], "choices": [{"message": {"role": "assistant", "content": "ok"}}],
+            "usage": {"prompt_tokens": 5, "completion_tokens": 1, "total_tokens": 6}
+        })
+
+    client = TestClient(create_chat_app(ServiceConfig("hey-hi-test")))
+    question = [{"role": "user", "content": "Où placer la lumière de contre ?"}]
+    with patch("shared.chat_proxy.post_upstream", side_effect=upstream):
+        assert client.post("/api/chat", json={"messages": question}).status_code == 200
+        assert client.post("/api/chat", json={"messages": question, "retrieval": False}).status_code == 200
+    assert sent[0][0]["role"] == "system" and "eclairage.html" in sent[0][0]["content"]
+    assert sent[1] == question
+    assert client.get("/metrics").json()["retrieval"]["queries"] == 1
+
+def test_chat_service_server_tools(index_dir, monkeypatch):
+    """Teste server_tools de bout en bout sur /api/chat: search_docs et current_time exécutés puis renvoyés au modèle"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("RETRIEVAL_INDEX", str(index_dir))
+    monkeypatch.setenv("RETRIEVAL_MIN_SCORE", "0.1")
+    sent = []
+
+    async def upstream(url, headers, payload, timeout):
+        sent.append(payload)
+        if len(sent) == 1:
+            message = {"role": "assistant", "content": None, "tool_calls": [
+                {"id": "a", "type": "function", "function": {"name": "search_docs", "arguments": json.dumps({"query": "lumière de contre"})}},
+                {"id": "b", "type": "function", "function": {"name": "current_time", "arguments": json.dumps({"timezone": "America/Montreal"})}}
+            ]}
+        else:
+            message = {"role": "assistant", "content": "Placez-la derrière le sujet."}
+        return httpx.Response(200, json={
+            "model": payload["model"], "choices": [{"message": message}],
+            "usage": {"prompt_tokens": 5, "completion_tokens": 1, "total_tokens": 6}
+        })
+
+    client = TestClient(create_chat_app(ServiceConfig("hey-hi-test")))
+    body = {"messages": [{"role": "user", "content": "Où placer la lumière ?"}], "retrieval": False,
+            "server_tools": ["search_docs", "current_time"]}
+    with patch("shared.chat_proxy.post_upstream", side_effect=upstream):
+        response = client.post("/api/chat", json=body)
+        unknown = client.post("/api/chat", json={**body, "server_tools": ["absent"]})
+    assert response.status_code == 200 and response.json()["tool_steps"] == 1
+    assert [t["function"]["name"] for t in sent[0]["tools"]] == ["search_docs", "current_time"]
+    results = {m["tool_call_id"]: json.loads(m["content"]) for m in sent[1]["messages"] if m["role"] == "tool"}
+    assert results["a"]["results"][0]["source"] == "lumiere/eclairage.html"
+    assert results["b"]["timezone"] == "America/Montreal" and "T" in results["b"]["datetime"]
+    assert unknown.status_code == 400 and unknown.json()["detail"]["available"] == ["current_time", "search_docs"]
+    by_name = client.get("/metrics").json()["tools"]["by_name"]
+    assert by_name["search_docs"]["calls"] == by_name["current_time"]["calls"] == 1
+    assert by_name["search_docs"]["errors"] == by_name["current_time"]["errors"] == {}
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
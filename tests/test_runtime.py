@@ -0,0 +1,77 @@
+"""
+Tests de l'instrumentation runtime (shared/runtime.py) et de /debug/runtime
+"""
+import gc
+import time
+import asyncio
+import threading
+import pytest
+from fastapi.testclient import TestClient
+from shared.runtime import RuntimeMonitor, current_rss_bytes
+from shared.services import ServiceConfig, create_chat_app
+
+def _busy_handler(seconds: float):
+    """Bloque la boucle comme un sanitize_input sur une très grosse entrée"""
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+@pytest.mark.asyncio
+async def test_monitor_detects_loop_lag_and_gc_pauses():
+    """Teste la mesure du lag de boucle, des pauses GC et du RSS"""
+    monitor = RuntimeMonitor(interval=0.01, capacity=50)
+    monitor.start()
+    try:
+        await asyncio.sleep(0.05)
+        _busy_handler(0.1)
+        gc.collect()
+        await asyncio.sleep(0.05)
+    finally:
+        await monitor.stop()
+    stats = monitor.get_stats(last=5)
+    assert stats["running"] is False
+    assert stats["loop_lag_ms"]["max"] >= 50
+    assert stats["gc"]["pauses"] >= 1
+    assert len(stats["samples"]) == 5
+    assert current_rss_bytes() > 0
+    assert gc.callbacks.count(monitor._on_gc) == 0
+
+@pytest.mark.asyncio
+async def test_profile_collapsed_stacks():
+    """Teste le profil par échantillonnage du thread de la boucle"""
+    monitor = RuntimeMonitor()
+    loop_thread = threading.get_ident()
+    task = asyncio.create_task(asyncio.to_thread(monitor.profile, 0.1, 2, loop_thread))
+    await asyncio.sleep(0)  # le thread de profil démarre
+    _busy_handler(0.15)
+    profile = await task
+    top_stack, count = profile.splitlines()[0].rsplit(" ", 1)
+    assert "test_runtime.py:_busy_handler" in top_stack
+    assert int(count) > 1
+
+    # Un seul profil à la fois
+    monitor._profiling.acquire()
+    try:
+        assert monitor.profile(0.01) is None
+    finally:
+        monitor._profiling.release()
+
+def test_debug_endpoints(monkeypatch):
+    """Teste /debug/runtime et la protection de /debug/profile par ADMIN_KEY"""
+    client = TestClient(create_chat_app(ServiceConfig("hey-hi-test")))
+    data = client.get("/debug/runtime?samples=0").json()
+    assert data["in_flight"] == 1  # la requête en cours
+    assert set(data) >= {"loop_lag_ms", "upstream", "rss_bytes", "gc", "samples"}
+    assert client.post("/debug/profile").status_code == 404
+
+    monkeypatch.setenv("ADMIN_KEY", "s3cret")
+    client = TestClient(create_chat_app(ServiceConfig("hey-hi-test")))
+    response = client.post("/debug/profile?seconds=0.05", headers={"X-Admin-Key": "wrong"})
+    assert response.status_code == 403
+    assert response.json()["detail"]["error"] == "FORBIDDEN"
+    response = client.post("/debug/profile?seconds=0.05&interval_ms=1", headers={"X-Admin-Key": "s3cret"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
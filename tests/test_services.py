@@ -3,6 +3,7 @@ Tests d'intégration pour les services hey-hi
 """
 import pytest
 from fastapi.testclient import TestClient
+from shared.body_limit import DEFAULT_BODY_LIMITS, parse_body_limits
 
 # Test du service coach
 def test_coach_service():
@@ -19,6 +20,7 @@ def test_coach_service():
     assert response.status_code == 200
     data = response.json()
     assert data["ok"] is True
+    assert data["ready"] is True
     assert "service" in data
     
     # Test version
@@ -34,6 +36,13 @@ def test_coach_service():
     data = response.json()
     assert "total_requests" in data
     assert "success_rate" in data
+    
+    # Test usage
+    response = client.get("/usage?window=3600&group_by=project_id")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["window_seconds"] == 3600
+    assert isinstance(data["usage"], list)
 
 def test_video_service():
     """Teste les endpoints du service video"""
@@ -117,6 +126,28 @@ def test_chat_endpoint_validation():
         ]
     })
     assert response.status_code == 422
+    error = response.json()["detail"][0]
+    assert error["loc"] == ["body", "messages", 0, "role"]
+    assert error["msg"] == "Value error, Invalid role"
+    
+    # Message trop long
+    response = client.post("/api/chat", json={
+        "messages": [
+            {"role": "user", "content": "x" * 50001}
+        ]
+    })
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["msg"] == "Value error, Message too long (max 50000 chars)"
+    
+    # JSON invalide
+    response = client.post("/api/chat", content=b"{not json", headers={"Content-Type": "application/json"})
+    assert response.status_code == 422
+    
+    # Body au-delà de toute requête valide: refusé avant lecture (413)
+    limit = parse_body_limits(DEFAULT_BODY_LIMITS)["/api/chat"]
+    response = client.post("/api/chat", content=b"x" * (limit + 1), headers={"Content-Type": "application/json"})
+    assert response.status_code == 413
+    assert response.json()["detail"]["error"] == "PAYLOAD_TOO_LARGE"
 
 def test_cors_headers():
     """Teste la présence des headers CORS"""
@@ -134,5 +165,62 @@ def test_cors_headers():
     
     assert "access-control-allow-origin" in response.headers or response.status_code == 200
 
+def test_builder_home_cached():
+    """Teste la page d'accueil précompressée du website builder"""
+    import os
+    import importlib.util
+    path = os.path.join(os.path.dirname(__file__), '..', 'hey-hi-website-builder-onlymatt', 'app.py')
+    spec = importlib.util.spec_from_file_location("builder_app", path)
+    builder = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(builder)
+    client = TestClient(builder.app)
+    
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert "AI Website Builder" in response.text
+    etag = response.headers["etag"]
+    
+    # Revalidation: 304 sans body
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+def test_builder_variants_single_upstream_call(monkeypatch):
+    """Teste /build avec variants: un seul appel (n), variantes mises en cache une à une, prompt compté une fois"""
+    import httpx
+    from unittest.mock import patch
+    from shared.services import ServiceConfig, create_builder_app
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    client = TestClient(create_builder_app(ServiceConfig("om-builder-test")))
+    payloads = []
+
+    async def upstream(url, headers, payload, timeout):
+        payloads.append(payload)
+        return httpx.Response(200, json={
+            "model": payload["model"],
+            "choices": [{"index": i, "message": {"content": f"<p>Variante {i}</p>"}} for i in range(payload.get("n", 1))],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 30 * payload.get("n", 1)}
+        })
+
+    with patch("shared.services.post_upstream", side_effect=upstream):
+        response = client.post("/build", json={"title": "Accueil", "instructions": "Trois designs", "variants": 3})
+        single = client.post("/build", json={"title": "Accueil", "instructions": "Un design"})
+        too_many = client.post("/build", json={"title": "Accueil", "instructions": "x", "variants": 50})
+    assert response.status_code == 200 and len(payloads) == 2
+    assert payloads[0]["n"] == 3 and "n" not in payloads[1]
+    data = response.json()
+    assert data["html"] == "<p>Variante 0</p>"
+    assert [v["html"] for v in data["variants"]] == [f"<p>Variante {i}</p>" for i in range(3)]
+    assert "variants" not in single.json() and too_many.status_code == 422
+
+    cached = client.get(f"/build/variants/{data['variants'][2]['id']}")
+    assert cached.status_code == 200 and cached.json()["html"] == "<p>Variante 2</p>"
+    assert "immutable" in cached.headers["cache-control"]
+    assert client.get("/build/variants/inconnue").status_code == 404
+
+    stats = client.get("/metrics").json()["build"]
+    assert stats["requests"] == 2 and stats["variants"] == 4
+    assert stats["prompt_tokens"] == 200 and stats["prompt_tokens_saved"] == 200
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
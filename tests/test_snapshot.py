@@ -0,0 +1,129 @@
+"""
+Tests des snapshots d'état (shared/snapshot.py)
+"""
+import os
+import asyncio
+import pytest
+from unittest.mock import patch
+from shared import snapshot
+from shared.snapshot import StateSnapshotter, encode_snapshot, decode_snapshot, _HEADER
+from shared.chat_proxy import ChatMetrics, CircuitBreaker
+from shared.model_policy import ModelPolicy, DowngradeRule
+
+def _sources():
+    return {
+        "metrics": ChatMetrics(),
+        "circuit_breaker": CircuitBreaker(),
+        "model_policy": ModelPolicy([DowngradeRule("gpt-4o", "gpt-4o-mini", max_latency=5)])
+    }
+
+@pytest.mark.parametrize("codec", ["msgpack", "json"])
+def test_encode_decode_roundtrip(codec):
+    """Teste l'aller-retour avec et sans msgpack"""
+    if codec == "msgpack":
+        pytest.importorskip("msgpack")
+        data = encode_snapshot({"a": {"b": [1, 2.5, "x"]}}, created_at=123.0)
+    else:
+        with patch.object(snapshot, "msgpack", None):
+            data = encode_snapshot({"a": {"b": [1, 2.5, "x"]}}, created_at=123.0)
+    assert data[:4] == b"HHSS"
+    assert decode_snapshot(data) == (123.0, {"a": {"b": [1, 2.5, "x"]}})
+
+def test_decode_rejects_corruption_and_versions():
+    """Teste le rejet des fichiers corrompus, tronqués ou d'une autre version"""
+    data = encode_snapshot({"a": 1})
+    with pytest.raises(ValueError, match="crc"):
+        decode_snapshot(data[:-1] + bytes([data[-1] ^ 0xFF]))
+    with pytest.raises(ValueError, match="tronqué"):
+        decode_snapshot(data[:5])
+    magic, version, codec, created_at, size, crc = _HEADER.unpack_from(data)
+    future = _HEADER.pack(magic, version + 1, codec, created_at, size, crc) + data[_HEADER.size:]
+    with pytest.raises(ValueError, match="version"):
+        decode_snapshot(future)
+
+def test_collect_detaches_live_state():
+    """Teste que l'état collecté n'est plus modifié par la boucle pendant l'écriture (thread)"""
+    snapshotter = StateSnapshotter("", _sources())
+    sources = snapshotter.sources
+    sources["metrics"].record_request(False, 0.5, error_type="timeout")
+    sources["model_policy"].observe("gpt-4o", 2.0)
+    state = snapshotter.collect()
+    sources["metrics"].record_request(False, 0.5, error_type="network")
+    sources["model_policy"].observe("gpt-4o-mini", 1.0)
+    sources["model_policy"].choose("gpt-4o")
+    assert state["metrics"]["errors_by_type"] == {"timeout": 1}
+    assert state["model_policy"]["latency_ewma"] == {"gpt-4o": 2.0}
+    assert state["model_policy"]["chosen"] == {}
+
+def test_warm_restart_restores_state(tmp_path):
+    """Teste qu'une nouvelle instance reprend l'état de la précédente"""
+    path = str(tmp_path / "state.bin")
+    before = _sources()
+    before["metrics"].record_request(True, 1.5, tokens=40)
+    before["metrics"].record_request(False, 0.5, error_type="timeout")
+    for _ in range(5):
+        before["circuit_breaker"].record_failure()
+    before["model_policy"].observe("gpt-4o", 9.0)
+    size = StateSnapshotter(path, before).write()
+    assert size == os.path.getsize(path)
+    assert os.listdir(tmp_path) == ["state.bin"]
+
+    after = _sources()
+    report = StateSnapshotter(path, after).restore()
+    assert sorted(report["restored"]) == ["circuit_breaker", "metrics", "model_policy"]
+    assert report["restore_ms"] < 100
+    stats = after["metrics"].get_stats()
+    assert stats["total_requests"] == 2 and stats["total_tokens"] == 40
+    assert stats["errors_by_type"] == {"timeout": 1}
+    assert after["circuit_breaker"].state == "open"
+    assert after["model_policy"].choose("gpt-4o") == ("gpt-4o-mini", "latency")
+
+def test_concurrent_writers_use_distinct_temp_files(tmp_path):
+    """Teste que deux écrivains du même chemin ne partagent jamais leur fichier temporaire"""
+    path = str(tmp_path / "state.bin")
+    replaced = []
+    real_replace = os.replace
+
+    def spy(src, dst):
+        replaced.append(src)
+        real_replace(src, dst)
+
+    with patch("shared.snapshot.os.replace", side_effect=spy):
+        StateSnapshotter(path, _sources()).write()
+        StateSnapshotter(path, _sources()).write()
+    assert len(set(replaced)) == 2
+    assert all(os.path.dirname(src) == str(tmp_path) for src in replaced)
+    assert os.listdir(tmp_path) == ["state.bin"]
+
+    # Échec d'écriture: le fichier temporaire est supprimé, le snapshot précédent reste intact
+    with patch("shared.snapshot.os.replace", side_effect=OSError("disk full")), pytest.raises(OSError):
+        StateSnapshotter(path, _sources()).write()
+    assert os.listdir(tmp_path) == ["state.bin"]
+
+def test_restore_is_cold_on_bad_file(tmp_path):
+    """Teste qu'un fichier absent ou invalide laisse les sources à froid"""
+    sources = _sources()
+    assert StateSnapshotter(str(tmp_path / "absent.bin"), sources).restore()["error"] == "absent"
+    bad = tmp_path / "bad.bin"
+    bad.write_bytes(b"not a snapshot at all, definitely")
+    report = StateSnapshotter(str(bad), sources).restore()
+    assert report["error"] == "format inconnu"
+    assert sources["metrics"].total_requests == 0
+    assert StateSnapshotter("", sources).restore() == {"enabled": False}
+
+@pytest.mark.asyncio
+async def test_periodic_snapshot_and_final_write(tmp_path):
+    """Teste l'écriture périodique et le snapshot final à l'arrêt"""
+    path = str(tmp_path / "state.bin")
+    sources = _sources()
+    snapshotter = StateSnapshotter(path, sources, interval=0.01)
+    snapshotter.start()
+    await asyncio.sleep(0.05)
+    assert snapshotter.writes >= 1
+    sources["metrics"].record_request(True, 1.0, tokens=7)
+    await snapshotter.stop()
+    _, state = decode_snapshot(open(path, "rb").read())
+    assert state["metrics"]["total_tokens"] == 7
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
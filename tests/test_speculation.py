@@ -0,0 +1,173 @@
+"""
+Tests du préchargement spéculatif des relances (shared/speculation.py)
+"""
+import asyncio
+import pytest
+from unittest.mock import MagicMock, patch
+from shared.chat_proxy import ChatRequest, handle_chat_request
+from shared.speculation import SpeculativeCache
+
+def _reply(content, tokens=10, finish_reason="stop"):
+    return {
+        "choices": [{"message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}],
+        "usage": {"prompt_tokens": tokens // 2, "completion_tokens": tokens - tokens // 2, "total_tokens": tokens},
+        "model": "gpt-4o-mini"
+    }
+
+def test_key_normalizes_whitespace_and_params():
+    """Teste que la clé ignore les espaces de bord mais pas les paramètres"""
+    a = [{"role": "user", "content": "  Hello "}]
+    b = [{"role": "user", "content": "Hello"}]
+    assert SpeculativeCache.key(a, ("gpt-4o-mini",)) == SpeculativeCache.key(b, ("gpt-4o-mini",))
+    assert SpeculativeCache.key(a, ("gpt-4o-mini",)) != SpeculativeCache.key(a, ("gpt-4o",))
+
+@pytest.mark.asyncio
+async def test_hit_cancels_siblings():
+    """Teste qu'un clic sur une relance est servi et annule les autres"""
+    cache = SpeculativeCache(top_k=2, delay=0)
+    started = []
+
+    async def generate(messages, max_tokens):
+        started.append(messages[-1]["content"])
+        if messages[-1]["content"] == "B":
+            await asyncio.sleep(10)
+        return _reply("answer " + messages[-1]["content"])
+
+    history = [{"role": "user", "content": "Q"}]
+    assert cache.schedule("s1", history, "R", ["A", "B", "C"], generate) == 2
+    await asyncio.sleep(0.01)
+
+    clicked = history + [{"role": "assistant", "content": "R"}, {"role": "user", "content": "A"}]
+    result = await cache.lookup("s1", clicked)
+    assert result["choices"][0]["message"]["content"] == "answer A"
+    assert "C" not in started
+    stats = cache.get_stats()
+    assert stats["hits"] == 1 and stats["cancelled"] == 1 and stats["sessions"] == 0
+
+@pytest.mark.asyncio
+async def test_unrelated_message_is_a_miss():
+    """Teste qu'un message libre annule les spéculations sans les servir"""
+    cache = SpeculativeCache(delay=0)
+
+    async def generate(messages, max_tokens):
+        await asyncio.sleep(10)
+
+    cache.schedule("s1", [{"role": "user", "content": "Q"}], "R", ["A"], generate)
+    result = await cache.lookup("s1", [{"role": "user", "content": "autre chose"}])
+    assert result is None
+    assert cache.get_stats()["misses"] == 1
+    assert cache.get_stats()["cancelled"] == 1
+
+@pytest.mark.asyncio
+async def test_token_budget_caps_speculation():
+    """Teste que le budget de tokens limite le nombre de relances lancées"""
+    cache = SpeculativeCache(top_k=3, max_tokens=100, token_budget=250, delay=0)
+
+    async def generate(messages, max_tokens):
+        return _reply("ok", tokens=20)
+
+    launched = cache.schedule("s1", [{"role": "user", "content": "Q"}], "R", ["A", "B", "C"], generate)
+    assert launched == 2
+    assert cache.get_stats()["skipped_budget"] == 1
+    await asyncio.gather(*(spec.task for spec in cache._sessions["s1"].values()))
+    # Seuls les tokens réellement consommés restent imputés à la fenêtre
+    assert cache.get_stats()["window_tokens"] == 40
+    assert cache.get_stats()["tokens_spent"] == 40
+
+@pytest.mark.asyncio
+async def test_handle_chat_request_serves_speculated_followup():
+    """Teste le parcours complet: réponse, pré-génération puis clic servi sans appel upstream"""
+    cache = SpeculativeCache(delay=0)
+    calls = []
+
+    async def fake_call(**kwargs):
+        calls.append(kwargs)
+        return _reply("réponse à " + kwargs["messages"][-1]["content"])
+
+    with patch("shared.chat_proxy.call_openai_with_retry", side_effect=fake_call):
+        first = ChatRequest(
+            messages=[{"role": "user", "content": "Bonjour"}],
+            session_id="sess-1",
+            speculate=True,
+            followups=["Et ensuite ?"]
+        )
+        response = await handle_chat_request(first, "test-key", "gpt-4o-mini", 10, 70, speculator=cache)
+        assert response["speculative"] is False
+        await asyncio.sleep(0.05)
+        assert len(calls) == 2
+        assert calls[1]["max_tokens"] == cache.max_tokens
+
+        followup = ChatRequest(
+            messages=[
+                {"role": "user", "content": "Bonjour"},
+                {"role": "assistant", "content": "réponse à Bonjour"},
+                {"role": "user", "content": "Et ensuite ?"}
+            ],
+            session_id="sess-1"
+        )
+        response = await handle_chat_request(followup, "test-key", "gpt-4o-mini", 10, 70, speculator=cache)
+
+    assert response["speculative"] is True
+    assert response["choices"][0]["message"]["content"] == "réponse à Et ensuite ?"
+    assert len(calls) == 2
+
+@pytest.mark.asyncio
+async def test_no_speculation_while_downgraded():
+    """Teste qu'aucune relance n'est pré-générée sous rétrogradation (la clé porte le modèle demandé)"""
+    cache = SpeculativeCache(delay=0)
+    policy = MagicMock()
+    policy.choose.return_value = ("gpt-4o-mini", "latency")
+    calls = []
+
+    async def fake_call(**kwargs):
+        calls.append(kwargs["model"])
+        return _reply("réponse")
+
+    with patch("shared.chat_proxy.call_openai_with_retry", side_effect=fake_call):
+        first = ChatRequest(
+            messages=[{"role": "user", "content": "Bonjour"}],
+            model="gpt-4o",
+            session_id="sess-3",
+            speculate=True,
+            followups=["Et ensuite ?"]
+        )
+        response = await handle_chat_request(first, "test-key", "gpt-4o-mini", 10, 70, speculator=cache, policy=policy)
+        await asyncio.sleep(0.05)
+    assert response["model_downgrade"] == "latency" and response["requested_model"] == "gpt-4o"
+    assert calls == ["gpt-4o-mini"]
+    assert cache.get_stats()["scheduled"] == 0
+
+@pytest.mark.asyncio
+async def test_truncated_speculation_is_not_served():
+    """Teste qu'une relance coupée par le plafond spéculatif n'est pas servie"""
+    cache = SpeculativeCache(delay=0)
+
+    async def fake_call(**kwargs):
+        if kwargs["max_tokens"] == cache.max_tokens:
+            return _reply("tronqué", finish_reason="length")
+        return _reply("complet")
+
+    with patch("shared.chat_proxy.call_openai_with_retry", side_effect=fake_call):
+        first = ChatRequest(
+            messages=[{"role": "user", "content": "Q"}],
+            session_id="sess-2",
+            speculate=True,
+            followups=["A"]
+        )
+        await handle_chat_request(first, "test-key", "gpt-4o-mini", 10, 70, speculator=cache)
+        await asyncio.sleep(0.05)
+        followup = ChatRequest(
+            messages=[
+                {"role": "user", "content": "Q"},
+                {"role": "assistant", "content": "complet"},
+                {"role": "user", "content": "A"}
+            ],
+            session_id="sess-2"
+        )
+        response = await handle_chat_request(followup, "test-key", "gpt-4o-mini", 10, 70, speculator=cache)
+
+    assert response["speculative"] is False
+    assert response["choices"][0]["message"]["content"] == "complet"
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
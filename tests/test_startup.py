@@ -0,0 +1,118 @@
+"""
+Tests du chemin de démarrage: imports paresseux, warm-up et pool upstream
+"""
+import sys
+import subprocess
+from pathlib import Path
+import httpx
+import pytest
+from shared import chat_proxy
+from shared.chat_proxy import call_openai_with_retry, open_upstream_pool, close_upstream_pool, prewarm
+from shared.lifecycle import ServiceLifecycle
+
+def test_shared_import_is_lazy():
+    """Teste que `shared` et `shared.utils` ne chargent pas FastAPI/pydantic/httpx"""
+    code = (
+        "import sys, shared, shared.utils\n"
+        "heavy = [m for m in ('fastapi', 'pydantic', 'httpx') if m in sys.modules]\n"
+        "assert not heavy, heavy\n"
+        "assert shared.SimpleRateLimiter is shared.utils.SimpleRateLimiter\n"
+        "assert 'shared.chat_proxy' not in sys.modules\n"
+        "shared.ChatRequest\n"
+        "assert 'shared.chat_proxy' in sys.modules\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+def test_service_import_defers_httpx():
+    """Teste que le service (et chat_proxy) n'importe httpx qu'à l'ouverture du pool upstream"""
+    code = (
+        "import sys, asyncio\n"
+        "sys.path.insert(0, 'hey-hi-coach-onlymatt')\n"
+        "import app\n"
+        "from shared import chat_proxy\n"
+        "assert 'httpx' not in sys.modules\n"
+        "asyncio.run(chat_proxy.open_upstream_pool())\n"
+        "assert 'httpx' in sys.modules\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=Path(__file__).resolve().parent.parent)
+
+def test_shared_unknown_attribute():
+    """Teste l'erreur sur un attribut inconnu"""
+    import shared
+    with pytest.raises(AttributeError):
+        shared.does_not_exist
+    assert "handle_chat_request" in dir(shared)
+
+@pytest.mark.asyncio
+async def test_lifecycle_runs_warmup_once():
+    """Teste que le warm-up est exécuté une seule fois avant ready"""
+    calls = []
+
+    async def warmup():
+        calls.append(1)
+        return {"done": True}
+
+    lifecycle = ServiceLifecycle(warmup=warmup)
+    assert lifecycle.ready is False
+    assert await lifecycle.ensure_ready() is True
+    assert await lifecycle.ensure_ready() is True
+    assert calls == [1]
+    assert lifecycle.get_stats()["warmup"] == {"done": True}
+
+@pytest.mark.asyncio
+async def test_lifecycle_warmup_failure_is_not_fatal():
+    """Teste qu'un warm-up en échec n'empêche pas le service de démarrer"""
+    async def warmup():
+        raise RuntimeError("boom")
+
+    closed = []
+
+    async def shutdown():
+        closed.append(True)
+
+    lifecycle = ServiceLifecycle(warmup=warmup, shutdown=shutdown)
+    async with lifecycle.lifespan(app=None):
+        assert lifecycle.ready is True
+        assert lifecycle.warmup_report == {"error": "boom"}
+    assert lifecycle.ready is False
+    assert closed == [True]
+
+@pytest.mark.asyncio
+async def test_prewarm_opens_shared_pool():
+    """Teste que prewarm ouvre le pool et que les appels le réutilisent"""
+    seen = []
+
+    def handler(request):
+        seen.append(request.method)
+        if request.method == "HEAD":
+            return httpx.Response(405)
+        return httpx.Response(200, json={"choices": [], "usage": {"total_tokens": 1}})
+
+    await open_upstream_pool(transport=httpx.MockTransport(handler))
+    try:
+        report = await prewarm("test-key", connect_timeout=1)
+        assert report["upstream_connected"] is True
+        assert "validators_ms" in report
+
+        result = await call_openai_with_retry(
+            api_key="test-key",
+            messages=[{"role": "user", "content": "Hi"}],
+            model="gpt-4o-mini",
+            connect_timeout=10,
+            read_timeout=70
+        )
+        assert result["usage"]["total_tokens"] == 1
+        assert seen == ["HEAD", "POST"]
+    finally:
+        await close_upstream_pool()
+    assert chat_proxy._upstream_client is None
+
+@pytest.mark.asyncio
+async def test_prewarm_without_key_skips_pool():
+    """Teste que sans clé API aucun pool n'est ouvert"""
+    report = await prewarm("")
+    assert "upstream_connected" not in report
+    assert chat_proxy._upstream_client is None
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
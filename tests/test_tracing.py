@@ -0,0 +1,149 @@
+"""
+Tests pour shared/tracing.py
+"""
+import json
+import pytest
+from unittest.mock import Mock, AsyncMock, patch
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from shared.tracing import (
+    RequestTrace, RequestTracingMiddleware, JsonSpanExporter,
+    bind_trace, current_request_id, span, to_otlp
+)
+from shared.chat_proxy import ChatRequest, Message, handle_chat_request
+
+def _traced_app(exporter=None, sample_rate=1.0):
+    app = FastAPI()
+    app.add_middleware(RequestTracingMiddleware, service_name="test", exporter=exporter, sample_rate=sample_rate)
+
+    @app.get("/rid")
+    async def rid():
+        with span("work", kind="test"):
+            return {"request_id": current_request_id()}
+
+    return app
+
+def test_request_id_generated_and_returned():
+    """Teste la génération d'un X-Request-ID quand le client n'en fournit pas"""
+    client = TestClient(_traced_app())
+    response = client.get("/rid")
+    assert response.status_code == 200
+    request_id = response.headers["x-request-id"]
+    assert len(request_id) == 32
+    assert response.json()["request_id"] == request_id
+
+def test_request_id_accepted_from_client():
+    """Teste que l'identifiant fourni par le client est conservé"""
+    client = TestClient(_traced_app())
+    response = client.get("/rid", headers={"X-Request-ID": "wp-1234"})
+    assert response.headers["x-request-id"] == "wp-1234"
+    assert response.json()["request_id"] == "wp-1234"
+
+    # Identifiant invalide: remplacé
+    response = client.get("/rid", headers={"X-Request-ID": "bad id\twith spaces"})
+    assert response.headers["x-request-id"] != "bad id\twith spaces"
+
+def test_spans_exported_as_otlp(tmp_path):
+    """Teste l'export JSON lines au format OTLP"""
+    path = tmp_path / "spans.jsonl"
+    client = TestClient(_traced_app(JsonSpanExporter(str(path))))
+    client.get("/rid", headers={"X-Request-ID": "trace-me"})
+
+    lines = path.read_text().strip().splitlines()
+    assert len(lines) == 1
+    spans = json.loads(lines[0])["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    by_name = {s["name"]: s for s in spans}
+    assert set(by_name) == {"work", "http.request"}
+    # Le span applicatif est enfant du span racine
+    assert by_name["work"]["parentSpanId"] == by_name["http.request"]["spanId"]
+    assert by_name["work"]["traceId"] == by_name["http.request"]["traceId"]
+
+def test_sampling_disabled(tmp_path):
+    """Teste qu'aucun span n'est exporté avec un taux à 0"""
+    path = tmp_path / "spans.jsonl"
+    client = TestClient(_traced_app(JsonSpanExporter(str(path)), sample_rate=0.0))
+    response = client.get("/rid")
+    assert "x-request-id" in response.headers
+    assert not path.exists()
+
+def test_span_noop_without_trace():
+    """Teste que span() ne fait rien hors requête"""
+    with span("orphan") as attrs:
+        assert attrs is None
+
+def test_nested_spans_and_otlp_shape():
+    """Teste la hiérarchie des spans et la sérialisation OTLP"""
+    trace = RequestTrace("rid-1", sampled=True)
+    with bind_trace(trace):
+        with span("outer"):
+            with span("inner", attempt=1):
+                pass
+    inner, outer = trace.spans
+    assert inner.parent_id == outer.span_id
+    assert outer.parent_id == trace.root_span_id
+
+    otlp = to_otlp(trace, "svc")
+    resource = otlp["resourceSpans"][0]["resource"]["attributes"]
+    assert resource == [{"key": "service.name", "value": {"stringValue": "svc"}}]
+    attributes = otlp["resourceSpans"][0]["scopeSpans"][0]["spans"][0]["attributes"]
+    assert {"key": "attempt", "value": {"intValue": "1"}} in attributes
+
+@pytest.mark.asyncio
+async def test_request_id_propagated_upstream():
+    """Teste la propagation de X-Request-ID et les spans de retry/backoff"""
+    request = ChatRequest(messages=[Message(role="user", content="Hi")])
+    error_response = Mock(status_code=500, text="boom")
+    ok_response = Mock(status_code=200)
+    ok_response.json.return_value = {"choices": [], "usage": {"total_tokens": 3}, "model": "gpt-4o-mini"}
+
+    trace = RequestTrace("corr-42", sampled=True)
+    with bind_trace(trace), patch('httpx.AsyncClient') as mock_client, \
+            patch('shared.chat_proxy.asyncio.sleep', new=AsyncMock()):
+        post = AsyncMock(side_effect=[error_response, ok_response])
+        mock_client.return_value.__aenter__.return_value.post = post
+        await handle_chat_request(
+            request=request,
+            api_key="test-key",
+            default_model="gpt-4o-mini",
+            connect_timeout=10,
+            read_timeout=70
+        )
+
+    assert post.call_args.kwargs["headers"]["X-Request-ID"] == "corr-42"
+    names = [s.name for s in trace.spans]
+    assert names.count("upstream.attempt") == 2
+    assert "backoff" in names
+    assert "validation" in names
+    assert "upstream.call" in names
+    assert trace.annotations["upstream_attempts"] == 2
+
+def test_serialization_span_covers_json_encoding(tmp_path, monkeypatch):
+    """Teste le span serialization de /api/chat: encodage JSON réel (octets produits), headers conservés"""
+    import httpx
+    from shared.services import ServiceConfig, create_chat_app
+    path = tmp_path / "spans.jsonl"
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("TRACE_LOG_PATH", str(path))
+    monkeypatch.setenv("TRACE_SAMPLE_RATE", "1")
+    client = TestClient(create_chat_app(ServiceConfig("hey-hi-test")))
+
+    async def upstream(url, headers, payload, timeout):
+        return httpx.Response(200, json={
+            "model": payload["model"], "choices": [{"message": {"role": "assistant", "content": "é" * 5000}}],
+            "usage": {"total_tokens": 3}
+        })
+
+    body = {"messages": [{"role": "user", "content": "Hi"}]}
+    with patch("shared.chat_proxy.post_upstream", side_effect=upstream):
+        client.post("/api/chat", json=body, headers={"Idempotency-Key": "k1"})
+        replayed = client.post("/api/chat", json=body, headers={"Idempotency-Key": "k1"})
+    assert replayed.headers["idempotent-replayed"] == "true" and replayed.json()["choices"][0]["message"]["content"] == "é" * 5000
+
+    spans = json.loads(path.read_text().splitlines()[0])["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    serialization = next(s for s in spans if s["name"] == "serialization")
+    attributes = {a["key"]: a["value"] for a in serialization["attributes"]}
+    assert int(attributes["bytes"]["intValue"]) > 10000
+    assert int(serialization["endTimeUnixNano"]) > int(serialization["startTimeUnixNano"])
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
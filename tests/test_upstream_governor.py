@@ -0,0 +1,99 @@
+"""
+Tests du régulateur de quota upstream (shared/upstream_governor.py)
+"""
+import time
+import asyncio
+import httpx
+import pytest
+from unittest.mock import patch
+from fastapi import HTTPException
+from shared.chat_proxy import call_openai_with_retry, circuit_breaker, close_upstream_pool, open_upstream_pool
+from shared.upstream_governor import UpstreamGovernor, parse_reset
+from benchmarks.openai_stub import OpenAIStub
+
+def test_parse_reset_formats():
+    """Teste les formats de durée des headers x-ratelimit-reset-*"""
+    assert parse_reset("20ms") == pytest.approx(0.02)
+    assert parse_reset("1.5s") == 1.5
+    assert parse_reset("6m0s") == 360
+    assert parse_reset("1h2m3s") == 3723
+    assert parse_reset("2") == 2
+    assert parse_reset("") is None and parse_reset("bientôt") is None
+
+@pytest.mark.asyncio
+async def test_governor_paces_instead_of_429():
+    """Teste qu'une rafale contre un quota strict part au rythme du quota, sans 429"""
+    stub = OpenAIStub(base_latency=0.01, per_token_latency=0, concurrency=20, rpm_limit=5, quota_window=0.2)
+    governor = UpstreamGovernor()
+    circuit_breaker.record_success()
+    await open_upstream_pool(transport=httpx.ASGITransport(app=stub))
+    limit = asyncio.Semaphore(5)
+
+    async def one(i):
+        async with limit:
+            return await call_openai_with_retry(
+                api_key="k", messages=[{"role": "user", "content": f"question {i}"}], model="gpt-4o-mini",
+                connect_timeout=5, read_timeout=5, max_tokens=8
+            )
+
+    started = time.monotonic()
+    try:
+        with patch("shared.chat_proxy.upstream_governor", governor):
+            results = await asyncio.gather(*(one(i) for i in range(15)))
+    finally:
+        await close_upstream_pool()
+    assert len(results) == 15 and stub.rejected == 0
+    # 5 requêtes de quota initial, puis 25 req/s
+    assert time.monotonic() - started >= 0.35
+    stats = governor.get_stats()
+    assert stats["paced_requests"] >= 5 and stats["upstream_429"] == 0
+
+@pytest.mark.asyncio
+async def test_governor_rejects_when_wait_exceeds_budget():
+    """Teste le 429 immédiat quand l'attente dépasserait GOVERNOR_MAX_WAIT"""
+    governor = UpstreamGovernor(max_wait=0.05)
+    ticket = await governor.acquire(10)
+    governor.observe({
+        "x-ratelimit-limit-requests": "2", "x-ratelimit-remaining-requests": "0",
+        "x-ratelimit-reset-requests": "5s"
+    }, 429, ticket)
+    with pytest.raises(HTTPException) as exc:
+        await governor.acquire(10)
+    assert exc.value.status_code == 429
+    assert exc.value.detail["error"] == "UPSTREAM_RATE_LIMITED"
+    assert 0 < exc.value.detail["retry_after_seconds"] <= 5
+    assert governor.get_stats()["rejected_requests"] == 1
+
+    # Réponse en retard (ticket plus ancien): ignorée
+    governor.observe({"x-ratelimit-remaining-requests": "100"}, 200, (ticket[0], 0.0, 0.0, 0.0))
+    assert governor.get_stats()["estimated_remaining"]["default"]["requests"] < 1
+
+@pytest.mark.asyncio
+async def test_governor_quota_per_api_key_and_no_head_of_line_blocking():
+    """Teste un quota par clé API et qu'une grosse requête en attente ne bloque pas les petites"""
+    governor = UpstreamGovernor(max_wait=5)
+    ticket = await governor.acquire(10, "coach-key")
+    governor.observe({
+        "x-ratelimit-limit-tokens": "1000", "x-ratelimit-remaining-tokens": "100",
+        "x-ratelimit-reset-tokens": "1s"
+    }, 200, ticket)
+    # Autre clé (service avec sa propre COACH_/VIDEO_OPENAI_API_KEY): quota intact
+    assert await governor.acquire(5000, "video-key") is not None
+
+    order = []
+
+    async def request(name, tokens):
+        await governor.acquire(tokens, "coach-key")
+        order.append(name)
+
+    big = asyncio.ensure_future(request("big", 600))
+    await asyncio.sleep(0)
+    await asyncio.wait_for(request("small", 20), timeout=0.1)
+    assert order == ["small"] and not big.done()
+    await asyncio.wait_for(big, timeout=2)
+    assert order == ["small", "big"]
+    remaining = governor.get_stats()["estimated_remaining"]
+    assert len(remaining) == 2 and "coach-key" not in str(remaining)
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
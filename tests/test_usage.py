@@ -0,0 +1,173 @@
+"""
+Tests pour shared/usage.py
+"""
+import pytest
+import time
+from unittest.mock import Mock, AsyncMock, patch
+from fastapi import HTTPException
+from shared.usage import UsageLedger, estimate_cost, parse_budgets
+from shared.chat_proxy import ChatRequest, Message, handle_chat_request
+
+def test_estimate_cost():
+    """Teste l'estimation de coût par modèle"""
+    # gpt-4o-mini: 0.15$/M prompt, 0.60$/M completion
+    assert estimate_cost("gpt-4o-mini", 1_000_000, 0) == pytest.approx(0.15)
+    # Les versions datées utilisent le préfixe le plus long
+    assert estimate_cost("gpt-4o-mini-2024-07-18", 0, 1_000_000) == pytest.approx(0.60)
+    assert estimate_cost("gpt-4o-2024-08-06", 1_000_000, 0) == pytest.approx(2.50)
+    # Modèle inconnu: tarif prudent
+    assert estimate_cost("mystery", 1_000_000, 0) == pytest.approx(2.50)
+
+def test_parse_budgets():
+    """Teste le parsing des budgets"""
+    budgets = parse_budgets("projet_a=5, projet_b=12.5,*=50,invalide")
+    assert budgets == {"projet_a": 5.0, "projet_b": 12.5, "*": 50.0}
+    assert parse_budgets("") == {}
+
+def test_ledger_record_and_query():
+    """Teste l'agrégation en mémoire et le flush vers SQLite"""
+    ledger = UsageLedger()
+    now = time.time()
+    ledger.record("p1", "s1", "gpt-4o-mini", 100, 50, now=now)
+    ledger.record("p1", "s1", "gpt-4o-mini", 200, 50, now=now)
+    ledger.record("p2", "s2", "gpt-4o", 10, 10, now=now)
+
+    # Agrégation en mémoire: une seule ligne par clé
+    assert ledger.get_stats()["pending_rows"] == 2
+
+    rows = ledger.query(since=now - 60, project_id="p1")
+    assert len(rows) == 1
+    assert rows[0]["requests"] == 2
+    assert rows[0]["prompt_tokens"] == 300
+    assert rows[0]["completion_tokens"] == 100
+    assert rows[0]["total_tokens"] == 400
+
+    # Le lot a été flushé
+    assert ledger.get_stats()["pending_rows"] == 0
+    assert ledger.get_stats()["flushed_rows"] == 2
+
+    # Un second flush additionne au lieu d'écraser
+    ledger.record("p1", "s1", "gpt-4o-mini", 100, 0, now=now)
+    rows = ledger.query(since=now - 60, group_by=("project_id",))
+    by_project = {r["project_id"]: r for r in rows}
+    assert by_project["p1"]["prompt_tokens"] == 400
+    assert by_project["p2"]["requests"] == 1
+
+def test_ledger_query_window_and_interval():
+    """Teste le filtrage temporel et les séries par intervalle"""
+    ledger = UsageLedger()
+    now = time.time()
+    ledger.record("p1", None, "gpt-4o-mini", 10, 0, now=now - 7200)
+    ledger.record("p1", None, "gpt-4o-mini", 20, 0, now=now)
+
+    rows = ledger.query(since=now - 3600)
+    assert len(rows) == 1
+    assert rows[0]["prompt_tokens"] == 20
+
+    rows = ledger.query(since=now - 3 * 3600, group_by=(), interval=3600)
+    assert len(rows) == 2
+    assert all("window_start" in r for r in rows)
+
+    # Fenêtre vide
+    assert ledger.query(since=now + 3600, group_by=()) == []
+
+def test_ledger_budget_enforcement():
+    """Teste le refus une fois le budget atteint"""
+    ledger = UsageLedger(budgets={"p1": 0.001, "*": 100})
+    allowed, info = ledger.check_budget("p1")
+    assert allowed is True
+
+    # 0.60$/M completion -> 2000 tokens = 0.0012$
+    ledger.record("p1", None, "gpt-4o-mini", 0, 2000)
+    allowed, info = ledger.check_budget("p1")
+    assert allowed is False
+    assert info["error"] == "BUDGET_EXCEEDED"
+    assert ledger.rejected_requests == 1
+
+    # Les autres projets utilisent le budget par défaut
+    allowed, _ = ledger.check_budget("p2")
+    assert allowed is True
+    assert ledger.budget_ratio("p1") > 1
+
+def test_ledger_budget_window_expiry():
+    """Teste que les dépenses hors fenêtre ne comptent plus"""
+    ledger = UsageLedger(budgets={"p1": 0.001}, budget_window=3600)
+    ledger.record("p1", None, "gpt-4o-mini", 0, 2000, now=time.time() - 7200)
+    allowed, _ = ledger.check_budget("p1")
+    assert allowed is True
+
+def test_ledger_persistence(tmp_path):
+    """Teste la reprise des dépenses depuis SQLite après redémarrage"""
+    db_path = str(tmp_path / "usage.sqlite3")
+    ledger = UsageLedger(db_path=db_path, budgets={"p1": 0.001})
+    ledger.record("p1", None, "gpt-4o-mini", 0, 2000)
+    ledger.close()
+
+    restarted = UsageLedger(db_path=db_path, budgets={"p1": 0.001})
+    allowed, _ = restarted.check_budget("p1")
+    assert allowed is False
+    restarted.close()
+
+@pytest.mark.asyncio
+async def test_handle_chat_request_budget_exceeded():
+    """Teste que le budget est vérifié avant l'appel upstream"""
+    from shared import chat_proxy
+    ledger = UsageLedger(budgets={"broke": 0.0})
+    request = ChatRequest(messages=[Message(role="user", content="Hi")], project_id="broke")
+
+    with patch.object(chat_proxy, "usage_ledger", ledger), patch('httpx.AsyncClient') as mock_client:
+        mock_client.return_value.__aenter__.return_value.post = AsyncMock()
+        with pytest.raises(HTTPException) as exc_info:
+            await handle_chat_request(
+                request=request,
+                api_key="test-key",
+                default_model="gpt-4o-mini",
+                connect_timeout=10,
+                read_timeout=70
+            )
+        assert exc_info.value.status_code == 429
+        assert exc_info.value.detail["error"] == "BUDGET_EXCEEDED"
+        assert mock_client.return_value.__aenter__.return_value.post.call_count == 0
+
+@pytest.mark.asyncio
+async def test_handle_chat_request_records_usage():
+    """Teste l'enregistrement de l'usage après un appel réussi"""
+    from shared import chat_proxy
+    ledger = UsageLedger()
+    request = ChatRequest(
+        messages=[Message(role="user", content="Hi")],
+        project_id="p1",
+        session_id="s1"
+    )
+    mock_response = Mock()
+    mock_response.status_code = 200
+    mock_response.json.return_value = {
+        "choices": [{"message": {"content": "Hello!"}}],
+        "usage": {"prompt_tokens": 20, "completion_tokens": 5, "total_tokens": 25},
+        "model": "gpt-4o-mini"
+    }
+
+    with patch.object(chat_proxy, "usage_ledger", ledger), patch('httpx.AsyncClient') as mock_client:
+        mock_client.return_value.__aenter__.return_value.post = AsyncMock(return_value=mock_response)
+        await handle_chat_request(
+            request=request,
+            api_key="test-key",
+            default_model="gpt-4o-mini",
+            connect_timeout=10,
+            read_timeout=70
+        )
+
+    rows = ledger.query(since=time.time() - 60, group_by=("project_id", "session_id", "model"))
+    assert rows == [{
+        "project_id": "p1",
+        "session_id": "s1",
+        "model": "gpt-4o-mini",
+        "requests": 1,
+        "prompt_tokens": 20,
+        "completion_tokens": 5,
+        "total_tokens": 25,
+        "cost_usd": round(estimate_cost("gpt-4o-mini", 20, 5), 6)
+    }]
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,173 @@
+"""
+Tests du transport WebSocket /ws/chat (shared/ws_chat.py) et du streaming upstream
+"""
+import asyncio
+import httpx
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+from shared.chat_proxy import ChatMetrics, call_openai_with_retry, close_upstream_pool, open_upstream_pool
+from shared.services import ServiceConfig, create_chat_app
+from shared.ws_chat import trim_history
+from benchmarks.openai_stub import OpenAIStub
+
+def _client(monkeypatch, **env):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    for key, value in env.items():
+        monkeypatch.setenv(key, value)
+    app = create_chat_app(ServiceConfig("hey-hi-test"))
+    return TestClient(app), app
+
+def _fake_stream(seen_payloads, hang=False):
+    """Upstream SSE simulé: répond "Réponse N" en deux fragments"""
+    async def fake(url, headers, payload, timeout, on_delta):
+        seen_payloads.append(payload)
+        if hang:
+            await asyncio.sleep(30)
+        await on_delta("Réponse")
+        await on_delta(f" {len(seen_payloads)}")
+        return httpx.Response(200, json={
+            "model": payload["model"],
+            "choices": [{"message": {"role": "assistant", "content": f"Réponse {len(seen_payloads)}"}}],
+            "usage": {"total_tokens": 7}
+        })
+    return fake
+
+def _receive_until(ws, kind):
+    frames = []
+    while True:
+        frame = ws.receive_json()
+        frames.append(frame)
+        if frame["type"] == kind:
+            return frames
+
+def test_multi_turn_session_streams_deltas(monkeypatch):
+    """Teste l'historique côté serveur, les deltas et les options persistées entre tours"""
+    client, app = _client(monkeypatch)
+    payloads = []
+    with patch("shared.chat_proxy.stream_upstream", side_effect=_fake_stream(payloads)):
+        with client.websocket_connect("/ws/chat") as ws:
+            session_id = ws.receive_json()["session_id"]
+            ws.send_json({"type": "chat", "id": "t1", "model": "gpt-4o", "messages": [
+                {"role": "system", "content": "Tu es un coach."}, {"role": "user", "content": "Bonjour"}
+            ]})
+            frames = _receive_until(ws, "done")
+            assert [f["content"] for f in frames if f["type"] == "delta"] == ["Réponse", " 1"]
+            assert frames[-1]["content"] == "Réponse 1" and frames[-1]["usage"]["total_tokens"] == 7
+
+            ws.send_json({"type": "chat", "id": "t2", "messages": [{"role": "user", "content": "Et ensuite ?"}]})
+            assert _receive_until(ws, "done")[-1]["id"] == "t2"
+            ws.send_json({"type": "ping"})
+            assert ws.receive_json() == {"type": "pong"}
+
+    assert payloads[0]["stream"] is True
+    assert [m["content"] for m in payloads[1]["messages"]] == ["Tu es un coach.", "Bonjour", "Réponse 1", "Et ensuite ?"]
+    assert payloads[1]["model"] == "gpt-4o"
+    stats = app.state.get_stats()
+    assert stats["total_requests"] == 2 and stats["total_tokens"] == 14
+    assert stats["websocket"]["turns"] == 2 and stats["websocket"]["active_sessions"] == 0
+    assert stats["websocket"]["closed"] == {"client_disconnect": 1}
+    assert len(session_id) == 32
+
+def test_cancel_and_errors(monkeypatch):
+    """Teste l'annulation par le client, un tour concurrent refusé et la validation"""
+    client, app = _client(monkeypatch)
+    with patch("shared.chat_proxy.stream_upstream", side_effect=_fake_stream([], hang=True)):
+        with client.websocket_connect("/ws/chat") as ws:
+            ws.receive_json()
+            ws.send_json({"type": "chat", "id": "t1", "messages": [{"role": "user", "content": "Long"}]})
+            ws.send_json({"type": "chat", "id": "t2", "messages": [{"role": "user", "content": "Encore"}]})
+            error = ws.receive_json()
+            assert error["status"] == 409 and error["detail"]["error"] == "TURN_IN_PROGRESS"
+            ws.send_json({"type": "cancel"})
+            assert ws.receive_json() == {"type": "cancelled", "id": "t1", "reason": "client_cancel"}
+
+            ws.send_json({"type": "chat", "id": "t3", "messages": [{"role": "robot", "content": "x"}]})
+            error = ws.receive_json()
+            assert error["id"] == "t3" and error["status"] == 422
+            ws.send_text("pas du json")
+            assert ws.receive_json()["detail"]["error"] == "INVALID_FRAME"
+            for timeout in ("nan", "inf", 0, -1):
+                ws.send_json({"type": "chat", "id": "t4", "timeout": timeout, "messages": [{"role": "user", "content": "x"}]})
+                error = ws.receive_json()
+                assert error["status"] == 422 and error["detail"]["error"] == "INVALID_FRAME"
+
+    stats = app.state.get_stats()
+    assert stats["cancellations"]["by_reason"] == {"client_cancel": 1}
+    assert stats["websocket"]["cancelled_turns"] == {"client_cancel": 1}
+
+def test_origin_and_idle_timeout(monkeypatch):
+    """Teste le refus d'une Origin non autorisée et la fermeture des sessions inactives"""
+    client, app = _client(monkeypatch, ALLOWED_ORIGINS="https://onlymatt.ca", WS_IDLE_TIMEOUT="0.05")
+    with pytest.raises(WebSocketDisconnect) as exc:
+        with client.websocket_connect("/ws/chat", headers={"Origin": "https://evil.example"}) as ws:
+            ws.receive_json()
+    assert exc.value.code == 1008
+
+    with client.websocket_connect("/ws/chat", headers={"Origin": "https://onlymatt.ca"}) as ws:
+        ws.receive_json()
+        with pytest.raises(WebSocketDisconnect) as exc:
+            ws.receive_json()
+    assert exc.value.code == 1001
+    assert app.state.get_stats()["websocket"]["closed"] == {"idle_timeout": 1}
+    assert app.state.get_stats()["websocket"]["rejected_sessions"] == 1
+
+def test_binary_frame_closes_with_unsupported_data(monkeypatch):
+    """Teste qu'une trame binaire ferme la session proprement (1003) au lieu d'une erreur serveur"""
+    client, app = _client(monkeypatch)
+    with client.websocket_connect("/ws/chat") as ws:
+        assert ws.receive_json()["type"] == "session"
+        ws.send_bytes(b'{"type": "chat"}')
+        with pytest.raises(WebSocketDisconnect) as exc:
+            ws.receive_json()
+    assert exc.value.code == 1003
+    stats = app.state.get_stats()["websocket"]
+    assert stats["closed"] == {"unsupported_data": 1}
+
+def test_trim_history_keeps_system_messages():
+    """Teste que l'historique tronqué garde les messages system et les nouveaux messages"""
+    history = [{"role": "system", "content": "s"}] + [{"role": "user", "content": str(i)} for i in range(5)]
+    trimmed = trim_history(history, [{"role": "user", "content": "new"}], limit=4)
+    assert [m["content"] for m in trimmed] == ["s", "3", "4", "new"]
+    # Limite en caractères: les échanges les plus anciens partent d'abord
+    history = [{"role": "system", "content": "s"}] + [{"role": "user", "content": str(i) * 10} for i in range(5)]
+    trimmed = trim_history(history, [{"role": "user", "content": "new"}], max_chars=20)
+    assert [m["content"] for m in trimmed] == ["s", "4" * 10, "new"]
+
+def test_session_ids_server_generated_and_sessions_capped(monkeypatch):
+    """Teste qu'un session_id client est ignoré et que les sessions au-delà de WS_MAX_SESSIONS sont refusées"""
+    client, app = _client(monkeypatch, WS_MAX_SESSIONS="2")
+    with client.websocket_connect("/ws/chat?session_id=partage") as first, \
+            client.websocket_connect("/ws/chat?session_id=partage") as second:
+        ids = {first.receive_json()["session_id"], second.receive_json()["session_id"]}
+        assert len(ids) == 2 and "partage" not in ids
+        with pytest.raises(WebSocketDisconnect) as exc:
+            with client.websocket_connect("/ws/chat") as third:
+                third.receive_json()
+        assert exc.value.code == 1013
+    stats = app.state.get_stats()["websocket"]
+    assert stats["rejected_sessions"] == 1 and stats["active_sessions"] == 0
+    assert stats["closed"] == {"client_disconnect": 2}
+
+@pytest.mark.asyncio
+async def test_call_openai_streaming_against_stub():
+    """Teste le streaming SSE de call_openai_with_retry (deltas + réponse complète + usage)"""
+    await open_upstream_pool(transport=httpx.ASGITransport(app=OpenAIStub(base_latency=0, per_token_latency=0)))
+    deltas = []
+
+    async def on_delta(text):
+        deltas.append(text)
+
+    try:
+        result = await call_openai_with_retry(
+            api_key="k", messages=[{"role": "user", "content": "bonjour le monde"}], model="gpt-4o-mini",
+            connect_timeout=5, read_timeout=5, chat_metrics=ChatMetrics(), on_delta=on_delta
+        )
+    finally:
+        await close_upstream_pool()
+    assert "".join(deltas) == result["choices"][0]["message"]["content"]
+    assert len(deltas) > 1 and result["usage"]["total_tokens"] > 0
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])